@@ -14,7 +14,7 @@ from cl.alerts.models import Alert, RealTimeQueue
 from cl.lib import search_utils
 from cl.lib.command_utils import VerboseCommand, logger
 from cl.lib.scorched_utils import ExtraSolrInterface
-from cl.lib.search_utils import regroup_snippets
+from cl.lib.search_utils import add_recap_docket_fields, regroup_snippets
 from cl.search.forms import SearchForm
 from cl.search.models import SEARCH_TYPES
 from cl.stats.utils import tally_stat
@@ -176,6 +176,8 @@ class Command(VerboseCommand):
                     .add_extra(**main_params)
                     .execute()
                 )
+            if query_type == SEARCH_TYPES.RECAP:
+                add_recap_docket_fields(results, main_params.get("uq"))
             regroup_snippets(results)
 
         logger.info("There were %s results." % len(results))
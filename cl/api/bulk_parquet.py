@@ -0,0 +1,431 @@
+"""
+Columnar bulk data, as Parquet files.
+
+The JSON bulk data has a file per object, which is slow to load for
+analysis. This writes the database columns of the main tables as Parquet
+instead, partitioned Hive-style by court and year where the table has them:
+
+    parquet/opinions/court_id=ca1/year=2001/part-0.parquet
+    parquet/citations/all.parquet
+
+Rows are streamed from Postgres with a server-side cursor and written a
+batch at a time, so memory stays bounded no matter how big the table is.
+
+Each dataset has a manifest.json listing its schema and partitions. After the
+first run, only the partitions that have rows modified since the last good
+run are rewritten. A row whose court or year changes is left in its old
+partition, and deleted rows stay, until that partition is rewritten for
+another reason or the export is run in full.
+"""
+import json
+import os
+from collections import defaultdict
+from os.path import join
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Tuple
+
+from django.db.models import Model, Q, QuerySet
+from django.db.models.functions import ExtractYear
+from django.utils.timezone import now
+
+from cl.api.utils import BulkJsonHistory
+from cl.lib.command_utils import logger
+from cl.lib.utils import mkdir_p
+from cl.people_db.models import Person, Position
+from cl.search.models import (
+    Court,
+    Docket,
+    Opinion,
+    OpinionCluster,
+    OpinionsCited,
+)
+
+if TYPE_CHECKING:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+# How many rows to hold in memory before writing them out. Opinions can be
+# big, so this is kept small.
+PARQUET_BATCH_ROWS = 2000
+
+# What Hive-style partitioning calls a partition for null values.
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+INT_FIELDS = {
+    "AutoField",
+    "BigAutoField",
+    "BigIntegerField",
+    "IntegerField",
+    "PositiveIntegerField",
+    "PositiveSmallIntegerField",
+    "SmallIntegerField",
+}
+
+
+def get_arrow_type(field) -> "pa.DataType":
+    """Get the Arrow type for a Django model field. Relations get the type
+    of the field they point at.
+    """
+    import pyarrow as pa
+
+    while field.is_relation:
+        field = field.target_field
+    internal_type = field.get_internal_type()
+    if internal_type in INT_FIELDS:
+        return pa.int64()
+    if internal_type in ["BooleanField", "NullBooleanField"]:
+        return pa.bool_()
+    if internal_type == "DateTimeField":
+        return pa.timestamp("us", tz="UTC")
+    if internal_type == "DateField":
+        return pa.date32()
+    if internal_type == "FloatField":
+        return pa.float64()
+    if internal_type == "DecimalField":
+        return pa.decimal128(field.max_digits, field.decimal_places)
+    return pa.string()
+
+
+def make_arrow_array(values: Sequence[Any], arrow_type: "pa.DataType"):
+    import pyarrow as pa
+
+    if arrow_type == pa.string():
+        # Files, UUIDs and the like come back from the DB as objects.
+        values = [
+            v if v is None or isinstance(v, str) else str(v) for v in values
+        ]
+    return pa.array(values, type=arrow_type)
+
+
+class ParquetDataset(object):
+    """A table to export as Parquet.
+
+    :param name: The name of the dataset, used for its directory.
+    :param model: The model to export. Every concrete field is exported,
+    with relations as their ids.
+    :param court_lookup: A lookup from the model to a court id, to
+    partition by, or None to leave the dataset unpartitioned.
+    :param date_lookup: A lookup from the model to the date to take the year
+    partition from.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        model: Model,
+        court_lookup: Optional[str] = None,
+        date_lookup: Optional[str] = None,
+    ) -> None:
+        self.name = name
+        self.model = model
+        self.court_lookup = court_lookup
+        self.date_lookup = date_lookup
+        self.columns = [f.attname for f in model._meta.concrete_fields]
+        self._schema = None
+
+    @property
+    def schema(self) -> "pa.Schema":
+        # Made on first use, so pyarrow is only needed to export Parquet.
+        if self._schema is None:
+            import pyarrow as pa
+
+            self._schema = pa.schema(
+                [
+                    pa.field(f.attname, get_arrow_type(f))
+                    for f in self.model._meta.concrete_fields
+                ]
+            )
+        return self._schema
+
+    @property
+    def is_partitioned(self) -> bool:
+        return self.court_lookup is not None
+
+    @property
+    def is_incremental(self) -> bool:
+        return "date_modified" in self.columns
+
+    def get_queryset(self) -> QuerySet:
+        return self.model.objects.all().order_by()
+
+    def get_rows(self, qs: QuerySet):
+        """Stream rows of the dataset, each followed by its court id and
+        date, if the dataset is partitioned.
+        """
+        lookups = list(self.columns)
+        if self.is_partitioned:
+            lookups += [self.court_lookup, self.date_lookup]
+        return qs.values_list(*lookups).iterator()
+
+    def get_changed_partitions(self, since) -> Dict[Any, set]:
+        """Find the partitions with rows modified since a date.
+
+        :return: A dict of court ids to the years that changed for them.
+        """
+        changed = (
+            self.get_queryset()
+            .filter(date_modified__gte=since)
+            .annotate(partition_year=ExtractYear(self.date_lookup))
+            .values_list(self.court_lookup, "partition_year")
+            .distinct()
+        )
+        partitions = defaultdict(set)
+        for court_id, year in changed:
+            partitions[court_id].add(year)
+        return partitions
+
+    def filter_partitions(
+        self,
+        qs: QuerySet,
+        court_id: Optional[str],
+        years: Optional[set] = None,
+    ) -> QuerySet:
+        """Narrow a queryset to a court, and optionally to some years."""
+        if court_id is None:
+            qs = qs.filter(**{"%s__isnull" % self.court_lookup: True})
+        else:
+            qs = qs.filter(**{self.court_lookup: court_id})
+        if years is not None:
+            q = Q(**{"%s__year__in" % self.date_lookup: years - {None}})
+            if None in years:
+                q |= Q(**{"%s__isnull" % self.date_lookup: True})
+            qs = qs.filter(q)
+        return qs
+
+
+def get_partition_name(court_id: Optional[str], year: Optional[int]) -> str:
+    return "court_id=%s/year=%s" % (
+        NULL_PARTITION if court_id is None else court_id,
+        NULL_PARTITION if year is None else year,
+    )
+
+
+class PartitionedParquetWriter(object):
+    """Write rows to the Parquet files of a dataset's partitions.
+
+    Rows are buffered until there are max_rows of them, across every
+    partition, and then written as a row group of each partition's file.
+    Files are written next to where they go and moved into place when the
+    writer is closed, so readers never see half-written files.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        schema: "pa.Schema",
+        max_rows: int = PARQUET_BATCH_ROWS,
+    ) -> None:
+        self.root = root
+        self.schema = schema
+        self.max_rows = max_rows
+        self.buffers: Dict[str, List[Tuple]] = defaultdict(list)
+        self.buffered = 0
+        self.writers: Dict[str, Tuple[str, "pq.ParquetWriter"]] = {}
+        self.counts: Dict[str, int] = defaultdict(int)
+
+    @staticmethod
+    def get_path(partition: str) -> str:
+        if partition:
+            return join(partition, "part-0.parquet")
+        return "all.parquet"
+
+    def add(self, partition: str, row: Tuple) -> None:
+        self.buffers[partition].append(row)
+        self.buffered += 1
+        if self.buffered >= self.max_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        import pyarrow as pa
+
+        for partition, rows in self.buffers.items():
+            columns = list(zip(*rows))
+            table = pa.Table.from_arrays(
+                [
+                    make_arrow_array(values, field.type)
+                    for values, field in zip(columns, self.schema)
+                ],
+                schema=self.schema,
+            )
+            self._get_writer(partition).write_table(table)
+            self.counts[partition] += len(rows)
+        self.buffers.clear()
+        self.buffered = 0
+
+    def _get_writer(self, partition: str) -> "pq.ParquetWriter":
+        import pyarrow.parquet as pq
+
+        if partition not in self.writers:
+            path = join(self.root, self.get_path(partition))
+            mkdir_p(os.path.dirname(path))
+            tmp_path = "%s.tmp" % path
+            writer = pq.ParquetWriter(
+                tmp_path, self.schema, compression="snappy"
+            )
+            self.writers[partition] = (tmp_path, writer)
+        return self.writers[partition][1]
+
+    def close(self) -> Dict[str, int]:
+        """Write out what's left, and move the files into place.
+
+        :return: A dict of the partitions written to how many rows each got.
+        """
+        self.flush()
+        for partition, (tmp_path, writer) in self.writers.items():
+            writer.close()
+            os.replace(tmp_path, join(self.root, self.get_path(partition)))
+        self.writers = {}
+        counts, self.counts = dict(self.counts), defaultdict(int)
+        return counts
+
+
+class ParquetManifest(object):
+    """The manifest.json of a dataset, listing its schema and partitions."""
+
+    def __init__(self, dataset: ParquetDataset, root: str) -> None:
+        self.dataset = dataset
+        self.root = root
+        self.path = join(root, "manifest.json")
+        try:
+            with open(self.path, "r") as f:
+                self.json = json.load(f)
+        except (IOError, ValueError):
+            self.json = {}
+        self.json.update(
+            {
+                "dataset": dataset.name,
+                "partitioning": ["court_id", "year"]
+                if dataset.is_partitioned
+                else [],
+                "schema": [
+                    {"name": f.name, "type": str(f.type)}
+                    for f in dataset.schema
+                ],
+            }
+        )
+        self.json.setdefault("partitions", {})
+
+    @property
+    def partitions(self) -> Dict[str, Dict[str, Any]]:
+        return self.json["partitions"]
+
+    def update(self, counts: Dict[str, int], replaced: Sequence[str]) -> None:
+        """Record partitions that were written, and drop ones that were
+        replaced and came out empty.
+
+        :param counts: A dict of the partitions written to their row counts.
+        :param replaced: The partitions that were meant to be rewritten.
+        """
+        updated = now().isoformat()
+        for partition in replaced:
+            if partition in counts:
+                continue
+            old = self.partitions.pop(partition, None)
+            if old is not None:
+                try:
+                    os.remove(join(self.root, old["path"]))
+                except FileNotFoundError:
+                    pass
+        for partition, rows in counts.items():
+            self.partitions[partition] = {
+                "path": PartitionedParquetWriter.get_path(partition),
+                "rows": rows,
+                "updated": updated,
+            }
+        self.json["rows"] = sum(p["rows"] for p in self.partitions.values())
+
+    def save(self) -> None:
+        mkdir_p(self.root)
+        with open(self.path, "w") as f:
+            json.dump(self.json, f, indent=2)
+
+
+def export_parquet_dataset(
+    dataset: ParquetDataset,
+    bulk_dir: str,
+    full: bool = False,
+    max_rows: int = PARQUET_BATCH_ROWS,
+) -> int:
+    """Write a dataset to Parquet, updating only the partitions that changed
+    since the last good run, unless a full export is asked for.
+
+    :param dataset: The dataset to export.
+    :param bulk_dir: The bulk data directory. Files go in its parquet
+    directory.
+    :param full: Whether to rewrite every partition.
+    :param max_rows: How many rows to hold in memory at once.
+    :return: The number of rows written.
+    """
+    root = join(bulk_dir, "parquet", dataset.name)
+    history = BulkJsonHistory(join("parquet", dataset.name), bulk_dir)
+    last_good_date = history.get_last_good_date()
+    history.add_current_attempt_and_save()
+    # Rows changed from here on are picked up by the next run
+    started = history.get_last_attempt()
+    manifest = ParquetManifest(dataset, root)
+    if full or not dataset.is_incremental or not manifest.partitions:
+        last_good_date = None
+
+    qs = dataset.get_queryset()
+    writer = PartitionedParquetWriter(root, dataset.schema, max_rows)
+    rows_written = 0
+    if not dataset.is_partitioned:
+        if (
+            last_good_date is not None
+            and not qs.filter(date_modified__gte=last_good_date).exists()
+        ):
+            logger.info("   - No %s have changed.", dataset.name)
+        else:
+            for row in dataset.get_rows(qs):
+                writer.add("", row)
+            counts = writer.close()
+            manifest.update(counts, [""])
+            rows_written = sum(counts.values())
+    else:
+        if last_good_date is None:
+            courts = list(Court.objects.values_list("pk", flat=True)) + [None]
+            partitions = {court_id: None for court_id in courts}
+            # Anything that was there before is being replaced.
+            replaced = list(manifest.partitions)
+        else:
+            partitions = dataset.get_changed_partitions(last_good_date)
+            replaced = [
+                get_partition_name(court_id, year)
+                for court_id, years in partitions.items()
+                for year in years
+            ]
+        n = len(dataset.columns)
+        written = set()
+        for court_id, years in partitions.items():
+            court_qs = dataset.filter_partitions(qs, court_id, years)
+            for row in dataset.get_rows(court_qs):
+                date = row[n + 1]
+                partition = get_partition_name(
+                    row[n], None if date is None else date.year
+                )
+                writer.add(partition, row[:n])
+            # Close the court's files before moving on, so few are open.
+            counts = writer.close()
+            manifest.update(counts, [])
+            written.update(counts)
+            rows_written += sum(counts.values())
+        manifest.update({}, [p for p in replaced if p not in written])
+    manifest.save()
+    history.mark_success_and_save(good_date=started)
+    logger.info(
+        "   - Wrote %s %s rows to Parquet.", rows_written, dataset.name
+    )
+    return rows_written
+
+
+PARQUET_DATASETS = [
+    ParquetDataset(
+        "opinions", Opinion, "cluster__docket__court_id", "cluster__date_filed"
+    ),
+    ParquetDataset(
+        "clusters", OpinionCluster, "docket__court_id", "date_filed"
+    ),
+    ParquetDataset("dockets", Docket, "court_id", "date_filed"),
+    ParquetDataset("people", Person),
+    ParquetDataset("positions", Position, "court_id", "date_start"),
+    ParquetDataset("citations", OpinionsCited),
+]
@@ -0,0 +1,86 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+
+from cl.api.utils import ApiUsageMeter
+from cl.lib.command_utils import VerboseCommand
+from cl.lib.redis_utils import make_redis_interface
+
+
+def time_requests(meter, count):
+    """Time count calls to the meter, as the request path makes them.
+
+    :return: A list of per-call latencies in milliseconds.
+    """
+    user = AnonymousUser()
+    latencies = []
+    for _ in range(count):
+        t1 = time.perf_counter()
+        meter.record(user, "benchmark-list", 25)
+        latencies.append((time.perf_counter() - t1) * 1000)
+    meter.flush()
+    return sorted(latencies)
+
+
+class Command(VerboseCommand):
+    help = (
+        "Compare the latency that API usage metering adds to the request "
+        "path when it writes to Redis on every request versus in batches."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=5000,
+            help="The number of requests to simulate in each mode.",
+        )
+        parser.add_argument(
+            "--flush-size",
+            type=int,
+            default=250,
+            help="The batch size to use for the buffered mode.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        count = options["count"]
+        # Use the cache database so real stats aren't polluted.
+        modes = (
+            ("unbuffered", 1),
+            ("buffered", options["flush_size"]),
+            ("none", None),
+        )
+        for name, flush_size in modes:
+            if flush_size is None:
+                # The baseline: a request path with no metering at all.
+                latencies = []
+                for _ in range(count):
+                    t1 = time.perf_counter()
+                    latencies.append((time.perf_counter() - t1) * 1000)
+                latencies.sort()
+            else:
+                meter = ApiUsageMeter(
+                    [],
+                    flush_size=flush_size,
+                    flush_interval=3600,
+                    db_name="CACHE",
+                    send_events=False,
+                )
+                latencies = time_requests(meter, count)
+            self.stdout.write(
+                "%-10s  mean: %7.3fms  p50: %7.3fms  p99: %7.3fms  "
+                "total: %7.1fms\n"
+                % (
+                    name,
+                    sum(latencies) / count,
+                    latencies[count // 2],
+                    latencies[int(count * 0.99)],
+                    sum(latencies),
+                )
+            )
+
+        r = make_redis_interface("CACHE")
+        keys = list(r.scan_iter("api:v3*"))
+        if keys:
+            r.delete(*keys)
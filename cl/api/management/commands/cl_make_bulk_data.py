@@ -5,6 +5,7 @@ from typing import Any, Dict, List
 
 from django.conf import settings
 
+from cl.api.bulk_parquet import PARQUET_DATASETS, export_parquet_dataset
 from cl.api.tasks import make_bulk_data_and_swap_it_in
 from cl.audio.api_serializers import AudioSerializer
 from cl.audio.models import Audio
@@ -38,8 +39,39 @@ from cl.search.models import Court, Docket, Opinion, OpinionCluster
 class Command(VerboseCommand):
     help = 'Create the bulk files for all jurisdictions and for "all".'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--format",
+            default="json",
+            choices=("json", "parquet", "all"),
+            help="Which bulk files to make. JSON files are the per-object "
+            "archives. Parquet files hold the columns of the main tables, "
+            "partitioned by court and year, for analysis.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            default=False,
+            help="Rewrite every Parquet partition, instead of only the ones "
+            "with changes since the last run.",
+        )
+
     def handle(self, *args: List[str], **options: Dict[str, Any]):
         super(Command, self).handle(*args, **options)
+        if options["format"] in ["json", "all"]:
+            self.make_json_data()
+        if options["format"] in ["parquet", "all"]:
+            self.make_parquet_data(options["full"])
+
+    @staticmethod
+    def make_parquet_data(full: bool) -> None:
+        logger.info("Starting Parquet file creation...")
+        for dataset in PARQUET_DATASETS:
+            logger.info(" - Creating Parquet files for %s...", dataset.name)
+            export_parquet_dataset(dataset, settings.BULK_DATA_DIR, full=full)
+        logger.info("Done.\n")
+
+    def make_json_data(self) -> None:
         courts = Court.objects.all()
 
         kwargs_list = [
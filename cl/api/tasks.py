@@ -5,16 +5,75 @@ import tarfile
 from os.path import join
 from typing import Any, Dict
 
+from django.contrib.auth.models import User
+from django.contrib.humanize.templatetags.humanize import intcomma, ordinal
+from django.core.mail import send_mail
 from django.db.models import QuerySet
 from django.test import RequestFactory
 from rest_framework.renderers import JSONRenderer
 from rest_framework.versioning import URLPathVersioning
 
-from cl.api.utils import BulkJsonHistory, HyperlinkedModelSerializerWithId
+from cl.api.utils import (
+    SEND_API_WELCOME_EMAIL_COUNT,
+    BulkJsonHistory,
+    HyperlinkedModelSerializerWithId,
+    emails,
+    write_api_usage,
+)
 from cl.celery_init import app
-from cl.lib.db_tools import queryset_generator
+from cl.lib.db_tools import PartitionedQuerysetScanner
 from cl.lib.timer import print_timing
 from cl.lib.utils import deepgetattr, mkdir_p
+from cl.stats.models import Event
+
+
+@app.task(ignore_result=True)
+def write_api_usage_batch(usage, user_milestones, db_name, send_events):
+    """Write a full batch of API usage stats to Redis, away from the request
+    cycle.
+
+    :param usage: A dict of the stats, from ApiUsageMeter.
+    :param user_milestones: The per-user request counts that get Events.
+    :param db_name: The Redis database to write to.
+    :param send_events: Whether to handle the milestones that were passed.
+    """
+    write_api_usage(usage, user_milestones, db_name, send_events)
+
+
+@app.task(ignore_result=True)
+def handle_api_milestones(global_milestones, user_milestones, milestones):
+    """Create events and send welcome emails for API usage milestones, away
+    from the request cycle.
+
+    :param global_milestones: A list of total request counts that were just
+    reached.
+    :param user_milestones: A list of (user_pk, count) tuples for request
+    counts that users just reached.
+    :param milestones: The user milestones that should create Events.
+    """
+    for total_count in global_milestones:
+        Event.objects.create(
+            description="API has logged %s total requests." % total_count
+        )
+    users = User.objects.in_bulk({user_pk for user_pk, _ in user_milestones})
+    for user_pk, user_count in user_milestones:
+        user = users.get(user_pk)
+        if user is None:
+            continue
+        if user_count in milestones:
+            Event.objects.create(
+                description="User '%s' has placed their %s API request."
+                % (user.username, intcomma(ordinal(user_count))),
+                user=user,
+            )
+        if user_count == SEND_API_WELCOME_EMAIL_COUNT:
+            email = emails["new_api_user"]
+            send_mail(
+                email["subject"],
+                email["body"] % user.first_name or "there",
+                email["from"],
+                [user.email],
+            )
 
 
 @app.task
@@ -160,7 +219,7 @@ def write_json_to_disk(
         print("   - Incremental data not found. Working from scratch...")
         qs = obj_class.objects.all()
 
-    if qs.count() == 0:
+    if not qs.exists():
         print(
             "   - No %s-type items in the DB or none that have changed. All "
             "done here." % obj_type_str
@@ -168,11 +227,9 @@ def write_json_to_disk(
         history.mark_success_and_save()
         return 0
     else:
-        if type(qs[0].pk) == int:
-            item_list = queryset_generator(qs)
-        else:
-            # Necessary for Court objects, which don't have ints for ids.
-            item_list = qs
+        # The scanner streams the rows in pk order, whether the pks are ints
+        # or, as with Court objects, strings.
+        item_list = PartitionedQuerysetScanner(qs)
 
         i = 0
         renderer = JSONRenderer()
@@ -209,6 +266,7 @@ def write_json_to_disk(
             i += 1
 
         print("   - %s %s json files created." % (i, obj_type_str))
+        print("   - Scanned %s" % item_list.stats)
 
         history.mark_success_and_save()
         return i
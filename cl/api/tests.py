@@ -1,7 +1,10 @@
 import json
 import shutil
+import time
 from datetime import date, timedelta
+from os.path import join
 
+import pyarrow.parquet as pq
 from django.conf import settings
 from django.contrib.auth.models import Permission, User
 from django.core import mail
@@ -19,7 +22,12 @@ from django.urls import ResolverMatch, reverse
 from django.utils.timezone import now
 from rest_framework.status import HTTP_200_OK, HTTP_403_FORBIDDEN
 
-from cl.api.utils import SEND_API_WELCOME_EMAIL_COUNT, BulkJsonHistory
+from cl.api.utils import (
+    SEND_API_WELCOME_EMAIL_COUNT,
+    ApiUsageMeter,
+    BulkJsonHistory,
+    get_crossed_milestones,
+)
 from cl.api.views import coverage_data
 from cl.audio.api_views import AudioViewSet
 from cl.audio.models import Audio
@@ -270,6 +278,65 @@ class ApiEventCreationTestCase(TestCase):
         self.assertEqual(expected_event_count, Event.objects.count())
 
 
+class ApiUsageMeterTest(TestCase):
+    """Are API stats buffered and flushed to Redis correctly?"""
+
+    fixtures = ["user_with_recap_api_access.json"]
+
+    def setUp(self):
+        self.user = User.objects.get(pk=6)
+        self.r = make_redis_interface("STATS")
+        self.r.flushdb()
+
+    def tearDown(self):
+        Event.objects.all().delete()
+        self.r.flushdb()
+
+    def test_get_crossed_milestones(self):
+        milestones = [1, 5, 10, 50]
+        self.assertEqual(get_crossed_milestones(0, 1, milestones), [1])
+        self.assertEqual(get_crossed_milestones(1, 10, milestones), [5, 10])
+        self.assertEqual(get_crossed_milestones(10, 49, milestones), [])
+
+    def test_buffered_requests_are_flushed_together(self):
+        """Are stats held back until the batch is full, then all written?"""
+        meter = ApiUsageMeter([], flush_size=3, flush_interval=3600)
+        meter.record(self.user, "audio-list", 10)
+        meter.record(self.user, "audio-list", 20)
+        self.assertIsNone(self.r.get("api:v3.count"))
+
+        meter.record(self.user, "docket-list", 30)
+        self.assertEqual(int(self.r.get("api:v3.count")), 3)
+        self.assertEqual(int(self.r.get("api:v3.timing")), 60)
+        self.assertEqual(self.r.zscore("api:v3.user.counts", self.user.pk), 3)
+        self.assertEqual(
+            self.r.zscore("api:v3.endpoint.counts", "audio-list"), 2
+        )
+
+    def test_idle_meters_are_flushed(self):
+        """Are stats written on a timer, even if no more requests come?"""
+        meter = ApiUsageMeter(
+            [], flush_size=100, flush_interval=0.1, send_events=False
+        )
+        meter.record(self.user, "audio-list", 10)
+        deadline = time.monotonic() + 5
+        while self.r.get("api:v3.count") is None:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.05)
+        self.assertEqual(int(self.r.get("api:v3.count")), 1)
+
+    def test_milestones_are_found_across_a_batch(self):
+        """If a batch passes a milestone, is an event still created?"""
+        meter = ApiUsageMeter([2], flush_size=3, flush_interval=3600)
+        for _ in range(3):
+            meter.record(self.user, "audio-list", 10)
+        self.assertTrue(
+            Event.objects.filter(
+                user=self.user, description__contains="2nd"
+            ).exists()
+        )
+
+
 class DRFOrderingTests(TestCase):
     """Does ordering work generally and specifically?"""
 
@@ -962,6 +1029,29 @@ class BulkDataTest(TestCase):
         """Can we successfully generate all bulk files?"""
         call_command("cl_make_bulk_data")
 
+    @override_settings(BULK_DATA_DIR=tmp_data_dir)
+    def test_make_parquet_files(self):
+        """Can we write Parquet files, and skip partitions that haven't
+        changed the next time around?
+        """
+        call_command("cl_make_bulk_data", format="parquet")
+        root = join(self.tmp_data_dir, "parquet", "opinions")
+        with open(join(root, "manifest.json")) as f:
+            manifest = json.load(f)
+        partition = "court_id=test/year=%s" % self.doc_cluster.date_filed.year
+        info = manifest["partitions"][partition]
+        self.assertEqual(info["rows"], 2)
+        table = pq.read_table(join(root, info["path"]))
+        self.assertEqual(
+            set(table.column("type").to_pylist()),
+            {"Lead Opinion", "Concurrence"},
+        )
+
+        call_command("cl_make_bulk_data", format="parquet")
+        with open(join(root, "manifest.json")) as f:
+            manifest = json.load(f)
+        self.assertEqual(manifest["partitions"][partition], info)
+
     def test_database_has_objects_for_bulk_export(self):
         self.assertTrue(Opinion.objects.count() > 0, "Opinions exist")
         self.assertTrue(OpinionsCited.objects.count() > 0, "Citations exist")
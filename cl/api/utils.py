@@ -1,6 +1,9 @@
+import atexit
 import json
 import logging
 import os
+import threading
+import time
 from collections import OrderedDict, defaultdict
 from datetime import date
 
@@ -8,8 +11,6 @@ from dateutil import parser
 from dateutil.rrule import DAILY, rrule
 from django.conf import settings
 from django.contrib.auth.models import User
-from django.contrib.humanize.templatetags.humanize import intcomma, ordinal
-from django.core.mail import send_mail
 from django.db import connections
 from django.urls import resolve
 from django.utils.decorators import method_decorator
@@ -29,7 +30,6 @@ from rest_framework_filters.backends import RestFrameworkFilterBackend
 from cl.lib.db_tools import fetchall_as_dict
 from cl.lib.redis_utils import make_redis_interface
 from cl.lib.utils import mkdir_p
-from cl.stats.models import Event
 from cl.stats.utils import MILESTONES_FLAT, get_milestone_range
 
 BOOLEAN_LOOKUPS = ["exact"]
@@ -171,6 +171,238 @@ class SimpleMetadataWithFilters(SimpleMetadata):
 SEND_API_WELCOME_EMAIL_COUNT = 5
 
 
+def get_crossed_milestones(old_count, new_count, milestones):
+    """Get the milestones passed when a count goes from old_count to
+    new_count, i.e., those in (old_count, new_count].
+    """
+    return [m for m in milestones if old_count < m <= new_count]
+
+
+def write_api_usage(usage, user_milestones, db_name="STATS", send_events=True):
+    """Write a batch of API usage stats to Redis.
+
+    :param usage: A dict of the stats, from ApiUsageMeter.
+    :param user_milestones: The per-user request counts that get Events.
+    :param db_name: The Redis database to write to.
+    :param send_events: Whether to handle the milestones that were passed.
+    """
+    request_count = usage["request_count"]
+    counts = usage["counts"]
+    timings = usage["timings"]
+    user_counts = usage["user_counts"]
+    endpoint_counts = usage["endpoint_counts"]
+    endpoint_timings = usage["endpoint_timings"]
+    authenticated_users = usage["authenticated_users"]
+
+    r = make_redis_interface(db_name)
+    pipe = r.pipeline()
+
+    # Global and daily tallies for all URLs.
+    pipe.incr("api:v3.count", request_count)
+    for d, count in counts.items():
+        pipe.incr("api:v3.d:%s.count" % d, count)
+    pipe.incr("api:v3.timing", sum(timings.values()))
+    for d, timing in timings.items():
+        pipe.incr("api:v3.d:%s.timing" % d, timing)
+
+    # Use a sorted set to store the user stats, with the score representing
+    # the number of queries the user made total or on a given day.
+    user_totals = defaultdict(int)
+    for (d, user_pk), count in user_counts.items():
+        user_totals[user_pk] += count
+        pipe.zincrby("api:v3.user.d:%s.counts" % d, count, user_pk)
+    user_order = list(user_totals.keys())
+    for user_pk in user_order:
+        pipe.zincrby("api:v3.user.counts", user_totals[user_pk], user_pk)
+
+    # Use a sorted set to store all the endpoints with score representing the
+    # number of queries the endpoint received total or on a given day.
+    endpoint_totals = defaultdict(int)
+    for (d, endpoint), count in endpoint_counts.items():
+        endpoint_totals[endpoint] += count
+        pipe.zincrby("api:v3.endpoint.d:%s.counts" % d, count, endpoint)
+    for endpoint, count in endpoint_totals.items():
+        pipe.zincrby("api:v3.endpoint.counts", count, endpoint)
+
+    # We create a per-day key in redis for timings. Inside the key we have
+    # members for every endpoint, with score of the total time. So to get the
+    # average for an endpoint you need to get the number of requests and the
+    # total time for the endpoint and divide.
+    for (d, endpoint), timing in endpoint_timings.items():
+        pipe.zincrby("api:v3.endpoint.d:%s.timings" % d, timing, endpoint)
+
+    results = pipe.execute()
+    if not send_events:
+        return
+
+    # Work out which milestones were passed from the new totals.
+    total_count = results[0]
+    global_milestones = get_crossed_milestones(
+        total_count - request_count, total_count, MILESTONES_FLAT
+    )
+    user_results_start = 2 + len(counts) + len(timings) + len(user_counts)
+    crossed_user_milestones = []
+    for i, user_pk in enumerate(user_order):
+        if user_pk not in authenticated_users:
+            continue
+        new_count = int(results[user_results_start + i])
+        old_count = new_count - user_totals[user_pk]
+        for milestone in get_crossed_milestones(
+            old_count,
+            new_count,
+            set(user_milestones) | {SEND_API_WELCOME_EMAIL_COUNT},
+        ):
+            crossed_user_milestones.append((user_pk, milestone))
+
+    if global_milestones or crossed_user_milestones:
+        from cl.api.tasks import handle_api_milestones
+
+        handle_api_milestones.delay(
+            global_milestones, crossed_user_milestones, user_milestones
+        )
+
+
+class ApiUsageMeter(object):
+    """Buffer API usage stats in memory and write them to Redis in batches.
+
+    Logging every request to Redis as it happened meant a nine-command
+    pipeline inside every API response. Instead, each process sums up the
+    counts and timings it sees. Every settings.API_METER_FLUSH_SIZE requests,
+    the batch is handed to a Celery task to write. A background thread in
+    each process also writes whatever is buffered every
+    settings.API_METER_FLUSH_INTERVAL seconds, so idle processes don't sit
+    on their counts, and the rest is written when the process exits. The
+    Redis keys are the same as they always were, so the readers of those keys
+    (invert_user_logs, get_count_for_endpoint, etc.) don't need to change.
+
+    Milestone events and welcome emails are worked out from the counts Redis
+    returns when writing, and are sent to Celery rather than handled in the
+    request.
+    """
+
+    def __init__(
+        self,
+        user_milestones,
+        flush_size=None,
+        flush_interval=None,
+        db_name="STATS",
+        send_events=True,
+    ):
+        """
+        :param user_milestones: The per-user request counts that get Events.
+        :param flush_size: Override settings.API_METER_FLUSH_SIZE.
+        :param flush_interval: Override settings.API_METER_FLUSH_INTERVAL.
+        :param db_name: The Redis database to write to.
+        :param send_events: Whether to handle milestones when flushing.
+        """
+        self.user_milestones = user_milestones
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.db_name = db_name
+        self.send_events = send_events
+        self._lock = threading.Lock()
+        self._timer_pid = None
+        self._reset()
+
+    def _reset(self):
+        self.request_count = 0
+        # Keyed by date string
+        self.counts = defaultdict(int)
+        self.timings = defaultdict(int)
+        # Keyed by (date string, member)
+        self.user_counts = defaultdict(int)
+        self.endpoint_counts = defaultdict(int)
+        self.endpoint_timings = defaultdict(int)
+        # Users that have made a request, by pk, to check milestones
+        self.authenticated_users = set()
+
+    def _start_timer(self):
+        """Start the thread that flushes the meter every flush_interval
+        seconds, if this process doesn't have one yet. Threads don't survive
+        a fork, so each process starts its own, and a forked process drops
+        the stats it inherited, since its parent writes them.
+
+        Call this with the lock held.
+        """
+        pid = os.getpid()
+        if self._timer_pid == pid:
+            return
+        if self._timer_pid is not None:
+            self._reset()
+        self._timer_pid = pid
+        thread = threading.Thread(
+            target=self._run_timer, name="api-usage-meter", daemon=True
+        )
+        thread.start()
+
+    def _run_timer(self):
+        interval = self.flush_interval or settings.API_METER_FLUSH_INTERVAL
+        while True:
+            time.sleep(interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Unable to flush API usage stats: %s", e)
+
+    def record(self, user, endpoint, response_ms):
+        """Record one API request, handing the batch to Celery if it's
+        full.
+
+        :param user: The user that made the request.
+        :param endpoint: The name of the endpoint that was requested.
+        :param response_ms: How long it took to respond, in milliseconds.
+        """
+        d = date.today().isoformat()
+        user_pk = user.pk or "AnonymousUser"
+        with self._lock:
+            self._start_timer()
+            self.request_count += 1
+            self.counts[d] += 1
+            self.timings[d] += response_ms
+            self.user_counts[(d, user_pk)] += 1
+            self.endpoint_counts[(d, endpoint)] += 1
+            self.endpoint_timings[(d, endpoint)] += response_ms
+            if user.is_authenticated:
+                self.authenticated_users.add(user_pk)
+            flush_size = self.flush_size or settings.API_METER_FLUSH_SIZE
+            usage = None
+            if self.request_count >= flush_size:
+                usage = self._take()
+        if usage is not None:
+            from cl.api.tasks import write_api_usage_batch
+
+            write_api_usage_batch.delay(
+                usage, self.user_milestones, self.db_name, self.send_events
+            )
+
+    def _take(self):
+        """Empty the buffer. Call this with the lock held.
+
+        :return: A dict of the buffered stats, for write_api_usage.
+        """
+        usage = {
+            "request_count": self.request_count,
+            "counts": dict(self.counts),
+            "timings": dict(self.timings),
+            "user_counts": dict(self.user_counts),
+            "endpoint_counts": dict(self.endpoint_counts),
+            "endpoint_timings": dict(self.endpoint_timings),
+            "authenticated_users": self.authenticated_users,
+        }
+        self._reset()
+        return usage
+
+    def flush(self):
+        """Write everything that's buffered to Redis."""
+        with self._lock:
+            if self.request_count == 0:
+                return
+            usage = self._take()
+        write_api_usage(
+            usage, self.user_milestones, self.db_name, self.send_events
+        )
+
+
 class LoggingMixin(object):
     """Log requests to Redis
 
@@ -185,6 +417,8 @@ class LoggingMixin(object):
      - How many queries ever, total?
      - How many queries total made by user X?
      - How many queries per day made by user X?
+
+    Requests are buffered by the usage meter and written in batches.
     """
 
     milestones = get_milestone_range("SM", "XXXL")
@@ -200,12 +434,11 @@ class LoggingMixin(object):
             request, response, *args, **kwargs
         )
 
-        if not response.exception:
+        if not getattr(response, "exception", False):
             # Don't log things like 401, 403, etc.,
             # noinspection PyBroadException
             try:
-                results = self._log_request(request)
-                self._handle_events(results, request.user)
+                self._log_request(request)
             except Exception as e:
                 logger.exception(
                     "Unable to log API response timing info: %s", e
@@ -223,64 +456,12 @@ class LoggingMixin(object):
         return max(response_ms, 0)
 
     def _log_request(self, request):
-        d = date.today().isoformat()
-        user = request.user
         endpoint = resolve(request.path_info).url_name
-        response_ms = self._get_response_ms()
+        api_usage_meter.record(request.user, endpoint, self._get_response_ms())
 
-        r = make_redis_interface("STATS")
-        pipe = r.pipeline()
 
-        # Global and daily tallies for all URLs.
-        pipe.incr("api:v3.count")
-        pipe.incr("api:v3.d:%s.count" % d)
-        pipe.incr("api:v3.timing", response_ms)
-        pipe.incr("api:v3.d:%s.timing" % d, response_ms)
-
-        # Use a sorted set to store the user stats, with the score representing
-        # the number of queries the user made total or on a given day.
-        user_pk = user.pk or "AnonymousUser"
-        pipe.zincrby("api:v3.user.counts", 1, user_pk)
-        pipe.zincrby("api:v3.user.d:%s.counts" % d, 1, user_pk)
-
-        # Use a sorted set to store all the endpoints with score representing
-        # the number of queries the endpoint received total or on a given day.
-        pipe.zincrby("api:v3.endpoint.counts", 1, endpoint)
-        pipe.zincrby("api:v3.endpoint.d:%s.counts" % d, 1, endpoint)
-
-        # We create a per-day key in redis for timings. Inside the key we have
-        # members for every endpoint, with score of the total time. So to get
-        # the average for an endpoint you need to get the number of requests
-        # and the total time for the endpoint and divide.
-        timing_key = "api:v3.endpoint.d:%s.timings" % d
-        pipe.zincrby(timing_key, response_ms, endpoint)
-
-        results = pipe.execute()
-        return results
-
-    def _handle_events(self, results, user):
-        total_count = results[0]
-        user_count = results[4]
-
-        if total_count in MILESTONES_FLAT:
-            Event.objects.create(
-                description="API has logged %s total requests." % total_count
-            )
-        if user.is_authenticated:
-            if user_count in self.milestones:
-                Event.objects.create(
-                    description="User '%s' has placed their %s API request."
-                    % (user.username, intcomma(ordinal(user_count))),
-                    user=user,
-                )
-            if user_count == SEND_API_WELCOME_EMAIL_COUNT:
-                email = emails["new_api_user"]
-                send_mail(
-                    email["subject"],
-                    email["body"] % user.first_name or "there",
-                    email["from"],
-                    [user.email],
-                )
+api_usage_meter = ApiUsageMeter(LoggingMixin.milestones)
+atexit.register(api_usage_meter.flush)
 
 
 class CacheListMixin(object):
@@ -449,10 +630,17 @@ class BulkJsonHistory(object):
         self.json["last_attempt"] = now().isoformat()
         self.save_to_disk()
 
-    def mark_success_and_save(self):
-        """Note a successful run."""
+    def mark_success_and_save(self, good_date=None):
+        """Note a successful run.
+
+        :param good_date: When the data that was written was read, if not
+        now. Runs that pick up changes since the last good date should pass
+        the time they started, so changes made while they ran aren't missed.
+        """
         n = now()
-        self.json["last_good_date"] = n.isoformat()
+        if good_date is None:
+            good_date = n
+        self.json["last_good_date"] = good_date.isoformat()
         try:
             duration = n - parser.parse(self.json["last_attempt"])
             self.json["duration"] = int(duration.total_seconds())
@@ -1,5 +1,8 @@
+import subprocess
 from distutils.spawn import find_executable
+from typing import Any, Dict, Optional
 
+import eyed3
 from django.utils.text import slugify
 
 
@@ -45,3 +48,80 @@ def make_af_filename(court_id, docket_number, date_argued, extension):
         extension,
     ]
     return ".".join(parts)
+
+
+def convert_audio_locally(
+    path: str, out_path: str, audio_data: Dict[str, Any]
+) -> None:
+    """Convert an audio file to a tagged MP3 without the BTE service.
+
+    This is the fallback for when BTE can't be reached. The MP3 is encoded
+    the way BTE encodes it, but doesn't get BTE's cover art.
+
+    :param path: The path of the original audio file.
+    :param out_path: Where to write the MP3.
+    :param audio_data: Metadata for the tags, from get_audio_metadata.
+    :return: None
+    """
+    av_command = [
+        get_audio_binary(),
+        "-i",
+        path,
+        "-ar",
+        "22050",
+        "-ab",
+        "48k",
+        "-f",
+        "mp3",
+        "-y",
+        out_path,
+    ]
+    subprocess.run(
+        av_command,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        check=True,
+    )
+    set_mp3_meta_data(out_path, audio_data)
+
+
+def set_mp3_meta_data(path: str, audio_data: Dict[str, Any]) -> None:
+    """Tag an MP3 with the metadata of its case and court.
+
+    :param path: The path of the MP3.
+    :param audio_data: Metadata for the tags, from get_audio_metadata.
+    :return: None
+    """
+    audio_file = eyed3.load(path)
+    audio_file.initTag()
+    tag = audio_file.tag
+    tag.title = audio_data["case_name"] or audio_data["case_name_full"]
+    tag.artist = audio_data["court_full_name"]
+    tag.album = "%s, %s" % (
+        audio_data["court_full_name"],
+        audio_data["date_argued_year"],
+    )
+    tag.artist_url = audio_data["court_url"]
+    tag.audio_source_url = audio_data["download_url"]
+    tag.comments.set(
+        "Argued: %s. Docket number: %s"
+        % (audio_data["date_argued"], audio_data["docket_number"])
+    )
+    tag.genre = "Speech"
+    tag.publisher = "Free Law Project"
+    tag.publisher_url = "https://free.law"
+    if audio_data["date_argued"]:
+        tag.recording_date = audio_data["date_argued"]
+    tag.save()
+
+
+def get_audio_duration(path: str) -> Optional[float]:
+    """Measure the length of an MP3.
+
+    :param path: The path of the MP3.
+    :return: The duration in seconds, or None if it can't be read.
+    """
+    audio_file = eyed3.load(path)
+    if audio_file is None or audio_file.info is None:
+        return None
+    return audio_file.info.time_secs
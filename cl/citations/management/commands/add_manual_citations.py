@@ -3,6 +3,7 @@ import pandas as pd
 from cl.lib.command_utils import VerboseCommand, logger
 from cl.search.models import Opinion, OpinionsCited
 from cl.search.tasks import add_items_to_solr
+from cl.visualizations.citation_graph import log_citation_changes
 
 
 def load_csv(csv_location):
@@ -51,6 +52,11 @@ def process_citations(data, debug):
     logger.info("\nUpdating Solr...")
     if not debug:
         add_items_to_solr(updated_ids, "search.Opinion")
+        log_citation_changes(
+            Opinion.objects.filter(
+                pk__in=updated_ids, cluster__docket__court_id="scotus"
+            ).values_list("cluster_id", flat=True)
+        )
     logger.info("Done.")
 
 
@@ -1,11 +1,100 @@
 import sys
+from multiprocessing import Pool
+from typing import Dict, List, Optional, Sequence
 
+import scorched
 from django.conf import settings
-from django.core.management import call_command
+from django.db import connection, connections, transaction
+from django.utils.timezone import now
 
 from cl.lib.command_utils import VerboseCommand, logger
-from cl.lib.db_tools import queryset_generator
-from cl.search.models import OpinionCluster
+from cl.lib.db_tools import PkRange, get_pk_boundaries, make_pk_ranges
+from cl.lib.search_cache import bump_search_generation
+from cl.search.models import Opinion, OpinionCluster, OpinionsCited
+from cl.search.tasks import send_solr_field_updates
+
+
+def recount_citations(
+    pk_range: PkRange = (None, None),
+    cluster_pks: Optional[Sequence[int]] = None,
+) -> Dict[int, int]:
+    """Recount the citations to clusters and save the counts that changed.
+
+    The counts are computed with one grouped query over OpinionsCited, and
+    the clusters whose counts are wrong are fixed by the same statement, so
+    the clusters that are already right aren't written at all.
+
+    :param pk_range: A half-open range of cluster pks to recount. Either end
+    can be None to leave that side open.
+    :param cluster_pks: If provided, only recount these clusters.
+    :return: A dict of the pks of the clusters that changed to their new
+    citation counts.
+    """
+    qn = connection.ops.quote_name
+    conditions = []
+    params: List = []
+    start, end = pk_range
+    if start is not None:
+        conditions.append("c.id >= %s")
+        params.append(start)
+    if end is not None:
+        conditions.append("c.id < %s")
+        params.append(end)
+    if cluster_pks:
+        placeholders = ", ".join(["%s"] * len(cluster_pks))
+        conditions.append("c.id IN (%s)" % placeholders)
+        params.extend(cluster_pks)
+    where = "WHERE %s" % " AND ".join(conditions) if conditions else ""
+
+    query = (
+        "UPDATE {cluster} AS t "
+        "SET citation_count = counts.n, date_modified = %s "
+        "FROM ("
+        "  SELECT c.id, COUNT(oc.id) AS n FROM {cluster} AS c "
+        "  LEFT JOIN {opinion} AS o ON o.cluster_id = c.id "
+        "  LEFT JOIN {cited} AS oc ON oc.cited_opinion_id = o.id "
+        "  {where} GROUP BY c.id"
+        ") AS counts "
+        "WHERE t.id = counts.id AND t.citation_count <> counts.n "
+        "RETURNING t.id, t.citation_count".format(
+            cluster=qn(OpinionCluster._meta.db_table),
+            opinion=qn(Opinion._meta.db_table),
+            cited=qn(OpinionsCited._meta.db_table),
+            where=where,
+        )
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(query, [now()] + params)
+        return dict(cursor.fetchall())
+
+
+def _recount_range(pk_range: PkRange) -> Dict[int, int]:
+    try:
+        return recount_citations(pk_range)
+    finally:
+        connections.close_all()
+
+
+def update_cite_counts_in_solr(changes: Dict[int, int]) -> None:
+    """Send new citation counts to the opinions core.
+
+    Only the citeCount field of each opinion is sent, as an atomic update,
+    so the opinions' text doesn't have to be loaded or sent again.
+
+    :param changes: A dict of cluster pks to their new citation counts.
+    """
+    if not changes:
+        return
+    si = scorched.SolrInterface(settings.SOLR_OPINION_URL, mode="w")
+    try:
+        send_solr_field_updates(
+            si,
+            {pk: {"citeCount": count} for pk, count in changes.items()},
+            "search.OpinionCluster",
+        )
+    finally:
+        si.conn.http_connection.close()
+    bump_search_generation(settings.SOLR_OPINION_URL)
 
 
 class Command(VerboseCommand):
@@ -24,63 +113,73 @@ class Command(VerboseCommand):
             default="all-at-end",
             choices=("all-at-end", "concurrently", "False"),
             help=(
-                "When/if to save changes to the Solr index. Options are "
-                "all-at-end, concurrently or False. Saving 'concurrently' "
-                "is least efficient, since each document is updated once "
-                "for each citation to it, however this setting will show "
-                "changes in the index in realtime. Saving 'all-at-end' can "
-                "be considerably more efficient, but will not show changes "
-                "until the process has finished and the index has been "
-                "completely regenerated from the database. Setting this to "
-                "False disables changes to Solr, if that is what's desired. "
-                "Finally, only 'concurrently' will avoid reindexing the "
-                "entire collection. If you are only updating a subset of "
-                "the opinions, it is thus generally wise to use "
-                "'concurrently'."
+                "When/if to save changes to the Solr index. Only the "
+                "citation counts of clusters whose counts changed are sent. "
+                "Options are all-at-end, concurrently or False. Saving "
+                "'concurrently' sends the changes after each range of "
+                "clusters is recounted, so they show up sooner. Saving "
+                "'all-at-end' sends them once every range is done. Setting "
+                "this to False disables changes to Solr, if that is what's "
+                "desired."
             ),
         )
+        parser.add_argument(
+            "--partitions",
+            type=int,
+            default=1,
+            help="How many ranges of cluster pks to recount separately. "
+            "Smaller ranges keep each transaction short.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="How many ranges to recount at once, in separate processes.",
+        )
 
     @staticmethod
-    def do_solr(options):
+    def do_solr(options, changes):
         """Update Solr if requested, or report if not."""
-        if options["index"] == "all-at-end":
-            # fmt: off
-            call_command(
-                'cl_update_index',
-                '--type', 'search.Opinion',
-                '--solr-url', settings.SOLR_OPINION_URL,
-                '--noinput',
-                '--update',
-                '--everything',
-                '--do-commit',
-            )
-            # fmt: on
-        elif options["index"] == "False":
+        if options["index"] == "False":
             sys.stdout.write(
                 "Solr index not updated after running citation "
                 "finder. You may want to do so manually."
             )
+        else:
+            update_cite_counts_in_solr(changes)
 
     def handle(self, *args, **options):
         """
-        For any item that has a citation count > 0, update the citation
-        count based on the DB.
+        Recount the citations to every cluster, and update the ones whose
+        citation counts are wrong.
         """
         super(Command, self).handle(*args, **options)
-        index_during_processing = False
-        if options["index"] == "concurrently":
-            index_during_processing = True
-
-        q = OpinionCluster.objects.filter(citation_count__gt=0)
         if options.get("doc_id"):
-            q = q.filter(pk__in=options["doc_id"])
-        items = queryset_generator(q, chunksize=10000)
-        for item in items:
-            count = 0
-            for sub_opinion in item.sub_opinions.all():
-                count += sub_opinion.citing_opinions.all().count()
+            changes = recount_citations(cluster_pks=options["doc_id"])
+            logger.info("Updated %s clusters", len(changes))
+            self.do_solr(options, changes)
+            return
 
-            item.citation_count = count
-            item.save(index=index_during_processing)
-
-        self.do_solr(options)
+        boundaries = get_pk_boundaries(
+            OpinionCluster.objects.all(), options["partitions"]
+        )
+        ranges = make_pk_ranges(boundaries)
+        concurrently = options["index"] == "concurrently"
+        changes: Dict[int, int] = {}
+        if options["workers"] > 1:
+            connections.close_all()
+            with Pool(processes=options["workers"]) as pool:
+                results = pool.imap_unordered(_recount_range, ranges)
+                for range_changes in results:
+                    changes.update(range_changes)
+                    if concurrently:
+                        self.do_solr(options, range_changes)
+        else:
+            for pk_range in ranges:
+                range_changes = recount_citations(pk_range)
+                changes.update(range_changes)
+                if concurrently:
+                    self.do_solr(options, range_changes)
+        logger.info("Updated %s clusters", len(changes))
+        if not concurrently:
+            self.do_solr(options, changes)
@@ -15,7 +15,8 @@ from cl.citations.utils import (
     remove_duplicate_citations_by_regex,
 )
 from cl.search.models import Opinion, OpinionCluster, OpinionsCited
-from cl.search.tasks import add_items_to_solr
+from cl.search.tasks import add_items_to_solr, update_solr_fields
+from cl.visualizations.citation_graph import log_citation_changes
 
 # This is the distance two reporter abbreviations can be from each other if
 # they are considered parallel reporters. For example,
@@ -207,17 +208,21 @@ def find_citations_for_opinion_by_pks(
 
         with transaction.atomic():
             # Then, increment the citation_count fields for those matched
-            # clusters all at once. Trigger a single Solr update as well, if
-            # required.
+            # clusters all at once. Increment their counts in Solr as well, if
+            # required. Solr does the increment, so it doesn't matter if other
+            # tasks change the counts in the meantime.
             opinion_clusters_to_update = OpinionCluster.objects.filter(
                 sub_opinions__pk__in=opinion_ids_to_update
             )
+            cluster_pks = set(
+                opinion_clusters_to_update.values_list("pk", flat=True)
+            )
             opinion_clusters_to_update.update(
                 citation_count=F("citation_count") + 1
             )
-            if index:
-                add_items_to_solr.delay(
-                    opinion_clusters_to_update.values_list("pk", flat=True),
+            if index and cluster_pks:
+                update_solr_fields.delay(
+                    {pk: {"citeCount": {"inc": 1}} for pk in cluster_pks},
                     "search.OpinionCluster",
                 )
 
@@ -243,6 +248,13 @@ def find_citations_for_opinion_by_pks(
             # Save all the changes to the citing opinion (send to solr later)
             opinion.save(index=False)
 
+    # Let the in-memory SCOTUS citation graphs know what changed.
+    log_citation_changes(
+        Opinion.objects.filter(
+            pk__in=opinion_pks, cluster__docket__court_id="scotus"
+        ).values_list("cluster_id", flat=True)
+    )
+
     # If a Solr update was requested, do a single one at the end with all the
     # pks of the passed opinions
     if index:
@@ -20,6 +20,11 @@ from cl.citations.tasks import (
     create_cited_html,
     find_citations_for_opinion_by_pks,
 )
+from cl.citations.utils import (
+    get_citation_depth_between_clusters,
+    get_citation_depths_from_cluster,
+    get_citation_depths_to_cluster,
+)
 from cl.lib.test_helpers import IndexedSolrTestCase
 from cl.search.models import Opinion, OpinionCluster, OpinionsCited
 
@@ -576,6 +581,36 @@ class UpdateTest(IndexedSolrTestCase):
             )
             print("✓")
 
+    def test_batch_citation_depths(self):
+        """Do the batch depth lookups match the per-pair lookups?"""
+        remove_citations_from_imported_fixtures()
+        find_citations_for_opinion_by_pks.delay([10])
+        citing = Opinion.objects.get(pk=10)
+        cited_clusters = [
+            Opinion.objects.get(pk=pk).cluster_id for pk in (7, 8, 9)
+        ]
+
+        depths = get_citation_depths_from_cluster(citing.cluster_id)
+        for cited_cluster_pk in cited_clusters:
+            self.assertEqual(
+                depths[cited_cluster_pk],
+                get_citation_depth_between_clusters(
+                    citing.cluster_id, cited_cluster_pk
+                ),
+            )
+
+        depths = get_citation_depths_to_cluster(
+            [citing.cluster_id, cited_clusters[1]], cited_clusters[0]
+        )
+        self.assertEqual(
+            depths,
+            {
+                citing.cluster_id: get_citation_depth_between_clusters(
+                    citing.cluster_id, cited_clusters[0]
+                )
+            },
+        )
+
 
 class CitationFeedTest(IndexedSolrTestCase):
     def _tree_has_content(self, content, expected_count):
@@ -680,6 +715,55 @@ class CitationCommandTest(IndexedSolrTestCase):
         self.call_command_and_test_it(args)
 
 
+class CountCitationsTest(IndexedSolrTestCase):
+    """Test that cl_count_citations fixes wrong counts, and only those."""
+
+    fixtures = [
+        "judge_judy.json",
+        "test_objects_search.json",
+        "opinions_matching_citations.json",
+    ]
+
+    def setUp(self):
+        remove_citations_from_imported_fixtures()
+        OpinionsCited.objects.create(citing_opinion_id=3, cited_opinion_id=2)
+        self.cited = Opinion.objects.get(pk=2).cluster
+        self.uncited = Opinion.objects.get(pk=3).cluster
+        OpinionCluster.objects.filter(pk=self.uncited.pk).update(
+            citation_count=5
+        )
+
+    def test_recount_fixes_wrong_counts(self):
+        unchanged = OpinionCluster.objects.exclude(
+            pk__in=[self.cited.pk, self.uncited.pk]
+        ).first()
+        call_command(
+            "cl_count_citations", "--partitions", "3", "--index", "False"
+        )
+        self.cited.refresh_from_db()
+        self.uncited.refresh_from_db()
+        self.assertEqual(self.cited.citation_count, 1)
+        self.assertEqual(self.uncited.citation_count, 0)
+
+        # Clusters that were already right aren't written
+        date_modified = unchanged.date_modified
+        unchanged.refresh_from_db()
+        self.assertEqual(unchanged.date_modified, date_modified)
+
+    def test_recount_by_doc_id(self):
+        call_command(
+            "cl_count_citations",
+            "--doc-id",
+            str(self.cited.pk),
+            "--index",
+            "False",
+        )
+        self.cited.refresh_from_db()
+        self.uncited.refresh_from_db()
+        self.assertEqual(self.cited.citation_count, 1)
+        self.assertEqual(self.uncited.citation_count, 5)
+
+
 class ParallelCitationTest(SimpleTestCase):
     allow_database_queries = True
 
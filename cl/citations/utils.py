@@ -44,6 +44,50 @@ def get_citation_depth_between_clusters(citing_cluster_pk, cited_cluster_pk):
     ).aggregate(depth=Sum("depth"))["depth"]
 
 
+def get_citation_depths_to_cluster(citing_cluster_pks, cited_cluster_pk):
+    """Get the citation depths between many citing clusters and one cited
+    cluster in a single query.
+
+    This is the batch version of get_citation_depth_between_clusters, for use
+    when rendering lists, like the results of a "cites:" search.
+
+    :param citing_cluster_pks: An iterable of citing OpinionCluster pks
+    :param cited_cluster_pk: The primary key of the cited OpinionCluster
+    :return: A dict mapping each citing cluster pk to its depth. Clusters that
+        do not cite the cited cluster are omitted.
+    """
+    OpinionsCited = apps.get_model("search.OpinionsCited")
+    rows = (
+        OpinionsCited.objects.filter(
+            citing_opinion__cluster__pk__in=list(citing_cluster_pks),
+            cited_opinion__cluster__pk=cited_cluster_pk,
+        )
+        .values("citing_opinion__cluster_id")
+        .annotate(depth=Sum("depth"))
+        .order_by()
+    )
+    return {row["citing_opinion__cluster_id"]: row["depth"] for row in rows}
+
+
+def get_citation_depths_from_cluster(citing_cluster_pk):
+    """Get the citation depths between one citing cluster and every cluster
+    it cites in a single query.
+
+    :param citing_cluster_pk: The primary key of the citing OpinionCluster
+    :return: A dict mapping each cited cluster pk to its depth.
+    """
+    OpinionsCited = apps.get_model("search.OpinionsCited")
+    rows = (
+        OpinionsCited.objects.filter(
+            citing_opinion__cluster__pk=citing_cluster_pk,
+        )
+        .values("cited_opinion__cluster_id")
+        .annotate(depth=Sum("depth"))
+        .order_by()
+    )
+    return {row["cited_opinion__cluster_id"]: row["depth"] for row in rows}
+
+
 def is_balanced_html(text):
     """Test whether a given string contains balanced HTML tags
 
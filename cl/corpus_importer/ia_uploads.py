@@ -0,0 +1,883 @@
+"""
+Batched uploads to the Internet Archive.
+
+IA would rather get all the files for an item at once than one at a time,
+and wants clients to back off when its S3 endpoint says it's overloaded.
+Instead of a task per file, each checking for overload on its own and
+sleeping through its retries, files waiting to go to IA are queued by item in
+Redis and uploaded an item at a time:
+
+ 1. enqueue_ia_files() records files as pending for their items. The
+    collect-ia-uploads action of the upload_to_ia command queues everything
+    the DB says needs uploading, so the DB stays the record of what's pending
+    and nothing is lost if a run dies part way through.
+ 2. The upload-ia-batches action claims items that are due, and sends them
+    to upload_ia_batch tasks. Claims expire, so items claimed by a task that
+    died come due again.
+ 3. Before each item, tasks take a token from a bucket shared by every
+    worker. When IA says it's overloaded, the bucket is paused for everyone,
+    and items that weren't finished are put back in the queue for later,
+    with backoff, instead of tying up a worker.
+"""
+import abc
+import hashlib
+import json
+import time
+from io import BytesIO
+from typing import (
+    IO,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from django.db.models import F, Q
+from django.db.models.functions import Coalesce
+from django.utils.text import slugify
+from django.utils.timezone import now
+from requests.exceptions import RequestException
+from rest_framework.status import (
+    HTTP_400_BAD_REQUEST,
+    HTTP_403_FORBIDDEN,
+    HTTP_503_SERVICE_UNAVAILABLE,
+)
+
+from cl.audio.models import Audio
+from cl.audio.utils import make_af_filename
+from cl.corpus_importer.utils import get_start_of_quarter
+from cl.custom_filters.templatetags.text_filters import best_case_name
+from cl.lib.crypto import sha1
+from cl.lib.recap_utils import (
+    get_bucket_name,
+    get_docket_filename,
+    get_document_filename,
+)
+from cl.lib.redis_utils import make_redis_interface
+from cl.search.models import Docket, RECAPDocument
+
+ITEMS_KEY = "ia-upload:items"
+ATTEMPTS_KEY = "ia-upload:attempts"
+TOKENS_KEY = "ia-upload:tokens"
+PAUSED_KEY = "ia-upload:paused-until"
+OVERLOADS_KEY = "ia-upload:overloads"
+SECTION_HASHES_KEY = "ia-upload:docket-json-sections"
+
+# How long a task has to finish an item it claimed before another can.
+CLAIM_LEASE = 60 * 60
+# How long to wait after the first failure of an item, and at most.
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 60 * 60 * 6
+# How long to stop uploading when IA is overloaded, and at most.
+OVERLOAD_PAUSE = 60
+MAX_OVERLOAD_PAUSE = 60 * 30
+
+CLAIM_ITEMS = """
+local items = redis.call("zrangebyscore", KEYS[1], "-inf", ARGV[1],
+                         "LIMIT", 0, ARGV[2])
+for _, item in ipairs(items) do
+    redis.call("zadd", KEYS[1], ARGV[3], item)
+end
+return items
+"""
+
+FINISH_FILES = """
+for i = 2, #ARGV do
+    redis.call("hdel", KEYS[1], ARGV[i])
+end
+if redis.call("exists", KEYS[1]) == 0 then
+    redis.call("zrem", KEYS[2], ARGV[1])
+    redis.call("hdel", KEYS[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+TAKE_TOKEN = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local paused_until = tonumber(redis.call("get", KEYS[2]) or "0")
+if paused_until > now then
+    return tostring(paused_until - now)
+end
+local state = redis.call("hmget", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("hmset", KEYS[1], "tokens", tostring(tokens),
+           "updated", tostring(now))
+return tostring(wait)
+"""
+
+
+def _item_key(identifier: str) -> str:
+    return "ia-upload:item:%s" % identifier
+
+
+def make_ia_url(identifier: str, file_name: str) -> str:
+    return "https://archive.org/download/%s/%s" % (identifier, file_name)
+
+
+class PendingIaFile(abc.ABC):
+    """A file waiting to be uploaded to an item in the Internet Archive.
+
+    Subclasses handle one kind of object. They know how to find the objects
+    that need uploading, which item each goes in, and how to record the
+    result of the upload. In the queue, files are referred to as
+    "<kind>:<pk>".
+    """
+
+    kind = ""
+    model = None
+    description = ""
+    media_type = "texts"
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    @property
+    def ref(self) -> str:
+        return "%s:%s" % (self.kind, self.obj.pk)
+
+    @classmethod
+    @abc.abstractmethod
+    def get_pending(cls):
+        """Get a queryset of the objects that need uploading."""
+
+    @classmethod
+    @abc.abstractmethod
+    def collect(cls) -> Iterator[Tuple[str, str]]:
+        """Find everything of this kind that needs uploading.
+
+        :return: An iterator of (identifier, ref) tuples.
+        """
+
+    @classmethod
+    def load(cls, pks: Iterable[int]) -> List["PendingIaFile"]:
+        """Load the objects with these pks that still need uploading."""
+        return [cls(obj) for obj in cls.get_pending().filter(pk__in=pks)]
+
+    @classmethod
+    def prepare(cls, files: Sequence["PendingIaFile"]) -> None:
+        """Do any work for a batch of files that's cheaper done all at once
+        than file by file.
+        """
+        pass
+
+    def has_changed(self) -> bool:
+        """Whether the file differs from the copy in IA, if there is one.
+        Files that haven't changed are marked as uploaded without sending
+        them again.
+        """
+        return True
+
+    @property
+    @abc.abstractmethod
+    def docket(self) -> Docket:
+        """The docket the file's item is named after."""
+
+    @property
+    @abc.abstractmethod
+    def identifier(self) -> str:
+        """The identifier of the item the file goes in."""
+
+    @property
+    @abc.abstractmethod
+    def file_name(self) -> str:
+        """The name of the file in its item."""
+
+    @abc.abstractmethod
+    def open(self) -> IO[bytes]:
+        """Open the file's content for uploading."""
+
+    @property
+    def collection(self) -> List[str]:
+        return settings.IA_COLLECTIONS
+
+    def get_item_metadata(self) -> Dict[str, object]:
+        """The metadata of the item this file goes in, used if the upload
+        creates the item.
+        """
+        return {
+            "title": best_case_name(self.docket),
+            "collection": self.collection,
+            "contributor": '<a href="https://free.law">Free Law Project</a>',
+            "court": self.docket.court_id,
+            "source_url": "https://www.courtlistener.com%s"
+            % self.obj.get_absolute_url(),
+            "language": "eng",
+            "mediatype": self.media_type,
+            "description": self.description,
+            "licenseurl": "https://www.usa.gov/government-works",
+        }
+
+    def mark_uploaded(self) -> None:
+        self.model.objects.filter(pk=self.obj.pk).update(
+            filepath_ia=make_ia_url(self.identifier, self.file_name),
+            ia_upload_failure_count=None,
+        )
+
+    def mark_failed(self) -> None:
+        self.model.objects.filter(pk=self.obj.pk).update(
+            ia_upload_failure_count=Coalesce(F("ia_upload_failure_count"), 0)
+            + 1
+        )
+
+
+class PendingDocketJson(PendingIaFile):
+    """A docket's JSON, which is regenerated each time it's uploaded.
+
+    Dockets are serialized a batch at a time, so they can share their
+    queries. Hashes of each section of the last JSON uploaded are kept, and
+    JSON is only uploaded again if a section changed.
+    """
+
+    kind = "docket"
+    model = Docket
+    description = (
+        "This item represents a case in PACER, the U.S. Government's "
+        "website for federal case data. This information is uploaded "
+        "quarterly. To see our most recent version please use the source "
+        "url parameter, linked below. To see the canonical source for this "
+        "data, please consult PACER directly."
+    )
+
+    def __init__(self, obj):
+        super(PendingDocketJson, self).__init__(obj)
+        self.json_str = None
+        self.section_hashes = None
+        self.uploaded_hashes = None
+
+    @classmethod
+    def get_pending(cls):
+        return Docket.objects.filter(ia_needs_upload=True)
+
+    @classmethod
+    def collect(cls):
+        ds = (
+            cls.get_pending()
+            .filter(
+                Q(ia_upload_failure_count__lte=3)
+                | Q(ia_upload_failure_count=None),
+                source__in=Docket.RECAP_SOURCES,
+                ia_date_first_change__lt=get_start_of_quarter(),
+            )
+            .values_list("pk", "court_id", "pacer_case_id")
+            .order_by()
+        )
+        for pk, court_id, pacer_case_id in ds.iterator():
+            yield get_bucket_name(court_id, pacer_case_id), "docket:%s" % pk
+
+    @classmethod
+    def prepare(cls, files):
+        from cl.corpus_importer.tasks import (
+            render_ia_json,
+            serialize_ia_dockets,
+        )
+
+        if not files:
+            return
+        pks = [f.obj.pk for f in files]
+        serialized = serialize_ia_dockets(pks)
+        uploaded = get_uploaded_section_hashes(pks)
+        for f in files:
+            if f.obj.pk not in serialized:
+                continue
+            _, data = serialized[f.obj.pk]
+            f.json_str = render_ia_json(data)
+            f.section_hashes = hash_ia_json_sections(data)
+            f.uploaded_hashes = uploaded.get(f.obj.pk)
+
+    @property
+    def docket(self):
+        return self.obj
+
+    @property
+    def identifier(self):
+        return get_bucket_name(self.obj.court_id, self.obj.pacer_case_id)
+
+    @property
+    def file_name(self):
+        return get_docket_filename(
+            self.obj.court_id, self.obj.pacer_case_id, "json"
+        )
+
+    def has_changed(self):
+        return not (
+            self.obj.filepath_ia_json
+            and self.section_hashes is not None
+            and self.section_hashes == self.uploaded_hashes
+        )
+
+    def open(self):
+        if self.json_str is None:
+            self.prepare([self])
+        return BytesIO(self.json_str.encode())
+
+    def mark_uploaded(self):
+        Docket.objects.filter(pk=self.obj.pk).update(
+            filepath_ia_json=make_ia_url(self.identifier, self.file_name),
+            ia_needs_upload=False,
+            ia_date_first_change=None,
+            ia_upload_failure_count=None,
+            date_modified=now(),
+        )
+        if self.section_hashes is not None:
+            r = make_redis_interface("CACHE")
+            r.hset(
+                SECTION_HASHES_KEY,
+                self.obj.pk,
+                json.dumps(self.section_hashes),
+            )
+
+
+class PendingRecapPdf(PendingIaFile):
+    kind = "rd"
+    model = RECAPDocument
+    description = (
+        "This item represents a case in PACER, the U.S. Government's "
+        "website for federal case data. If you wish to see the entire case, "
+        "please consult PACER directly."
+    )
+
+    @classmethod
+    def get_pending(cls):
+        return (
+            RECAPDocument.objects.filter(is_available=True, filepath_ia="")
+            .exclude(filepath_local="")
+            .select_related("docket_entry__docket")
+        )
+
+    @classmethod
+    def collect(cls):
+        rds = (
+            cls.get_pending()
+            .filter(
+                Q(ia_upload_failure_count__lt=3)
+                | Q(ia_upload_failure_count=None),
+            )
+            .values_list(
+                "pk",
+                "docket_entry__docket__court_id",
+                "docket_entry__docket__pacer_case_id",
+            )
+            .order_by()
+        )
+        for pk, court_id, pacer_case_id in rds.iterator():
+            yield get_bucket_name(court_id, pacer_case_id), "rd:%s" % pk
+
+    @property
+    def docket(self):
+        return self.obj.docket_entry.docket
+
+    @property
+    def identifier(self):
+        return get_bucket_name(self.docket.court_id, self.docket.pacer_case_id)
+
+    @property
+    def file_name(self):
+        return get_document_filename(
+            self.docket.court_id,
+            self.docket.pacer_case_id,
+            self.obj.document_number,
+            self.obj.attachment_number or 0,
+        )
+
+    def open(self):
+        return open(self.obj.filepath_local.path, "rb")
+
+
+class PendingAudio(PendingIaFile):
+    kind = "audio"
+    model = Audio
+    media_type = "audio"
+    description = (
+        "This item represents an oral argument audio file as scraped from a "
+        "U.S. Government website by Free Law Project."
+    )
+
+    @classmethod
+    def get_pending(cls):
+        return (
+            Audio.objects.filter(filepath_ia="")
+            .exclude(local_path_mp3="")
+            .select_related("docket")
+        )
+
+    @classmethod
+    def collect(cls):
+        afs = (
+            cls.get_pending()
+            .filter(
+                Q(ia_upload_failure_count__lt=3)
+                | Q(ia_upload_failure_count=None),
+            )
+            .values_list("pk", "docket__court_id", "docket__docket_number")
+            .order_by()
+        )
+        for pk, court_id, docket_number in afs.iterator():
+            identifier = get_bucket_name(court_id, slugify(docket_number))
+            yield identifier, "audio:%s" % pk
+
+    @property
+    def docket(self):
+        return self.obj.docket
+
+    @property
+    def collection(self):
+        return settings.IA_OA_COLLECTIONS
+
+    @property
+    def identifier(self):
+        return get_bucket_name(
+            self.docket.court_id, slugify(self.docket.docket_number)
+        )
+
+    @property
+    def file_name(self):
+        return make_af_filename(
+            self.docket.court_id,
+            self.docket.docket_number,
+            self.docket.date_argued,
+            self.obj.local_path_original_file.path.rsplit(".", 1)[1],
+        )
+
+    def open(self):
+        return open(self.obj.local_path_original_file.path, "rb")
+
+
+PENDING_FILE_KINDS: Dict[str, Type[PendingIaFile]] = {
+    cls.kind: cls for cls in (PendingDocketJson, PendingRecapPdf, PendingAudio)
+}
+
+
+def load_pending_files(refs: Iterable[str]) -> List[PendingIaFile]:
+    """Load the objects behind some refs, skipping any that don't exist or
+    no longer need uploading.
+    """
+    pks_by_kind: Dict[str, List[int]] = {}
+    for ref in refs:
+        kind, pk = ref.split(":", 1)
+        pks_by_kind.setdefault(kind, []).append(int(pk))
+    pending = []
+    for kind, pks in pks_by_kind.items():
+        pending.extend(PENDING_FILE_KINDS[kind].load(pks))
+    return pending
+
+
+# The parts of a docket's JSON that are hashed on their own. Everything else
+# is hashed together as the "docket" section.
+IA_JSON_SECTIONS = ("docket_entries", "parties", "claims")
+
+# Fields that change without the data changing, as when a docket is merged
+# again from the same report, or that only point back at the upload itself.
+VOLATILE_IA_JSON_FIELDS = {"date_modified", "filepath_ia_json"}
+
+
+def _without_volatile_fields(value):
+    if isinstance(value, dict):
+        return {
+            k: _without_volatile_fields(v)
+            for k, v in value.items()
+            if k not in VOLATILE_IA_JSON_FIELDS
+        }
+    if isinstance(value, list):
+        return [_without_volatile_fields(v) for v in value]
+    return value
+
+
+def hash_ia_json_sections(data: Dict) -> Dict[str, str]:
+    """Hash each section of a docket's serialized IA data, ignoring fields
+    that change when nothing else does.
+
+    :param data: The data from IADocketSerializer.
+    :return: A dict of section names to hashes.
+    """
+    sections = {name: data.get(name) for name in IA_JSON_SECTIONS}
+    sections["docket"] = {
+        k: v for k, v in data.items() if k not in IA_JSON_SECTIONS
+    }
+    return {
+        name: sha1(
+            json.dumps(
+                _without_volatile_fields(value),
+                sort_keys=True,
+                separators=(",", ":"),
+                default=str,
+            )
+        )
+        for name, value in sections.items()
+    }
+
+
+def get_uploaded_section_hashes(
+    d_pks: Sequence[int],
+) -> Dict[int, Dict[str, str]]:
+    """Get the section hashes of the JSON last uploaded for some dockets.
+
+    :return: A dict of docket PKs to their section hashes, leaving out
+    dockets that haven't been uploaded in batches before.
+    """
+    if not d_pks:
+        return {}
+    r = make_redis_interface("CACHE")
+    values = r.hmget(SECTION_HASHES_KEY, list(d_pks))
+    return {
+        pk: json.loads(value)
+        for pk, value in zip(d_pks, values)
+        if value is not None
+    }
+
+
+def prepare_ia_files(files: Sequence[PendingIaFile]) -> None:
+    """Prepare files for uploading, with the files of each kind together."""
+    for cls in PENDING_FILE_KINDS.values():
+        cls.prepare([f for f in files if isinstance(f, cls)])
+
+
+def load_ia_batch(
+    identifiers: Sequence[str],
+) -> Dict[str, Tuple[List[str], List[PendingIaFile]]]:
+    """Load the files queued for a batch of items all at once, so that
+    objects of each kind are looked up together.
+
+    The files aren't prepared here, since preparing them can be costly, like
+    serializing a docket. Prepare them with prepare_ia_files once their items
+    are cleared to upload, so items that get deferred don't pay for it.
+
+    :param identifiers: The items to load.
+    :return: A dict of identifiers to tuples of the refs queued for the item
+    and the files among them that still need uploading.
+    """
+    r = make_redis_interface("CACHE")
+    pipe = r.pipeline(transaction=False)
+    for identifier in identifiers:
+        pipe.hkeys(_item_key(identifier))
+    refs_by_item = dict(zip(identifiers, pipe.execute()))
+
+    pending = load_pending_files(
+        ref for refs in refs_by_item.values() for ref in refs
+    )
+    pending_by_ref = {f.ref: f for f in pending}
+    return {
+        identifier: (
+            refs,
+            [pending_by_ref[ref] for ref in refs if ref in pending_by_ref],
+        )
+        for identifier, refs in refs_by_item.items()
+    }
+
+
+def enqueue_ia_files(files: Iterable[Tuple[str, str]]) -> int:
+    """Queue files to be uploaded to their items.
+
+    Items that are already queued keep their place, so queuing files again,
+    as each run of the collector does, doesn't hold anything up.
+
+    :param files: An iterable of (identifier, ref) tuples.
+    :return: The number of files queued.
+    """
+    r = make_redis_interface("CACHE")
+    pipe = r.pipeline(transaction=False)
+    timestamp = time.time()
+    count = 0
+    for identifier, ref in files:
+        pipe.hset(_item_key(identifier), ref, 1)
+        pipe.zadd(ITEMS_KEY, {identifier: timestamp}, nx=True)
+        count += 1
+        if count % 1000 == 0:
+            pipe.execute()
+    pipe.execute()
+    return count
+
+
+def claim_ia_items(limit: int) -> List[str]:
+    """Claim items that are due to be uploaded, so that no other task takes
+    them until CLAIM_LEASE has passed.
+
+    :param limit: The most items to claim.
+    :return: The identifiers of the claimed items.
+    """
+    r = make_redis_interface("CACHE")
+    timestamp = time.time()
+    return r.eval(
+        CLAIM_ITEMS, 1, ITEMS_KEY, timestamp, limit, timestamp + CLAIM_LEASE
+    )
+
+
+def defer_ia_items(identifiers: Sequence[str], delay: float) -> None:
+    """Put claimed items back in the queue, to come due after a delay."""
+    if not identifiers:
+        return
+    r = make_redis_interface("CACHE")
+    due = time.time() + delay
+    r.zadd(ITEMS_KEY, {identifier: due for identifier in identifiers})
+
+
+def finish_ia_files(identifier: str, refs: Sequence[str]) -> bool:
+    """Take files out of the queue, and the item too, if it has no files
+    left.
+
+    :return: Whether the item has no files left.
+    """
+    r = make_redis_interface("CACHE")
+    keys = [_item_key(identifier), ITEMS_KEY, ATTEMPTS_KEY]
+    return bool(r.eval(FINISH_FILES, len(keys), *keys, identifier, *refs))
+
+
+def retry_ia_item(identifier: str, pending: Sequence[PendingIaFile]) -> None:
+    """Requeue an item whose files couldn't all be uploaded, backing off
+    more each time, and giving up on its files after
+    IA_UPLOAD_MAX_ATTEMPTS tries.
+    """
+    r = make_redis_interface("CACHE")
+    attempts = r.hincrby(ATTEMPTS_KEY, identifier, 1)
+    if attempts >= settings.IA_UPLOAD_MAX_ATTEMPTS:
+        for f in pending:
+            f.mark_failed()
+        finish_ia_files(identifier, [f.ref for f in pending])
+        return
+    delay = min(RETRY_DELAY * 2 ** (attempts - 1), MAX_RETRY_DELAY)
+    defer_ia_items([identifier], delay)
+
+
+class SharedTokenBucket(object):
+    """A token bucket in Redis, so that every worker uploading to IA shares
+    one rate limit, and one pause when IA is overloaded.
+    """
+
+    def __init__(
+        self,
+        rate: Optional[float] = None,
+        capacity: Optional[float] = None,
+    ) -> None:
+        """
+        :param rate: How many tokens are added per second.
+        :param capacity: How many tokens the bucket can hold.
+        """
+        self.r = make_redis_interface("CACHE")
+        self.rate = rate or settings.IA_UPLOAD_RATE
+        self.capacity = capacity or settings.IA_UPLOAD_BURST
+
+    def take(self) -> float:
+        """Try to take a token.
+
+        :return: 0 if a token was taken, otherwise how many seconds to wait
+        before trying again.
+        """
+        wait = self.r.eval(
+            TAKE_TOKEN,
+            2,
+            TOKENS_KEY,
+            PAUSED_KEY,
+            time.time(),
+            self.rate,
+            self.capacity,
+        )
+        return float(wait)
+
+    def pause(self) -> float:
+        """Stop all uploads for a while. Pauses double if IA stays
+        overloaded.
+
+        :return: How many seconds uploads are paused for.
+        """
+        overloads = self.r.incr(OVERLOADS_KEY)
+        self.r.expire(OVERLOADS_KEY, MAX_OVERLOAD_PAUSE * 2)
+        seconds = min(
+            OVERLOAD_PAUSE * 2 ** (overloads - 1), MAX_OVERLOAD_PAUSE
+        )
+        self.r.set(PAUSED_KEY, time.time() + seconds, ex=seconds)
+        return seconds
+
+    def clear_overloads(self) -> None:
+        self.r.delete(OVERLOADS_KEY)
+
+
+def make_metadata_headers(metadata: Dict[str, object]) -> Dict[str, str]:
+    """Make the x-archive-meta headers IA's S3 API reads item metadata from.
+
+    Lists get numbered headers, underscores in names are escaped as "--", and
+    values that can't go in a header as is are URI encoded, as IA expects.
+    """
+    headers = {}
+    for name, value in metadata.items():
+        name = name.replace("_", "--")
+        values = value if isinstance(value, list) else [value]
+        for i, v in enumerate(values):
+            v = str(v)
+            if not all(32 <= ord(c) < 127 for c in v):
+                v = "uri(%s)" % quote(v)
+            headers["x-archive-meta%02d-%s" % (i, name)] = v
+    return headers
+
+
+class IaS3Client(object):
+    """A small client for IA's S3-like API.
+
+    It does just what the batch uploader needs: checking whether the
+    endpoint is overloaded, and putting files in items, creating them as
+    needed. The endpoint comes from the IA_S3_URL setting.
+    """
+
+    def __init__(
+        self,
+        url: Optional[str] = None,
+        access_key: Optional[str] = None,
+        secret_key: Optional[str] = None,
+    ) -> None:
+        self.url = (url or settings.IA_S3_URL).rstrip("/")
+        self.access_key = access_key or settings.IA_ACCESS_KEY
+        secret_key = secret_key or settings.IA_SECRET_KEY
+        self.session = requests.Session()
+        self.session.headers["authorization"] = "LOW %s:%s" % (
+            self.access_key,
+            secret_key,
+        )
+
+    def is_overloaded(self, identifier: str) -> bool:
+        """Ask IA whether uploads to an item should wait. Errors are taken
+        to mean yes.
+        """
+        params = {
+            "check_limit": 1,
+            "accesskey": self.access_key,
+            "bucket": identifier,
+        }
+        try:
+            r = self.session.get("%s/" % self.url, params=params, timeout=60)
+            return r.json()["over_limit"] != 0
+        except (RequestException, ValueError, KeyError):
+            return True
+
+    def upload_file(
+        self,
+        identifier: str,
+        file_name: str,
+        body: IO[bytes],
+        metadata: Dict[str, object],
+    ) -> requests.Response:
+        """Put a file in an item, making the item if it doesn't exist.
+
+        :param identifier: The item to put the file in.
+        :param file_name: The name of the file in the item.
+        :param body: A file object to upload from.
+        :param metadata: The item's metadata, used if it gets created.
+        :return: The response from IA.
+        """
+        md5 = hashlib.md5()
+        for chunk in iter(lambda: body.read(1024 * 1024), b""):
+            md5.update(chunk)
+        body.seek(0)
+        headers = {
+            "x-archive-auto-make-bucket": "1",
+            "x-archive-queue-derive": "0",
+            "Content-MD5": md5.hexdigest(),
+        }
+        headers.update(make_metadata_headers(metadata))
+        return self.session.put(
+            "%s/%s/%s" % (self.url, identifier, quote(file_name)),
+            data=body,
+            headers=headers,
+            timeout=settings.IA_UPLOAD_TIMEOUT,
+        )
+
+
+def is_overloaded_response(response: requests.Response) -> bool:
+    return (
+        response.status_code == HTTP_503_SERVICE_UNAVAILABLE
+        or "SlowDown" in response.text
+    )
+
+
+def upload_ia_item(
+    client: IaS3Client,
+    identifier: str,
+    refs: Sequence[str],
+    pending: Sequence[PendingIaFile],
+) -> bool:
+    """Upload the files queued for an item, record the results, and take
+    the files that are done out of the queue.
+
+    Files that haven't changed since they were last uploaded are marked
+    uploaded without being sent. Files that fail for reasons that won't go
+    away, like a bad PDF, are counted as failures and dropped. If others
+    fail, the item is retried later.
+
+    :param client: The client to upload with.
+    :param identifier: The item to upload.
+    :param refs: The refs of the files queued for the item.
+    :param pending: The files among them that still need uploading, from
+    load_ia_batch, already prepared with prepare_ia_files.
+    :return: False if IA was overloaded, leaving the item to be deferred
+    with the rest of the batch, otherwise True.
+    """
+    found = {f.ref for f in pending}
+    done = [ref for ref in refs if ref not in found]
+    changed = []
+    for f in pending:
+        if f.has_changed():
+            changed.append(f)
+        else:
+            f.mark_uploaded()
+            done.append(f.ref)
+    if not changed:
+        finish_ia_files(identifier, done)
+        return True
+    if client.is_overloaded(identifier):
+        finish_ia_files(identifier, done)
+        return False
+
+    metadata = changed[0].get_item_metadata()
+    overloaded = False
+    left = []
+    for f in changed:
+        try:
+            with f.open() as body:
+                response = client.upload_file(
+                    identifier, f.file_name, body, metadata
+                )
+        except RequestException:
+            # This has to come first, since it's a kind of OSError too.
+            left.append(f)
+            continue
+        except OSError:
+            # A missing file won't turn up by trying again.
+            f.mark_failed()
+            done.append(f.ref)
+            continue
+        if response.ok:
+            f.mark_uploaded()
+            done.append(f.ref)
+        elif is_overloaded_response(response):
+            overloaded = True
+            break
+        elif response.status_code in [
+            HTTP_403_FORBIDDEN,  # Can't access bucket, typically.
+            HTTP_400_BAD_REQUEST,  # Corrupt PDF, typically.
+        ]:
+            f.mark_failed()
+            done.append(f.ref)
+        else:
+            left.append(f)
+
+    finish_ia_files(identifier, done)
+    if overloaded:
+        return False
+    if left:
+        retry_ia_item(identifier, left)
+    return True
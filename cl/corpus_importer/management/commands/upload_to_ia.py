@@ -1,12 +1,22 @@
 import argparse
 import time
 
+from django.conf import settings
 from django.db.models import Q
 from django.utils.timezone import now
 
 from cl.audio.models import Audio
 from cl.audio.tasks import upload_audio_to_ia
-from cl.corpus_importer.tasks import upload_pdf_to_ia, upload_recap_json
+from cl.corpus_importer.ia_uploads import (
+    PENDING_FILE_KINDS,
+    claim_ia_items,
+    enqueue_ia_files,
+)
+from cl.corpus_importer.tasks import (
+    upload_ia_batch,
+    upload_pdf_to_ia,
+    upload_recap_json,
+)
 from cl.corpus_importer.utils import get_start_of_quarter
 from cl.lib.celery_utils import CeleryThrottle
 from cl.lib.command_utils import VerboseCommand, logger
@@ -145,6 +155,33 @@ def upload_recap_data(options):
             previous_i = i
 
 
+def collect_ia_uploads(options):
+    """Queue everything that needs uploading to IA, grouped by item.
+
+    Queuing is idempotent, so this can run as often as cron likes.
+    """
+    for kind, cls in PENDING_FILE_KINDS.items():
+        count = enqueue_ia_files(cls.collect())
+        logger.info("Queued %s %s files for Internet Archive.", count, kind)
+
+
+def upload_ia_batches(options):
+    """Send the items that are due in the IA upload queue to celery, a batch
+    at a time.
+    """
+    q = options["queue"]
+    throttle = CeleryThrottle(queue_name=q, min_items=5)
+    count = 0
+    while True:
+        throttle.maybe_wait()
+        identifiers = claim_ia_items(settings.IA_UPLOAD_BATCH_SIZE)
+        if not identifiers:
+            break
+        upload_ia_batch.apply_async(args=(identifiers,), queue=q)
+        count += len(identifiers)
+    logger.info("Sent %s items to Internet Archive in batches.", count)
+
+
 def do_routine_uploads(options):
     logger.info("Uploading free opinions to Internet Archive.")
     upload_pdfs_to_internet_archive(options)
@@ -196,4 +233,6 @@ class Command(VerboseCommand):
         "upload-non-free-pdfs-to-ia": upload_non_free_pdfs_to_internet_archive,
         "upload-oral-arguments-to-ia": upload_oral_arguments_to_internet_archive,
         "upload-recap-data-to-ia": upload_recap_data,
+        "collect-ia-uploads": collect_ia_uploads,
+        "upload-ia-batches": upload_ia_batches,
     }
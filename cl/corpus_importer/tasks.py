@@ -2,10 +2,11 @@ import copy
 import logging
 import os
 import shutil
+import time
 from datetime import date
 from io import BytesIO
 from tempfile import NamedTemporaryFile
-from typing import Any, Dict, List, Optional, Tuple, Union, re
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union, re
 
 import internetarchive as ia
 import requests
@@ -49,6 +50,14 @@ from cl.alerts.tasks import enqueue_docket_alert, send_docket_alert
 from cl.audio.models import Audio
 from cl.celery_init import app
 from cl.corpus_importer.api_serializers import IADocketSerializer
+from cl.corpus_importer.ia_uploads import (
+    IaS3Client,
+    SharedTokenBucket,
+    defer_ia_items,
+    load_ia_batch,
+    prepare_ia_files,
+    upload_ia_item,
+)
 from cl.corpus_importer.utils import mark_ia_upload_needed
 from cl.custom_filters.templatetags.text_filters import best_case_name
 from cl.lib.celery_utils import throttle_task
@@ -110,22 +119,26 @@ def increment_failure_count(obj: Union[Audio, Docket, RECAPDocument]) -> None:
     obj.save()
 
 
-def generate_ia_json(
-    d_pk: int,
+def serialize_ia_dockets(
+    d_pks: Sequence[int],
     database: str = "default",
-) -> Tuple[Docket, str]:
-    """Generate JSON for upload to Internet Archive
+) -> Dict[int, Tuple[Docket, Dict]]:
+    """Serialize dockets for upload to Internet Archive
 
-    :param d_pk: The PK of the docket to generate JSON for
+    The dockets share their queries, so serializing many at once takes about
+    as many queries as serializing one, except for attorneys, which have to
+    be looked up docket by docket.
+
+    :param d_pks: The PKs of the dockets to serialize
     :param database: The name of the database to use for the queries
-    :return: A tuple of the docket object requested and a string of json data
-    to upload.
+    :return: A dict of the PKs of the dockets that were found to tuples of
+    the docket objects and their serialized data.
     """
     # This is a pretty highly optimized query that minimizes the hits to the DB
     # when generating a docket JSON rendering, regardless of how many related
     # objects the docket has such as docket entries, parties, etc.
-    ds = (
-        Docket.objects.filter(pk=d_pk)
+    ds = list(
+        Docket.objects.filter(pk__in=d_pks)
         .select_related(
             "originating_court_information",
             "bankruptcy_information",
@@ -150,46 +163,66 @@ def generate_ia_json(
         )
         .using(database)
     )
-    d = ds[0]
-
-    # Prefetching attorneys needs to be done in a second pass where we can
-    # access the party IDs identified above. If we don't do it this way, Django
-    # generates a bad query that double-joins the attorney table to the role
-    # table. See notes in #901. Doing this way makes for a very large query,
-    # but one that is fairly efficient since the double-join, while still
-    # there, appears to be ignored by the query planner.
-    # Do not add a `using` method here, it causes an additional (unnecessary)
-    # query to be run. I think this is a Django bug.
-    party_ids = [p.pk for p in d.parties.all()]
-    attorney_prefetch = Prefetch(
-        "parties__attorneys",
-        queryset=Attorney.objects.filter(
-            roles__docket_id=d_pk, parties__id__in=party_ids
-        )
-        .distinct()
-        .prefetch_related(
-            Prefetch(
-                # Only roles for those attorneys in the docket.
-                "roles",
-                queryset=Role.objects.filter(docket_id=d_pk),
-            )
-        ),
-    )
     prefetch_related_objects(
-        [d],
+        ds,
         *[
             "parties__party_types__criminal_complaints",
             "parties__party_types__criminal_counts",
-            attorney_prefetch,
         ],
     )
 
+    results = {}
+    for d in ds:
+        # Prefetching attorneys needs to be done in a second pass where we
+        # can access the party IDs identified above. If we don't do it this
+        # way, Django generates a bad query that double-joins the attorney
+        # table to the role table. See notes in #901. Doing this way makes
+        # for a very large query, but one that is fairly efficient since the
+        # double-join, while still there, appears to be ignored by the query
+        # planner. Do not add a `using` method here, it causes an additional
+        # (unnecessary) query to be run. I think this is a Django bug.
+        party_ids = [p.pk for p in d.parties.all()]
+        attorney_prefetch = Prefetch(
+            "parties__attorneys",
+            queryset=Attorney.objects.filter(
+                roles__docket_id=d.pk, parties__id__in=party_ids
+            )
+            .distinct()
+            .prefetch_related(
+                Prefetch(
+                    # Only roles for those attorneys in the docket.
+                    "roles",
+                    queryset=Role.objects.filter(docket_id=d.pk),
+                )
+            ),
+        )
+        prefetch_related_objects([d], attorney_prefetch)
+        results[d.pk] = (d, IADocketSerializer(d).data)
+    return results
+
+
+def render_ia_json(data: Dict) -> str:
+    """Render serialized docket data as the JSON uploaded to IA"""
     renderer = JSONRenderer()
-    json_str = renderer.render(
-        IADocketSerializer(d).data,
+    return renderer.render(
+        data,
         accepted_media_type="application/json; indent=2",
     ).decode()
-    return d, json_str
+
+
+def generate_ia_json(
+    d_pk: int,
+    database: str = "default",
+) -> Tuple[Docket, str]:
+    """Generate JSON for upload to Internet Archive
+
+    :param d_pk: The PK of the docket to generate JSON for
+    :param database: The name of the database to use for the queries
+    :return: A tuple of the docket object requested and a string of json data
+    to upload.
+    """
+    d, data = serialize_ia_dockets([d_pk], database=database)[d_pk]
+    return d, render_ia_json(data)
 
 
 @app.task(bind=True, ignore_result=True)
@@ -757,6 +790,60 @@ def upload_to_ia(
     return responses
 
 
+# Tasks that would wait longer than this for a token give their items back.
+MAX_TOKEN_WAIT = 10
+
+
+@app.task(ignore_result=True)
+def upload_ia_batch(identifiers: List[str]) -> None:
+    """Upload a batch of items claimed from the IA upload queue.
+
+    The objects for the whole batch are looked up together first. Then
+    tokens are taken for as many items as the rate limit allows, and the
+    files of those items are prepared together, e.g. their dockets
+    serialized with shared queries. Items that are deferred aren't
+    prepared at all.
+
+    Uploads share one rate limit across workers. If it's used up for long,
+    or IA says it's overloaded, the items that weren't done go back in the
+    queue for later rather than holding up the worker.
+
+    :param identifiers: The identifiers of the items to upload.
+    """
+    client = IaS3Client()
+    bucket = SharedTokenBucket()
+    batch = load_ia_batch(identifiers)
+    i = 0
+    while i < len(identifiers):
+        group = []
+        wait = 0
+        for identifier in identifiers[i:]:
+            wait = bucket.take()
+            if wait:
+                break
+            group.append(identifier)
+        if not group:
+            if wait > MAX_TOKEN_WAIT:
+                defer_ia_items(identifiers[i:], wait)
+                return
+            time.sleep(wait)
+            continue
+
+        prepare_ia_files([f for item in group for f in batch[item][1]])
+        for identifier in group:
+            refs, pending = batch[identifier]
+            if not upload_ia_item(client, identifier, refs, pending):
+                seconds = bucket.pause()
+                logger.info(
+                    "IA is overloaded. Pausing uploads for %s seconds.",
+                    seconds,
+                )
+                defer_ia_items(identifiers[i:], seconds)
+                return
+            bucket.clear_overloads()
+            i += 1
+
+
 @app.task
 def mark_court_done_on_date(
     status: int, court_id: str, d: date
@@ -1,15 +1,27 @@
 import json
 import os
+import threading
+import time
 import unittest
 from datetime import date, datetime
 from glob import iglob
+from http.server import BaseHTTPRequestHandler, HTTPServer
 from unittest import mock
 
 import pytest
 from django.conf import settings
-from django.test import TestCase
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 
 from cl.corpus_importer.court_regexes import match_court_string
+from cl.corpus_importer.ia_uploads import (
+    ATTEMPTS_KEY,
+    ITEMS_KEY,
+    PAUSED_KEY,
+    PendingDocketJson,
+    enqueue_ia_files,
+)
 from cl.corpus_importer.import_columbia.parse_judges import find_judge_names
 from cl.corpus_importer.import_columbia.parse_opinions import (
     get_state_court_object,
@@ -19,9 +31,15 @@ from cl.corpus_importer.management.commands.harvard_opinions import (
     validate_dt,
 )
 from cl.corpus_importer.management.commands.import_tn import import_tn_corpus
-from cl.corpus_importer.tasks import generate_ia_json
+from cl.corpus_importer.tasks import (
+    generate_ia_json,
+    render_ia_json,
+    serialize_ia_dockets,
+    upload_ia_batch,
+)
 from cl.corpus_importer.utils import get_start_of_quarter
 from cl.lib.pacer import process_docket_data
+from cl.lib.redis_utils import make_redis_interface
 from cl.people_db.models import Attorney, AttorneyOrganization, Party
 from cl.recap.mergers import find_docket_object
 from cl.recap.models import UPLOAD_TYPE
@@ -448,6 +466,15 @@ class IAUploaderTest(TestCase):
             "Got %s, expected %s" % (actual_num_roles, expected_num_roles),
         )
 
+    def test_batch_serialization_matches(self):
+        """Do dockets serialized together come out the same as dockets
+        serialized one at a time?
+        """
+        batch = serialize_ia_dockets([1, 2, 3])
+        for pk in [1, 2, 3]:
+            _, j_str = generate_ia_json(pk)
+            self.assertEqual(render_ia_json(batch[pk][1]), j_str)
+
     def test_num_queries_ok(self):
         """Have we regressed the number of queries it takes to make the JSON
 
@@ -464,6 +491,171 @@ class IAUploaderTest(TestCase):
             generate_ia_json(3)
 
 
+class FakeIaS3(BaseHTTPRequestHandler):
+    """Stands in for IA's S3-like upload endpoint."""
+
+    over_limit = 0
+    uploads = {}
+    # Whether to hang up on uploads instead of answering
+    drop_uploads = False
+
+    def do_GET(self):
+        body = json.dumps({"over_limit": self.over_limit}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.drop_uploads:
+            self.close_connection = True
+            return
+        self.uploads[self.path] = (dict(self.headers), body)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.django_db
+class IABatchUploadTest(TestCase):
+    """Do queued files get uploaded to IA a whole item at a time?"""
+
+    fixtures = ["test_objects_query_counts.json"]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(("localhost", 0), FakeIaS3)
+        cls.url = "http://localhost:%s" % cls.server.server_port
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.r = make_redis_interface("CACHE")
+        self.clear_queue()
+        FakeIaS3.over_limit = 0
+        FakeIaS3.uploads = {}
+        FakeIaS3.drop_uploads = False
+        Docket.objects.filter(pk=1).update(ia_needs_upload=True)
+        self.f = PendingDocketJson.load([1])[0]
+        enqueue_ia_files([(self.f.identifier, self.f.ref)])
+
+    def tearDown(self):
+        self.clear_queue()
+
+    def clear_queue(self):
+        keys = self.r.keys("ia-upload:*")
+        if keys:
+            self.r.delete(*keys)
+
+    def test_upload_batch(self):
+        with override_settings(IA_S3_URL=self.url):
+            upload_ia_batch([self.f.identifier])
+
+        path = "/%s/%s" % (self.f.identifier, self.f.file_name)
+        headers, body = FakeIaS3.uploads[path]
+        self.assertEqual(json.loads(body)["id"], 1)
+        self.assertEqual(headers["x-archive-meta00-mediatype"], "texts")
+        self.assertEqual(headers["x-archive-queue-derive"], "0")
+
+        d = Docket.objects.get(pk=1)
+        self.assertFalse(d.ia_needs_upload)
+        self.assertIn(self.f.file_name, d.filepath_ia_json)
+        self.assertIsNone(self.r.zscore(ITEMS_KEY, self.f.identifier))
+
+    def test_unchanged_json_is_not_uploaded_again(self):
+        with override_settings(IA_S3_URL=self.url):
+            upload_ia_batch([self.f.identifier])
+            FakeIaS3.uploads = {}
+            # Saving the docket again changes date_modified, but nothing
+            # that's worth uploading.
+            d = Docket.objects.get(pk=1)
+            d.ia_needs_upload = True
+            d.save()
+            enqueue_ia_files([(self.f.identifier, self.f.ref)])
+            upload_ia_batch([self.f.identifier])
+
+        self.assertEqual(FakeIaS3.uploads, {})
+        self.assertFalse(Docket.objects.get(pk=1).ia_needs_upload)
+        self.assertIsNone(self.r.zscore(ITEMS_KEY, self.f.identifier))
+
+    def test_overloaded_endpoint_defers_items(self):
+        FakeIaS3.over_limit = 1
+        with override_settings(IA_S3_URL=self.url):
+            upload_ia_batch([self.f.identifier])
+
+        self.assertEqual(FakeIaS3.uploads, {})
+        self.assertTrue(Docket.objects.get(pk=1).ia_needs_upload)
+        self.assertTrue(self.r.exists(PAUSED_KEY))
+        due = self.r.zscore(ITEMS_KEY, self.f.identifier)
+        self.assertGreater(due, time.time())
+
+    def test_dropped_connections_are_retried(self):
+        """Are network errors retried later, not counted as failures?"""
+        FakeIaS3.drop_uploads = True
+        with override_settings(IA_S3_URL=self.url):
+            upload_ia_batch([self.f.identifier])
+
+        d = Docket.objects.get(pk=1)
+        self.assertTrue(d.ia_needs_upload)
+        self.assertIsNone(d.ia_upload_failure_count)
+        # The file is still queued, for a retry after a backoff.
+        self.assertTrue(
+            self.r.hexists("ia-upload:item:%s" % self.f.identifier, self.f.ref)
+        )
+        self.assertEqual(int(self.r.hget(ATTEMPTS_KEY, self.f.identifier)), 1)
+        due = self.r.zscore(ITEMS_KEY, self.f.identifier)
+        self.assertGreater(due, time.time())
+
+    def test_batch_dockets_are_serialized_together(self):
+        """Do the dockets of the items in a batch share their queries?"""
+        for pk in [2, 3]:
+            Docket.objects.filter(pk=pk).update(
+                ia_needs_upload=True, pacer_case_id=str(pk)
+            )
+        files = PendingDocketJson.load([1, 2, 3])
+        enqueue_ia_files([(f.identifier, f.ref) for f in files])
+        with override_settings(IA_S3_URL=self.url), CaptureQueriesContext(
+            connection
+        ) as queries:
+            upload_ia_batch([f.identifier for f in files])
+
+        self.assertEqual(len(FakeIaS3.uploads), 3)
+        self.assertFalse(
+            Docket.objects.filter(
+                pk__in=[1, 2, 3], ia_needs_upload=True
+            ).exists()
+        )
+        entry_queries = [
+            q
+            for q in queries.captured_queries
+            if 'FROM "search_docketentry"' in q["sql"]
+        ]
+        self.assertEqual(len(entry_queries), 1)
+
+    @mock.patch("cl.corpus_importer.tasks.serialize_ia_dockets")
+    def test_paused_items_are_not_serialized(self, serialize):
+        """Are items that have to wait deferred without being serialized?"""
+        self.r.set(PAUSED_KEY, time.time() + 60, ex=60)
+        with override_settings(IA_S3_URL=self.url):
+            upload_ia_batch([self.f.identifier])
+
+        serialize.assert_not_called()
+        self.assertEqual(FakeIaS3.uploads, {})
+        due = self.r.zscore(ITEMS_KEY, self.f.identifier)
+        self.assertGreater(due, time.time())
+
+
 class TNCorpusTests(TestCase):
     """Can we properly import the TN Corpus?"""
 
@@ -1,8 +1,20 @@
 import json
+from datetime import timedelta
 
-from cl.disclosures.tasks import has_been_extracted, import_disclosure
+from celery.canvas import chain
+from django.utils.timezone import now
+
+from cl.disclosures.tasks import (
+    extract_disclosure_stage,
+    has_been_extracted,
+    save_disclosure_stage,
+    start_disclosure_import,
+)
 from cl.lib.celery_utils import CeleryThrottle
 from cl.lib.command_utils import VerboseCommand, logger
+from cl.stats.utils import sum_stats
+
+STAGES = ["download", "extract", "save"]
 
 
 def import_financial_disclosures(
@@ -10,13 +22,26 @@ def import_financial_disclosures(
     skip_until: int,
     queue_name: str,
     min_size: int,
+    extract_queue: str,
+    save_queue: str,
 ) -> None:
     """Import financial documents into courtlistener.
 
+    Each disclosure goes through three stages, each in its own queue:
+    downloading and saving the PDF, extracting its content, and saving the
+    content. Extractions can take over an hour, so giving them their own
+    queue keeps them from holding up everything else.
+
+    Rerunning an interrupted import picks up where each disclosure left off.
+    Disclosures that have been extracted are skipped, and ones whose PDFs
+    were saved go straight to extraction.
+
     :param filepath: Path to file data to import.
     :param skip_until: ID if any to skip until.
-    :param queue_name: The celery queue name.
+    :param queue_name: The celery queue name for the download stage.
     :param min_size: The minimum items in a queue.
+    :param extract_queue: The celery queue name for the extraction stage.
+    :param save_queue: The celery queue name for the save stage.
     :return:None
     """
     throttle = CeleryThrottle(
@@ -37,10 +62,32 @@ def import_financial_disclosures(
 
         throttle.maybe_wait()
 
-        # Add disclosures to celery queue
-        import_disclosure.apply_async(
-            args=[data],
-            queue=queue_name,
+        # Add disclosures to celery queues
+        chain(
+            start_disclosure_import.si(data).set(queue=queue_name),
+            extract_disclosure_stage.s().set(queue=extract_queue),
+            save_disclosure_stage.s().set(queue=save_queue),
+        ).apply_async()
+
+
+def report_throughput(days: int) -> None:
+    """Log how many disclosures each stage of the import has processed, and
+    how quickly.
+
+    :param days: How many days back to report on.
+    :return: None
+    """
+    since = now() - timedelta(days=days)
+    for stage in STAGES:
+        done = sum_stats(f"disclosures.{stage}.done", since)
+        failed = sum_stats(f"disclosures.{stage}.failed", since)
+        seconds = sum_stats(f"disclosures.{stage}.seconds", since)
+        count = done + failed
+        per_hour = count * 3600 / seconds if seconds else 0
+        logger.info(
+            f"{stage}: {done} done, {failed} failed, "
+            f"{seconds / count if count else 0:.1f}s each, "
+            f"{per_hour:.1f}/hour per worker"
         )
 
 
@@ -50,7 +97,6 @@ class Command(VerboseCommand):
     def add_arguments(self, parser):
         parser.add_argument(
             "--filepath",
-            required=True,
             help="Filepath to json identify documents to process.",
         )
 
@@ -65,7 +111,19 @@ class Command(VerboseCommand):
         parser.add_argument(
             "--queue",
             default="batch1",
-            help="The celery queue where the tasks should be processed.",
+            help="The celery queue where PDFs should be downloaded.",
+        )
+
+        parser.add_argument(
+            "--extract-queue",
+            help="The celery queue where PDFs should be extracted. Defaults "
+            "to --queue, but the import goes faster with its own queue.",
+        )
+
+        parser.add_argument(
+            "--save-queue",
+            help="The celery queue where extracted content should be saved. "
+            "Defaults to --queue.",
         )
 
         parser.add_argument(
@@ -75,11 +133,36 @@ class Command(VerboseCommand):
             help="Minimum tasks in a queue (max = min x 2)",
         )
 
+        parser.add_argument(
+            "--report",
+            action="store_true",
+            default=False,
+            help="Instead of importing, report the throughput of each "
+            "stage of the import.",
+        )
+
+        parser.add_argument(
+            "--report-days",
+            default=1,
+            type=int,
+            help="How many days back to report on.",
+        )
+
     def handle(self, *args, **options):
         super(Command, self).handle(*args, **options)
+        if options["report"]:
+            report_throughput(options["report_days"])
+            return
+
+        if not options["filepath"]:
+            logger.error("--filepath is required for imports.")
+            return
+
         import_financial_disclosures(
             filepath=options["filepath"],
             skip_until=options["skip_until"],
             queue_name=options["queue"],
             min_size=options["min_size"],
+            extract_queue=options["extract_queue"] or options["queue"],
+            save_queue=options["save_queue"] or options["queue"],
         )
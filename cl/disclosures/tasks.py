@@ -1,6 +1,7 @@
 import datetime
 import json
-from typing import Dict, List, Optional, Union
+import time
+from typing import Dict, List, Optional, Tuple, Union
 from urllib.parse import quote
 
 import requests
@@ -34,6 +35,7 @@ from cl.scrapers.transformer_extractor_utils import (
     generate_thumbnail,
     get_page_count,
 )
+from cl.stats.utils import tally_stat
 
 
 def make_disclosure_key(data_id: str) -> str:
@@ -407,98 +409,189 @@ def generate_or_download_disclosure_as_pdf(
     )
 
 
+def record_stage(stage: str, start: float, succeeded: bool) -> None:
+    """Tally how many disclosures went through a stage of the import, and
+    how long they took, so the throughput of each stage can be reported.
+
+    :param stage: The name of the stage, like "download".
+    :param start: When the stage started, from time.monotonic().
+    :param succeeded: Whether the stage succeeded.
+    :return: None
+    """
+    outcome = "done" if succeeded else "failed"
+    tally_stat(f"disclosures.{stage}.{outcome}")
+    tally_stat(
+        f"disclosures.{stage}.seconds",
+        inc=int(round(time.monotonic() - start)),
+    )
+
+
+def download_disclosure(
+    data: Dict[str, Union[str, int, list]],
+) -> Optional[FinancialDisclosure]:
+    """Make a PDF of a disclosure, save it, and create its
+    FinancialDisclosure, unless that's already been done.
+
+    :param data: The disclosure information to process
+    :return: The FinancialDisclosure, or None if it shouldn't be extracted.
+    """
+    # Check download_filepath to see if it has been processed before.
+    disclosure_url = get_aws_url(data)
+    if has_been_pdfed(disclosure_url):
+        logger.info(f"Resuming with the saved PDF for {data['id']}.")
+        return get_disclosure_from_pdf_path(disclosure_url)
+
+    year = int(data["year"])
+    person_id = data["person_id"]
+    logger.info(
+        f"Processing row {data['id']} for person {person_id} "
+        f"in year {year}"
+    )
+    pdf_response = generate_or_download_disclosure_as_pdf(data, None)
+    if pdf_response.status_code != 200:
+        logger.info("PDF generation failed.")
+        return None
+    pdf_bytes = pdf_response.content
+    logger.info("PDF generated successfully.")
+
+    # Sha1 hash - Check for duplicates
+    sha1_hash = sha1(pdf_bytes)
+    if check_if_in_system(sha1_hash):
+        return None
+
+    # Return page count - 0 indicates a failure of some kind.  Like PDF
+    # Not actually present on aws.
+    pg_count = get_page_count(pdf_bytes)
+    if not pg_count:
+        logger.info(f"PDF failed for disclosure {data['id']}.")
+        return None
+
+    # Save Financial Disclosure here to AWS and move onward
+    disclosure = FinancialDisclosure(
+        year=year,
+        page_count=pg_count,
+        person=Person.objects.get(id=person_id),
+        sha1=sha1_hash,
+        has_been_extracted=False,
+        download_filepath=disclosure_url,
+    )
+    # Save and upload PDF
+    disclosure.filepath.save(
+        f"{disclosure.person.slug}-disclosure.{year}.pdf",
+        ContentFile(pdf_bytes),
+    )
+    logger.info(
+        f"Uploaded to https://{settings.AWS_S3_CUSTOM_DOMAIN}/"
+        f"{disclosure.filepath}"
+    )
+    return disclosure
+
+
 @app.task(bind=True, max_retries=2, interval_start=10, ignore_result=True)
 def import_disclosure(self, data: Dict[str, Union[str, int, list]]) -> None:
     """Import disclosures into Courtlistener
 
+    This does every stage of the import in one task. For big imports, use
+    the pipeline in import_financial_disclosures instead, which does each
+    stage in its own queue.
+
     :param data: The disclosure information to process
     :return: None
     """
-    # Check download_filepath to see if it has been processed before.
+    data = start_disclosure_import(data)
+    extracted = extract_disclosure_stage(data)
+    save_disclosure_stage(extracted)
+
+
+@app.task(bind=True, max_retries=2, interval_start=10)
+def start_disclosure_import(
+    self, data: Dict[str, Union[str, int, list]]
+) -> Optional[Dict[str, Union[str, int, list]]]:
+    """The download stage of a disclosure import.
+
+    Make and save the disclosure's PDF, unless that's already been done by
+    an earlier, interrupted import.
+
+    :param data: The disclosure information to process
+    :return: The data, with the pk of its FinancialDisclosure, for the
+    extraction stage, or None if there's nothing more to do.
+    """
     if has_been_extracted(data):
         logger.info(f"Document already extracted and saved: {data['id']}.")
-        return
+        return None
 
     interface = make_redis_interface("CACHE")
     disclosure_key = make_disclosure_key(data["id"])
     newly_enqueued = enqueue_disclosure_process(interface, disclosure_key)
-
     if not newly_enqueued:
         logger.info(f"Process is already running {data['id']}.")
-        return
+        return None
 
-    # Generate PDF content from our three paths
-    year = int(data["year"])
-    person_id = data["person_id"]
+    start = time.monotonic()
+    disclosure = download_disclosure(data)
+    record_stage("download", start, disclosure is not None)
+    if disclosure is None:
+        interface.delete(disclosure_key)
+        return None
+    return dict(data, disclosure_pk=disclosure.pk)
 
-    logger.info(
-        f"Processing row {data['id']} for person {person_id} "
-        f"in year {year}"
-    )
 
-    # Check if we've already extracted
-    disclosure_url = get_aws_url(data)
-    was_previously_pdfed = has_been_pdfed(disclosure_url)
-    pdf_response = generate_or_download_disclosure_as_pdf(
-        data, was_previously_pdfed
-    )
-    pdf_bytes = pdf_response.content
+@app.task(bind=True, max_retries=2, interval_start=10)
+def extract_disclosure_stage(
+    self, data: Optional[Dict[str, Union[str, int, list]]]
+) -> Optional[Tuple[Dict[str, Union[str, int, list]], dict]]:
+    """The extraction stage of a disclosure import.
 
-    if pdf_response.status_code != 200:
-        logger.info("PDF generation failed.")
-        return
+    This is the slow one, so it gets its own queue, where it doesn't hold up
+    the downloads or saves of other disclosures.
 
-    if was_previously_pdfed:
-        disclosure = get_disclosure_from_pdf_path(disclosure_url)
-    else:
-        logger.info("PDF generated successfully.")
-
-        # Sha1 hash - Check for duplicates
-        sha1_hash = sha1(pdf_bytes)
-        in_system = check_if_in_system(sha1_hash)
-        if in_system:
-            logger.info("PDF already in system.")
-            interface.delete(disclosure_key)
-            return
+    :param data: The disclosure information from start_disclosure_import.
+    :return: The data and the extracted content for the save stage, or None
+    if there's nothing more to do.
+    """
+    if data is None:
+        return None
 
-        # Return page count - 0 indicates a failure of some kind.  Like PDF
-        # Not actually present on aws.
-        pg_count = get_page_count(pdf_bytes)
-        if not pg_count:
-            logger.info(f"PDF failed for disclosure {data['id']}.")
-            interface.delete(disclosure_key)
-            return
+    disclosure = FinancialDisclosure.objects.get(pk=data["disclosure_pk"])
+    with disclosure.filepath.open("rb") as f:
+        pdf_bytes = f.read()
 
-        # Save Financial Disclosure here to AWS and move onward
-        disclosure = FinancialDisclosure(
-            year=year,
-            page_count=pg_count,
-            person=Person.objects.get(id=person_id),
-            sha1=sha1_hash,
-            has_been_extracted=False,
-            download_filepath=data.get("url")
-            if data.get("url")
-            else data.get("urls")[0],
-        )
-        # Save and upload PDF
-        disclosure.filepath.save(
-            f"{disclosure.person.slug}-disclosure.{year}.pdf",
-            ContentFile(pdf_bytes),
-        )
-        logger.info(
-            f"Uploaded to https://{settings.AWS_S3_CUSTOM_DOMAIN}/"
-            f"{disclosure.filepath}"
-        )
-    # Extract content from PDF
+    start = time.monotonic()
     content = extract_content(
         pdf_bytes=pdf_bytes, disclosure_type=data["disclosure_type"]
     )
+    record_stage("extract", start, bool(content))
     if not content:
         logger.info("Failed extraction!")
-        interface.delete(disclosure_key)
-        return
+        make_redis_interface("CACHE").delete(make_disclosure_key(data["id"]))
+        return None
+    return data, content
 
-    # Save PDF content
-    save_disclosure(extracted_data=content, disclosure=disclosure)
+
+@app.task(bind=True, max_retries=2, interval_start=10, ignore_result=True)
+def save_disclosure_stage(
+    self,
+    extracted: Optional[Tuple[Dict[str, Union[str, int, list]], dict]],
+) -> None:
+    """The save stage of a disclosure import.
+
+    :param extracted: The disclosure information and extracted content from
+    extract_disclosure_stage.
+    :return: None
+    """
+    if extracted is None:
+        return
+    data, content = extracted
+
+    start = time.monotonic()
+    with transaction.atomic():
+        # Lock the disclosure, so that if an interrupted import was rerun
+        # and extracted it twice, it's still only saved once.
+        disclosure = FinancialDisclosure.objects.select_for_update().get(
+            pk=data["disclosure_pk"]
+        )
+        if not disclosure.has_been_extracted:
+            save_disclosure(extracted_data=content, disclosure=disclosure)
+    record_stage("save", start, True)
     # Remove disclosure ID in redis for completed disclosure
-    interface.delete(disclosure_key)
+    make_redis_interface("CACHE").delete(make_disclosure_key(data["id"]))
@@ -12,7 +12,7 @@ from cl.disclosures.models import (
     NonInvestmentIncome,
     Reimbursement,
 )
-from cl.disclosures.tasks import save_disclosure
+from cl.disclosures.tasks import save_disclosure, save_disclosure_stage
 
 
 class DisclosureIngestionTest(TestCase):
@@ -55,6 +55,24 @@ class DisclosureIngestionTest(TestCase):
             % non_investments.count(),
         )
 
+    def test_save_stage_is_idempotent(self):
+        """If an interrupted import is rerun, is a disclosure only saved
+        once?
+        """
+        with open(self.test_file, "r") as f:
+            extracted_data = json.load(f)
+        data = {"id": 1, "disclosure_pk": 1}
+
+        save_disclosure_stage((data, extracted_data))
+        save_disclosure_stage((data, extracted_data))
+        # Nothing to do for disclosures that failed in an earlier stage.
+        save_disclosure_stage(None)
+
+        self.assertTrue(
+            FinancialDisclosure.objects.get(pk=1).has_been_extracted
+        )
+        self.assertEqual(Investment.objects.count(), 19)
+
 
 class LoggedInDisclosureTestCase(TestCase):
     fixtures = [
@@ -0,0 +1,264 @@
+"""
+Verification of the search engine crawlers that we exempt from rate limits.
+
+Crawlers are recognized two ways:
+
+ 1. By the IP ranges that Google and Bing publish for their crawlers. These
+    are fetched by the update_crawler_ip_ranges command and matched in memory.
+ 2. By a reverse DNS lookup of the IP, followed by a forward lookup of the
+    host to make sure it points back at the IP. These lookups are slow and can
+    hang, so they're done in Celery, never in a request, and their results
+    are cached, both good and bad.
+"""
+import ipaddress
+import json
+import logging
+import socket
+import threading
+import time
+from bisect import bisect_right
+from typing import Iterable, List, Optional
+
+import requests
+from django.conf import settings
+from django.core.cache import caches
+
+from cl.lib.redis_utils import make_redis_interface
+from cl.stats.utils import tally_stat
+
+logger = logging.getLogger(__name__)
+
+# See: https://www.bing.com/webmaster/help/how-to-verify-bingbot-3905dc26
+# and: https://support.google.com/webmasters/answer/80553?hl=en
+APPROVED_DOMAINS = [
+    "google.com",
+    "googlebot.com",
+    "search.msn.com",
+    "localhost",  # For dev.
+]
+
+CRAWLER_IP_RANGE_URLS = {
+    "googlebot": (
+        "https://developers.google.com/search/apis/ipranges/googlebot.json"
+    ),
+    "bingbot": "https://www.bing.com/toolbox/bingbot.json",
+}
+IP_RANGES_KEY = "crawler:ip-ranges"
+# How often each process rereads the IP ranges from Redis, in seconds
+IP_RANGES_REFRESH = 60 * 5
+
+VERDICT_CACHE_PREFIX = "rl:whitelist"
+PENDING_CACHE_PREFIX = "rl:whitelist-pending"
+
+
+def get_host_from_IP(ip_address: str) -> str:
+    """Get the host for an IP address by doing a reverse DNS lookup. Return
+    the value as a string.
+    """
+    return socket.getfqdn(ip_address)
+
+
+def get_ip_from_host(host: str) -> str:
+    """Do a forward DNS lookup of the host found in step one."""
+    return socket.gethostbyname(host)
+
+
+def host_is_approved(host: str) -> bool:
+    """Check whether the domain is in our approved whitelist."""
+    return any(
+        [
+            host.endswith(approved_domain)
+            for approved_domain in APPROVED_DOMAINS
+        ]
+    )
+
+
+def verify_ip_address(ip_address: str) -> bool:
+    """Do authentication checks for the IP address requesting the page."""
+    # First we do a rDNS lookup of the IP.
+    host = get_host_from_IP(ip_address)
+
+    #  Then we check the returned host to ensure it's an approved crawler
+    if host_is_approved(host):
+        # If it's approved, do a forward DNS lookup to get the IP from the host.
+        # If that matches the original IP, we're good.
+        if ip_address == get_ip_from_host(host):
+            # Everything checks out!
+            return True
+    return False
+
+
+class IPRangeSet(object):
+    """A set of IP networks that can be checked for an address quickly.
+
+    The networks are merged and stored as sorted ranges of integers, so a
+    lookup is one binary search, no matter how many networks there are.
+    """
+
+    def __init__(self, cidrs: Iterable[str] = ()) -> None:
+        self.starts = {4: [], 6: []}
+        self.ends = {4: [], 6: []}
+        networks = {4: [], 6: []}
+        for cidr in cidrs:
+            try:
+                network = ipaddress.ip_network(cidr, strict=False)
+            except ValueError:
+                logger.warning("Skipping invalid crawler IP range: %s", cidr)
+                continue
+            networks[network.version].append(network)
+        for version, nets in networks.items():
+            for network in ipaddress.collapse_addresses(nets):
+                self.starts[version].append(int(network.network_address))
+                self.ends[version].append(int(network.broadcast_address))
+
+    def __len__(self) -> int:
+        return len(self.starts[4]) + len(self.starts[6])
+
+    def __contains__(self, ip_address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(ip_address)
+        except ValueError:
+            return False
+        value = int(ip)
+        i = bisect_right(self.starts[ip.version], value) - 1
+        return i >= 0 and value <= self.ends[ip.version][i]
+
+
+def parse_ip_range_list(data: dict) -> List[str]:
+    """Get the CIDRs out of a crawler IP range list, in the format that both
+    Google and Bing publish.
+    """
+    cidrs = []
+    for prefix in data.get("prefixes", []):
+        cidr = prefix.get("ipv4Prefix") or prefix.get("ipv6Prefix")
+        if cidr:
+            cidrs.append(cidr)
+    return cidrs
+
+
+def fetch_crawler_ip_ranges() -> List[str]:
+    """Download the published IP ranges of every crawler we trust.
+
+    :return: A list of CIDRs.
+    """
+    cidrs = []
+    for name, url in CRAWLER_IP_RANGE_URLS.items():
+        r = requests.get(url, timeout=30)
+        r.raise_for_status()
+        crawler_cidrs = parse_ip_range_list(r.json())
+        logger.info("Got %s IP ranges for %s", len(crawler_cidrs), name)
+        cidrs.extend(crawler_cidrs)
+    return cidrs
+
+
+def save_crawler_ip_ranges(cidrs: List[str]) -> None:
+    """Save crawler IP ranges for every process to use."""
+    r = make_redis_interface("CACHE")
+    r.set(IP_RANGES_KEY, json.dumps(cidrs))
+
+
+_ip_ranges = IPRangeSet()
+_ip_ranges_loaded = None
+_ip_ranges_lock = threading.Lock()
+
+
+def get_crawler_ip_ranges() -> IPRangeSet:
+    """Get the crawler IP ranges, rereading them from Redis now and then."""
+    global _ip_ranges, _ip_ranges_loaded
+    with _ip_ranges_lock:
+        if (
+            _ip_ranges_loaded is None
+            or time.monotonic() - _ip_ranges_loaded > IP_RANGES_REFRESH
+        ):
+            r = make_redis_interface("CACHE")
+            cidrs = r.get(IP_RANGES_KEY)
+            _ip_ranges = IPRangeSet(json.loads(cidrs) if cidrs else [])
+            _ip_ranges_loaded = time.monotonic()
+        return _ip_ranges
+
+
+def _get_cache():
+    return caches[getattr(settings, "RATELIMIT_USE_CACHE", "default")]
+
+
+def get_cached_verdict(ip_address: str) -> Optional[bool]:
+    """Get the cached result of verifying an IP, if there is one.
+
+    :return: True if the IP is a crawler, False if it isn't, or None if it
+    hasn't been checked lately.
+    """
+    verdict = _get_cache().get("%s:%s" % (VERDICT_CACHE_PREFIX, ip_address))
+    if verdict is None:
+        return None
+    # Older entries hold the IP address itself for approved crawlers.
+    return verdict != 0
+
+
+def verify_and_cache_ip_address(ip_address: str) -> bool:
+    """Verify an IP with DNS lookups, then cache and record the verdict.
+
+    Approved crawlers are cached for settings.CRAWLER_APPROVED_TTL, and
+    everybody else for settings.CRAWLER_REJECTED_TTL.
+
+    :return: Whether the IP belongs to an approved crawler.
+    """
+    t1 = time.monotonic()
+    try:
+        approved = verify_ip_address(ip_address)
+    except OSError as e:
+        # DNS failures and timeouts. Treat them as a no, for now.
+        logger.info("Unable to verify crawler IP %s: %s", ip_address, e)
+        approved = False
+        tally_stat("crawler.verify.error")
+    elapsed_ms = int((time.monotonic() - t1) * 1000)
+
+    verdict = "approved" if approved else "rejected"
+    tally_stat("crawler.verify.%s" % verdict)
+    tally_stat("crawler.verify.ms", inc=elapsed_ms)
+    logger.info(
+        "Crawler verification of %s: %s in %sms",
+        ip_address,
+        verdict,
+        elapsed_ms,
+    )
+
+    cache = _get_cache()
+    if approved:
+        timeout = settings.CRAWLER_APPROVED_TTL
+    else:
+        timeout = settings.CRAWLER_REJECTED_TTL
+    cache.set(
+        "%s:%s" % (VERDICT_CACHE_PREFIX, ip_address), int(approved), timeout
+    )
+    cache.delete("%s:%s" % (PENDING_CACHE_PREFIX, ip_address))
+    return approved
+
+
+def is_approved_crawler(ip_address: str) -> bool:
+    """Check if an IP belongs to an approved crawler without blocking.
+
+    IPs in the published ranges are approved right away. Others are looked
+    up in the verdict cache. If an IP isn't there, it's verified in Celery,
+    and this request gets settings.CRAWLER_PROVISIONAL_VERDICT.
+
+    :param ip_address: The IP making the request.
+    :return: Whether to treat the IP as an approved crawler.
+    """
+    if ip_address in get_crawler_ip_ranges():
+        return True
+
+    verdict = get_cached_verdict(ip_address)
+    if verdict is not None:
+        return verdict
+
+    # Only enqueue one verification per IP at a time.
+    pending_key = "%s:%s" % (PENDING_CACHE_PREFIX, ip_address)
+    if _get_cache().add(pending_key, 1, settings.CRAWLER_VERIFY_TIMEOUT):
+        from cl.lib.tasks import verify_crawler_ip
+
+        verify_crawler_ip.delay(ip_address)
+        # If Celery ran the task right away, we already have the answer.
+        verdict = get_cached_verdict(ip_address)
+        if verdict is not None:
+            return verdict
+    return settings.CRAWLER_PROVISIONAL_VERDICT
@@ -1,4 +1,16 @@
+import json
+import time
 from datetime import timedelta
+from multiprocessing import Pool
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.db import connection, connections
+from django.db.models import Max, Min, Model, QuerySet
+
+from cl.lib.redis_utils import make_redis_interface
+
+# A half-open range of primary keys, [start, end). None means unbounded.
+PkRange = Tuple[Optional[Any], Optional[Any]]
 
 
 def queryset_generator(queryset, chunksize=1000):
@@ -60,3 +72,405 @@ def fetchall_as_dict(cursor):
     """
     columns = [col[0] for col in cursor.description]
     return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def get_pk_boundaries(
+    queryset: QuerySet,
+    partitions: int,
+    sample_size: int = 0,
+) -> List[Any]:
+    """Get the split points that divide a queryset's pk space into ranges.
+
+    By default the split points are spread evenly between the lowest and
+    highest pk, which is cheap (two index lookups), but requires integer pks
+    and works best when pks are dense. If the pks are sparse or skewed (or
+    aren't integers), use sample_size to pick the split points from a random
+    sample of the table instead. Note that the sample is taken from the whole
+    table, not just the rows matching the queryset's filters.
+
+    :param queryset: The queryset to split up.
+    :param partitions: The number of ranges that are desired.
+    :param sample_size: If non-zero, about how many pks to sample from the
+    table when picking split points.
+    :return: A sorted list of no more than partitions - 1 distinct split
+    points. Fewer are returned if the table is too small to split.
+    """
+    if partitions <= 1:
+        return []
+
+    if sample_size:
+        samples = sorted(sample_pks(queryset.model, sample_size))
+        if not samples:
+            return []
+        points = [
+            samples[len(samples) * i // partitions]
+            for i in range(1, partitions)
+        ]
+    else:
+        bounds = queryset.order_by().aggregate(lo=Min("pk"), hi=Max("pk"))
+        lo, hi = bounds["lo"], bounds["hi"]
+        if lo is None:
+            return []
+        if not isinstance(lo, int):
+            raise ValueError(
+                "Min/max boundaries require integer pks. Use sample_size "
+                "to split tables with other kinds of pks."
+            )
+        step = (hi - lo + 1) / partitions
+        points = [lo + int(step * i) for i in range(1, partitions)]
+
+    # Small or clumpy tables can produce the same point more than once.
+    return sorted(set(points))
+
+
+def sample_pks(model: Model, sample_size: int) -> List[Any]:
+    """Get roughly sample_size random pks from a model's table.
+
+    Uses Postgres's TABLESAMPLE, which reads random pages of the table rather
+    than scanning it, so this is fast even on huge tables. The size of the
+    table comes from the planner's estimate.
+
+    :param model: The model whose table should be sampled.
+    :param sample_size: About how many pks to return.
+    :return: A list of pks, in no particular order.
+    """
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT reltuples FROM pg_class WHERE relname = %s", [table]
+        )
+        row = cursor.fetchone()
+        estimate = row[0] if row else 0
+        if estimate > 0:
+            percent = min(100.0, sample_size * 100.0 / estimate)
+        else:
+            # Never analyzed; just read the whole thing.
+            percent = 100.0
+        cursor.execute(
+            "SELECT %s FROM %s TABLESAMPLE SYSTEM (%%s)"
+            % (
+                connection.ops.quote_name(model._meta.pk.column),
+                connection.ops.quote_name(table),
+            ),
+            [percent],
+        )
+        return [r[0] for r in cursor.fetchall()]
+
+
+def make_pk_ranges(boundaries: List[Any]) -> List[PkRange]:
+    """Convert a sorted list of split points into half-open pk ranges.
+
+    The first and last ranges are open-ended so that no row can fall outside
+    of all the ranges, even if rows are added while a scan is in progress.
+    """
+    points = [None] + list(boundaries) + [None]
+    return list(zip(points[:-1], points[1:]))
+
+
+def get_row_pk(row: Any) -> Any:
+    """Get the pk of a row from a queryset, values query, or flat values_list
+    query of pks.
+    """
+    if isinstance(row, Model):
+        return row.pk
+    if isinstance(row, dict):
+        for key in ("pk", "id"):
+            if key in row:
+                return row[key]
+        raise Exception(
+            "Unable to lookup pk of item. Did you forget to include it in a "
+            "values query?"
+        )
+    if isinstance(row, (tuple, list)):
+        raise Exception(
+            "Unable to lookup pk of a values_list row. Use flat=True with "
+            "the pk, or use a values query instead."
+        )
+    # A flat values_list query of pks
+    return row
+
+
+class QuerysetScanStats(object):
+    """Throughput statistics for a scan of a queryset."""
+
+    def __init__(self) -> None:
+        self.started = time.time()
+        self.finished = None
+        self.rows_by_range: Dict[int, int] = {}
+
+    def add(self, index: int, count: int) -> None:
+        self.rows_by_range[index] = self.rows_by_range.get(index, 0) + count
+
+    def finish(self) -> None:
+        self.finished = time.time()
+
+    @property
+    def rows(self) -> int:
+        return sum(self.rows_by_range.values())
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / (self.elapsed or 1)
+
+    def __str__(self) -> str:
+        return "%s rows from %s ranges in %0.1f seconds (%0.1f/s)" % (
+            self.rows,
+            len(self.rows_by_range),
+            self.elapsed,
+            self.rows_per_second,
+        )
+
+
+# How long the progress of a scan is kept after it was last saved
+CHECKPOINT_TIMEOUT = 60 * 60 * 24 * 14
+
+
+class PartitionedQuerysetScanner(object):
+    """Scan a queryset in pk ranges, optionally in parallel.
+
+    The pk space of the queryset is split into ranges (see
+    get_pk_boundaries), and each range is streamed in pk order with a
+    server-side cursor. Unlike queryset_generator, this does not need a count
+    query up front, works with non-integer pks, and can hand the ranges off
+    to a process pool or to Celery.
+
+    If a checkpoint_name is provided, the last pk processed in each range is
+    saved to Redis every checkpoint_every rows, and completed ranges are
+    marked as done. The split points of the ranges are saved too, so that
+    scanning again with the same name resumes where the last scan left off,
+    over the same ranges, even if rows were added since or the split points
+    came from a sample. Call clear_checkpoints() to start over.
+
+    Usage:
+
+        scanner = PartitionedQuerysetScanner(
+            Opinion.objects.filter(...), partitions=16
+        )
+        for opinion in scanner:
+            ...
+
+        # Or in parallel:
+        stats = scanner.run(some_module_level_function, workers=8)
+    """
+
+    def __init__(
+        self,
+        queryset: QuerySet,
+        partitions: int = 1,
+        sample_size: int = 0,
+        checkpoint_name: Optional[str] = None,
+        checkpoint_every: int = 1000,
+    ) -> None:
+        """
+        :param queryset: The queryset to scan. Any ordering is discarded.
+        :param partitions: The number of pk ranges to split the queryset into.
+        :param sample_size: If non-zero, pick range boundaries from a sample
+        of this many pks instead of using the min and max pks.
+        :param checkpoint_name: A unique name for this scan, used to save and
+        resume progress in Redis.
+        :param checkpoint_every: How often, in rows, to save progress.
+        """
+        self.queryset = queryset.order_by("pk").prefetch_related(None)
+        self.partitions = partitions
+        self.sample_size = sample_size
+        self.checkpoint_name = checkpoint_name
+        self.checkpoint_every = checkpoint_every
+        self._ranges: Optional[List[PkRange]] = None
+        self.stats = QuerysetScanStats()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Pickling a queryset evaluates it, so pickle its query instead. This
+        # lets scanners be sent to Celery tasks and process pools.
+        state = self.__dict__.copy()
+        state["model"] = self.queryset.model
+        state["query"] = self.queryset.query
+        del state["queryset"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        model = state.pop("model")
+        query = state.pop("query")
+        self.__dict__.update(state)
+        self.queryset = model.objects.all()
+        self.queryset.query = query
+
+    @property
+    def ranges(self) -> List[PkRange]:
+        if self._ranges is None:
+            self._ranges = make_pk_ranges(self._get_boundaries())
+        return self._ranges
+
+    def _get_boundaries(self) -> List[Any]:
+        """Get the split points of the ranges, reusing the ones saved with
+        the checkpoints, if there are any.
+        """
+        if not self.checkpoint_name:
+            return get_pk_boundaries(
+                self.queryset, self.partitions, self.sample_size
+            )
+        r = make_redis_interface("CACHE")
+        key = self._checkpoint_key()
+        saved = r.hget(key, "boundaries")
+        if saved is None:
+            boundaries = get_pk_boundaries(
+                self.queryset, self.partitions, self.sample_size
+            )
+            # If another scanner saved its split points first, use those.
+            r.hsetnx(
+                key, "boundaries", json.dumps([str(b) for b in boundaries])
+            )
+            r.expire(key, CHECKPOINT_TIMEOUT)
+            saved = r.hget(key, "boundaries")
+        to_python = self.queryset.model._meta.pk.to_python
+        return [to_python(b) for b in json.loads(saved)]
+
+    def _checkpoint_key(self) -> str:
+        return "scan:%s" % self.checkpoint_name
+
+    def get_checkpoint(self, index: int) -> Tuple[bool, Optional[Any]]:
+        """Get the saved progress for a range
+
+        :param index: The index of the range in self.ranges.
+        :return: A tuple of whether the range is done and the last pk that
+        was processed in it, if any.
+        """
+        if not self.checkpoint_name:
+            return False, None
+        r = make_redis_interface("CACHE")
+        done, last_pk = r.hmget(
+            self._checkpoint_key(), ["%s:done" % index, str(index)]
+        )
+        if last_pk is not None:
+            last_pk = self.queryset.model._meta.pk.to_python(last_pk)
+        return bool(done), last_pk
+
+    def save_checkpoint(
+        self,
+        index: int,
+        last_pk: Any,
+        done: bool = False,
+    ) -> None:
+        if not self.checkpoint_name:
+            return
+        r = make_redis_interface("CACHE")
+        key = self._checkpoint_key()
+        pipe = r.pipeline()
+        if last_pk is not None:
+            pipe.hset(key, str(index), str(last_pk))
+        if done:
+            pipe.hset(key, "%s:done" % index, 1)
+        pipe.expire(key, CHECKPOINT_TIMEOUT)
+        pipe.execute()
+
+    def clear_checkpoints(self) -> None:
+        if self.checkpoint_name:
+            make_redis_interface("CACHE").delete(self._checkpoint_key())
+
+    def scan_range(self, index: int) -> Iterator[Any]:
+        """Stream the rows of one range, in pk order.
+
+        :param index: The index of the range in self.ranges.
+        """
+        start, end = self.ranges[index]
+        done, last_pk = self.get_checkpoint(index)
+        if done:
+            return
+
+        qs = self.queryset
+        if last_pk is not None:
+            qs = qs.filter(pk__gt=last_pk)
+        elif start is not None:
+            qs = qs.filter(pk__gte=start)
+        if end is not None:
+            qs = qs.filter(pk__lt=end)
+
+        count = 0
+        row_pk = None
+        for row in qs.iterator():
+            yield row
+            count += 1
+            if self.checkpoint_name:
+                row_pk = get_row_pk(row)
+                if count % self.checkpoint_every == 0:
+                    self.save_checkpoint(index, row_pk)
+        self.save_checkpoint(index, row_pk, done=True)
+        self.stats.add(index, count)
+
+    def __iter__(self) -> Iterator[Any]:
+        for index in range(len(self.ranges)):
+            yield from self.scan_range(index)
+        self.stats.finish()
+
+    def run(
+        self,
+        func: Callable[[Any], Any],
+        workers: int = 1,
+    ) -> QuerysetScanStats:
+        """Call a function on every row, spreading the ranges across a pool
+        of processes.
+
+        :param func: The function to call with each row. If workers > 1, it
+        must be picklable, i.e., defined at the top level of a module.
+        :param workers: The number of processes to use. If 1, the ranges are
+        processed in this process.
+        :return: Stats for the scan.
+        """
+        if workers <= 1:
+            for row in self:
+                func(row)
+            return self.stats
+
+        # Make sure the ranges are calculated once, here, and that the
+        # children don't inherit (and share) our database connections.
+        indexes = list(range(len(self.ranges)))
+        connections.close_all()
+        with Pool(processes=workers) as pool:
+            args = [(self, index, func) for index in indexes]
+            for index, count in pool.imap_unordered(_run_range, args):
+                self.stats.add(index, count)
+        self.stats.finish()
+        return self.stats
+
+    def enqueue(
+        self,
+        func: Callable[[Any], Any],
+        queue: str = "celery",
+    ) -> int:
+        """Send each range that isn't done yet to Celery.
+
+        Pair this with a checkpoint_name so that ranges that die partway
+        through can be resumed by enqueueing them again.
+
+        :param func: The function to call with each row. Must be picklable.
+        :param queue: The celery queue to use.
+        :return: The number of ranges that were enqueued.
+        """
+        from cl.lib.tasks import scan_queryset_range
+
+        enqueued = 0
+        for index in range(len(self.ranges)):
+            done, _ = self.get_checkpoint(index)
+            if done:
+                continue
+            scan_queryset_range.apply_async(
+                args=(self, index, func), queue=queue
+            )
+            enqueued += 1
+        return enqueued
+
+
+def _run_range(
+    args: Tuple[PartitionedQuerysetScanner, int, Callable[[Any], Any]]
+) -> Tuple[int, int]:
+    """Process one range of a scanner in a pool worker."""
+    scanner, index, func = args
+    count = 0
+    for row in scanner.scan_range(index):
+        func(row)
+        count += 1
+    connections.close_all()
+    return index, count
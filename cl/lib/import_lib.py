@@ -1,8 +1,7 @@
-from dateutil.relativedelta import relativedelta
 from django.db.models import Min, Q
 
 from cl.corpus_importer.import_columbia.parse_judges import find_judge_names
-from cl.lib.utils import previous_and_next
+from cl.people_db.judge_index import get_judge_index
 from cl.people_db.models import Person
 from cl.search.models import Court, Opinion
 
@@ -15,58 +14,20 @@ def find_person(
     raise_mult=False,
     raise_zero=False,
 ):
-    """Uniquely identifies a judge by both name and metadata. Prints a warning
-    if couldn't find and raises an exception if not unique.
+    """Uniquely identifies a judge by both name and metadata. Returns None if
+    the judge can't be found or isn't unique, or raises an exception if
+    raise_zero or raise_mult are set.
+
+    Lookups are answered from the process's in-memory judge index.
     """
-    filter_sets = [
-        # check based on name and court first
-        [Q(name_last__iexact=name_last), Q(positions__court_id=court_id)],
-    ]
-    if case_date is not None:
-        # If we've got the date, narrow by date next
-        filter_sets.append(
-            [
-                Q(positions__date_start__lt=case_date + relativedelta(years=1))
-                | Q(positions__date_start=None),
-                Q(
-                    positions__date_termination__gt=case_date
-                    - relativedelta(years=1)
-                )
-                | Q(positions__date_termination=None),
-            ]
-        )
-    if name_first is not None:
-        # Finally if we have the first name, narrow by that
-        filter_sets.append([Q(name_first__iexact=name_first)])
-
-    # Iterate through the filter sets. Each time, add the current filters to
-    # the previous ones to progressively narrow the filter. If we get to zero
-    # results, raise. If we do all filtering and still have more than 1 result,
-    # raise.
-    for prev, filters, nxt in previous_and_next(filter_sets):
-        if prev is not None:
-            # Each time, add the current filters to those that came before.
-            prev.extend(filters)
-        candidates = Person.objects.filter(*filters)
-        if len(candidates) == 0:
-            msg = "Unable to find judge with lname %s in court %s" % (
-                name_last,
-                court_id,
-            )
-            if raise_zero:
-                raise Exception(msg)
-            else:
-                return None
-
-        if len(candidates) == 1:
-            return candidates[0]
-
-    # Unable to get to one or zero results. Raise exception if desired.
-    if raise_mult:
-        raise Exception(
-            "Multiple judges: Last name '%s', court '%s', options: %s."
-            % (name_last, court_id, str([c.name_first for c in candidates]))
-        )
+    return get_judge_index().find_person(
+        name_last,
+        court_id,
+        name_first=name_first,
+        case_date=case_date,
+        raise_mult=raise_mult,
+        raise_zero=raise_zero,
+    )
 
 
 def get_candidate_judges(judge_str, court_id, event_date):
@@ -87,9 +48,9 @@ def get_candidate_judges(judge_str, court_id, event_date):
     if len(judges) == 0:
         return []
 
-    candidates = []
-    for judge in judges:
-        candidates.append(find_person(judge, court_id, case_date=event_date))
+    candidates = get_judge_index().find_people(
+        (judge, court_id, event_date) for judge in judges
+    )
     return [c for c in candidates if c is not None]
 
 
@@ -0,0 +1,14 @@
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.view_utils import flush_view_counts
+
+
+class Command(VerboseCommand):
+    help = (
+        "Add the page views counted in Redis to the view_count columns in "
+        "the database. Run this every few minutes."
+    )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        for label, count in flush_view_counts().items():
+            logger.info("Updated view counts of %s %s objects", count, label)
@@ -0,0 +1,16 @@
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.crawlers import fetch_crawler_ip_ranges, save_crawler_ip_ranges
+
+
+class Command(VerboseCommand):
+    help = (
+        "Download the IP ranges that search engines publish for their "
+        "crawlers, so the rate limiter can recognize them without DNS "
+        "lookups. Run this daily."
+    )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        cidrs = fetch_crawler_ip_ranges()
+        save_crawler_ip_ranges(cidrs)
+        logger.info("Saved %s crawler IP ranges.", len(cidrs))
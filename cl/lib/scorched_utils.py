@@ -1,3 +1,6 @@
+import threading
+
+import requests
 from scorched import SolrInterface
 from scorched.exc import SolrError
 from scorched.search import Options, SolrSearch
@@ -153,3 +156,32 @@ class MoreLikeThisHighlightsSolrSearch(ExtraSolrSearch):
             ret = self.constructor(ret, constructor)
 
         return ret
+
+
+_pooled_interfaces = {}
+_pooled_interfaces_lock = threading.Lock()
+
+
+def get_pooled_solr_interface(url: str) -> ExtraSolrInterface:
+    """Get a read-only interface to a Solr core that's shared by the whole
+    process.
+
+    Making an interface fetches the core's schema and opens a new session,
+    so for queries on the request path, reuse one instead. Its session's
+    connection pool is big enough for a few threads to query at once.
+
+    :param url: The URL of the Solr core.
+    :return: An ExtraSolrInterface. Don't close its connection.
+    """
+    with _pooled_interfaces_lock:
+        si = _pooled_interfaces.get(url)
+        if si is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=10
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            si = ExtraSolrInterface(url, http_connection=session, mode="r")
+            _pooled_interfaces[url] = si
+        return si
@@ -0,0 +1,274 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from cl.lib.redis_utils import make_redis_interface
+from cl.stats.utils import tally_stat
+
+
+class LRUCache(object):
+    """A small, thread-safe, in-process LRU cache with a TTL.
+
+    This sits in front of Redis so that a worker serving the same popular
+    query over and over doesn't even need to unpickle the results again.
+    """
+
+    def __init__(self, max_size: int = 256, timeout: int = 60) -> None:
+        self.max_size = max_size
+        self.timeout = timeout
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                return None
+            if expires < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(
+        self, key: Hashable, value: Any, timeout: Optional[float] = None
+    ) -> None:
+        if timeout is None:
+            timeout = self.timeout
+        with self._lock:
+            self._data[key] = (time.monotonic() + timeout, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+local_cache = LRUCache(
+    max_size=settings.SEARCH_CACHE_LOCAL_SIZE,
+    timeout=settings.SEARCH_CACHE_LOCAL_TIMEOUT,
+)
+
+
+def normalize_query_string(q: str) -> str:
+    """Collapse the whitespace in a query so that trivially different
+    queries share a cache entry. Case is left alone since it is meaningful
+    for boolean operators.
+    """
+    return " ".join(q.split())
+
+
+def make_search_fingerprint(
+    cd: Dict[str, Any],
+    page: int,
+    rows: int,
+    facet: bool,
+) -> str:
+    """Make a canonical fingerprint of a search.
+
+    The fingerprint is built from the form's cleaned data rather than the raw
+    GET parameters so that parameter order, blank parameters, and the many
+    ways of selecting courts all collapse to the same value.
+
+    :param cd: The cleaned data from a SearchForm.
+    :param page: The page of results requested.
+    :param rows: The number of rows per page.
+    :param facet: Whether the results include facets.
+    :return: A hex digest identifying the search.
+    """
+    params = {}
+    courts = []
+    for key, value in cd.items():
+        if key.startswith("court_"):
+            if value:
+                courts.append(key[len("court_") :])
+            continue
+        if key == "court":
+            # Redundant with the court_* fields, gathered above.
+            continue
+        if value in (None, "", False, []):
+            continue
+        if key == "q":
+            value = normalize_query_string(value)
+        params[key] = value
+    params["courts"] = sorted(courts)
+    params["page"] = page
+    params["rows"] = rows
+    params["facet"] = facet
+    serialized = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()
+
+
+def _generation_key(solr_url: str) -> str:
+    return "search-gen:%s" % solr_url
+
+
+def _uncommitted_key(solr_url: str) -> str:
+    return "search-gen-uncommitted:%s" % solr_url
+
+
+def get_search_generation(solr_url: str) -> Tuple[int, Optional[float]]:
+    """Get the current generation of a Solr core.
+
+    The generation goes up every time documents are sent to the core. It is
+    part of every cache key, so bumping it invalidates everything that was
+    cached for the core without having to find and delete the keys.
+
+    :param solr_url: The URL of the core.
+    :return: A tuple of the generation, and the time until which results may
+    not show the latest changes because Solr hasn't committed them yet, or
+    None if everything sent to the core is committed.
+    """
+    r = make_redis_interface("CACHE")
+    generation, uncommitted = r.mget(
+        _generation_key(solr_url), _uncommitted_key(solr_url)
+    )
+    until = None
+    if uncommitted is not None:
+        until = float(uncommitted) + settings.SEARCH_CACHE_COMMIT_WINDOW
+    return int(generation or 0), until
+
+
+def bump_search_generation(solr_url: str, committed: bool = False) -> int:
+    """Invalidate the cached search results for a Solr core.
+
+    Call this after sending documents to the core, and after committing them
+    if you do. Without a commit, Solr only shows the documents after its next
+    automatic one, so results cached until then are kept only briefly.
+
+    :param solr_url: The URL of the core that was changed.
+    :param committed: Whether the changes were committed.
+    :return: The new generation.
+    """
+    r = make_redis_interface("CACHE")
+    pipe = r.pipeline()
+    pipe.incr(_generation_key(solr_url))
+    if not committed:
+        pipe.set(
+            _uncommitted_key(solr_url),
+            time.time(),
+            ex=settings.SEARCH_CACHE_COMMIT_WINDOW,
+        )
+    return pipe.execute()[0]
+
+
+def get_or_compute_search_results(
+    fingerprint: str,
+    solr_url: str,
+    search_type: str,
+    compute: Callable[[], Any],
+) -> Any:
+    """Get search results from the cache, or compute and cache them.
+
+    Results are looked for in the process's LRU cache, then in Redis. On a
+    miss, only one process computes the results at a time (single-flight).
+    Others wait for it to finish, up to a limit, then give up and compute the
+    results themselves.
+
+    :param fingerprint: The fingerprint of the search, from
+    make_search_fingerprint.
+    :param solr_url: The URL of the core being searched.
+    :param search_type: The type of search, for hit/miss stats.
+    :param compute: A function that runs the search and returns its results.
+    :return: The results, from the cache or from compute.
+    """
+    generation, uncommitted_until = get_search_generation(solr_url)
+    key = "search-results:%s:%s" % (generation, fingerprint)
+
+    # Stats are tallied in Redis and saved in batches, so this is cheap.
+    hit_stat = "search.cache.%s.hit" % search_type
+    results = local_cache.get(key)
+    if results is not None:
+        tally_stat(hit_stat)
+        return results
+
+    results = cache.get(key)
+    if results is not None:
+        local_cache.set(key, results)
+        tally_stat(hit_stat)
+        return results
+
+    lock_key = "%s:lock" % key
+    lock_timeout = settings.SEARCH_CACHE_LOCK_TIMEOUT
+    have_lock = cache.add(lock_key, 1, lock_timeout)
+    if not have_lock:
+        # Somebody else is running this search. Wait for them.
+        deadline = time.monotonic() + lock_timeout
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            results = cache.get(key)
+            if results is not None:
+                local_cache.set(key, results)
+                tally_stat(hit_stat)
+                return results
+            if cache.get(lock_key) is None:
+                # They failed. Try it ourselves.
+                break
+
+    tally_stat("search.cache.%s.miss" % search_type)
+    try:
+        results = compute()
+        timeout = settings.SEARCH_CACHE_TIMEOUT
+        if uncommitted_until is not None:
+            # The results may be from before Solr shows the latest changes,
+            # so drop them once it must have.
+            timeout = max(
+                min(timeout, int(uncommitted_until - time.time())), 1
+            )
+        cache.set(key, results, timeout)
+        local_cache.set(key, results, min(timeout, local_cache.timeout))
+    finally:
+        if have_lock:
+            cache.delete(lock_key)
+    return results
+
+
+def _docket_metadata_key(docket_pk: int) -> str:
+    return "docket-metadata:%s" % docket_pk
+
+
+def get_docket_search_metadata(docket) -> Dict[str, Any]:
+    """Get the fields of a docket that are copied onto its RECAP documents
+    when they're indexed, from the cache if possible.
+
+    Building them takes several queries, for the court, the judges and the
+    parties, attorneys and firms, so the result is cached and shared by every
+    task that indexes documents from the docket. Entries are versioned by
+    the docket's date_modified, so saving the docket invalidates them, and
+    changes to its parties must call invalidate_docket_search_metadata().
+
+    :param docket: The Docket.
+    :return: A dict like the one from Docket.get_search_metadata().
+    """
+    key = _docket_metadata_key(docket.pk)
+    cached = cache.get(key)
+    if cached is not None:
+        version, metadata = cached
+        if version == docket.date_modified:
+            return dict(metadata)
+
+    metadata = docket.get_search_metadata()
+    cache.set(
+        key,
+        (docket.date_modified, metadata),
+        settings.DOCKET_METADATA_CACHE_TIMEOUT,
+    )
+    return dict(metadata)
+
+
+def invalidate_docket_search_metadata(docket_pk: int) -> None:
+    """Drop the cached search metadata of a docket, for changes that don't
+    touch its date_modified, like changes to its parties.
+
+    :param docket_pk: The pk of the Docket.
+    """
+    cache.delete(_docket_metadata_key(docket_pk))
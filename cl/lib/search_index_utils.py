@@ -1,4 +1,11 @@
-from datetime import date
+import re
+from datetime import date, datetime
+from multiprocessing import Pool
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.template.defaultfilters import date as date_filter
+from django.utils.html import escape, strip_tags
+from django.utils.timezone import utc
 
 from cl.lib.date_time import midnight_pst
 
@@ -27,6 +34,34 @@ null_map = dict.fromkeys(
     list(range(0, 10)) + list(range(11, 13)) + list(range(14, 32))
 )
 
+# Tags that fast_strip_tags can remove knowing that Django's strip_tags,
+# which uses HTMLParser, would remove exactly the same characters.
+simple_tag_re = re.compile(
+    r"</[a-zA-Z][^<>\"'\x00]*>"
+    r"|<\?[^>]*>"
+    r"|<[a-zA-Z][-.:_a-zA-Z0-9]*"
+    r"(?:[\s/](?:[^<>\"'\x00]|=\s*\"[^<>\"\x00]*\"|=\s*'[^<>'\x00]*')*)?>"
+)
+# HTMLParser adds the missing semicolons of the entities in text it parses
+entity_no_semicolon_re = re.compile(
+    r"&([a-zA-Z][-.a-zA-Z0-9]*)(?=[^-.;a-zA-Z0-9])"
+)
+charref_no_semicolon_re = re.compile(
+    r"&#([0-9]+|[xX][0-9a-fA-F]+)(?=[^;0-9a-fA-F])"
+)
+# Markup that HTMLParser treats in ways the regexes above don't mimic:
+# elements whose content isn't parsed, charrefs it can't parse, and
+# entities at the very end of the text.
+complex_markup_re = re.compile(
+    r"<(?i:script|style|textarea|title|xmp|iframe|noembed|noframes|"
+    r"noscript|plaintext)"
+    r"|&#(?!(?:[0-9]+|[xX][0-9a-fA-F]+)[^0-9a-fA-F])"
+    r"|&[a-zA-Z#][-.a-zA-Z0-9]*\Z"
+)
+# The characters in null_map. Removing them with a regex is much faster than
+# translating long strings with null_map.
+control_chars_re = re.compile(r"[\x00-\x09\x0b\x0c\x0e-\x1f]")
+
 
 def normalize_search_dicts(d):
     """Prepare search dicts for indexing by solr.
@@ -52,3 +87,369 @@ def normalize_search_dicts(d):
         else:
             new_dict[k] = v
     return new_dict
+
+
+def solr_date(value):
+    """Convert a date for Solr, leaving None alone so it clears the field."""
+    if value is None:
+        return None
+    return midnight_pst(value)
+
+
+def make_atomic_update(doc_id, fields):
+    """Make a Solr atomic update that changes some fields of a document.
+
+    :param doc_id: The id of the Solr document.
+    :param fields: A dict of Solr fields to their new values. Values are set,
+    unless they're already a dict naming an operation, like {"inc": 1}. None
+    removes the field, and sets are converted to lists.
+    :return: A dict that can be sent to Solr like a document.
+    """
+    out = {"id": doc_id}
+    for name, value in fields.items():
+        if isinstance(value, set):
+            value = list(value)
+        if not isinstance(value, dict):
+            value = {"set": value}
+        out[name] = value
+    return out
+
+
+class SolrFieldTracker(object):
+    """A model mixin that remembers the values an object was loaded with,
+    so that saving it can send Solr only the fields that changed.
+
+    Models using it set solr_fields to a dict of the attnames of their fields
+    to functions that take the object and return a dict of the Solr fields
+    made from that field. Indexed fields that can't be updated on their own,
+    like ones that other Solr fields are built from, go in
+    solr_full_update_fields. Changes to any other field are assumed not to
+    affect Solr.
+
+    Note that the catch-all "text" field isn't touched by atomic updates, so
+    it stays stale until the next full update of the document.
+
+    Data from related objects, like the judges on a panel, isn't tracked.
+    Code that changes it on an object should call mark_solr_stale() so that
+    saving the object does a full update.
+    """
+
+    solr_fields: Dict[str, Callable[[Any], Dict[str, Any]]] = {}
+    solr_full_update_fields: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(SolrFieldTracker, cls).from_db(
+            db, field_names, values
+        )
+        instance._solr_loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_solr_changes(self) -> Optional[Dict[str, Any]]:
+        """Work out which Solr fields have changed since the object was
+        loaded, or since reset_solr_changes() was last called.
+
+        :return: A dict of Solr fields to their new values, which is empty if
+        nothing in Solr changed, or None if the object's documents need to be
+        indexed from scratch, as when it's new.
+        """
+        loaded = getattr(self, "_solr_loaded_values", None)
+        if self._state.adding or loaded is None:
+            return None
+        if getattr(self, "_solr_stale", False):
+            return None
+        changes = {}
+        for name, value in loaded.items():
+            if getattr(self, name) == value:
+                continue
+            if name in self.solr_full_update_fields:
+                return None
+            if name in self.solr_fields:
+                changes.update(self.solr_fields[name](self))
+        return changes
+
+    def reset_solr_changes(self) -> None:
+        """Treat the object's current values as the ones in Solr. Models
+        that send their changes to Solr when they're saved call this after
+        saving.
+        """
+        if hasattr(self, "_solr_loaded_values"):
+            self._solr_loaded_values = {
+                name: getattr(self, name) for name in self._solr_loaded_values
+            }
+        self._solr_stale = False
+
+    def mark_solr_stale(self) -> None:
+        """Note that related data indexed with the object has changed, so
+        its documents need a full update the next time it's saved.
+        """
+        self._solr_stale = True
+
+
+# The fields of the RECAP core that describe a docket. In a nested core,
+# they're only in the docket's parent document, so changing one of them is a
+# single write instead of one per RECAP document on the docket.
+RECAP_PARENT_FIELDS = (
+    "docketNumber",
+    "caseName",
+    "suitNature",
+    "cause",
+    "juryDemand",
+    "jurisdictionType",
+    "dateArgued",
+    "dateTerminated",
+    "docket_absolute_url",
+    "assignedTo",
+    "referredTo",
+    "assigned_to_id",
+    "referred_to_id",
+    "court",
+    "court_citation_string",
+    "party_id",
+    "party",
+    "attorney_id",
+    "attorney",
+    "firm_id",
+    "firm",
+)
+# The fields of the RECAP documents in a nested core. They keep the docket
+# fields that results are filtered, sorted and grouped by, and their text
+# still includes the docket's, so a query can match words from both.
+RECAP_CHILD_FIELDS = (
+    "docket_entry_id",
+    "docket_id",
+    "court_id",
+    "court_exact",
+    "dateFiled",
+    "short_description",
+    "document_type",
+    "document_number",
+    "attachment_number",
+    "is_available",
+    "page_count",
+    "filepath_local",
+    "absolute_url",
+    "description",
+    "entry_number",
+    "entry_date_filed",
+    "text",
+)
+RECAP_PARENT_FILTER = "doc_type:docket"
+RECAP_CHILD_FILTER = "doc_type:recap_document"
+# The field of a docket's parent document that holds its RECAP documents
+RECAP_CHILD_RELATION = "recap_documents"
+
+
+def make_recap_parent_id(docket_pk):
+    """Make the id of a docket's parent document in a nested RECAP core."""
+    return "docket-%s" % docket_pk
+
+
+def make_recap_child(search_dict):
+    """Turn the search dict of a RECAP document into a child document for a
+    nested RECAP core, by dropping the fields that are in its parent.
+    """
+    out = {
+        k: v for k, v in search_dict.items() if k not in RECAP_PARENT_FIELDS
+    }
+    out["doc_type"] = "recap_document"
+    return out
+
+
+def make_recap_child_update(rd_pk, docket_pk, fields):
+    """Make an atomic update of a RECAP document in a nested core.
+
+    :param rd_pk: The pk of the RECAPDocument.
+    :param docket_pk: The pk of its docket. Solr needs the id of the root of
+    the block to update a child in place.
+    :param fields: A dict of Solr fields to their new values, as for
+    make_atomic_update.
+    :return: A dict that can be sent to Solr like a document.
+    """
+    out = make_atomic_update(rd_pk, fields)
+    out["_root_"] = make_recap_parent_id(docket_pk)
+    return out
+
+
+def format_solr_dates(doc):
+    """Format the datetimes in a document as Solr dates.
+
+    scorched only converts the top-level fields of the documents it sends,
+    so this is needed for child documents and for atomic updates.
+
+    :param doc: A document, atomic update or block of documents.
+    :return: A copy of the document with its datetimes, including ones in
+    nested documents and operations, replaced by strings.
+    """
+    if isinstance(doc, datetime):
+        return doc.astimezone(utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    if isinstance(doc, dict):
+        return {k: format_solr_dates(v) for k, v in doc.items()}
+    if isinstance(doc, (list, tuple, set)):
+        return [format_solr_dates(v) for v in doc]
+    return doc
+
+
+def fast_strip_tags(value):
+    """Strip the tags from HTML, giving the same result as Django's
+    strip_tags, only faster.
+
+    strip_tags runs HTMLParser over the HTML, which is slow for the megabytes
+    of HTML in some opinions. Most HTML is simple enough for a few regexes to
+    do the same job, so they're used when they can be, and strip_tags when
+    they can't.
+
+    :param value: A string of HTML.
+    :return: The text of the HTML, with its entities left as they were.
+    """
+    if "<" not in value or ">" not in value:
+        # strip_tags doesn't parse text without tags
+        return value
+    if complex_markup_re.search(value):
+        return strip_tags(value)
+    text = value
+    if "&" in text:
+        text = entity_no_semicolon_re.sub(r"&\1;", text)
+        text = charref_no_semicolon_re.sub(r"&#\1;", text)
+    text = simple_tag_re.sub("", text)
+    if "<" in text or len(text) >= len(value):
+        # Some markup wasn't simple, or adding semicolons made the text
+        # longer, which makes strip_tags give up and return the HTML as is.
+        return strip_tags(value)
+    return text
+
+
+def get_opinion_body(opinion):
+    """Get the text that the search index uses for an opinion's body.
+
+    :param opinion: An Opinion.
+    :return: A tuple of the best text field of the opinion, and whether it's
+    HTML.
+    """
+    if opinion.html_columbia:
+        return opinion.html_columbia, True
+    if opinion.html_lawbox:
+        return opinion.html_lawbox, True
+    if opinion.html:
+        return opinion.html, True
+    return opinion.plain_text, False
+
+
+def make_cluster_text(cluster, citation_string, judge_names=None):
+    """Make the part of the indexed text of an opinion that comes from its
+    cluster, docket and court.
+
+    It's the same for all the opinions of a cluster, so it can be made once
+    per cluster and passed to assemble_opinion_text for each opinion.
+
+    :param cluster: An OpinionCluster.
+    :param citation_string: The citation string of the cluster.
+    :param judge_names: The full names of the judges on the panel of the
+    cluster, if they've already been looked up.
+    :return: A string, escaped as the opinion_text.txt template escapes it.
+    """
+    docket = cluster.docket
+    court = docket.court
+    if judge_names is None:
+        judge_names = [judge.name_full for judge in cluster.panel.all()]
+    if cluster.case_name_full:
+        case_name = cluster.case_name_full
+    elif cluster.case_name:
+        case_name = cluster.case_name
+    else:
+        case_name = cluster.case_name_short
+    parts = [
+        escape(date_filter(docket.date_argued, "j F Y")),
+        escape(date_filter(docket.date_reargued, "j F Y")),
+        escape(date_filter(docket.date_reargument_denied, "j F Y")),
+        escape(docket.docket_number),
+        "",
+        "",
+        escape(court.full_name),
+        escape(court.pk),
+        escape(court.citation_string),
+        "",
+        "",
+        "",
+        "    %s" % escape(case_name),
+        "",
+    ]
+    for name in judge_names:
+        parts.extend(["", "    %s" % escape(name)])
+    parts.extend(
+        [
+            "",
+            escape(cluster.judges),
+            escape(date_filter(cluster.date_filed, "j F Y")),
+            escape(citation_string),
+            escape(cluster.procedural_history),
+            escape(cluster.attorneys),
+            escape(cluster.nature_of_suit),
+            escape(cluster.posture),
+            escape(cluster.syllabus),
+            escape(cluster.precedential_status),
+            "",
+            "",
+        ]
+    )
+    return "\n".join(parts)
+
+
+def assemble_opinion_text(body, is_html, cluster_text, sha1):
+    """Assemble the text that the search index has for an opinion.
+
+    This gives the same text as rendering the indexes/opinion_text.txt
+    template and removing the control characters, without the template
+    engine. It only takes strings, so it can be run in a process pool.
+
+    :param body: The opinion's body, from get_opinion_body.
+    :param is_html: Whether the body is HTML.
+    :param cluster_text: The text from make_cluster_text.
+    :param sha1: The sha1 of the opinion.
+    :return: The text for the search index.
+    """
+    if is_html:
+        body = fast_strip_tags(body)
+    text = "\n\n    %s\n\n\n\n\n%s\n%s\n\n\n" % (
+        escape(body),
+        cluster_text,
+        escape(sha1),
+    )
+    return control_chars_re.sub("", text)
+
+
+def make_opinion_text(opinion, citation_string, cluster_text=None):
+    """Make the text that the search index has for an opinion.
+
+    :param opinion: An Opinion.
+    :param citation_string: The citation string of the opinion's cluster.
+    :param cluster_text: The text from make_cluster_text, if it's already
+    been made for the opinion's cluster.
+    :return: The text for the search index.
+    """
+    if cluster_text is None:
+        cluster_text = make_cluster_text(opinion.cluster, citation_string)
+    body, is_html = get_opinion_body(opinion)
+    return assemble_opinion_text(body, is_html, cluster_text, opinion.sha1)
+
+
+def assemble_opinion_texts(
+    texts: Iterable[Tuple[str, bool, str, str]],
+    processes: int = 1,
+    chunksize: int = 10,
+) -> List[str]:
+    """Assemble the texts of many opinions, optionally in a process pool.
+
+    Don't use a pool from inside a Celery task; its worker processes are
+    daemons, which can't have children.
+
+    :param texts: Tuples of arguments for assemble_opinion_text.
+    :param processes: How many processes to use. With one, the texts are
+    assembled in this process.
+    :param chunksize: How many texts to send to a process at once.
+    :return: A list of the texts, in the same order as their arguments.
+    """
+    if processes <= 1:
+        return [assemble_opinion_text(*args) for args in texts]
+    with Pool(processes=processes) as pool:
+        return pool.starmap(assemble_opinion_text, texts, chunksize)
@@ -4,29 +4,30 @@ from typing import Any, Dict, List, Optional, Tuple
 from urllib.parse import parse_qs, urlencode
 
 from django.conf import settings
-from django.core.cache import cache, caches
+from django.core.cache import caches
 from django.http import HttpRequest, QueryDict
 from eyecite.find_citations import get_citations
 from eyecite.models import Citation
 from scorched.response import SolrResponse
 
 from cl.citations.match_citations import match_citation
-from cl.citations.utils import get_citation_depth_between_clusters
+from cl.citations.utils import get_citation_depths_to_cluster
 from cl.lib.bot_detector import is_bot
-from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.scorched_utils import ExtraSolrInterface, get_pooled_solr_interface
+from cl.lib.search_index_utils import (
+    RECAP_CHILD_FILTER,
+    RECAP_PARENT_FIELDS,
+    RECAP_PARENT_FILTER,
+)
 from cl.search.constants import (
     SOLR_OPINION_HL_FIELDS,
     SOLR_ORAL_ARGUMENT_HL_FIELDS,
     SOLR_PEOPLE_HL_FIELDS,
     SOLR_RECAP_HL_FIELDS,
 )
+from cl.search.court_registry import CheckedCourt, get_court_registry
 from cl.search.forms import SearchForm
-from cl.search.models import (
-    DOCUMENT_STATUSES,
-    SEARCH_TYPES,
-    Court,
-    OpinionCluster,
-)
+from cl.search.models import DOCUMENT_STATUSES, SEARCH_TYPES, OpinionCluster
 
 recap_boosts_qf = {
     "text": 1,
@@ -68,21 +69,23 @@ BOOSTS = {
 }
 
 
-def get_solr_interface(cd: Dict[str, Any]) -> ExtraSolrInterface:
-    """Get the correct solr interface for the query"""
-    search_type = cd["type"]
+def get_solr_url(search_type: str) -> str:
+    """Get the URL of the Solr core for a search type"""
     if search_type == SEARCH_TYPES.OPINION:
-        si = ExtraSolrInterface(settings.SOLR_OPINION_URL, mode="r")
+        return settings.SOLR_OPINION_URL
     elif search_type in [SEARCH_TYPES.RECAP, SEARCH_TYPES.DOCKETS]:
-        si = ExtraSolrInterface(settings.SOLR_RECAP_URL, mode="r")
+        return settings.SOLR_RECAP_URL
     elif search_type == SEARCH_TYPES.ORAL_ARGUMENT:
-        si = ExtraSolrInterface(settings.SOLR_AUDIO_URL, mode="r")
+        return settings.SOLR_AUDIO_URL
     elif search_type == SEARCH_TYPES.PEOPLE:
-        si = ExtraSolrInterface(settings.SOLR_PEOPLE_URL, mode="r")
+        return settings.SOLR_PEOPLE_URL
     else:
         raise NotImplementedError("Unknown search type: %s" % search_type)
 
-    return si
+
+def get_solr_interface(cd: Dict[str, Any]) -> ExtraSolrInterface:
+    """Get the correct solr interface for the query"""
+    return ExtraSolrInterface(get_solr_url(cd["type"]), mode="r")
 
 
 def make_get_string(
@@ -174,6 +177,41 @@ def make_stats_variable(
     return facet_fields
 
 
+def get_court_checked_states(search_form: SearchForm) -> Dict[str, bool]:
+    """Get whether each court's checkbox is checked in a search form.
+
+    This is what search_form["court_<id>"].value() would say for each court,
+    without making a BoundField for every court.
+
+    :param search_form: The search form.
+    :return: A dict of court IDs to whether they're checked.
+    """
+    court_fields = get_court_registry().court_fields
+    checked = {}
+    for name, field in court_fields.items():
+        if name not in search_form.fields:
+            continue
+        if search_form.is_bound:
+            value = field.widget.value_from_datadict(
+                search_form.data,
+                search_form.files,
+                search_form.add_prefix(name),
+            )
+        else:
+            value = search_form.get_initial_for_field(field, name)
+        checked[name[len("court_") :]] = value
+    return checked
+
+
+def _check_courts(layout, checked: Dict[str, bool]):
+    """Copy a tab layout, wrapping its courts with their checked states."""
+    if isinstance(layout, list):
+        return [_check_courts(item, checked) for item in layout]
+    if isinstance(layout, dict):
+        return {k: _check_courts(v, checked) for k, v in layout.items()}
+    return CheckedCourt(layout, checked.get(layout.pk, False))
+
+
 def merge_form_with_courts(courts, search_form):
     """Merges the courts dict with the values from the search form.
 
@@ -203,16 +241,13 @@ def merge_form_with_courts(courts, search_form):
         ...
     }
 
-    State courts are a special exception. For layout purposes, they get
-    bundled by supreme court and then by hand. Yes, this means new state courts
-    requires manual adjustment here.
+    The layout of the tabs comes from the court registry, which only works
+    it out once per set of courts. See make_tab_layout for how the courts
+    are arranged. The courts in the result are CheckedCourt objects.
     """
     # Are any of the checkboxes checked?
-    checked_statuses = [
-        field.value()
-        for field in search_form
-        if field.html_name.startswith("court_")
-    ]
+    checked = get_court_checked_states(search_form)
+    checked_statuses = list(checked.values())
     no_facets_selected = not any(checked_statuses)
     all_facets_selected = all(checked_statuses)
     court_count = len(
@@ -222,71 +257,11 @@ def merge_form_with_courts(courts, search_form):
     if all_facets_selected:
         court_count_human = "All"
 
-    for field in search_form:
-        if no_facets_selected:
-            for court in courts:
-                court.checked = True
-        else:
-            for court in courts:
-                # We're merging two lists, so we have to do a nested loop
-                # to find the right value.
-                if "court_%s" % court.pk == field.html_name:
-                    court.checked = field.value()
-                    break
-
-    # Build the dict with jurisdiction keys and arrange courts into tabs
-    court_tabs = {
-        "federal": [],
-        "district": [],
-        "state": [],
-        "special": [],
-    }
-    bap_bundle = []
-    b_bundle = []
-    state_bundle = []
-    state_bundles = []
-    for court in courts:
-        if court.jurisdiction == Court.FEDERAL_APPELLATE:
-            court_tabs["federal"].append(court)
-        elif court.jurisdiction == Court.FEDERAL_DISTRICT:
-            court_tabs["district"].append(court)
-        elif court.jurisdiction in Court.BANKRUPTCY_JURISDICTIONS:
-            # Bankruptcy gets bundled into BAPs and regular courts.
-            if court.jurisdiction == Court.FEDERAL_BANKRUPTCY_PANEL:
-                bap_bundle.append(court)
-            else:
-                b_bundle.append(court)
-        elif court.jurisdiction in Court.STATE_JURISDICTIONS:
-            # State courts get bundled by supreme courts
-            if court.jurisdiction == Court.STATE_SUPREME:
-                # Whenever we hit a state supreme court, we append the
-                # previous bundle and start a new one.
-                if state_bundle:
-                    state_bundles.append(state_bundle)
-                state_bundle = [court]
-            else:
-                state_bundle.append(court)
-        elif court.jurisdiction in [
-            Court.FEDERAL_SPECIAL,
-            Court.COMMITTEE,
-            Court.INTERNATIONAL,
-        ]:
-            court_tabs["special"].append(court)
-
-    # append the final state bundle after the loop ends. Hack?
-    state_bundles.append(state_bundle)
-
-    # Put the bankruptcy bundles in the courts dict
-    if bap_bundle:
-        court_tabs["bankruptcy_panel"] = [bap_bundle]
-    court_tabs["bankruptcy"] = [b_bundle]
-
-    # Divide the state bundles into the correct partitions
-    court_tabs["state"].append(state_bundles[:17])
-    court_tabs["state"].append(state_bundles[17:34])
-    court_tabs["state"].append(state_bundles[34:])
-
-    return court_tabs, court_count_human, court_count
+    if no_facets_selected:
+        checked = {court.pk: True for court in courts}
+
+    court_tabs = get_court_registry().get_tab_layout(list(courts))
+    return _check_courts(court_tabs, checked), court_count_human, court_count
 
 
 def make_fq(cd, field, key, make_phrase=False):
@@ -642,6 +617,8 @@ def add_filter_queries(main_params, cd):
         main_fq.append(
             make_date_query("dateFiled", cd["filed_before"], cd["filed_after"])
         )
+        if settings.SOLR_RECAP_NESTED:
+            main_fq = [make_nested_recap_fq(fq) for fq in main_fq]
 
     elif cd["type"] == SEARCH_TYPES.ORAL_ARGUMENT:
         if cd["case_name"]:
@@ -702,6 +679,134 @@ def add_filter_queries(main_params, cd):
             main_params["fq"] = main_fq
 
 
+def make_nested_recap_fq(fq):
+    """Make an fq on a docket field match the RECAP documents of the dockets
+    that match it, for a nested RECAP core.
+
+    :param fq: A field query, like "caseName:(Roe)".
+    :return: The field query, wrapped in a block join if its field is only in
+    dockets' parent documents.
+    """
+    if fq.split(":", 1)[0] in RECAP_PARENT_FIELDS:
+        return "{!child of=$parent_filter}%s" % fq
+    return fq
+
+
+def add_nested_recap_query(main_params, cd):
+    """Adapt a RECAP query to a nested RECAP core.
+
+    RECAP documents are still the results, but the docket fields are only in
+    their dockets' parent documents. So a RECAP document matches the query if
+    it matches on its own, or if its docket does, and the scores of both are
+    added together. Parents are filtered out of the results, and grouping
+    by docket_id works as before.
+    """
+    if not settings.SOLR_RECAP_NESTED or cd["type"] not in [
+        SEARCH_TYPES.RECAP,
+        SEARCH_TYPES.DOCKETS,
+    ]:
+        return
+
+    main_params["parent_filter"] = RECAP_PARENT_FILTER
+    if main_params["q"] != "*":
+        main_params.update(
+            {
+                "uq": main_params["q"],
+                "q": "{!bool should=$recap_q should=$docket_q}",
+                "recap_q": "{!edismax v=$uq}",
+                "docket_q": "{!child of=$parent_filter v=$docket_uq}",
+                "docket_uq": "{!edismax v=$uq}",
+            }
+        )
+        if main_params.get("hl") == "true":
+            # Highlighters can't see through the block join
+            main_params["hl.q"] = "{!edismax v=$uq}"
+    if "fq" in main_params:
+        main_params["fq"].append(RECAP_CHILD_FILTER)
+    else:
+        main_params["fq"] = [RECAP_CHILD_FILTER]
+
+
+def _get_result_docs(results):
+    """Get the documents of search results, whether or not they're grouped
+    or paginated.
+    """
+    if hasattr(results, "paginator"):
+        results = results.object_list
+    if results.group_field is None:
+        return list(results.result.docs)
+    groups = getattr(results.groups, results.group_field)["groups"]
+    return [doc for group in groups for doc in group["doclist"]["docs"]]
+
+
+def add_recap_docket_fields(results, q=None):
+    """Copy the fields of dockets onto RECAP results from a nested core.
+
+    In a nested RECAP core, the results don't have their dockets' fields, so
+    they're fetched from the parent documents of the dockets on the page, in
+    one query, and copied onto the results and their highlights. Nothing is
+    done if the core isn't nested.
+
+    :param results: The results of a RECAP query, grouped or not, paginated
+    or not.
+    :param q: The user's query, to highlight the dockets' fields with. If
+    None, their values are used as is.
+    """
+    if results is None or not settings.SOLR_RECAP_NESTED:
+        return
+    docs = [doc for doc in _get_result_docs(results) if "docket_id" in doc]
+    if not docs:
+        return
+
+    d_pks = {doc["docket_id"] for doc in docs}
+    params = {
+        "q": "*",
+        "fq": [
+            RECAP_PARENT_FILTER,
+            "docket_id:(%s)" % " OR ".join(str(pk) for pk in d_pks),
+        ],
+        "fl": ",".join(("docket_id",) + RECAP_PARENT_FIELDS),
+        "rows": len(d_pks),
+        "caller": "add_recap_docket_fields",
+    }
+    hl_fields = [f for f in SOLR_RECAP_HL_FIELDS if f in RECAP_PARENT_FIELDS]
+    if q and q != "*":
+        params.update(
+            {
+                "hl": "true",
+                "hl.fl": ",".join(hl_fields),
+                "hl.q": "{!edismax v=$uq}",
+                "uq": q,
+            }
+        )
+        for field in hl_fields:
+            params["f.%s.hl.fragListBuilder" % field] = "single"
+            params["f.%s.hl.alternateField" % field] = field
+    si = get_pooled_solr_interface(settings.SOLR_RECAP_URL)
+    parents = {
+        parent["docket_id"]: parent
+        for parent in si.query().add_extra(**params).execute().result.docs
+    }
+
+    for doc in docs:
+        parent = parents.get(doc["docket_id"])
+        if parent is None:
+            continue
+        highlights = doc.setdefault("solr_highlights", {})
+        parent_highlights = parent.get("solr_highlights", {})
+        for field in RECAP_PARENT_FIELDS:
+            if field in parent:
+                doc[field] = parent[field]
+        for field in hl_fields:
+            if parent_highlights.get(field):
+                highlights[field] = parent_highlights[field]
+            elif field in parent and not highlights.get(field):
+                value = parent[field]
+                highlights[field] = (
+                    value if isinstance(value, list) else [value]
+                )
+
+
 def map_to_docket_entry_sorting(sort_string):
     """Convert a RECAP sorting param to a docket entry sorting parameter."""
     if sort_string == "dateFiled asc":
@@ -850,6 +955,7 @@ def build_main_query(cd, highlight="all", order_by="", facet=True, group=True):
     add_highlighting(main_params, cd, highlight)
     add_filter_queries(main_params, cd)
     add_grouping(main_params, cd, group)
+    add_nested_recap_query(main_params, cd)
 
     print_params(main_params)
     return main_params
@@ -924,6 +1030,7 @@ def build_alert_estimation_query(cd, day_count):
     cd["filed_after"] = date.today() - timedelta(days=day_count)
     cd["filed_before"] = None
     add_filter_queries(params, cd)
+    add_nested_recap_query(params, cd)
 
     print_params(params)
     return params
@@ -979,16 +1086,138 @@ def add_depth_counts(
         except OpinionCluster.DoesNotExist:
             return None
         else:
+            depths = get_citation_depths_to_cluster(
+                citing_cluster_pks=[
+                    result["cluster_id"]
+                    for result in search_results.object_list
+                ],
+                cited_cluster_pk=cited_cluster.pk,
+            )
             for result in search_results.object_list:
-                result["citation_depth"] = get_citation_depth_between_clusters(
-                    citing_cluster_pk=result["cluster_id"],
-                    cited_cluster_pk=cited_cluster.pk,
-                )
+                result["citation_depth"] = depths.get(result["cluster_id"])
             return cited_cluster
     else:
         return None
 
 
+CITING_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+
+def get_citing_cache_key(cluster_pk: int) -> str:
+    return "citing:%s" % cluster_pk
+
+
+def get_related_cache_key(cluster_pk: int) -> str:
+    return "mlt-cluster:%s" % cluster_pk
+
+
+def fetch_citing_clusters(
+    si: ExtraSolrInterface,
+    sub_opinion_pks: List[int],
+) -> Tuple[list, int]:
+    """Query Solr for the clusters citing a cluster, without the cache.
+
+    :param si: An interface to the opinion core.
+    :param sub_opinion_pks: The pks of the cluster's opinions.
+    :return: A tuple of the list of solr results and the number of results
+    """
+    ids_str = " OR ".join([str(pk) for pk in sub_opinion_pks])
+    q = {
+        "q": "cites:(%s)" % ids_str,
+        "rows": 5,
+        "start": 0,
+        "sort": "citeCount desc",
+        "caller": "view_opinion",
+        "fl": "absolute_url,caseName,dateFiled",
+    }
+    results = si.query().add_extra(**q).execute()
+    return list(results), results.result.numFound
+
+
+def get_related_search_params() -> Dict[str, str]:
+    """Get the URL parameters of a search for related opinions, which has
+    the same status filter as the MoreLikeThis query.
+    """
+    if settings.RELATED_FILTER_BY_STATUS:
+        return {"stat_" + settings.RELATED_FILTER_BY_STATUS: "on"}
+    # By default all statuses are included
+    available_statuses = dict(DOCUMENT_STATUSES).values()
+    return {"stat_" + v: "on" for v in available_statuses}
+
+
+def fetch_related_clusters(
+    si: ExtraSolrInterface,
+    sub_opinion_pks: List[int],
+) -> List[Dict[str, Any]]:
+    """Query Solr for the clusters related to a cluster with a MoreLikeThis
+    query, without the cache.
+
+    :param si: An interface to the opinion core.
+    :param sub_opinion_pks: The pks of the cluster's opinions.
+    :return: A list of related clusters
+    """
+    # Turn list of opinion IDs into list of Q objects
+    sub_opinion_queries = [si.Q(id=sub_id) for sub_id in sub_opinion_pks]
+
+    # Take one Q object from the list
+    sub_opinion_query = sub_opinion_queries.pop()
+
+    # OR the Q object with the ones remaining in the list
+    for item in sub_opinion_queries:
+        sub_opinion_query |= item
+
+    # Set MoreLikeThis parameters
+    # (see https://lucene.apache.org/solr/guide/6_6/other-parsers.html#OtherParsers-MoreLikeThisQueryParser)
+    mlt_params = {
+        "fields": "text",
+        "count": settings.RELATED_COUNT,
+        "maxqt": settings.RELATED_MLT_MAXQT,
+        "mintf": settings.RELATED_MLT_MINTF,
+        "minwl": settings.RELATED_MLT_MINWL,
+        "maxwl": settings.RELATED_MLT_MAXWL,
+        "maxdf": settings.RELATED_MLT_MAXDF,
+    }
+
+    mlt_query = (
+        si.query(sub_opinion_query)
+        .mlt(**mlt_params)
+        .field_limit(fields=["id", "caseName", "absolute_url"])
+    )
+
+    if settings.RELATED_FILTER_BY_STATUS:
+        # Filter results by status (e.g., Precedential)
+        mlt_query = mlt_query.filter(
+            status_exact=settings.RELATED_FILTER_BY_STATUS
+        )
+
+    mlt_res = mlt_query.execute()
+
+    if hasattr(mlt_res, "more_like_this"):
+        # Only a single sub opinion
+        return mlt_res.more_like_this.docs
+    elif hasattr(mlt_res, "more_like_these"):
+        # Multiple sub opinions
+
+        # Get result list for each sub opinion
+        sub_docs = [
+            sub_res.docs for sub_id, sub_res in mlt_res.more_like_these.items()
+        ]
+
+        # Merge sub results by interleaving
+        # - exclude items that are sub opinions
+        related_clusters = [
+            item
+            for pair in zip(*sub_docs)
+            for item in pair
+            if item["id"] not in sub_opinion_pks
+        ]
+
+        # Limit number of results
+        return related_clusters[: settings.RELATED_COUNT]
+    # No MLT results are available (this should not happen)
+    return []
+
+
 def get_citing_clusters_with_cache(
     cluster: OpinionCluster,
 ) -> Tuple[list, int]:
@@ -998,32 +1227,18 @@ def get_citing_clusters_with_cache(
     :type cluster: OpinionCluster
     :return: A tuple of the list of solr results and the number of results
     """
-    cache_key = "citing:%s" % cluster.pk
+    cache_key = get_citing_cache_key(cluster.pk)
     cache = caches["db_cache"]
     cached_results = cache.get(cache_key)
     if cached_results is not None:
         return cached_results
 
     # Cache miss. Get the citing results from Solr
-    sub_opinion_pks = cluster.sub_opinions.values_list("pk", flat=True)
-    ids_str = " OR ".join([str(pk) for pk in sub_opinion_pks])
-    q = {
-        "q": "cites:(%s)" % ids_str,
-        "rows": 5,
-        "start": 0,
-        "sort": "citeCount desc",
-        "caller": "view_opinion",
-        "fl": "absolute_url,caseName,dateFiled",
-    }
-    conn = ExtraSolrInterface(settings.SOLR_OPINION_URL, mode="r")
-    results = conn.query().add_extra(**q).execute()
-    conn.conn.http_connection.close()
-    citing_clusters = list(results)
-    citing_cluster_count = results.result.numFound
-    a_week = 60 * 60 * 24 * 7
-    cache.set(cache_key, (citing_clusters, citing_cluster_count), a_week)
-
-    return citing_clusters, citing_cluster_count
+    sub_opinion_pks = list(cluster.sub_opinions.values_list("pk", flat=True))
+    si = get_pooled_solr_interface(settings.SOLR_OPINION_URL)
+    citing = fetch_citing_clusters(si, sub_opinion_pks)
+    cache.set(cache_key, citing, CITING_CACHE_TIMEOUT)
+    return citing
 
 
 def get_related_clusters_with_cache(
@@ -1037,103 +1252,29 @@ def get_related_clusters_with_cache(
     :return: A list of related clusters, a list of sub-opinion IDs, and a dict
     of URL parameters
     """
-
-    # By default all statuses are included
-    available_statuses = dict(DOCUMENT_STATUSES).values()
-    url_search_params = {"stat_" + v: "on" for v in available_statuses}
+    url_search_params = get_related_search_params()
 
     # Opinions that belong to the targeted cluster
-    sub_opinion_ids = cluster.sub_opinions.values_list("pk", flat=True)
+    sub_opinion_ids = list(cluster.sub_opinions.values_list("pk", flat=True))
 
     if is_bot(request) or not sub_opinion_ids:
         # If it is a bot or lacks sub-opinion IDs, return empty results
         return [], [], url_search_params
 
-    si = ExtraSolrInterface(settings.SOLR_OPINION_URL, mode="r")
-
     # Use cache if enabled
-    mlt_cache_key = "mlt-cluster:%s" % cluster.pk
+    mlt_cache_key = get_related_cache_key(cluster.pk)
+    cache = caches["db_cache"]
     related_clusters = (
-        caches["db_cache"].get(mlt_cache_key)
-        if settings.RELATED_USE_CACHE
-        else None
+        cache.get(mlt_cache_key) if settings.RELATED_USE_CACHE else None
     )
 
     if related_clusters is None:
         # Cache is empty
-
-        # Turn list of opinion IDs into list of Q objects
-        sub_opinion_queries = [si.Q(id=sub_id) for sub_id in sub_opinion_ids]
-
-        # Take one Q object from the list
-        sub_opinion_query = sub_opinion_queries.pop()
-
-        # OR the Q object with the ones remaining in the list
-        for item in sub_opinion_queries:
-            sub_opinion_query |= item
-
-        # Set MoreLikeThis parameters
-        # (see https://lucene.apache.org/solr/guide/6_6/other-parsers.html#OtherParsers-MoreLikeThisQueryParser)
-        mlt_params = {
-            "fields": "text",
-            "count": settings.RELATED_COUNT,
-            "maxqt": settings.RELATED_MLT_MAXQT,
-            "mintf": settings.RELATED_MLT_MINTF,
-            "minwl": settings.RELATED_MLT_MINWL,
-            "maxwl": settings.RELATED_MLT_MAXWL,
-            "maxdf": settings.RELATED_MLT_MAXDF,
-        }
-
-        mlt_query = (
-            si.query(sub_opinion_query)
-            .mlt(**mlt_params)
-            .field_limit(fields=["id", "caseName", "absolute_url"])
-        )
-
-        if settings.RELATED_FILTER_BY_STATUS:
-            # Filter results by status (e.g., Precedential)
-            mlt_query = mlt_query.filter(
-                status_exact=settings.RELATED_FILTER_BY_STATUS
-            )
-
-            # Update URL parameters accordingly
-            url_search_params = {
-                "stat_" + settings.RELATED_FILTER_BY_STATUS: "on"
-            }
-
-        mlt_res = mlt_query.execute()
-
-        if hasattr(mlt_res, "more_like_this"):
-            # Only a single sub opinion
-            related_clusters = mlt_res.more_like_this.docs
-        elif hasattr(mlt_res, "more_like_these"):
-            # Multiple sub opinions
-
-            # Get result list for each sub opinion
-            sub_docs = [
-                sub_res.docs
-                for sub_id, sub_res in mlt_res.more_like_these.items()
-            ]
-
-            # Merge sub results by interleaving
-            # - exclude items that are sub opinions
-            related_clusters = [
-                item
-                for pair in zip(*sub_docs)
-                for item in pair
-                if item["id"] not in sub_opinion_ids
-            ]
-
-            # Limit number of results
-            related_clusters = related_clusters[: settings.RELATED_COUNT]
-        else:
-            # No MLT results are available (this should not happen)
-            related_clusters = []
-
+        si = get_pooled_solr_interface(settings.SOLR_OPINION_URL)
+        related_clusters = fetch_related_clusters(si, sub_opinion_ids)
         cache.set(
             mlt_cache_key, related_clusters, settings.RELATED_CACHE_TIMEOUT
         )
-    si.conn.http_connection.close()
     return related_clusters, sub_opinion_ids, url_search_params
 
 
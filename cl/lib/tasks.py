@@ -0,0 +1,35 @@
+from typing import Any, Callable
+
+from cl.celery_init import app
+from cl.lib.crawlers import verify_and_cache_ip_address
+from cl.lib.db_tools import PartitionedQuerysetScanner
+
+
+@app.task
+def scan_queryset_range(
+    scanner: PartitionedQuerysetScanner,
+    index: int,
+    func: Callable[[Any], Any],
+) -> int:
+    """Call a function on every row in one range of a queryset scan.
+
+    :param scanner: The scanner that the range belongs to.
+    :param index: The index of the range within the scanner's ranges.
+    :param func: The function to call with each row.
+    :return: The number of rows processed.
+    """
+    count = 0
+    for row in scanner.scan_range(index):
+        func(row)
+        count += 1
+    return count
+
+
+@app.task(ignore_result=True)
+def verify_crawler_ip(ip_address: str) -> None:
+    """Check whether an IP belongs to an approved crawler, and cache the
+    answer for the rate limiter.
+
+    :param ip_address: The IP to check.
+    """
+    verify_and_cache_ip_address(ip_address)
@@ -3,16 +3,33 @@
 
 import datetime
 import os
+import pickle
 import re
 import tempfile
+import time
+from unittest import mock
 
+from django.conf import settings
+from django.core.cache import cache
 from django.core.files.base import ContentFile
 from django.test import SimpleTestCase, TestCase, override_settings
 from django.urls import reverse
 from rest_framework.status import HTTP_200_OK, HTTP_503_SERVICE_UNAVAILABLE
 
-from cl.lib.db_tools import queryset_generator
+from cl.lib.crawlers import (
+    IPRangeSet,
+    is_approved_crawler,
+    parse_ip_range_list,
+    verify_and_cache_ip_address,
+)
+from cl.lib.db_tools import (
+    PartitionedQuerysetScanner,
+    get_pk_boundaries,
+    make_pk_ranges,
+    queryset_generator,
+)
 from cl.lib.filesizes import convert_size_to_bytes
+from cl.lib.import_lib import find_person
 from cl.lib.mime_types import lookup_mime_type
 from cl.lib.model_helpers import make_docket_number_core, make_upload_path
 from cl.lib.pacer import (
@@ -23,10 +40,16 @@ from cl.lib.pacer import (
     normalize_us_state,
 )
 from cl.lib.ratelimiter import parse_rate
+from cl.lib.search_cache import (
+    LRUCache,
+    get_or_compute_search_results,
+    make_search_fingerprint,
+)
 from cl.lib.search_utils import make_fq
 from cl.lib.storage import UUIDFileSystemStorage
 from cl.lib.string_utils import anonymize, trunc
-from cl.people_db.models import Role
+from cl.people_db.judge_index import get_judge_index
+from cl.people_db.models import Person, Position, Role
 from cl.scrapers.models import UrlHash
 from cl.search.models import Court, Docket, Opinion, OpinionCluster
 
@@ -117,6 +140,172 @@ class TestDBTools(TestCase):
         print("✓")
 
 
+class TestPartitionedQuerysetScanner(TestCase):
+    fixtures = ["test_queryset_generator.json"]
+
+    def test_make_pk_ranges(self) -> None:
+        """Are split points converted into open-ended, half-open ranges?"""
+        self.assertEqual(make_pk_ranges([]), [(None, None)])
+        self.assertEqual(
+            make_pk_ranges([10, 20]),
+            [(None, 10), (10, 20), (20, None)],
+        )
+
+    def test_min_max_boundaries_need_int_pks(self) -> None:
+        """Do we refuse to split string pks without sampling?"""
+        with self.assertRaises(ValueError):
+            get_pk_boundaries(UrlHash.objects.all(), 4)
+        self.assertEqual(get_pk_boundaries(UrlHash.objects.all(), 1), [])
+
+    def test_scan_all_rows_once(self) -> None:
+        """Does a scan over sampled ranges return each row exactly once?"""
+        for partitions in (1, 2, 4):
+            scanner = PartitionedQuerysetScanner(
+                UrlHash.objects.all(), partitions=partitions, sample_size=10
+            )
+            pks = [row.pk for row in scanner]
+            self.assertEqual(sorted(pks), ["0", "1"])
+            self.assertEqual(scanner.stats.rows, 2)
+
+    def test_scan_values_queries(self) -> None:
+        """Can we scan values and flat values_list queries?"""
+        scanner = PartitionedQuerysetScanner(UrlHash.objects.values())
+        self.assertEqual(sum(1 for _ in scanner), 2)
+        scanner = PartitionedQuerysetScanner(
+            UrlHash.objects.values_list("pk", flat=True)
+        )
+        self.assertEqual(list(scanner), ["0", "1"])
+
+    def test_resuming_uses_the_saved_ranges(self) -> None:
+        """If a scan resumes with different split points, are its saved
+        ranges still used, so every row is visited exactly once?
+        """
+        UrlHash.objects.bulk_create(
+            [UrlHash(id="a%02d" % i, sha1="") for i in range(20)]
+        )
+        all_pks = sorted(UrlHash.objects.values_list("pk", flat=True))
+
+        def make_scanner():
+            return PartitionedQuerysetScanner(
+                UrlHash.objects.all(),
+                partitions=4,
+                sample_size=100,
+                checkpoint_name="test-resume",
+                checkpoint_every=1,
+            )
+
+        scanner = make_scanner()
+        self.addCleanup(scanner.clear_checkpoints)
+        visited = []
+        with mock.patch(
+            "cl.lib.db_tools.get_pk_boundaries",
+            return_value=["a05", "a10", "a15"],
+        ):
+            visited.extend(row.pk for row in scanner.scan_range(0))
+            # Stop partway through the next range. Only the rows before the
+            # last one taken have been checkpointed.
+            rows = scanner.scan_range(1)
+            visited.extend([next(rows).pk, next(rows).pk])
+            visited.pop()
+
+        with mock.patch(
+            "cl.lib.db_tools.get_pk_boundaries", return_value=["a02", "a12"]
+        ):
+            visited.extend(row.pk for row in make_scanner())
+        self.assertEqual(sorted(visited), all_pks)
+
+    def test_scanner_pickles_without_evaluating(self) -> None:
+        """Can a scanner be pickled for Celery without losing its filters?"""
+        scanner = PartitionedQuerysetScanner(
+            UrlHash.objects.filter(pk__in=["1"])
+        )
+        scanner = pickle.loads(pickle.dumps(scanner))
+        self.assertEqual([row.pk for row in scanner], ["1"])
+
+
+class TestJudgeIndex(TestCase):
+    fixtures = ["test_court.json", "judge_judy.json"]
+
+    def test_find_person(self) -> None:
+        """Do we narrow judges by name and court?"""
+        judy = Person.objects.get(name_last="Sheindlin")
+        self.assertEqual(find_person("sheindlin", "ca1"), judy)
+        # The wrong court, or not a judge at all
+        self.assertIsNone(find_person("Sheindlin", "test"))
+        self.assertIsNone(find_person("Clinton", "ca1"))
+        with self.assertRaises(Exception):
+            find_person("Clinton", "ca1", raise_zero=True)
+
+    def test_find_person_narrows_by_date_and_first_name(self) -> None:
+        """With two judges of the same name in a court, do we narrow them
+        down by the date of the case, then by first name?
+        """
+        judy = Person.objects.get(name_last="Sheindlin")
+        gerald = Person.objects.create(
+            name_first="Gerald", name_last="Sheindlin"
+        )
+        Position.objects.create(
+            person=gerald,
+            court_id="ca1",
+            position_type=Position.JUDGE,
+            date_start=datetime.date(1990, 1, 1),
+            date_granularity_start="%Y-%m-%d",
+            date_termination=datetime.date(2000, 1, 1),
+            date_granularity_termination="%Y-%m-%d",
+        )
+        self.assertIsNone(find_person("Sheindlin", "ca1"))
+        with self.assertRaises(Exception):
+            find_person("Sheindlin", "ca1", raise_mult=True)
+
+        # Only one of them was on the court at the time
+        self.assertEqual(
+            find_person(
+                "Sheindlin", "ca1", case_date=datetime.date(2016, 1, 1)
+            ),
+            judy,
+        )
+        self.assertEqual(
+            find_person(
+                "Sheindlin", "ca1", case_date=datetime.date(1995, 1, 1)
+            ),
+            gerald,
+        )
+        # Too early for either of them
+        self.assertIsNone(
+            find_person(
+                "Sheindlin", "ca1", case_date=datetime.date(1980, 1, 1)
+            )
+        )
+
+        # Neither date helps, so the first name decides
+        self.assertEqual(
+            find_person("Sheindlin", "ca1", name_first="Judith"), judy
+        )
+        self.assertEqual(
+            find_person("Sheindlin", "ca1", name_first="gerald"), gerald
+        )
+        self.assertIsNone(find_person("Sheindlin", "ca1", name_first="Bill"))
+
+    def test_index_reloads_on_save(self) -> None:
+        """Does saving a position show up in the next lookup?"""
+        self.assertIsNone(find_person("Clinton", "ca1"))
+        clinton = Person.objects.get(name_last="Clinton")
+        Position.objects.create(
+            person=clinton,
+            court_id="ca1",
+            position_type=Position.JUDGE,
+            date_start=datetime.date(1990, 1, 1),
+            date_granularity_start="%Y-%m-%d",
+        )
+        self.assertEqual(find_person("Clinton", "ca1"), clinton)
+        self.assertEqual(
+            get_judge_index().find_people(
+                [("Clinton", "ca1", None), ("Nobody", "ca1", None)]
+            ),
+            [clinton, None],
+        )
+
+
 class TestStringUtils(TestCase):
     def test_trunc(self) -> None:
         """Does trunc give us the results we expect?"""
@@ -209,6 +398,76 @@ class TestMakeFQ(TestCase):
             )
 
 
+class TestSearchCache(SimpleTestCase):
+    def test_fingerprint_is_canonical(self) -> None:
+        """Do equivalent searches share a fingerprint?"""
+        a = {"q": "foo  bar", "type": "o", "court": "ca1", "court_ca1": True}
+        b = {
+            "type": "o",
+            "q": " foo bar",
+            "court_ca2": False,
+            "court_ca1": True,
+            "judge": "",
+        }
+        self.assertEqual(
+            make_search_fingerprint(a, 1, 20, True),
+            make_search_fingerprint(b, 1, 20, True),
+        )
+
+    def test_fingerprint_varies_with_page(self) -> None:
+        """Do different pages of the same search get different entries?"""
+        cd = {"q": "foo", "type": "o"}
+        self.assertNotEqual(
+            make_search_fingerprint(cd, 1, 20, True),
+            make_search_fingerprint(cd, 2, 20, True),
+        )
+
+    def test_lru_cache_evicts_oldest(self) -> None:
+        """Does the local cache evict the least recently used item?"""
+        lru = LRUCache(max_size=2, timeout=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual(lru.get("c"), 3)
+
+    @mock.patch("cl.lib.search_cache.tally_stat")
+    @mock.patch("cl.lib.search_cache.local_cache", LRUCache())
+    @mock.patch("cl.lib.search_cache.cache")
+    @mock.patch("cl.lib.search_cache.get_search_generation")
+    def test_uncommitted_results_expire_with_the_window(
+        self, get_generation, cache_backend, tally
+    ) -> None:
+        """Are results cached while Solr may not show the latest changes
+        kept only until it must?
+        """
+        cache_backend.get.return_value = None
+        cache_backend.add.return_value = True
+        get_generation.return_value = (3, time.time() + 5)
+        results = get_or_compute_search_results("abc", "url", "o", lambda: 1)
+        self.assertEqual(results, 1)
+        key, value, timeout = cache_backend.set.call_args[0]
+        self.assertEqual(key, "search-results:3:abc")
+        self.assertLessEqual(timeout, 5)
+
+        get_generation.return_value = (4, None)
+        get_or_compute_search_results("abc", "url", "o", lambda: 1)
+        self.assertEqual(
+            cache_backend.set.call_args[0][2], settings.SEARCH_CACHE_TIMEOUT
+        )
+        get_or_compute_search_results("abc", "url", "o", lambda: 1)
+        self.assertEqual(
+            [c[0][0] for c in tally.call_args_list],
+            [
+                "search.cache.o.miss",
+                "search.cache.o.miss",
+                "search.cache.o.hit",
+            ],
+        )
+
+
 class TestModelHelpers(TestCase):
     """Test the model_utils helper functions"""
 
@@ -838,3 +1097,52 @@ class TestRateLimiters(TestCase):
         for q, a in qa_pairs:
             with self.subTest("Parsing rates...", rate=q):
                 self.assertEqual(parse_rate(q), a)
+
+
+class TestCrawlerVerification(TestCase):
+    ip_address = "66.249.66.1"
+
+    def setUp(self) -> None:
+        self.clear_verdict()
+
+    def tearDown(self) -> None:
+        self.clear_verdict()
+
+    def clear_verdict(self) -> None:
+        cache.delete("rl:whitelist:%s" % self.ip_address)
+        cache.delete("rl:whitelist-pending:%s" % self.ip_address)
+
+    def test_ip_range_set(self) -> None:
+        """Can we match IPs against published crawler ranges?"""
+        cidrs = parse_ip_range_list(
+            {
+                "prefixes": [
+                    {"ipv4Prefix": "66.249.64.0/27"},
+                    {"ipv4Prefix": "66.249.64.32/27"},
+                    {"ipv6Prefix": "2001:4860:4801:10::/64"},
+                ]
+            }
+        )
+        ranges = IPRangeSet(cidrs)
+        # The two adjacent v4 ranges are merged.
+        self.assertEqual(len(ranges), 2)
+        self.assertIn("66.249.64.40", ranges)
+        self.assertIn("2001:4860:4801:10::1", ranges)
+        self.assertNotIn("66.249.64.64", ranges)
+        self.assertNotIn("10.0.0.1", ranges)
+        self.assertNotIn("not an ip", ranges)
+
+    @mock.patch("cl.lib.crawlers.verify_ip_address", return_value=False)
+    def test_rejections_are_cached(self, mock_verify) -> None:
+        """Do we only do the DNS lookups once for non-crawlers?"""
+        verify_and_cache_ip_address(self.ip_address)
+        self.assertFalse(is_approved_crawler(self.ip_address))
+        self.assertFalse(is_approved_crawler(self.ip_address))
+        self.assertEqual(mock_verify.call_count, 1)
+
+    @mock.patch("cl.lib.crawlers.verify_ip_address", return_value=True)
+    def test_approvals_are_cached(self, mock_verify) -> None:
+        """Are crawlers approved without repeating the DNS lookups?"""
+        verify_and_cache_ip_address(self.ip_address)
+        self.assertTrue(is_approved_crawler(self.ip_address))
+        self.assertEqual(mock_verify.call_count, 1)
@@ -1,30 +1,140 @@
-from django.db.models import F
+"""
+View counts for dockets, visualizations and tags.
+
+Views are counted in Redis as they happen and written to the database in
+batches by the flush_view_counts command, so that popular pages don't all
+fight over the same row with an UPDATE on every page load.
+"""
+from typing import Dict, List, Tuple, Type
+
+from django.apps import apps
+from django.db import connection, transaction
+from django.db.models import Model
 
 from cl.lib.bot_detector import is_bot
-from cl.lib.model_helpers import suppress_autotime
+from cl.lib.redis_utils import make_redis_interface
+
+VIEW_COUNT_MODELS_KEY = "view-counts:models"
+VIEW_COUNT_LOCK_KEY = "view-counts:flush-lock"
+# Longer than a flush should ever take, so a crashed flush doesn't block the
+# next one for long.
+VIEW_COUNT_LOCK_TIMEOUT = 60 * 10
+VIEW_COUNT_BATCH_SIZE = 1000
+
+
+def _pending_key(label: str) -> str:
+    return "view-counts:%s" % label
+
+
+def _flushing_key(label: str) -> str:
+    return "view-counts:%s:flushing" % label
 
 
 def increment_view_count(obj, request):
-    """Increment the view count of an object in the DB
+    """Increment the view count of an object
 
     Three tricks in this simple function:
 
       1. If it's a robot viewing the page, don't increment.
-      2. Make sure not to update the "date_modified" fields.
-      3. Do this using an atomic DB query for performance and don't reload from
-         the database after the increment (which would take another query).
+      2. Don't touch the database at all. The view is counted in Redis, and
+         flush_view_counts adds it to the view_count column later, without
+         updating the "date_modified" fields.
+      3. Update the object's view_count so it includes the views that haven't
+         been flushed yet, without reloading it from the database.
 
     :param obj: A django object containing a view_count parameter
     :param request: A django request so we can detect if it's a bot
     :return: Nothing. The obj is passed by reference
     """
     if not is_bot(request):
-        cached_value = obj.view_count
+        label = obj._meta.label_lower
+        r = make_redis_interface("STATS")
+        pipe = r.pipeline()
+        pipe.hincrby(_pending_key(label), obj.pk, 1)
+        pipe.sadd(VIEW_COUNT_MODELS_KEY, label)
+        pending, _ = pipe.execute()
+        obj.view_count = obj.view_count + pending
+
+
+def get_pending_view_counts(label: str) -> Dict[int, int]:
+    """Get the views of a model's objects that haven't been flushed yet.
+
+    :param label: The model's label, like "search.docket".
+    :return: A dict of object pks to the number of views.
+    """
+    r = make_redis_interface("STATS")
+    return {
+        int(pk): int(count)
+        for pk, count in r.hgetall(_pending_key(label)).items()
+    }
+
 
-        with suppress_autotime(obj, ["date_modified"]):
-            obj.view_count = F("view_count") + 1
-            obj.save()
+def update_view_counts(
+    model: Type[Model], deltas: List[Tuple[int, int]]
+) -> None:
+    """Add to the view counts of many objects with one query.
 
-        # To get the new value, you either need to get the item from the DB a
-        # second time, or just manipulate it manually....
-        obj.view_count = cached_value + 1
+    :param model: The model of the objects.
+    :param deltas: A list of (pk, number of views to add) tuples.
+    """
+    if not deltas:
+        return
+    qn = connection.ops.quote_name
+    query = (
+        "UPDATE {table} AS t SET view_count = t.view_count + v.delta "
+        "FROM (VALUES {values}) AS v(id, delta) WHERE t.{pk} = v.id".format(
+            table=qn(model._meta.db_table),
+            values=", ".join(["(%s, %s)"] * len(deltas)),
+            pk=qn(model._meta.pk.column),
+        )
+    )
+    params = [value for delta in deltas for value in delta]
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+
+
+def flush_view_counts_for_model(label: str) -> int:
+    """Write the pending views of one model to the database.
+
+    The pending views are moved aside before they're written, so views that
+    come in during the flush are kept for the next one. If writing fails,
+    the moved views are retried on the next flush.
+
+    :param label: The model's label, like "search.docket".
+    :return: The number of objects updated.
+    """
+    r = make_redis_interface("STATS")
+    pending_key = _pending_key(label)
+    flushing_key = _flushing_key(label)
+    if not r.exists(flushing_key):
+        if not r.exists(pending_key):
+            return 0
+        r.rename(pending_key, flushing_key)
+
+    model = apps.get_model(label)
+    deltas = sorted(
+        (int(pk), int(count)) for pk, count in r.hgetall(flushing_key).items()
+    )
+    with transaction.atomic():
+        for i in range(0, len(deltas), VIEW_COUNT_BATCH_SIZE):
+            update_view_counts(model, deltas[i : i + VIEW_COUNT_BATCH_SIZE])
+    r.delete(flushing_key)
+    return len(deltas)
+
+
+def flush_view_counts() -> Dict[str, int]:
+    """Write the pending views of every model to the database.
+
+    :return: A dict of model labels to the number of objects updated, or an
+    empty dict if another flush is already running.
+    """
+    r = make_redis_interface("STATS")
+    if not r.set(VIEW_COUNT_LOCK_KEY, 1, nx=True, ex=VIEW_COUNT_LOCK_TIMEOUT):
+        return {}
+    try:
+        return {
+            label: flush_view_counts_for_model(label)
+            for label in sorted(r.smembers(VIEW_COUNT_MODELS_KEY))
+        }
+    finally:
+        r.delete(VIEW_COUNT_LOCK_KEY)
@@ -1,9 +1,11 @@
 import datetime
 import os
 import shutil
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth.models import Group, User
+from django.core.cache import cache, caches
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import TestCase, override_settings
 from django.test.client import Client
@@ -16,18 +18,28 @@ from rest_framework.status import (
     HTTP_404_NOT_FOUND,
 )
 
+from cl.lib.redis_utils import make_redis_interface
 from cl.lib.scorched_utils import ExtraSolrInterface
 from cl.lib.test_helpers import SitemapTest
 from cl.opinion_page.forms import TennWorkersForm
+from cl.opinion_page.sitemap import OpinionSitemap
+from cl.opinion_page.utils import (
+    get_docket_entry_count,
+    get_entry_ordering,
+    load_opinion_sidebars,
+    paginate_docket_entries,
+)
 from cl.opinion_page.views import make_docket_title
 from cl.people_db.models import Person
 from cl.search.models import (
     SEARCH_TYPES,
     Citation,
     Docket,
+    DocketEntry,
     Opinion,
     OpinionCluster,
 )
+from cl.sitemap import SHARD_DIR, SitemapShardBuilder
 
 
 class TitleTest(TestCase):
@@ -48,6 +60,42 @@ class ViewDocumentTest(TestCase):
         self.assertIn("33 state 1", response.content.decode())
 
 
+@mock.patch("cl.opinion_page.utils.get_pooled_solr_interface")
+@mock.patch(
+    "cl.opinion_page.utils.fetch_related_clusters",
+    return_value=[{"id": 2, "caseName": "Related", "absolute_url": "/"}],
+)
+@mock.patch(
+    "cl.opinion_page.utils.fetch_citing_clusters",
+    return_value=([{"caseName": "Citing"}], 1),
+)
+class OpinionSidebarTest(TestCase):
+    fixtures = ["test_objects_search.json", "judge_judy.json"]
+
+    def setUp(self) -> None:
+        caches["db_cache"].delete_many(["citing:1", "mlt-cluster:1"])
+
+    def test_sidebars_are_cached(self, mock_citing, mock_related, _) -> None:
+        """Are both sidebars fetched once, then read from the cache?"""
+        cluster = OpinionCluster.objects.get(pk=1)
+        first = load_opinion_sidebars(cluster)
+        second = load_opinion_sidebars(cluster)
+
+        self.assertEqual(first, second)
+        self.assertEqual(second["citing_cluster_count"], 1)
+        self.assertEqual(second["related_clusters"][0]["id"], 2)
+        self.assertEqual(mock_citing.call_count, 1)
+        self.assertEqual(mock_related.call_count, 1)
+
+    def test_refreshing_sidebars(self, mock_citing, mock_related, _) -> None:
+        """Can the background job skip the cache to refresh it?"""
+        cluster = OpinionCluster.objects.get(pk=1)
+        load_opinion_sidebars(cluster)
+        load_opinion_sidebars(cluster, use_cache=False)
+        self.assertEqual(mock_citing.call_count, 2)
+        self.assertEqual(mock_related.call_count, 2)
+
+
 class CitationRedirectorTest(TestCase):
     """Tests to make sure that the basic citation redirector is working."""
 
@@ -153,6 +201,79 @@ class ViewRecapDocketTest(TestCase):
         self.assertEqual(r.redirect_chain[0][1], HTTP_302_FOUND)
 
 
+class DocketEntryPaginationTest(TestCase):
+    fixtures = ["test_objects_search.json", "judge_judy.json"]
+
+    def setUp(self) -> None:
+        self.docket = Docket.objects.get(pk=1)
+        self.docket.docket_entries.all().delete()
+        self.clear_count()
+        # Two unnumbered entries share a sequence number with a numbered one.
+        for rsn, entry_number in [
+            ("2020-01-01.001", 1),
+            ("2020-01-02.001", None),
+            ("2020-01-02.001", 2),
+            ("2020-01-02.001", None),
+            ("2020-01-03.001", 3),
+        ]:
+            DocketEntry.objects.create(
+                docket=self.docket,
+                recap_sequence_number=rsn,
+                entry_number=entry_number,
+            )
+
+    def tearDown(self) -> None:
+        self.clear_count()
+
+    def clear_count(self) -> None:
+        r = make_redis_interface("CACHE")
+        r.delete("docket.entry-count:%s" % self.docket.pk)
+
+    def walk(self, descending: bool) -> None:
+        """Page forward then back through the entries, two at a time, and
+        check that we see each one once, in the right order.
+        """
+        de_list = self.docket.docket_entries.all()
+        expected = list(
+            de_list.order_by(*get_entry_ordering(descending)).values_list(
+                "pk", flat=True
+            )
+        )
+        pages = [paginate_docket_entries(de_list, descending, page_size=2)]
+        while pages[-1].has_next:
+            pages.append(
+                paginate_docket_entries(
+                    de_list,
+                    descending,
+                    after=pages[-1].next_cursor,
+                    page_size=2,
+                )
+            )
+        seen = [de.pk for page in pages for de in page]
+        self.assertEqual(seen, expected)
+
+        back = paginate_docket_entries(
+            de_list, descending, before=pages[-1].previous_cursor, page_size=2
+        )
+        self.assertEqual([de.pk for de in back], [de.pk for de in pages[-2]])
+
+    def test_keyset_pagination_ascending(self) -> None:
+        self.walk(descending=False)
+
+    def test_keyset_pagination_descending(self) -> None:
+        self.walk(descending=True)
+
+    def test_entry_count_is_maintained(self) -> None:
+        """Is the cached entry count updated as entries come and go?"""
+        self.assertEqual(get_docket_entry_count(self.docket.pk), 5)
+        de = DocketEntry.objects.create(
+            docket=self.docket, recap_sequence_number="2020-01-04.001"
+        )
+        self.assertEqual(get_docket_entry_count(self.docket.pk), 6)
+        de.delete()
+        self.assertEqual(get_docket_entry_count(self.docket.pk), 5)
+
+
 class NewDocketAlertTest(TestCase):
     fixtures = [
         "test_objects_search.json",
@@ -196,6 +317,89 @@ class OpinionSitemapTest(SitemapTest):
         super(OpinionSitemapTest, self).assert_sitemap_has_content()
 
 
+@override_settings(
+    MEDIA_ROOT=os.path.join(settings.INSTALL_ROOT, "cl/assets/media/test/")
+)
+class SitemapShardTest(TestCase):
+    fixtures = ["test_objects_search.json", "judge_judy.json"]
+
+    def setUp(self) -> None:
+        site = OpinionSitemap()
+        # One URL per shard, so we get several shards from the fixtures
+        site.limit = 1
+        self.builder = SitemapShardBuilder(SEARCH_TYPES.OPINION, site)
+        self.sitemap_url = reverse(
+            "sitemaps", kwargs={"section": SEARCH_TYPES.OPINION}
+        )
+
+    def tearDown(self) -> None:
+        cache.delete("sitemap.manifest.%s" % SEARCH_TYPES.OPINION)
+        shutil.rmtree(
+            os.path.join(settings.MEDIA_ROOT, SHARD_DIR), ignore_errors=True
+        )
+
+    def test_shards_cover_every_item(self) -> None:
+        """Does every item land in exactly one prebuilt shard?"""
+        manifest = self.builder.build_all()
+        cluster_count = OpinionCluster.objects.count()
+        self.assertEqual(len(manifest["shards"]), cluster_count)
+        self.assertEqual(
+            sum(shard["count"] for shard in manifest["shards"]), cluster_count
+        )
+
+        r = self.client.get(self.sitemap_url, {"p": 2})
+        self.assertEqual(r.status_code, HTTP_200_OK)
+        self.assertEqual(r.content.decode().count("<url>"), 1)
+        self.assertIn("Accept-Encoding", r["Vary"])
+        r = self.client.get(self.sitemap_url, {"p": cluster_count + 1})
+        self.assertEqual(r.status_code, HTTP_404_NOT_FOUND)
+
+    def test_update_only_rebuilds_changed_shards(self) -> None:
+        """Are shards without changes left alone by an update?"""
+        shards = self.builder.build_all()["shards"]
+        cluster = OpinionCluster.objects.order_by("pk").last()
+        cluster.save()
+        new_shards = self.builder.update()["shards"]
+        self.assertEqual(len(new_shards), len(shards))
+        # Only the shard holding the saved cluster has a new lastmod.
+        changed = [
+            new["start_pk"]
+            for old, new in zip(shards, new_shards)
+            if old["lastmod"] != new["lastmod"]
+        ]
+        self.assertEqual(changed, [shards[-1]["start_pk"]])
+
+        # Rebuilt shards replace the old files instead of adding new ones.
+        shard_dir = os.path.join(
+            settings.MEDIA_ROOT, SHARD_DIR, SEARCH_TYPES.OPINION
+        )
+        self.assertEqual(
+            sorted(os.listdir(shard_dir)),
+            sorted(
+                ["manifest.json"]
+                + [os.path.basename(shard["path"]) for shard in new_shards]
+            ),
+        )
+
+    @mock.patch("cl.sitemap.FileSystemStorage", type("OtherStorage", (), {}))
+    def test_updates_without_file_system_storage(self) -> None:
+        """Can shards be updated with storage that can't move files?"""
+        shards = self.builder.build_all()["shards"]
+        OpinionCluster.objects.order_by("pk").last().save()
+        new_shards = self.builder.update()["shards"]
+        self.assertNotEqual(shards[-1]["path"], new_shards[-1]["path"])
+
+        cache.delete("sitemap.manifest.%s" % SEARCH_TYPES.OPINION)
+        r = self.client.get(self.sitemap_url, {"p": len(new_shards)})
+        self.assertEqual(r.status_code, HTTP_200_OK)
+        shard_dir = os.path.join(
+            settings.MEDIA_ROOT, SHARD_DIR, SEARCH_TYPES.OPINION
+        )
+        self.assertNotIn(
+            os.path.basename(shards[-1]["path"]), os.listdir(shard_dir)
+        )
+
+
 @override_settings(
     MEDIA_ROOT=os.path.join(settings.INSTALL_ROOT, "cl/assets/media/test/")
 )
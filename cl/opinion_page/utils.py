@@ -0,0 +1,336 @@
+import base64
+import binascii
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Prefetch, Q, QuerySet
+from django.http import HttpRequest
+
+from cl.lib.bot_detector import is_bot
+from cl.lib.redis_utils import make_redis_interface
+from cl.lib.scorched_utils import get_pooled_solr_interface
+from cl.lib.search_utils import (
+    CITING_CACHE_TIMEOUT,
+    fetch_citing_clusters,
+    fetch_related_clusters,
+    get_citing_cache_key,
+    get_related_cache_key,
+    get_related_search_params,
+)
+from cl.search.models import DocketEntry, OpinionCluster, RECAPDocument
+
+DOCKET_ENTRY_PAGE_SIZE = 200
+# Drift in the cached counts (from bulk writes that skip signals) fixes itself
+# when the key expires.
+ENTRY_COUNT_TIMEOUT = 60 * 60 * 24
+# Increment a counter only if it's already cached, so that a missing count
+# gets recomputed instead of starting from zero.
+INCR_IF_EXISTS = """
+if redis.call("exists", KEYS[1]) == 1 then
+    return redis.call("incrby", KEYS[1], ARGV[1])
+end
+return nil
+"""
+
+# The columns view_docket.html needs
+DOCKET_ENTRY_FIELDS = (
+    "pk",
+    "docket_id",
+    "date_filed",
+    "entry_number",
+    "recap_sequence_number",
+    "description",
+)
+RECAP_DOCUMENT_FIELDS = (
+    "pk",
+    "docket_entry_id",
+    "date_upload",
+    "document_type",
+    "document_number",
+    "attachment_number",
+    "pacer_doc_id",
+    "is_available",
+    "is_free_on_pacer",
+    "is_sealed",
+    "page_count",
+    "description",
+    "filepath_local",
+    "filepath_ia",
+)
+
+EntryKey = Tuple[str, Optional[int], int]
+
+
+def _entry_count_key(docket_id: int) -> str:
+    return "docket.entry-count:%s" % docket_id
+
+
+def get_docket_entry_count(docket_id: int) -> int:
+    """Get the number of entries on a docket, counting them only if the
+    count isn't cached.
+    """
+    r = make_redis_interface("CACHE")
+    key = _entry_count_key(docket_id)
+    count = r.get(key)
+    if count is None:
+        count = DocketEntry.objects.filter(docket_id=docket_id).count()
+        r.set(key, count, ex=ENTRY_COUNT_TIMEOUT)
+    return int(count)
+
+
+def adjust_docket_entry_count(docket_id: int, amount: int) -> None:
+    """Keep a cached docket entry count up to date as entries are added or
+    removed.
+
+    :param docket_id: The docket that changed.
+    :param amount: The number of entries added, or negative if removed.
+    """
+    r = make_redis_interface("CACHE")
+    r.eval(INCR_IF_EXISTS, 1, _entry_count_key(docket_id), amount)
+
+
+def encode_entry_cursor(de: DocketEntry) -> str:
+    """Make a URL-safe cursor pointing at a docket entry."""
+    key = [de.recap_sequence_number, de.entry_number, de.pk]
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_entry_cursor(cursor: Optional[str]) -> Optional[EntryKey]:
+    """Get the sort key from a cursor, or None if it's missing or invalid."""
+    if not cursor:
+        return None
+    try:
+        rsn, entry_number, pk = json.loads(base64.urlsafe_b64decode(cursor))
+    except (binascii.Error, ValueError, TypeError):
+        return None
+    if (
+        not isinstance(rsn, str)
+        or not isinstance(pk, int)
+        or not (entry_number is None or isinstance(entry_number, int))
+    ):
+        return None
+    return rsn, entry_number, pk
+
+
+def get_entry_ordering(descending: bool) -> List[str]:
+    """Order entries by recap_sequence_number and entry_number, as
+    DocketEntry.Meta does, with the pk to break ties.
+
+    Postgres puts null entry numbers last when ascending and first when
+    descending, so each ordering is the exact reverse of the other.
+    """
+    if descending:
+        return ["-recap_sequence_number", "-entry_number", "-pk"]
+    return ["recap_sequence_number", "entry_number", "pk"]
+
+
+def entries_after(key: EntryKey, descending: bool) -> Q:
+    """Make a filter for the entries that come after key in an ordering
+    from get_entry_ordering.
+    """
+    rsn, entry_number, pk = key
+    same_rsn = Q(recap_sequence_number=rsn)
+    if not descending:
+        q = Q(recap_sequence_number__gt=rsn)
+        if entry_number is None:
+            # Nulls are last, so only other nulls can follow.
+            return q | same_rsn & Q(entry_number__isnull=True, pk__gt=pk)
+        return (
+            q
+            | same_rsn & Q(entry_number__gt=entry_number)
+            | same_rsn & Q(entry_number=entry_number, pk__gt=pk)
+            | same_rsn & Q(entry_number__isnull=True)
+        )
+    q = Q(recap_sequence_number__lt=rsn)
+    if entry_number is None:
+        # Nulls are first, so every numbered entry follows.
+        return (
+            q
+            | same_rsn & Q(entry_number__isnull=True, pk__lt=pk)
+            | same_rsn & Q(entry_number__isnull=False)
+        )
+    return (
+        q
+        | same_rsn & Q(entry_number__lt=entry_number)
+        | same_rsn & Q(entry_number=entry_number, pk__lt=pk)
+    )
+
+
+class DocketEntryPage(object):
+    """A page of docket entries, with cursors to the pages around it."""
+
+    def __init__(
+        self,
+        object_list: List[DocketEntry],
+        has_previous: bool,
+        has_next: bool,
+        total_count: Optional[int] = None,
+    ) -> None:
+        self.object_list = object_list
+        self.has_previous = has_previous
+        self.has_next = has_next
+        # The number of entries in the whole list, if it's known cheaply.
+        self.total_count = total_count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def has_other_pages(self) -> bool:
+        return self.has_previous or self.has_next
+
+    @property
+    def previous_cursor(self) -> Optional[str]:
+        if not self.has_previous or not self.object_list:
+            return None
+        return encode_entry_cursor(self.object_list[0])
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        if not self.has_next or not self.object_list:
+            return None
+        return encode_entry_cursor(self.object_list[-1])
+
+
+def paginate_docket_entries(
+    de_list: QuerySet,
+    descending: bool = False,
+    after: Optional[str] = None,
+    before: Optional[str] = None,
+    page: Optional[str] = None,
+    total_count: Optional[int] = None,
+    page_size: int = DOCKET_ENTRY_PAGE_SIZE,
+) -> DocketEntryPage:
+    """Get a page of docket entries without counting them or scanning past
+    the entries on earlier pages.
+
+    Pages are found by their position relative to a cursor: the entries
+    after one page's last entry, or before its first. Old-style page numbers
+    still work, but are slower for deep pages.
+
+    :param de_list: The (possibly filtered) docket entries to paginate.
+    :param descending: Whether to show the newest entries first.
+    :param after: A cursor from DocketEntryPage.next_cursor.
+    :param before: A cursor from DocketEntryPage.previous_cursor.
+    :param page: A page number, for links made before cursors were used.
+    :param total_count: The total number of entries, if known.
+    :param page_size: The number of entries on a page.
+    :return: A DocketEntryPage.
+    """
+    de_list = de_list.only(*DOCKET_ENTRY_FIELDS).prefetch_related(
+        Prefetch(
+            "recap_documents",
+            queryset=RECAPDocument.objects.only(*RECAP_DOCUMENT_FIELDS),
+        )
+    )
+    after_key = decode_entry_cursor(after)
+    before_key = decode_entry_cursor(before)
+    if before_key is not None:
+        # Walk backwards from the cursor, then flip the page around.
+        qs = de_list.filter(entries_after(before_key, not descending))
+        qs = qs.order_by(*get_entry_ordering(not descending))
+        entries = list(qs[: page_size + 1])
+        has_previous = len(entries) > page_size
+        entries = entries[:page_size][::-1]
+        return DocketEntryPage(entries, has_previous, True, total_count)
+
+    qs = de_list.order_by(*get_entry_ordering(descending))
+    offset = 0
+    if after_key is not None:
+        qs = qs.filter(entries_after(after_key, descending))
+    elif page:
+        try:
+            offset = max(int(page) - 1, 0) * page_size
+        except ValueError:
+            pass
+    entries = list(qs[offset : offset + page_size + 1])
+    has_next = len(entries) > page_size
+    has_previous = after_key is not None or offset > 0
+    return DocketEntryPage(
+        entries[:page_size], has_previous, has_next, total_count
+    )
+
+
+# Runs the Solr queries for the opinion page sidebars, so that the citing
+# and related queries of a page can run at the same time.
+_sidebar_executor = ThreadPoolExecutor(
+    max_workers=4, thread_name_prefix="opinion-sidebar"
+)
+
+
+def load_opinion_sidebars(
+    cluster: OpinionCluster,
+    request: Optional[HttpRequest] = None,
+    use_cache: bool = True,
+) -> Dict[str, Any]:
+    """Get the citing and related clusters shown beside an opinion.
+
+    Both are looked up in the cache with one query. Whatever isn't cached is
+    fetched from Solr, with the two queries running concurrently, and then
+    cached.
+
+    :param cluster: The cluster on the page.
+    :param request: The request, to skip the related clusters for bots. If
+    None, they're always loaded.
+    :param use_cache: Whether to use cached results. If False, they're
+    fetched from Solr and the cache is refreshed.
+    :return: A dict of citing_clusters, citing_cluster_count,
+    related_clusters, sub_opinion_ids and related_search_params.
+    """
+    cache = caches["db_cache"]
+    citing_key = get_citing_cache_key(cluster.pk)
+    related_key = get_related_cache_key(cluster.pk)
+    sub_opinion_ids = list(cluster.sub_opinions.values_list("pk", flat=True))
+    want_related = bool(sub_opinion_ids) and (
+        request is None or not is_bot(request)
+    )
+
+    keys = [citing_key]
+    if want_related and settings.RELATED_USE_CACHE:
+        keys.append(related_key)
+    cached = cache.get_many(keys) if use_cache else {}
+    if not sub_opinion_ids:
+        # Nothing can cite a cluster without opinions.
+        cached[citing_key] = ([], 0)
+
+    queries = {}
+    if citing_key not in cached:
+        queries[citing_key] = fetch_citing_clusters
+    if want_related and related_key not in cached:
+        queries[related_key] = fetch_related_clusters
+    fetched = {}
+    if queries:
+        si = get_pooled_solr_interface(settings.SOLR_OPINION_URL)
+        futures = {
+            key: _sidebar_executor.submit(query, si, sub_opinion_ids)
+            for key, query in queries.items()
+        }
+        fetched = {key: future.result() for key, future in futures.items()}
+
+    if citing_key in fetched:
+        cache.set(citing_key, fetched[citing_key], CITING_CACHE_TIMEOUT)
+    if related_key in fetched:
+        cache.set(
+            related_key,
+            fetched[related_key],
+            settings.RELATED_CACHE_TIMEOUT,
+        )
+    results = {**cached, **fetched}
+
+    citing_clusters, citing_cluster_count = results[citing_key]
+    if want_related:
+        related_clusters = results[related_key]
+    else:
+        related_clusters, sub_opinion_ids = [], []
+    return {
+        "citing_clusters": citing_clusters,
+        "citing_cluster_count": citing_cluster_count,
+        "related_clusters": related_clusters,
+        "sub_opinion_ids": sub_opinion_ids,
+        "related_search_params": get_related_search_params(),
+    }
@@ -32,11 +32,7 @@ from cl.favorites.models import Favorite
 from cl.lib.auth import group_required
 from cl.lib.model_helpers import choices_to_csv
 from cl.lib.ratelimiter import ratelimit_if_not_whitelisted
-from cl.lib.search_utils import (
-    get_citing_clusters_with_cache,
-    get_related_clusters_with_cache,
-    make_get_string,
-)
+from cl.lib.search_utils import make_get_string
 from cl.lib.string_utils import trunc
 from cl.lib.view_utils import increment_view_count
 from cl.opinion_page.forms import (
@@ -44,6 +40,11 @@ from cl.opinion_page.forms import (
     DocketEntryFilterForm,
     TennWorkersForm,
 )
+from cl.opinion_page.utils import (
+    get_docket_entry_count,
+    load_opinion_sidebars,
+    paginate_docket_entries,
+)
 from cl.people_db.models import AttorneyOrganization, CriminalCount, Role
 from cl.people_db.tasks import make_thumb_if_needed
 from cl.recap.constants import COURT_TIMEZONES
@@ -194,38 +195,44 @@ def view_docket(request: HttpRequest, pk: int, slug: str) -> HttpResponse:
     docket, context = core_docket_data(request, pk)
     increment_view_count(docket, request)
 
-    de_list = docket.docket_entries.all().prefetch_related("recap_documents")
+    de_list = docket.docket_entries.all()
+    descending = False
+    filtered = False
     form = DocketEntryFilterForm(request.GET)
     if form.is_valid():
         cd = form.cleaned_data
         if cd.get("entry_gte"):
             de_list = de_list.filter(entry_number__gte=cd["entry_gte"])
+            filtered = True
         if cd.get("entry_lte"):
             de_list = de_list.filter(entry_number__lte=cd["entry_lte"])
+            filtered = True
         if cd.get("filed_after"):
             de_list = de_list.filter(date_filed__gte=cd["filed_after"])
+            filtered = True
         if cd.get("filed_before"):
             de_list = de_list.filter(date_filed__lte=cd["filed_before"])
+            filtered = True
         if cd.get("order_by") == DocketEntryFilterForm.DESCENDING:
-            de_list = de_list.order_by(
-                "-recap_sequence_number", "-entry_number"
-            )
-
-    paginator = Paginator(de_list, 200, orphans=10)
-    page = request.GET.get("page")
-    try:
-        docket_entries = paginator.page(page)
-    except PageNotAnInteger:
-        docket_entries = paginator.page(1)
-    except EmptyPage:
-        docket_entries = paginator.page(paginator.num_pages)
+            descending = True
+
+    docket_entries = paginate_docket_entries(
+        de_list,
+        descending=descending,
+        after=request.GET.get("after"),
+        before=request.GET.get("before"),
+        page=request.GET.get("page"),
+        total_count=None if filtered else get_docket_entry_count(docket.pk),
+    )
 
     context.update(
         {
             "parties": docket.parties.exists(),  # Needed to show/hide parties tab.
             "docket_entries": docket_entries,
             "form": form,
-            "get_string": make_get_string(request),
+            "get_string": make_get_string(
+                request, ["page", "show_alert_modal", "after", "before"]
+            ),
         }
     )
     return render(request, "view_docket.html", context)
@@ -429,15 +436,8 @@ def view_opinion(request: HttpRequest, pk: int, _: str) -> HttpResponse:
     else:
         favorite_form = FavoriteForm(instance=fave)
 
-    citing_clusters, citing_cluster_count = get_citing_clusters_with_cache(
-        cluster
-    )
-
-    (
-        related_clusters,
-        sub_opinion_ids,
-        related_search_params,
-    ) = get_related_clusters_with_cache(cluster, request)
+    sidebars = load_opinion_sidebars(cluster, request)
+    related_clusters = sidebars["related_clusters"]
 
     return render(
         request,
@@ -449,15 +449,16 @@ def view_opinion(request: HttpRequest, pk: int, _: str) -> HttpResponse:
             "favorite_form": favorite_form,
             "get_string": get_string,
             "private": cluster.blocked,
-            "citing_clusters": citing_clusters,
-            "citing_cluster_count": citing_cluster_count,
+            "citing_clusters": sidebars["citing_clusters"],
+            "citing_cluster_count": sidebars["citing_cluster_count"],
             "top_authorities": cluster.authorities_with_data[:5],
             "authorities_count": len(cluster.authorities_with_data),
-            "sub_opinion_ids": sub_opinion_ids,
+            "sub_opinion_ids": sidebars["sub_opinion_ids"],
             "related_algorithm": "mlt",
             "related_clusters": related_clusters,
             "related_cluster_ids": [item["id"] for item in related_clusters],
-            "related_search_params": "&" + urlencode(related_search_params),
+            "related_search_params": "&"
+            + urlencode(sidebars["related_search_params"]),
         },
     )
 
@@ -0,0 +1,198 @@
+"""
+An in-memory index of judges, for resolving judge names to people.
+
+Assigning authors to opinions resolves every judge name it sees with
+find_person, which used to run up to three joins against the people and
+positions tables per name. The set of people with court positions is small,
+so instead each process loads it once, keyed by last name and court, and
+answers lookups from memory.
+
+When a Person or Position is saved or deleted, a generation number in Redis is
+bumped, and each process reloads its index the next time it's used. Changes
+made with queryset.update() or bulk_create() don't send signals, so code making
+them should call invalidate_judge_index() itself.
+"""
+import datetime
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dateutil.relativedelta import relativedelta
+
+from cl.lib.redis_utils import make_redis_interface
+from cl.people_db.models import Person, Position
+
+GENERATION_KEY = "judge-index:generation"
+
+
+def normalize_name(name: str) -> str:
+    """Normalize a name for case-insensitive comparison, like Postgres's
+    UPPER(), which is what iexact lookups use.
+    """
+    return name.upper()
+
+
+class JudgeIndex(object):
+    """Judges' positions, grouped by their last name and court."""
+
+    def __init__(self) -> None:
+        self.people: Dict[int, Person] = {}
+        # Normalized last name -> court_id -> list of
+        # (person_pk, date_start, date_termination), one per position.
+        self.positions: Dict[str, Dict[str, List[Tuple]]] = {}
+        self.loaded = False
+        self.generation = None
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Load every person with a court position from the database."""
+        r = make_redis_interface("CACHE")
+        generation = r.get(GENERATION_KEY)
+        people = {
+            p.pk: p
+            for p in Person.objects.filter(
+                positions__court__isnull=False
+            ).distinct()
+        }
+        positions = defaultdict(lambda: defaultdict(list))
+        rows = (
+            Position.objects.filter(court__isnull=False, person__isnull=False)
+            .order_by("pk")
+            .values_list(
+                "person_id", "court_id", "date_start", "date_termination"
+            )
+        )
+        for person_pk, court_id, start, termination in rows.iterator():
+            person = people.get(person_pk)
+            if person is None:
+                continue
+            positions[normalize_name(person.name_last)][court_id].append(
+                (person_pk, start, termination)
+            )
+        self.people = people
+        self.positions = {k: dict(v) for k, v in positions.items()}
+        self.loaded = True
+        self.generation = generation
+
+    def refresh(self) -> None:
+        """Reload the index if it's missing or out of date."""
+        r = make_redis_interface("CACHE")
+        with self._lock:
+            generation = r.get(GENERATION_KEY)
+            if not self.loaded or self.generation != generation:
+                self.load()
+
+    def find_person(
+        self,
+        name_last: str,
+        court_id: str,
+        name_first: Optional[str] = None,
+        case_date: Optional[datetime.date] = None,
+        raise_mult: bool = False,
+        raise_zero: bool = False,
+    ) -> Optional[Person]:
+        """Identify a judge by their name and metadata.
+
+        This narrows the candidates the same way the database version of
+        find_person did: by last name and court, then by whether a position
+        in that court was held within a year of the case date, then by first
+        name. As soon as there's exactly one candidate, it's returned.
+
+        Like the old query, which joined people to their positions, the
+        candidates are positions rather than people, so a judge with two
+        matching positions in a court is ambiguous until a later step
+        narrows it down.
+
+        :param name_last: The judge's last name.
+        :param court_id: The court the case was in.
+        :param name_first: The judge's first name, if known.
+        :param case_date: The date of the case, if known.
+        :param raise_mult: Whether to raise if the judge can't be narrowed
+        down to one person.
+        :param raise_zero: Whether to raise if no judge matches.
+        :return: The Person, or None if there wasn't exactly one match. The
+        Person objects are shared by everybody using the index, so don't
+        change them.
+        """
+        candidates = self.positions.get(normalize_name(name_last), {}).get(
+            court_id, []
+        )
+        filter_steps = []
+        if case_date is not None:
+            if isinstance(case_date, datetime.datetime):
+                case_date = case_date.date()
+            latest_start = case_date + relativedelta(years=1)
+            earliest_end = case_date - relativedelta(years=1)
+            filter_steps.append(
+                lambda c: (c[1] is None or c[1] < latest_start)
+                and (c[2] is None or c[2] > earliest_end)
+            )
+        if name_first is not None:
+            name_first = normalize_name(name_first)
+            filter_steps.append(
+                lambda c: normalize_name(self.people[c[0]].name_first)
+                == name_first
+            )
+
+        # Check the name and court, then progressively narrow the candidates
+        # with each step.
+        for step in [None] + filter_steps:
+            if step is not None:
+                candidates = [c for c in candidates if step(c)]
+            if len(candidates) == 0:
+                if raise_zero:
+                    raise Exception(
+                        "Unable to find judge with lname %s in court %s"
+                        % (name_last, court_id)
+                    )
+                return None
+            if len(candidates) == 1:
+                return self.people[candidates[0][0]]
+
+        # Unable to get to one or zero results. Raise exception if desired.
+        if raise_mult:
+            raise Exception(
+                "Multiple judges: Last name '%s', court '%s', options: %s."
+                % (
+                    name_last,
+                    court_id,
+                    str([self.people[c[0]].name_first for c in candidates]),
+                )
+            )
+        return None
+
+    def find_people(
+        self,
+        lookups: Iterable[Tuple[str, str, Optional[datetime.date]]],
+    ) -> List[Optional[Person]]:
+        """Identify many judges at once.
+
+        :param lookups: An iterable of (name_last, court_id, case_date)
+        tuples.
+        :return: A list of the Person matching each lookup, or None where
+        there wasn't exactly one match.
+        """
+        return [
+            self.find_person(name_last, court_id, case_date=case_date)
+            for name_last, court_id, case_date in lookups
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_judge_index() -> JudgeIndex:
+    """Get this process's judge index, loading or reloading it as needed."""
+    global _index
+    with _index_lock:
+        if _index is None:
+            _index = JudgeIndex()
+    _index.refresh()
+    return _index
+
+
+def invalidate_judge_index() -> None:
+    """Make every process reload its judge index the next time it's used."""
+    r = make_redis_interface("CACHE")
+    r.incr(GENERATION_KEY)
@@ -1,4 +1,6 @@
 from django.db import models
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from django.template import loader
 from django.urls import reverse
 from django.utils.text import slugify
@@ -1655,3 +1657,14 @@ class AttorneyOrganization(AbstractDateTimeModel):
             self.state,
             self.zip_code,
         )
+
+
+@receiver(post_save, sender=Person)
+@receiver(post_delete, sender=Person)
+@receiver(post_save, sender=Position)
+@receiver(post_delete, sender=Position)
+def invalidate_judge_index_on_change(sender, **kwargs):
+    """Make processes reload their judge index when judges change."""
+    from cl.people_db.judge_index import invalidate_judge_index
+
+    invalidate_judge_index()
@@ -1,11 +1,16 @@
 import io
 import re
 import sys
+from collections import Counter, defaultdict
 from datetime import date
-from typing import Dict
+from itertools import islice
+from typing import Dict, Iterator, List, Optional, Tuple
 
+import pandas as pd
 from dateutil import parser
 from django.core.management import CommandError
+from django.db import connection, transaction
+from django.db.models import QuerySet
 from django.utils.timezone import now
 
 from cl.lib.command_utils import CommandUtils, VerboseCommand, logger
@@ -59,6 +64,227 @@ def create_or_update_row(values: Dict[str, str]) -> FjcIntegratedDatabase:
     return fjc_row
 
 
+def get_fjc_court_map(courts: QuerySet) -> Dict[str, str]:
+    """Map FJC court IDs to CL court IDs, leaving out FJC IDs that match
+    more than one court, since those rows can't be imported.
+    """
+    pairs = list(courts.values_list("fjc_court_id", "pk"))
+    counts = Counter(fjc_id for fjc_id, _ in pairs)
+    return {fjc_id: pk for fjc_id, pk in pairs if counts[fjc_id] == 1}
+
+
+def read_idb_batches(
+    path: str, batch_size: int, start_line: int = 0
+) -> Iterator[pd.DataFrame]:
+    """Read an IDB file in batches of rows.
+
+    Like make_csv_row_dict, bad characters are removed and quoted values are
+    unquoted, but a whole batch is parsed at once.
+
+    :param path: The path to the IDB file.
+    :param batch_size: The number of lines in each batch.
+    :param start_line: The first line to read, not counting the header.
+    :return: Yields DataFrames with a string column for each column of the
+    file, and a line_number column.
+    """
+    with io.open(path, mode="r", encoding="cp1252", newline="\r\n") as f:
+        col_headers = next(f).strip().split("\t")
+        line_number = max(start_line, 0)
+        lines = islice(f, line_number, None)
+        while True:
+            batch = list(islice(lines, batch_size))
+            if not batch:
+                break
+            text = Command.BAD_CHARS.sub("", "".join(batch))
+            # Lines end with \r\n, so a lone \n is part of a value.
+            text = re.sub(r"(?<!\r)\n", " ", text)
+            df = pd.read_csv(
+                io.StringIO(text),
+                sep="\t",
+                names=col_headers,
+                header=None,
+                dtype=str,
+                keep_default_na=False,
+                skip_blank_lines=False,
+            ).fillna("")
+            # make_csv_row_dict drops tabs inside quoted values
+            df = df.replace("\t", "", regex=True)
+            df["line_number"] = range(line_number, line_number + len(df))
+            line_number += len(batch)
+            yield df[(df[col_headers] != "").any(axis=1)]
+
+
+class IdbMergeReport(object):
+    """Counts of what happened to the rows of an IDB import."""
+
+    def __init__(self) -> None:
+        self.added = 0
+        self.updated = 0
+        self.ambiguous = 0
+        self.duplicates = 0
+
+    def __str__(self) -> str:
+        return (
+            "%s added, %s updated, %s skipped as ambiguous, %s replaced by "
+            "later rows in the file"
+            % (self.added, self.updated, self.ambiguous, self.duplicates)
+        )
+
+
+def plan_idb_merge(
+    rows: List[Tuple[int, tuple, str]],
+    matches: Dict[int, List[Tuple[int, bool]]],
+    report: IdbMergeReport,
+) -> Dict[int, Optional[int]]:
+    """Decide what to do with each row of a batch, using the same rules as
+    create_or_update_row.
+
+    A row updates the one existing row with the same district, docket number,
+    origin and filing date. If there are several, it updates the one of
+    those with the same defendant. If there are none, it's added. If there
+    are several with the same defendant too, it's skipped.
+
+    Rows are applied in order, so when a row would add or update the same
+    row as an earlier one in the batch, only the later one is kept.
+
+    :param rows: A list of (line number, key, defendant) tuples for the rows
+    in the batch, in order.
+    :param matches: A dict of line numbers to lists of (existing row pk,
+    whether its defendant is the same) tuples for the existing rows with the
+    same key.
+    :param report: An IdbMergeReport to count the rows in.
+    :return: A dict of line numbers to the pk of the row each one updates, or
+    None if it's added.
+    """
+    plan = {}
+    kept_lines = {}
+    for line_number, key, defendant in rows:
+        key_matches = matches.get(line_number, [])
+        if len(key_matches) <= 1:
+            dedupe_key = key
+            target = key_matches[0][0] if key_matches else None
+        else:
+            by_defendant = [pk for pk, same in key_matches if same]
+            if len(by_defendant) > 1:
+                logger.warning(
+                    "Got %s results when looking up line %s by defendant.",
+                    len(by_defendant),
+                    line_number,
+                )
+                report.ambiguous += 1
+                continue
+            dedupe_key = key + (defendant,)
+            target = by_defendant[0] if by_defendant else None
+
+        earlier_line = kept_lines.get(dedupe_key)
+        if earlier_line is not None:
+            del plan[earlier_line]
+            report.duplicates += 1
+        kept_lines[dedupe_key] = line_number
+        plan[line_number] = target
+    return plan
+
+
+def copy_rows(cursor, table: str, columns: List[str], df: pd.DataFrame):
+    """Load a DataFrame into a table with COPY."""
+    buf = io.StringIO()
+    df.to_csv(buf, header=False, index=False, na_rep="\\N")
+    buf.seek(0)
+    cursor.copy_expert(
+        "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+        % (table, ", ".join(columns)),
+        buf,
+    )
+
+
+def merge_idb_batch(
+    df: pd.DataFrame, columns: List[str], report: IdbMergeReport
+) -> None:
+    """Add or update the IDB rows in a batch with a few set-based queries.
+
+    The batch is copied into a temporary table, the existing rows that match
+    it are found with one query, and then the new rows are inserted and the
+    matched ones are updated with one query each.
+
+    :param df: A normalized batch, with a column for each of columns and a
+    line_number column.
+    :param columns: The FjcIntegratedDatabase columns in the batch.
+    :param report: An IdbMergeReport to count the rows in.
+    """
+    table = FjcIntegratedDatabase._meta.db_table
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE idb_staging ON COMMIT DROP AS "
+            "SELECT * FROM %s WITH NO DATA" % table
+        )
+        cursor.execute(
+            "ALTER TABLE idb_staging ADD COLUMN line_number integer"
+        )
+        copy_rows(
+            cursor,
+            "idb_staging",
+            columns + ["line_number"],
+            df[columns + ["line_number"]],
+        )
+        cursor.execute(
+            "SELECT s.line_number, f.id, "
+            "  f.defendant IS NOT DISTINCT FROM s.defendant "
+            "FROM idb_staging s JOIN %s f "
+            "  ON f.district_id = s.district_id "
+            "  AND f.docket_number = s.docket_number "
+            "  AND f.origin IS NOT DISTINCT FROM s.origin "
+            "  AND f.date_filed IS NOT DISTINCT FROM s.date_filed" % table
+        )
+        matches = defaultdict(list)
+        for line_number, pk, same_defendant in cursor.fetchall():
+            matches[line_number].append((pk, same_defendant))
+
+        cursor.execute(
+            "SELECT line_number, district_id, docket_number, origin, "
+            "  date_filed, defendant "
+            "FROM idb_staging ORDER BY line_number"
+        )
+        rows = [(r[0], tuple(r[1:5]), r[5]) for r in cursor.fetchall()]
+        plan = plan_idb_merge(rows, matches, report)
+
+        cursor.execute(
+            "CREATE TEMPORARY TABLE idb_plan "
+            "(line_number integer, target_id integer) ON COMMIT DROP"
+        )
+        copy_rows(
+            cursor,
+            "idb_plan",
+            ["line_number", "target_id"],
+            pd.DataFrame(
+                list(plan.items()), columns=["line_number", "target_id"]
+            ).astype("Int64"),
+        )
+        right_now = now()
+        cursor.execute(
+            "INSERT INTO {table} ({columns}, date_created, date_modified) "
+            "SELECT {s_columns}, %s, %s "
+            "FROM idb_staging s JOIN idb_plan p USING (line_number) "
+            "WHERE p.target_id IS NULL "
+            "ORDER BY s.line_number".format(
+                table=table,
+                columns=", ".join(columns),
+                s_columns=", ".join("s.%s" % c for c in columns),
+            ),
+            [right_now, right_now],
+        )
+        report.added += cursor.rowcount
+        cursor.execute(
+            "UPDATE {table} f SET {assignments}, date_modified = %s "
+            "FROM idb_staging s JOIN idb_plan p USING (line_number) "
+            "WHERE p.target_id = f.id".format(
+                table=table,
+                assignments=", ".join("%s = s.%s" % (c, c) for c in columns),
+            ),
+            [right_now],
+        )
+        report.updated += cursor.rowcount
+
+
 class Command(VerboseCommand, CommandUtils):
     help = (
         "Import a tab-separated file as produced by FJC for their IDB. "
@@ -85,6 +311,19 @@ class Command(VerboseCommand, CommandUtils):
             default=-1,
             type=int,
         )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            default=False,
+            help="Load the file in batches, with a few queries per batch "
+            "instead of several per row. Much faster for big files.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            help="The number of lines in each batch when using --bulk.",
+            default=50_000,
+            type=int,
+        )
 
     def __init__(self, *args, **kwargs):
         super(Command, self).__init__(*args, **kwargs)
@@ -184,6 +423,14 @@ class Command(VerboseCommand, CommandUtils):
         self.filetype = options["filetype"]
         self.build_field_data()
 
+        if options["bulk"]:
+            self.bulk_import(
+                options["input_file"],
+                options["batch_size"],
+                options["start_line"],
+            )
+            return
+
         logger.info("Importing IDB file at: %s" % options["input_file"])
         f = io.open(
             options["input_file"], mode="r", encoding="cp1252", newline="\r\n"
@@ -214,6 +461,94 @@ class Command(VerboseCommand, CommandUtils):
 
         f.close()
 
+    def bulk_import(self, path: str, batch_size: int, start_line: int):
+        """Import an IDB file in batches, using merge_idb_batch.
+
+        :param path: The path to the IDB file.
+        :param batch_size: The number of lines in each batch.
+        :param start_line: The first line to import, not counting the header.
+        """
+        if self.filetype not in [CV_2017, CV_2020, CR_2017]:
+            raise NotImplementedError("This file type not implemented.")
+
+        logger.info("Bulk importing IDB file at: %s", path)
+        columns = [
+            FjcIntegratedDatabase._meta.get_field(field).column
+            for field in self.field_mappings.values()
+        ] + ["dataset_source"]
+        report = IdbMergeReport()
+        for df in read_idb_batches(path, batch_size, start_line):
+            df = self.normalize_frame(df)
+            df = df.rename(
+                columns={
+                    k: FjcIntegratedDatabase._meta.get_field(v).column
+                    for k, v in self.field_mappings.items()
+                }
+            )
+            df["dataset_source"] = self.filetype
+            merge_idb_batch(df, columns, report)
+            logger.info(
+                "Imported through line %s: %s",
+                df["line_number"].max() if len(df) else "-",
+                report,
+            )
+        logger.info("Done importing IDB file: %s", report)
+
+    def normalize_frame(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Normalize a batch of rows at once, the way the normalize_* methods
+        do for single rows.
+
+        :param df: A DataFrame of rows from read_idb_batches.
+        :return: A DataFrame of the rows to import, with the mapped columns
+        converted to the right types and a line_number column.
+        """
+        if self.filetype == CR_2017:
+            df = df[df["SOURCE"] == "CMECF"]
+        df = df[list(self.field_mappings) + ["line_number"]].copy()
+
+        # Nulls
+        for col in self.field_mappings:
+            is_null = df[col].isin(["-8", "", "01/01/1900"])
+            if col in self.nullable_fields:
+                df[col] = df[col].where(~is_null, None)
+            else:
+                df.loc[is_null, col] = ""
+
+        # Courts. Strip the leading zero from circuits, like
+        # normalize_court_fields.
+        df["CIRCUIT"] = df["CIRCUIT"].str.replace(
+            r"^0(\d)$", r"\1", regex=True
+        )
+        if self.filetype == BANKR_2017:
+            district_courts = Court.federal_courts.bankruptcy_courts()
+        else:
+            district_courts = Court.federal_courts.district_courts()
+        court_maps = {
+            "CIRCUIT": get_fjc_court_map(
+                Court.federal_courts.appellate_courts()
+            ),
+            "DISTRICT": get_fjc_court_map(district_courts),
+        }
+        for col, court_map in court_maps.items():
+            courts = df[col].map(court_map)
+            unmatched = (df[col] != "") & courts.isna()
+            if unmatched.any():
+                raise Exception(
+                    "Unable to match %s column value %s to Court object"
+                    % (col, df.loc[unmatched, col].iloc[0])
+                )
+            df[col] = courts.where(df[col] != "", None)
+
+        for col in self.bool_fields:
+            is_null = df[col].isna()
+            df[col] = (df[col] == "1").astype(object).where(~is_null, None)
+        for col in self.date_fields:
+            dates = pd.to_datetime(df[col])
+            df[col] = dates.dt.date.astype(object).where(dates.notna(), None)
+        for col in self.int_fields:
+            df[col] = pd.to_numeric(df[col]).astype("Int64")
+        return df
+
     def normalize_nulls(self, row):
         """The IDB uses the value -8 to indicate a null value. Fix this
         and normalize to either a blank entry ('') or None.
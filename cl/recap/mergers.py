@@ -24,6 +24,7 @@ from cl.lib.pacer import (
     normalize_attorney_contact,
     normalize_attorney_role,
 )
+from cl.lib.search_cache import invalidate_docket_search_metadata
 from cl.lib.string_utils import anonymize
 from cl.lib.utils import previous_and_next, remove_duplicate_dicts
 from cl.people_db.models import (
@@ -971,6 +972,7 @@ def add_parties_and_attorneys(d, parties):
     disassociate_extraneous_entities(
         d, parties, updated_parties, updated_attorneys
     )
+    invalidate_docket_search_metadata(d.pk)
 
 
 @transaction.atomic
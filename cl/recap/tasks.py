@@ -1,5 +1,6 @@
 import logging
 import os
+from collections import defaultdict
 from typing import List, Optional, Tuple
 from zipfile import ZipFile
 
@@ -10,6 +11,7 @@ from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.db import IntegrityError, transaction
+from django.db.models import QuerySet
 from django.utils.timezone import now
 from juriscraper.lib.exceptions import PacerLoginException, ParsingException
 from juriscraper.lib.string_utils import CaseNameTweaker, harmonize
@@ -440,6 +442,9 @@ def process_recap_docket(self, pk):
             // recap document was created (implying a Solr needs
             // updating).
             'content_updated': True,
+            // The Solr fields of the docket that changed, or None if
+            // they couldn't be worked out.
+            'solr_changes': {'caseName': 'Lissner v. Lissner'},
         }
 
     This value is a dict so that it can be ingested in a Celery chain.
@@ -501,6 +506,9 @@ def process_recap_docket(self, pk):
 
     d.save()
 
+    # Metadata changes alone can be sent to Solr as atomic updates.
+    solr_changes = d.get_solr_changes()
+
     # Add the HTML to the docket in case we need it someday.
     pacer_file = PacerHtmlFiles(
         content_object=d, upload_type=UPLOAD_TYPE.DOCKET
@@ -523,6 +531,7 @@ def process_recap_docket(self, pk):
     return {
         "docket_pk": d.pk,
         "content_updated": bool(rds_created or content_updated),
+        "solr_changes": solr_changes,
     }
 
 
@@ -756,6 +765,9 @@ def process_recap_docket_history_report(self, pk):
             )
             raise self.retry(exc=exc)
 
+    # Metadata changes alone can be sent to Solr as atomic updates.
+    solr_changes = d.get_solr_changes()
+
     # Add the HTML to the docket in case we need it someday.
     pacer_file = PacerHtmlFiles(
         content_object=d, upload_type=UPLOAD_TYPE.DOCKET_HISTORY_REPORT
@@ -778,6 +790,7 @@ def process_recap_docket_history_report(self, pk):
     return {
         "docket_pk": d.pk,
         "content_updated": bool(rds_created or content_updated),
+        "solr_changes": solr_changes,
     }
 
 
@@ -796,6 +809,9 @@ def process_recap_appellate_docket(self, pk):
             // recap document was created (implying a Solr needs
             // updating).
             'content_updated': True,
+            // The Solr fields of the docket that changed, or None if
+            // they couldn't be worked out.
+            'solr_changes': {'caseName': 'Lissner v. Lissner'},
         }
 
     This value is a dict so that it can be ingested in a Celery chain.
@@ -854,6 +870,9 @@ def process_recap_appellate_docket(self, pk):
         d.originating_court_information = og_info
     d.save()
 
+    # Metadata changes alone can be sent to Solr as atomic updates.
+    solr_changes = d.get_solr_changes()
+
     # Add the HTML to the docket in case we need it someday.
     pacer_file = PacerHtmlFiles(
         content_object=d, upload_type=UPLOAD_TYPE.APPELLATE_DOCKET
@@ -876,6 +895,7 @@ def process_recap_appellate_docket(self, pk):
     return {
         "docket_pk": d.pk,
         "content_updated": bool(rds_created or content_updated),
+        "solr_changes": solr_changes,
     }
 
 
@@ -998,33 +1018,54 @@ def do_heuristic_match(idb_row, ds):
     return d
 
 
+def get_idb_merge_candidates() -> QuerySet:
+    """Get the dockets that IDB rows can be merged into."""
+    return (
+        Docket.objects.exclude(docket_number__icontains="cr")
+        .exclude(case_name__icontains="sealed")
+        .exclude(case_name__icontains="suppressed")
+        .exclude(case_name__icontains="search warrant")
+    )
+
+
 @app.task
 def create_or_merge_from_idb_chunk(idb_chunk):
     """Take a chunk of IDB rows and either merge them into the Docket table or
     create new items for them in the docket table.
 
+    The rows, and the dockets that might match them, are each looked up with
+    one query for the whole chunk.
+
     :param idb_chunk: A list of FjcIntegratedDatabase PKs
     :type idb_chunk: list
     :return: None
     :rtype: None
     """
+    idb_rows = FjcIntegratedDatabase.objects.filter(
+        pk__in=idb_chunk
+    ).select_related("district")
+    idb_rows = {row.pk: row for row in idb_rows}
+    candidates = defaultdict(list)
+    ds = get_idb_merge_candidates().filter(
+        docket_number_core__in={r.docket_number for r in idb_rows.values()},
+        court_id__in={r.district_id for r in idb_rows.values()},
+    )
+    for d in ds.order_by("pk"):
+        candidates[(d.docket_number_core, d.court_id)].append(d)
+
     for idb_pk in idb_chunk:
-        idb_row = FjcIntegratedDatabase.objects.get(pk=idb_pk)
-        ds = (
-            Docket.objects.filter(
-                docket_number_core=idb_row.docket_number,
-                court=idb_row.district,
-            )
-            .exclude(docket_number__icontains="cr")
-            .exclude(case_name__icontains="sealed")
-            .exclude(case_name__icontains="suppressed")
-            .exclude(case_name__icontains="search warrant")
-        )
-        count = ds.count()
+        idb_row = idb_rows.get(idb_pk)
+        if idb_row is None:
+            continue
+        key = (idb_row.docket_number, idb_row.district_id)
+        ds = candidates[key]
+        count = len(ds)
         if count == 0:
             msg = "Creating new docket for IDB row: %s"
             logger.info(msg, idb_row)
-            create_new_docket_from_idb(idb_row)
+            d_pk = create_new_docket_from_idb(idb_row)
+            # Later rows in the chunk can match the new docket.
+            ds.extend(get_idb_merge_candidates().filter(pk=d_pk))
             continue
         elif count == 1:
             d = ds[0]
@@ -1040,7 +1081,8 @@ def create_or_merge_from_idb_chunk(idb_chunk):
         if d is not None:
             merge_docket_with_idb(d, idb_row)
         else:
-            create_new_docket_from_idb(idb_row)
+            d_pk = create_new_docket_from_idb(idb_row)
+            ds.extend(get_idb_merge_candidates().filter(pk=d_pk))
 
 
 @app.task
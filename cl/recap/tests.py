@@ -1,6 +1,7 @@
 import json
 import os
 from datetime import date
+from tempfile import NamedTemporaryFile
 from unittest import mock
 
 from django.conf import settings
@@ -27,7 +28,12 @@ from cl.people_db.models import (
     PartyType,
     Role,
 )
-from cl.recap.management.commands.import_idb import Command
+from cl.recap.management.commands.import_idb import (
+    Command,
+    IdbMergeReport,
+    plan_idb_merge,
+    read_idb_batches,
+)
 from cl.recap.mergers import (
     add_attorney,
     add_docket_entries,
@@ -1601,3 +1607,50 @@ class IdbImportTest(TestCase):
             self.assertEqual(
                 self.cmd.make_csv_row_dict(qa[0], ["1", "2", "3"]), qa[1]
             )
+
+    def test_batch_parsing_matches_row_parsing(self):
+        """Does the bulk importer parse lines like make_csv_row_dict?"""
+        lines = [
+            "asdf\tasdf\tasdf",
+            'asdf\t"toyrus"\tasdf',
+            'asdf\t"\tto\tyrus\t"\tasdf',
+            'asdf\t"M/V ""Pheonix"""\tasdf',
+        ]
+        with NamedTemporaryFile(mode="w", suffix=".txt") as f:
+            f.write("\r\n".join(["1\t2\t3"] + lines) + "\r\n")
+            f.flush()
+            batches = list(read_idb_batches(f.name, batch_size=3))
+
+        self.assertEqual([len(df) for df in batches], [3, 1])
+        rows = [row for df in batches for row in df.to_dict(orient="records")]
+        for i, (line, row) in enumerate(zip(lines, rows)):
+            self.assertEqual(row.pop("line_number"), i)
+            self.assertEqual(
+                row, self.cmd.make_csv_row_dict(line, ["1", "2", "3"])
+            )
+
+    def test_merge_plan_keeps_ambiguity_rules(self):
+        report = IdbMergeReport()
+        key = ("nysd", "1234", 1, date(2020, 1, 1))
+        other_key = ("nysd", "5678", 1, date(2020, 1, 1))
+        rows = [
+            # No match: added
+            (0, other_key, "A"),
+            # One match: updated
+            (1, key, "B"),
+            # Several matches, one with the same defendant: updated
+            (2, key + ("x",), "C"),
+            # Several matches with the same defendant: skipped
+            (3, key + ("y",), "D"),
+            # Same as the first row, which it replaces
+            (4, other_key, "E"),
+        ]
+        matches = {
+            1: [(10, False)],
+            2: [(11, False), (12, True)],
+            3: [(13, True), (14, True)],
+        }
+        plan = plan_idb_merge(rows, matches, report)
+        self.assertEqual(plan, {1: 10, 2: 12, 4: None})
+        self.assertEqual(report.ambiguous, 1)
+        self.assertEqual(report.duplicates, 1)
@@ -1,16 +1,16 @@
-import base64
 import logging
 import random
 import re
 import subprocess
 import traceback
+from contextlib import closing
 from tempfile import NamedTemporaryFile
-from typing import List, Optional, Tuple, Union
+from typing import IO, List, Optional, Tuple, Union
 
 import requests
 from django.apps import apps
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.files.base import File
 from django.utils.encoding import (
     DjangoUnicodeDecodeError,
     force_text,
@@ -24,6 +24,7 @@ from PyPDF2 import PdfFileReader
 from PyPDF2.utils import PdfReadError
 
 from cl.audio.models import Audio
+from cl.audio.utils import convert_audio_locally, get_audio_duration
 from cl.celery_init import app
 from cl.citations.tasks import find_citations_for_opinion_by_pks
 from cl.custom_filters.templatetags.text_filters import best_case_name
@@ -36,7 +37,11 @@ from cl.lib.recap_utils import needs_ocr
 from cl.lib.string_utils import anonymize, trunc
 from cl.lib.utils import is_iter
 from cl.recap.mergers import save_iquery_to_docket
-from cl.scrapers.transformer_extractor_utils import convert_and_clean_audio
+from cl.scrapers.transformer_extractor_utils import (
+    convert_and_clean_audio,
+    get_audio_metadata,
+    save_converted_audio,
+)
 from cl.search.models import Docket, Opinion, RECAPDocument
 
 DEVNULL = open("/dev/null", "w")
@@ -539,6 +544,37 @@ def extract_by_ocr(path: str) -> (bool, str):
     return True, txt
 
 
+def convert_audio_file(af: Audio, out: IO[bytes]) -> Optional[float]:
+    """Convert an audio file to MP3 with BTE, or with ffmpeg if BTE can't be
+    reached and settings.AUDIO_CONVERSION_LOCAL_FALLBACK is on.
+
+    :param af: The Audio object to convert.
+    :param out: A named temporary file to write the MP3 to.
+    :return: The duration of the audio in seconds, if it's known.
+    """
+    try:
+        bte_audio_response = convert_and_clean_audio(af)
+    except requests.ConnectionError:
+        if not settings.AUDIO_CONVERSION_LOCAL_FALLBACK:
+            raise
+        logger.warning(
+            "Unable to reach BTE to convert audio %s. Converting locally.",
+            af.pk,
+        )
+        convert_audio_locally(
+            af.local_path_original_file.path,
+            out.name,
+            get_audio_metadata(af),
+        )
+        return None
+
+    with closing(bte_audio_response):
+        bte_audio_response.raise_for_status()
+        duration = save_converted_audio(bte_audio_response, out)
+    out.flush()
+    return duration
+
+
 @app.task(bind=True, max_retries=1, countdown=2)
 def process_audio_file(self, pk) -> None:
     """Given the key to an audio file, extract its content and add the related
@@ -549,14 +585,15 @@ def process_audio_file(self, pk) -> None:
     :return: None
     """
     af = Audio.objects.get(pk=pk)
-    bte_audio_response = convert_and_clean_audio(af)
-    bte_audio_response.raise_for_status()
-    audio_obj = bte_audio_response.json()
-    cf = ContentFile(base64.b64decode(audio_obj["audio_b64"]))
-    file_name = trunc(best_case_name(af).lower(), 72) + "_cl.mp3"
-    af.file_with_date = af.docket.date_argued
-    af.local_path_mp3.save(file_name, cf, save=False)
-    af.duration = audio_obj["duration"]
+    with NamedTemporaryFile(suffix=".mp3") as tmp:
+        duration = convert_audio_file(af, tmp)
+        if duration is None:
+            duration = get_audio_duration(tmp.name)
+        tmp.seek(0)
+        file_name = trunc(best_case_name(af).lower(), 72) + "_cl.mp3"
+        af.file_with_date = af.docket.date_argued
+        af.local_path_mp3.save(file_name, File(tmp), save=False)
+    af.duration = duration
     af.processing_complete = True
     af.save()
 
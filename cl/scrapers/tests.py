@@ -1,8 +1,13 @@
+import base64
+import json
 import os
+import threading
 from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
 
 from django.conf import settings
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django.utils.timezone import now
 
 from cl.audio.models import Audio
@@ -20,7 +25,10 @@ from cl.scrapers.tasks import (
     process_audio_file,
 )
 from cl.scrapers.test_assets import test_opinion_scraper, test_oral_arg_scraper
-from cl.scrapers.transformer_extractor_utils import convert_and_clean_audio
+from cl.scrapers.transformer_extractor_utils import (
+    AUDIO_DURATION_HEADER,
+    convert_and_clean_audio,
+)
 from cl.scrapers.utils import get_extension
 from cl.search.models import Court, Opinion
 
@@ -428,6 +436,98 @@ class DupcheckerWithFixturesTest(TestCase):
                 )
 
 
+class FakeAudioConverter(BaseHTTPRequestHandler):
+    """Stands in for BTE's convert-audio endpoint."""
+
+    mp3 = b"ID3" + b"\x00" * 1024
+    duration = 15
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path.startswith("/legacy"):
+            body = json.dumps(
+                {
+                    "audio_b64": base64.b64encode(self.mp3).decode(),
+                    "duration": self.duration,
+                }
+            ).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+        else:
+            body = self.mp3
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header(AUDIO_DURATION_HEADER, str(self.duration))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class AudioConversionTransportTest(TestCase):
+    """Can we save converted audio without holding it all in memory?"""
+
+    fixtures = [
+        "judge_judy.json",
+        "test_objects_search.json",
+        "test_objects_audio.json",
+    ]
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = HTTPServer(("localhost", 0), FakeAudioConverter)
+        cls.url = "http://localhost:%s" % cls.server.server_port
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def tearDown(self):
+        Audio.objects.get(pk=1).local_path_mp3.delete(save=False)
+
+    def convert(self, url):
+        bte_urls = {"convert-audio": {"url": url, "timeout": 5}}
+        with override_settings(BTE_URLS=bte_urls):
+            process_audio_file(pk=1)
+        af = Audio.objects.get(pk=1)
+        with af.local_path_mp3.open("rb") as f:
+            mp3 = f.read()
+        return af, mp3
+
+    def test_binary_transport(self):
+        af, mp3 = self.convert("%s/convert/audio" % self.url)
+        self.assertEqual(mp3, FakeAudioConverter.mp3)
+        self.assertEqual(af.duration, FakeAudioConverter.duration)
+        self.assertTrue(af.processing_complete)
+
+    def test_legacy_json_transport(self):
+        af, mp3 = self.convert("%s/legacy/convert/audio" % self.url)
+        self.assertEqual(mp3, FakeAudioConverter.mp3)
+        self.assertEqual(af.duration, FakeAudioConverter.duration)
+
+    @mock.patch("cl.scrapers.tasks.get_audio_duration", return_value=12)
+    @mock.patch("cl.scrapers.tasks.convert_audio_locally")
+    def test_local_fallback(self, mock_convert, mock_duration):
+        """Do we convert audio ourselves when BTE is down?"""
+
+        def write_mp3(path, out_path, audio_data):
+            with open(out_path, "wb") as f:
+                f.write(FakeAudioConverter.mp3)
+
+        mock_convert.side_effect = write_mp3
+        # Nothing is listening on port 1.
+        af, mp3 = self.convert("http://localhost:1/convert/audio")
+        self.assertEqual(mock_convert.call_count, 1)
+        self.assertEqual(mp3, FakeAudioConverter.mp3)
+        self.assertEqual(af.duration, 12)
+
+
 class AudioFileTaskTest(TestCase):
 
     fixtures = [
@@ -1,16 +1,20 @@
+import base64
 import json
-from typing import ByteString, Optional
+from typing import IO, Any, ByteString, Dict, Optional
 
 import requests
 from django.conf import settings
 
+AUDIO_CHUNK_SIZE = 1024 * 1024
+# Where BTE puts the duration of a converted MP3, in seconds
+AUDIO_DURATION_HEADER = "X-Audio-Duration"
 
-def convert_and_clean_audio(audio_obj) -> requests.Response:
-    """Convert audio file to MP3 w/ metadata and image.
+
+def get_audio_metadata(audio_obj) -> Dict[str, Any]:
+    """Get the metadata that goes into the tags of an audio file's MP3.
 
     :param audio_obj: Audio file object in db.
-    :return: BTE response object
-    :type: requests.Response
+    :return: A dict of metadata.
     """
     date_argued = audio_obj.docket.date_argued
     if date_argued:
@@ -19,7 +23,7 @@ def convert_and_clean_audio(audio_obj) -> requests.Response:
     else:
         date_argued_str, date_argued_year = None, None
 
-    audio_data = {
+    return {
         "court_full_name": audio_obj.docket.court.full_name,
         "court_short_name": audio_obj.docket.court.short_name,
         "court_pk": audio_obj.docket.court.pk,
@@ -32,18 +36,55 @@ def convert_and_clean_audio(audio_obj) -> requests.Response:
         "case_name_short": audio_obj.case_name_short,
         "download_url": audio_obj.download_url,
     }
-    with open(audio_obj.local_path_original_file.path, "rb") as af:
-        audio_file = {"audio_file": ("", af.read())}
 
-    bte_audio_response = requests.post(
-        settings.BTE_URLS["convert-audio"]["url"],
-        params={"audio_data": json.dumps(audio_data)},
-        files=audio_file,
-        timeout=settings.BTE_URLS["convert-audio"]["timeout"],
-    )
+
+def convert_and_clean_audio(audio_obj) -> requests.Response:
+    """Convert audio file to MP3 w/ metadata and image.
+
+    The MP3 is requested as raw bytes and the response is streamed, so read
+    it with save_converted_audio rather than response.content.
+
+    :param audio_obj: Audio file object in db.
+    :return: BTE response object
+    :type: requests.Response
+    """
+    audio_data = get_audio_metadata(audio_obj)
+    with open(audio_obj.local_path_original_file.path, "rb") as af:
+        bte_audio_response = requests.post(
+            settings.BTE_URLS["convert-audio"]["url"],
+            params={"audio_data": json.dumps(audio_data)},
+            files={"audio_file": ("", af)},
+            headers={"Accept": "audio/mpeg"},
+            stream=True,
+            timeout=settings.BTE_URLS["convert-audio"]["timeout"],
+        )
     return bte_audio_response
 
 
+def save_converted_audio(
+    bte_audio_response: requests.Response, out: IO[bytes]
+) -> Optional[float]:
+    """Write the MP3 from a convert-audio response to a file, a chunk at a
+    time, so that long recordings are never held in memory.
+
+    :param bte_audio_response: A streamed response from
+    convert_and_clean_audio.
+    :param out: A binary file to write the MP3 to.
+    :return: The duration of the audio in seconds, if BTE sent it.
+    """
+    content_type = bte_audio_response.headers.get("Content-Type", "")
+    if content_type.startswith("application/json"):
+        # Older versions of BTE send the MP3 base64-encoded in JSON.
+        audio_obj = bte_audio_response.json()
+        out.write(base64.b64decode(audio_obj["audio_b64"]))
+        return audio_obj["duration"]
+
+    for chunk in bte_audio_response.iter_content(chunk_size=AUDIO_CHUNK_SIZE):
+        out.write(chunk)
+    duration = bte_audio_response.headers.get(AUDIO_DURATION_HEADER)
+    return float(duration) if duration else None
+
+
 def get_page_count(pdf_bytes: bytes) -> Optional[int]:
     """Extract page count from PDF content.
 
@@ -1,11 +1,19 @@
+import base64
+import binascii
+import hashlib
+import json
+
 from django.conf import settings
 from rest_framework.exceptions import ParseError
 
 from cl.lib import search_utils
 from cl.lib.scorched_utils import ExtraSolrInterface
-from cl.lib.search_utils import map_to_docket_entry_sorting
+from cl.lib.search_utils import get_solr_url, map_to_docket_entry_sorting
 from cl.search.models import SEARCH_TYPES
 
+# The number of results fetched per Solr request when exporting a search
+EXPORT_PAGE_SIZE = 500
+
 
 def get_object_list(request, cd, paginator):
     """Perform the Solr work"""
@@ -33,6 +41,136 @@ def get_object_list(request, cd, paginator):
     return sl
 
 
+def add_sort_tiebreaker(sort):
+    """Make a sort order total by breaking ties with the unique key, as Solr
+    requires for cursors.
+
+    :param sort: A Solr sort string, like "dateFiled desc".
+    :return: The sort string, with "id asc" added if it's not already there.
+    """
+    sort = sort or "score desc"
+    fields = [c.split()[0] for c in sort.split(",") if c.strip()]
+    if "id" in fields:
+        return sort
+    return "%s,id asc" % sort
+
+
+def make_query_hash(main_query):
+    """Identify a query, so a cursor can't be used with a different one."""
+    params = {k: v for k, v in main_query.items() if k != "caller"}
+    serialized = json.dumps(params, sort_keys=True, default=str)
+    return hashlib.sha256(serialized.encode()).hexdigest()[:16]
+
+
+def make_cursor_token(cursor_mark, main_query):
+    """Wrap a Solr cursorMark in an opaque token for API users.
+
+    :param cursor_mark: The nextCursorMark from Solr.
+    :param main_query: The query the cursor belongs to.
+    :return: A URL-safe string.
+    """
+    payload = json.dumps({"m": cursor_mark, "q": make_query_hash(main_query)})
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def parse_cursor_token(token, main_query):
+    """Get the Solr cursorMark from a token made by make_cursor_token.
+
+    :param token: The token from the user, or "*" to start from the top.
+    :param main_query: The query the token is being used with.
+    :return: A Solr cursorMark.
+    """
+    if token == "*":
+        return token
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token.encode()))
+        cursor_mark, query_hash = payload["m"], payload["q"]
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise ParseError("Invalid cursor: %s" % token)
+    if query_hash != make_query_hash(main_query):
+        raise ParseError(
+            "This cursor belongs to a different query. Cursors can only be "
+            "used with the query that made them."
+        )
+    return cursor_mark
+
+
+class SolrCursorPage(object):
+    """One page of search results fetched with a Solr cursor."""
+
+    def __init__(self, results, count, next_cursor, schema):
+        self.results = results
+        self.count = count
+        self.next_cursor = next_cursor
+        self.schema = schema
+
+
+def get_cursor_page(cd, cursor, rows):
+    """Get a page of search results using Solr's cursorMark.
+
+    Unlike offset pagination, this costs Solr the same for the millionth
+    result as the first, and the total count comes back with the results
+    instead of needing its own query.
+
+    :param cd: The cleaned data from a SearchForm.
+    :param cursor: The cursor token from the previous page, or "*" for the
+    first page.
+    :param rows: The number of results to get.
+    :return: A SolrCursorPage. Its next_cursor is None on the last page.
+    """
+    if cd["type"] == SEARCH_TYPES.DOCKETS:
+        # Solr can't use cursors with result grouping.
+        raise ParseError(
+            "Cursors aren't available for docket searches. Use type=r to "
+            "page through RECAP documents instead."
+        )
+    main_query = search_utils.build_main_query(
+        cd, highlight="text", facet=False, group=False
+    )
+    main_query["caller"] = "api_search_cursor"
+    if cd["type"] == SEARCH_TYPES.RECAP:
+        main_query["sort"] = map_to_docket_entry_sorting(main_query["sort"])
+    main_query["sort"] = add_sort_tiebreaker(main_query["sort"])
+    cursor_mark = parse_cursor_token(cursor, main_query)
+
+    conn = ExtraSolrInterface(get_solr_url(cd["type"]), mode="r")
+    r = (
+        conn.query()
+        .add_extra(**main_query)
+        .add_extra(rows=rows, start=0, cursorMark=cursor_mark)
+        .execute()
+    )
+    conn.conn.http_connection.close()
+    if cd["type"] == SEARCH_TYPES.RECAP:
+        search_utils.add_recap_docket_fields(r, main_query.get("uq"))
+
+    results = []
+    for doc in r.result.docs:
+        doc["snippet"] = "&hellip;".join(doc["solr_highlights"]["text"])
+        results.append(SolrObject(initial=doc))
+
+    next_mark = r.nextCursorMark
+    if len(results) < rows or next_mark == cursor_mark:
+        next_cursor = None
+    else:
+        next_cursor = make_cursor_token(next_mark, main_query)
+    return SolrCursorPage(results, r.result.numFound, next_cursor, conn.schema)
+
+
+def iter_cursor_pages(cd, rows):
+    """Walk every page of a search with a cursor.
+
+    :param cd: The cleaned data from a SearchForm.
+    :param rows: The number of results to get per request.
+    :return: A generator of SolrCursorPage objects.
+    """
+    cursor = "*"
+    while cursor is not None:
+        page = get_cursor_page(cd, cursor, rows)
+        yield page
+        cursor = page.next_cursor
+
+
 class SolrList(object):
     """This implements a yielding list object that fetches items as they are
     queried.
@@ -73,6 +211,8 @@ class SolrList(object):
         self.main_query["start"] = self.offset
         r = self.conn.query().add_extra(**self.main_query).execute()
         self.conn.conn.http_connection.close()
+        if self.type in [SEARCH_TYPES.RECAP, SEARCH_TYPES.DOCKETS]:
+            search_utils.add_recap_docket_fields(r, self.main_query.get("uq"))
         if r.group_field is None:
             # Pull the text snippet up a level
             for result in r.result.docs:
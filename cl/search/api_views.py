@@ -1,4 +1,11 @@
+import itertools
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
 from rest_framework import pagination, permissions, response, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.utils.urls import replace_query_param
 
 from cl.api.utils import CacheListMixin, LoggingMixin, RECAPUsersReadOnly
 from cl.search import api_utils
@@ -178,6 +185,8 @@ class SearchViewSet(LoggingMixin, viewsets.ViewSet):
                 cd["q"] = "*"  # Get everything
 
             paginator = pagination.PageNumberPagination()
+            if "cursor" in request.GET:
+                return self._list_with_cursor(request, cd, paginator)
             sl = api_utils.get_object_list(request, cd=cd, paginator=paginator)
 
             result_page = paginator.paginate_queryset(sl, request)
@@ -190,3 +199,62 @@ class SearchViewSet(LoggingMixin, viewsets.ViewSet):
         return response.Response(
             search_form.errors, status=status.HTTP_400_BAD_REQUEST
         )
+
+    @staticmethod
+    def _list_with_cursor(request, cd, paginator):
+        """Return a page of results using a cursor instead of a page number.
+
+        Start with cursor=* and follow the next links. Deep pages are as fast
+        as the first one.
+        """
+        page = api_utils.get_cursor_page(
+            cd, request.GET["cursor"], paginator.get_page_size(request)
+        )
+        serializer = SearchResultSerializer(
+            page.results, many=True, context={"schema": page.schema}
+        )
+        next_url = None
+        if page.next_cursor is not None:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "cursor", page.next_cursor
+            )
+        return response.Response(
+            {
+                "count": page.count,
+                "next": next_url,
+                "previous": None,
+                "results": serializer.data,
+            }
+        )
+
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def export(self, request, *args, **kwargs):
+        """Stream every result of a search as newline-delimited JSON."""
+        search_form = SearchForm(request.GET)
+        if not search_form.is_valid():
+            return response.Response(
+                search_form.errors, status=status.HTTP_400_BAD_REQUEST
+            )
+        cd = search_form.cleaned_data
+        if cd["q"] == "":
+            cd["q"] = "*"
+        # Fetch the first page now, so that bad queries get a proper error
+        # instead of a broken stream.
+        pages = api_utils.iter_cursor_pages(cd, api_utils.EXPORT_PAGE_SIZE)
+        first_page = next(pages)
+
+        def stream():
+            for page in itertools.chain([first_page], pages):
+                serializer = SearchResultSerializer(
+                    page.results, many=True, context={"schema": page.schema}
+                )
+                for item in serializer.data:
+                    yield json.dumps(item, cls=DjangoJSONEncoder) + "\n"
+
+        return StreamingHttpResponse(
+            stream(), content_type="application/x-ndjson"
+        )
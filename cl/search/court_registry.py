@@ -0,0 +1,214 @@
+"""
+An in-memory registry of the courts used by the search form.
+
+Every search, alert and feed builds a SearchForm, which has a checkbox for
+every court in use, and search pages then sort those courts into the tabs of
+the jurisdiction picker. The courts hardly ever change, so instead of
+querying and rebuilding all of that each time, each process loads it once and
+reuses it.
+
+When a Court is saved or deleted, a generation number in Redis is bumped, and
+each process reloads its registry the next time it's used. Changes made with
+queryset.update() don't send signals, so code making them should call
+invalidate_court_registry() itself.
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+from django import forms
+
+from cl.lib.redis_utils import make_redis_interface
+from cl.search.models import Court
+
+GENERATION_KEY = "court-registry:generation"
+
+
+def make_court_field(court: Court) -> forms.BooleanField:
+    """Make the search form's checkbox for a court."""
+    return forms.BooleanField(
+        label=court.short_name,
+        required=False,
+        initial=True,
+        widget=forms.CheckboxInput(attrs={"checked": "checked"}),
+    )
+
+
+def make_tab_layout(courts: Sequence[Court]) -> Dict[str, list]:
+    """Arrange courts into the tabs of the jurisdiction picker.
+
+    State courts are a special exception. For layout purposes, they get
+    bundled by supreme court and then by hand. Yes, this means new state
+    courts requires manual adjustment here.
+
+    :param courts: The courts, in order.
+    :return: A dict of tab names to courts, or to bundles of courts.
+    """
+    court_tabs = {
+        "federal": [],
+        "district": [],
+        "state": [],
+        "special": [],
+    }
+    bap_bundle = []
+    b_bundle = []
+    state_bundle = []
+    state_bundles = []
+    for court in courts:
+        if court.jurisdiction == Court.FEDERAL_APPELLATE:
+            court_tabs["federal"].append(court)
+        elif court.jurisdiction == Court.FEDERAL_DISTRICT:
+            court_tabs["district"].append(court)
+        elif court.jurisdiction in Court.BANKRUPTCY_JURISDICTIONS:
+            # Bankruptcy gets bundled into BAPs and regular courts.
+            if court.jurisdiction == Court.FEDERAL_BANKRUPTCY_PANEL:
+                bap_bundle.append(court)
+            else:
+                b_bundle.append(court)
+        elif court.jurisdiction in Court.STATE_JURISDICTIONS:
+            # State courts get bundled by supreme courts
+            if court.jurisdiction == Court.STATE_SUPREME:
+                # Whenever we hit a state supreme court, we append the
+                # previous bundle and start a new one.
+                if state_bundle:
+                    state_bundles.append(state_bundle)
+                state_bundle = [court]
+            else:
+                state_bundle.append(court)
+        elif court.jurisdiction in [
+            Court.FEDERAL_SPECIAL,
+            Court.COMMITTEE,
+            Court.INTERNATIONAL,
+        ]:
+            court_tabs["special"].append(court)
+
+    # append the final state bundle after the loop ends. Hack?
+    state_bundles.append(state_bundle)
+
+    # Put the bankruptcy bundles in the courts dict
+    if bap_bundle:
+        court_tabs["bankruptcy_panel"] = [bap_bundle]
+    court_tabs["bankruptcy"] = [b_bundle]
+
+    # Divide the state bundles into the correct partitions
+    court_tabs["state"].append(state_bundles[:17])
+    court_tabs["state"].append(state_bundles[17:34])
+    court_tabs["state"].append(state_bundles[34:])
+    return court_tabs
+
+
+class CheckedCourt(object):
+    """A court in the jurisdiction picker, and whether it's checked.
+
+    The registry's Court objects are shared by every request, so the checked
+    state goes on this wrapper instead of on them. Everything else is read
+    from the court.
+    """
+
+    __slots__ = ("court", "checked")
+
+    def __init__(self, court: Court, checked: bool) -> None:
+        self.court = court
+        self.checked = checked
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "court":
+            # Not set yet, as when unpickling.
+            raise AttributeError(name)
+        return getattr(self.court, name)
+
+
+class CourtRegistry(object):
+    """The courts in use, with the search form fields and tab layouts made
+    from them.
+    """
+
+    def __init__(self) -> None:
+        self.courts: List[Court] = []
+        self.court_fields: Dict[str, forms.BooleanField] = OrderedDict()
+        self.loaded = False
+        self.generation = None
+        self._tab_layouts: Dict[Tuple[str, ...], Dict[str, list]] = {}
+        self._lock = threading.Lock()
+
+    def load(self) -> None:
+        """Load the courts in use from the database."""
+        r = make_redis_interface("CACHE")
+        generation = r.get(GENERATION_KEY)
+        courts = list(Court.objects.filter(in_use=True))
+        self.courts = courts
+        self.court_fields = OrderedDict(
+            ("court_%s" % court.pk, make_court_field(court))
+            for court in courts
+        )
+        self._tab_layouts = {}
+        self.loaded = True
+        self.generation = generation
+
+    def refresh(self) -> None:
+        """Reload the registry if it's missing or out of date."""
+        r = make_redis_interface("CACHE")
+        with self._lock:
+            generation = r.get(GENERATION_KEY)
+            if not self.loaded or self.generation != generation:
+                self.load()
+
+    def get_courts(
+        self, exclude_bap: bool = False, pacer_only: bool = False
+    ) -> List[Court]:
+        """Get the courts in use, in order.
+
+        :param exclude_bap: Whether to leave out bankruptcy appellate panels.
+        :param pacer_only: Whether to only include current courts in PACER.
+        :return: A list of Court objects. They're shared, so don't change
+        them.
+        """
+        courts = self.courts
+        if exclude_bap:
+            courts = [
+                c
+                for c in courts
+                if c.jurisdiction != Court.FEDERAL_BANKRUPTCY_PANEL
+            ]
+        if pacer_only:
+            courts = [
+                c
+                for c in courts
+                if c.pacer_court_id is not None and c.end_date is None
+            ]
+        return courts
+
+    def get_tab_layout(self, courts: Sequence[Court]) -> Dict[str, list]:
+        """Get the tab layout of some courts, making it only the first time
+        it's asked for.
+        """
+        key = tuple(court.pk for court in courts)
+        layout = self._tab_layouts.get(key)
+        if layout is None:
+            layout = make_tab_layout(courts)
+            self._tab_layouts[key] = layout
+        return layout
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_court_registry() -> CourtRegistry:
+    """Get this process's court registry, loading or reloading it as
+    needed.
+    """
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = CourtRegistry()
+    _registry.refresh()
+    return _registry
+
+
+def invalidate_court_registry() -> None:
+    """Make every process reload its court registry the next time it's
+    used.
+    """
+    r = make_redis_interface("CACHE")
+    r.incr(GENERATION_KEY)
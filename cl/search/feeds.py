@@ -64,6 +64,8 @@ class SearchFeed(Feed):
             main_params["fq"].append("%s:[* TO *]" % order_by)
             items = solr.query().add_extra(**main_params).execute()
             solr.conn.http_connection.close()
+            if cd["type"] == SEARCH_TYPES.RECAP:
+                search_utils.add_recap_docket_fields(items)
             return items
         else:
             return []
@@ -0,0 +1,137 @@
+import time
+
+from django.template import loader
+
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.search_index_utils import (
+    assemble_opinion_texts,
+    get_opinion_body,
+    make_cluster_text,
+    make_opinion_text,
+    null_map,
+)
+from cl.search.models import Opinion
+
+
+def render_template_text(opinion):
+    """Make the indexed text of an opinion the way it was made before
+    make_opinion_text, by rendering a template.
+    """
+    text_template = loader.get_template("indexes/opinion_text.txt")
+    return text_template.render(
+        {"item": opinion, "citation_string": opinion.cluster.citation_string}
+    ).translate(null_map)
+
+
+def assemble_text(opinion):
+    """Make the indexed text of an opinion with make_opinion_text."""
+    return make_opinion_text(opinion, opinion.cluster.citation_string)
+
+
+def time_texts(opinions, make_text):
+    """Time making the indexed text of opinions.
+
+    :param opinions: The opinions.
+    :param make_text: A function that takes an opinion and returns its text.
+    :return: A tuple of the texts, and a sorted list of how long each took in
+    milliseconds.
+    """
+    texts = []
+    latencies = []
+    for opinion in opinions:
+        t1 = time.perf_counter()
+        texts.append(make_text(opinion))
+        latencies.append((time.perf_counter() - t1) * 1000)
+    return texts, sorted(latencies)
+
+
+class Command(VerboseCommand):
+    help = (
+        "Compare the time it takes to make the indexed text of opinions by "
+        "rendering the opinion_text.txt template with the time it takes "
+        "make_opinion_text to assemble it, and check that they match."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=200,
+            help="The number of opinions to time, starting with the newest.",
+        )
+        parser.add_argument(
+            "--processes",
+            type=int,
+            default=4,
+            help="The number of processes to also time assembling the texts "
+            "with. Use 1 to skip this.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        opinions = list(
+            Opinion.objects.select_related("cluster__docket__court")
+            .prefetch_related("cluster__panel")
+            .order_by("-pk")[: options["count"]]
+        )
+        count = len(opinions)
+        if not count:
+            logger.info("No opinions to time.")
+            return
+        size = sum(len(get_opinion_body(o)[0] or "") for o in opinions)
+        self.stdout.write(
+            "%s opinions, %.1fMB of text\n" % (count, size / 1024.0 / 1024)
+        )
+
+        results = {}
+        for name, make_text in (
+            ("template", render_template_text),
+            ("assemble", assemble_text),
+        ):
+            texts, latencies = time_texts(opinions, make_text)
+            results[name] = texts
+            self.stdout.write(
+                "%-8s  total: %8.3fs  mean: %8.3fms  p50: %8.3fms  "
+                "max: %8.3fms\n"
+                % (
+                    name,
+                    sum(latencies) / 1000,
+                    sum(latencies) / count,
+                    latencies[count // 2],
+                    latencies[-1],
+                )
+            )
+
+        processes = options["processes"]
+        if processes > 1:
+            args = []
+            for opinion in opinions:
+                body, is_html = get_opinion_body(opinion)
+                cluster_text = make_cluster_text(
+                    opinion.cluster, opinion.cluster.citation_string
+                )
+                args.append((body, is_html, cluster_text, opinion.sha1))
+            t1 = time.perf_counter()
+            texts = assemble_opinion_texts(args, processes=processes)
+            self.stdout.write(
+                "%-8s  total: %8.3fs  (%s processes)\n"
+                % ("pool", time.perf_counter() - t1, processes)
+            )
+            if texts != results["assemble"]:
+                logger.error("The texts from the pool don't match.")
+
+        mismatches = [
+            o.pk
+            for o, expected, text in zip(
+                opinions, results["template"], results["assemble"]
+            )
+            if expected != text
+        ]
+        if mismatches:
+            logger.error(
+                "%s texts don't match the template's, for opinions: %s",
+                len(mismatches),
+                ", ".join(str(pk) for pk in mismatches),
+            )
+        else:
+            self.stdout.write("All texts match the template's.\n")
@@ -0,0 +1,73 @@
+import time
+
+from django.http import QueryDict
+
+from cl.lib.command_utils import VerboseCommand
+from cl.lib.search_utils import merge_form_with_courts
+from cl.search.court_registry import get_court_registry
+from cl.search.forms import SearchForm, _clean_form
+
+
+def time_searches(query_string, count, cold):
+    """Time the court handling that do_search does for a search, leaving out
+    the Solr query.
+
+    :param query_string: The GET parameters of the search.
+    :param count: How many searches to time.
+    :param cold: Whether to reload the court registry before every search,
+    as if the courts, fields and tabs were made from scratch each time, the
+    way they were before the registry.
+    :return: A sorted list of per-search latencies in milliseconds.
+    """
+    latencies = []
+    for _ in range(count):
+        get_params = QueryDict(query_string, mutable=True)
+        t1 = time.perf_counter()
+        registry = get_court_registry()
+        if cold:
+            registry.load()
+        courts = registry.get_courts()
+        search_form = SearchForm(get_params)
+        if search_form.is_valid():
+            search_form = _clean_form(
+                get_params, search_form.cleaned_data, courts
+            )
+        merge_form_with_courts(courts, search_form)
+        latencies.append((time.perf_counter() - t1) * 1000)
+    return sorted(latencies)
+
+
+class Command(VerboseCommand):
+    help = (
+        "Compare the CPU time that show_results spends on the search form "
+        "and jurisdiction picker with the court registry warm versus "
+        "rebuilt for every search."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--count",
+            type=int,
+            default=200,
+            help="The number of searches to time in each mode.",
+        )
+        parser.add_argument(
+            "--query",
+            default="q=foo&type=o&court_ca1=on&court_scotus=on",
+            help="The query string of the search to time.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        count = options["count"]
+        for name, cold in (("rebuilt", True), ("registry", False)):
+            latencies = time_searches(options["query"], count, cold)
+            self.stdout.write(
+                "%-8s  mean: %7.3fms  p50: %7.3fms  p99: %7.3fms\n"
+                % (
+                    name,
+                    sum(latencies) / count,
+                    latencies[count // 2],
+                    latencies[int(count * 0.99)],
+                )
+            )
@@ -0,0 +1,129 @@
+import sys
+
+from django.utils.timezone import now
+
+from cl.lib.argparse_types import valid_date_time
+from cl.lib.celery_utils import CeleryThrottle
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.lib.db_tools import PartitionedQuerysetScanner
+from cl.search.models import Docket, RECAPDocument
+from cl.search.tasks import add_recap_blocks_to_solr
+
+
+def get_changed_docket_pks(since):
+    """Get the pks of the RECAP dockets that changed since a time, either
+    themselves or in their RECAP documents.
+
+    :param since: A datetime.
+    :return: A sorted list of Docket pks.
+    """
+    d_pks = set(
+        Docket.objects.filter(
+            source__in=Docket.RECAP_SOURCES, date_modified__gte=since
+        ).values_list("pk", flat=True)
+    )
+    d_pks.update(
+        RECAPDocument.objects.filter(date_modified__gte=since).values_list(
+            "docket_entry__docket_id", flat=True
+        )
+    )
+    return sorted(d_pks)
+
+
+class Command(VerboseCommand):
+    help = (
+        "Build a nested RECAP core, with a parent document for each docket "
+        "and its RECAP documents as children.\n\n"
+        "To switch to a nested core: create an empty core with a schema for "
+        "nested documents, build it with this command, noting the time it "
+        "started, then run it again with --changed-since that time to catch "
+        "up on what changed in the meantime. Then point SOLR_RECAP_URL at "
+        "the new core and set SOLR_RECAP_NESTED."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--solr-url",
+            required=True,
+            help="The URL of the nested core to build, e.g., "
+            "http://127.0.0.1:8983/solr/recap_nested",
+        )
+        parser.add_argument(
+            "--changed-since",
+            type=valid_date_time,
+            help="Only index the dockets that changed since this date "
+            "(YYYY-MM-DD) or date and time (YYYY-MM-DD HH:MM:SS).",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=10,
+            help="How many dockets to index per Celery task. Dockets can "
+            "have thousands of documents, so keep this small.",
+        )
+        parser.add_argument(
+            "--partitions",
+            type=int,
+            default=16,
+            help="How many pk ranges to scan the dockets in. Progress is "
+            "saved per range, so an interrupted build resumes where it "
+            "left off.",
+        )
+        parser.add_argument(
+            "--restart",
+            action="store_true",
+            default=False,
+            help="Forget the progress of earlier builds and start over.",
+        )
+        parser.add_argument(
+            "--queue",
+            default="celery",
+            help="The celery queue where the tasks should be processed.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        started = now()
+        if options["changed_since"]:
+            d_pks = get_changed_docket_pks(options["changed_since"])
+            scanner = None
+        else:
+            d_pks = scanner = PartitionedQuerysetScanner(
+                Docket.objects.filter(
+                    source__in=Docket.RECAP_SOURCES
+                ).values_list("pk", flat=True),
+                partitions=options["partitions"],
+                checkpoint_name="nested-recap-index",
+            )
+            if options["restart"]:
+                scanner.clear_checkpoints()
+
+        queue = options["queue"]
+        throttle = CeleryThrottle(queue_name=queue)
+        chunk = []
+        count = 0
+        for d_pk in d_pks:
+            chunk.append(d_pk)
+            count += 1
+            if len(chunk) >= options["chunk_size"]:
+                throttle.maybe_wait()
+                add_recap_blocks_to_solr.apply_async(
+                    args=(chunk, options["solr_url"]), queue=queue
+                )
+                chunk = []
+                sys.stdout.write("\rEnqueued %s dockets" % count)
+                sys.stdout.flush()
+        if chunk:
+            add_recap_blocks_to_solr.apply_async(
+                args=(chunk, options["solr_url"]), queue=queue
+            )
+        sys.stdout.write("\n")
+
+        if scanner is not None:
+            logger.info("Scanned %s", scanner.stats)
+        logger.info(
+            "Enqueued %s dockets. To catch up on changes made during the "
+            "build, run again with --changed-since '%s'.",
+            count,
+            started.strftime("%Y-%m-%d %H:%M:%S%z"),
+        )
@@ -7,7 +7,9 @@ from django.conf import settings
 from cl.lib.argparse_types import valid_date_time
 from cl.lib.celery_utils import CeleryThrottle
 from cl.lib.command_utils import VerboseCommand
+from cl.lib.db_tools import PartitionedQuerysetScanner
 from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.search_cache import bump_search_generation
 from cl.lib.timer import print_timing
 from cl.people_db.models import Person
 from cl.search.models import Docket
@@ -296,6 +298,7 @@ class Command(VerboseCommand):
             self.si.delete_all()
             self.stdout.write("  Committing the deletion...\n")
             self.si.commit()
+            bump_search_generation(self.solr_url, committed=True)
             self.stdout.write(
                 "\nDone. The index located at: %s\n"
                 "is now empty.\n" % self.solr_url
@@ -319,6 +322,7 @@ class Command(VerboseCommand):
             self.stdout.write("Deleting all item(s) newer than %s\n" % dt)
             self.si.delete(list(qs))
             self.si.commit()
+            bump_search_generation(self.solr_url, committed=True)
 
     @print_timing
     def delete_by_query(self, query):
@@ -333,6 +337,7 @@ class Command(VerboseCommand):
             )
             self.si.delete(queries=self.si.Q(**query_dict))
             self.si.commit()
+            bump_search_generation(self.solr_url, committed=True)
 
     @print_timing
     def add_or_update(self, *items):
@@ -382,12 +387,14 @@ class Command(VerboseCommand):
                 source__in=Docket.RECAP_SOURCES
             ).values_list("pk", flat=True)
             count = q.count()
-            q = q.iterator()
+            q = PartitionedQuerysetScanner(q)
         else:
             q = model.objects.values_list("pk", flat=True)
             count = q.count()
-            q = q.iterator()
+            q = PartitionedQuerysetScanner(q)
         self.process_queryset(q, count)
+        if isinstance(q, PartitionedQuerysetScanner):
+            self.stdout.write("Scanned %s\n" % q.stats)
 
     @print_timing
     def optimize(self):
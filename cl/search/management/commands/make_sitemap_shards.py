@@ -0,0 +1,48 @@
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.opinion_page.sitemap import DocketSitemap, OpinionSitemap
+from cl.search.models import SEARCH_TYPES
+from cl.sitemap import SitemapShardBuilder
+
+SHARDED_SITEMAPS = {
+    SEARCH_TYPES.OPINION: OpinionSitemap,
+    SEARCH_TYPES.RECAP: DocketSitemap,
+}
+
+
+class Command(VerboseCommand):
+    help = (
+        "Prebuild the pages of the largest sitemaps as gzipped files, so "
+        "they can be served without querying the database. Run it "
+        "regularly; after the first run only pages with changes are rebuilt."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--sections",
+            nargs="+",
+            choices=list(SHARDED_SITEMAPS.keys()),
+            default=list(SHARDED_SITEMAPS.keys()),
+            help="The sitemap sections to build.",
+        )
+        parser.add_argument(
+            "--full",
+            action="store_true",
+            default=False,
+            help="Rebuild every page instead of only those with changes. "
+            "This also drops items that were deleted from the database.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        for section in options["sections"]:
+            builder = SitemapShardBuilder(section, SHARDED_SITEMAPS[section]())
+            if options["full"]:
+                manifest = builder.build_all()
+            else:
+                manifest = builder.update()
+            logger.info(
+                "Built sitemap section '%s' with %s pages and %s URLs.",
+                section,
+                len(manifest["shards"]),
+                sum(shard["count"] for shard in manifest["shards"]),
+            )
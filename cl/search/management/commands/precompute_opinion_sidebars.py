@@ -0,0 +1,67 @@
+from datetime import timedelta
+from typing import List
+
+from django.utils.timezone import now
+
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.opinion_page.utils import load_opinion_sidebars
+from cl.search.models import OpinionCluster, OpinionsCited
+
+
+def get_clusters_to_precompute(top: int, days: int) -> List[int]:
+    """Get the clusters whose opinion pages are most likely to be viewed or
+    to have stale sidebars.
+
+    :param top: How many of the most cited clusters to include.
+    :param days: Include clusters cited by opinions added in this many days.
+    :return: A list of cluster pks, most cited first.
+    """
+    pks = list(
+        OpinionCluster.objects.order_by("-citation_count").values_list(
+            "pk", flat=True
+        )[:top]
+    )
+    since = now() - timedelta(days=days)
+    newly_cited = (
+        OpinionsCited.objects.filter(citing_opinion__date_created__gte=since)
+        .values_list("cited_opinion__cluster_id", flat=True)
+        .distinct()
+    )
+    seen = set(pks)
+    pks.extend(pk for pk in newly_cited if pk not in seen)
+    return pks
+
+
+class Command(VerboseCommand):
+    help = (
+        "Refresh the cached citing and related clusters shown on opinion "
+        "pages, so visitors rarely wait on those Solr queries. Run daily."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--top",
+            type=int,
+            default=10_000,
+            help="How many of the most cited clusters to refresh.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=1,
+            help="Also refresh clusters cited by opinions added in this "
+            "many days.",
+        )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        pks = get_clusters_to_precompute(options["top"], options["days"])
+        logger.info("Refreshing sidebars of %s clusters", len(pks))
+        for i, pk in enumerate(pks):
+            try:
+                cluster = OpinionCluster.objects.get(pk=pk)
+            except OpinionCluster.DoesNotExist:
+                continue
+            load_opinion_sidebars(cluster, use_cache=False)
+            if i % 1000 == 0:
+                logger.info("Refreshed %s clusters", i)
@@ -1,19 +1,21 @@
 import os
 import re
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Optional
 
 from celery.canvas import chain
 from django.contrib.contenttypes.fields import GenericRelation
 from django.core.exceptions import ValidationError
 from django.db import models
 from django.db.models import Prefetch, Q, QuerySet
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
 from django.template import loader
 from django.urls import NoReverseMatch, reverse
 from django.utils.encoding import force_str
 from django.utils.text import slugify
 from eyecite.find_citations import get_citations
 
-from cl.citations.utils import get_citation_depth_between_clusters
+from cl.citations.utils import get_citation_depths_from_cluster
 from cl.custom_filters.templatetags.text_filters import best_case_name
 from cl.lib import fields
 from cl.lib.date_time import midnight_pst
@@ -24,9 +26,17 @@ from cl.lib.model_helpers import (
 )
 from cl.lib.models import AbstractDateTimeModel, AbstractPDF
 from cl.lib.search_index_utils import (
+    RECAP_CHILD_RELATION,
+    RECAP_PARENT_FIELDS,
     InvalidDocumentError,
+    SolrFieldTracker,
+    make_cluster_text,
+    make_opinion_text,
+    make_recap_child,
+    make_recap_parent_id,
     normalize_search_dicts,
     null_map,
+    solr_date,
 )
 from cl.lib.storage import IncrementingFileSystemStorage
 from cl.lib.string_utils import trunc
@@ -171,7 +181,7 @@ class OriginatingCourtInformation(AbstractDateTimeModel):
         verbose_name_plural = "Originating Court Information"
 
 
-class Docket(AbstractDateTimeModel):
+class Docket(SolrFieldTracker, AbstractDateTimeModel):
     """A class to sit above OpinionClusters, Audio files, and Docket Entries,
     and link them together.
     """
@@ -592,6 +602,35 @@ class Docket(AbstractDateTimeModel):
             ),
         )
 
+    # The Solr fields of the docket's RECAPDocuments that come from each
+    # field. The documents' own absolute_urls keep the old slug until they're
+    # fully updated, but they still work.
+    solr_fields = {
+        "case_name": lambda d: {"caseName": best_case_name(d)},
+        "case_name_short": lambda d: {"caseName": best_case_name(d)},
+        "case_name_full": lambda d: {"caseName": best_case_name(d)},
+        "slug": lambda d: {"docket_absolute_url": d.get_absolute_url()},
+        "docket_number": lambda d: {"docketNumber": d.docket_number},
+        "nature_of_suit": lambda d: {"suitNature": d.nature_of_suit},
+        "cause": lambda d: {"cause": d.cause},
+        "jury_demand": lambda d: {"juryDemand": d.jury_demand},
+        "jurisdiction_type": lambda d: {
+            "jurisdictionType": d.jurisdiction_type
+        },
+        "date_argued": lambda d: {"dateArgued": solr_date(d.date_argued)},
+        "date_filed": lambda d: {"dateFiled": solr_date(d.date_filed)},
+        "date_terminated": lambda d: {
+            "dateTerminated": solr_date(d.date_terminated)
+        },
+        "assigned_to_str": lambda d: (
+            {} if d.assigned_to_id else {"assignedTo": d.assigned_to_str}
+        ),
+        "referred_to_str": lambda d: (
+            {} if d.referred_to_id else {"referredTo": d.referred_to_str}
+        ),
+    }
+    solr_full_update_fields = ("court_id", "assigned_to_id", "referred_to_id")
+
     def __str__(self) -> str:
         if self.case_name:
             return force_str("%s: %s" % (self.pk, self.case_name))
@@ -711,12 +750,10 @@ class Docket(AbstractDateTimeModel):
             ),
         )
 
-    def as_search_list(self):
-        """Create list of search dicts from a single docket. This should be
-        faster than creating a search dict per document on the docket.
+    def get_search_metadata(self):
+        """The fields of the docket that go in the search documents of its
+        RECAP documents, or in its parent document in a nested RECAP core.
         """
-        search_list = []
-
         # Docket
         out = {
             "docketNumber": self.docket_number,
@@ -780,6 +817,24 @@ class Docket(AbstractDateTimeModel):
                     out["firm_id"].add(f.pk)
                     out["firm"].add(f.name)
 
+        # IDs
+        out.update(
+            {
+                "assigned_to_id": getattr(self.assigned_to, "pk", None),
+                "referred_to_id": getattr(self.referred_to, "pk", None),
+            }
+        )
+        return out
+
+    def as_search_list(self):
+        """Create list of search dicts from a single docket. This should be
+        faster than creating a search dict per document on the docket.
+        """
+        from cl.lib.search_cache import get_docket_search_metadata
+
+        search_list = []
+        out = get_docket_search_metadata(self)
+
         # Do RECAPDocument and Docket Entries in a nested loop
         for de in self.docket_entries.all().iterator():
             # Docket Entry
@@ -805,8 +860,6 @@ class Docket(AbstractDateTimeModel):
                     "docket_entry_id": de.pk,
                     "docket_id": self.pk,
                     "court_id": self.court.pk,
-                    "assigned_to_id": getattr(self.assigned_to, "pk", None),
-                    "referred_to_id": getattr(self.referred_to, "pk", None),
                 }
 
                 # RECAPDocument
@@ -844,6 +897,31 @@ class Docket(AbstractDateTimeModel):
 
         return search_list
 
+    def as_nested_search_dict(self):
+        """Create the block of documents that a docket is indexed as in a
+        nested RECAP core: a parent document with the docket's fields, and a
+        child document for each of its RECAP documents.
+        """
+        from cl.lib.search_cache import get_docket_search_metadata
+
+        metadata = get_docket_search_metadata(self)
+        out = {k: v for k, v in metadata.items() if k in RECAP_PARENT_FIELDS}
+        text_template = loader.get_template("indexes/dockets_parent_text.txt")
+        out.update(
+            {
+                "id": make_recap_parent_id(self.pk),
+                "docket_id": self.pk,
+                "doc_type": "docket",
+                "text": text_template.render({"item": self}).translate(
+                    null_map
+                ),
+                RECAP_CHILD_RELATION: [
+                    make_recap_child(d) for d in self.as_search_list()
+                ],
+            }
+        )
+        return normalize_search_dicts(out)
+
     def reprocess_recap_content(self, do_original_xml=False):
         """Go over any associated RECAP files and reprocess them.
 
@@ -871,7 +949,7 @@ class Docket(AbstractDateTimeModel):
             process_docket_data(self, html.filepath.path, html.upload_type)
 
 
-class DocketEntry(AbstractDateTimeModel):
+class DocketEntry(SolrFieldTracker, AbstractDateTimeModel):
 
     docket = models.ForeignKey(
         Docket,
@@ -954,6 +1032,10 @@ class DocketEntry(AbstractDateTimeModel):
         ordering = ("recap_sequence_number", "entry_number")
         permissions = (("has_recap_api_access", "Can work with RECAP API"),)
 
+    # Entries aren't indexed on their own, but these fields are indexed with
+    # their RECAPDocuments, which fully update when one of them changes.
+    solr_full_update_fields = ("description", "entry_number", "date_filed")
+
     def __str__(self) -> str:
         return "<DocketEntry:%s ---> %s >" % (
             self.pk,
@@ -1014,7 +1096,9 @@ class AbstractPacerDocument(models.Model):
         abstract = True
 
 
-class RECAPDocument(AbstractPacerDocument, AbstractPDF, AbstractDateTimeModel):
+class RECAPDocument(
+    SolrFieldTracker, AbstractPacerDocument, AbstractPDF, AbstractDateTimeModel
+):
     """The model for Docket Documents and Attachments."""
 
     PACER_DOCUMENT = 1
@@ -1064,6 +1148,34 @@ class RECAPDocument(AbstractPacerDocument, AbstractPDF, AbstractDateTimeModel):
         ]
         permissions = (("has_recap_api_access", "Can work with RECAP API"),)
 
+    solr_fields = {
+        "description": lambda rd: {"short_description": rd.description},
+        "is_available": lambda rd: {"is_available": rd.is_available},
+        "page_count": lambda rd: {"page_count": rd.page_count},
+        "filepath_local": lambda rd: {
+            "filepath_local": (
+                rd.filepath_local.path if rd.filepath_local else None
+            )
+        },
+    }
+    solr_full_update_fields = (
+        "docket_entry_id",
+        "document_type",
+        "document_number",
+        "attachment_number",
+        "plain_text",
+    )
+
+    def get_solr_changes(self) -> Optional[Dict[str, Any]]:
+        changes = super(RECAPDocument, self).get_solr_changes()
+        # The fields of the docket entry are indexed with the document too.
+        # Entries don't index themselves, so if the entry was loaded with
+        # the document and its indexed fields changed, do a full update.
+        if changes is not None and RECAPDocument.docket_entry.is_cached(self):
+            if self.docket_entry.get_solr_changes() != {}:
+                return None
+        return changes
+
     def __str__(self) -> str:
         return "%s: Docket_%s , document_number_%s , attachment_number_%s" % (
             self.pk,
@@ -1208,19 +1320,29 @@ class RECAPDocument(AbstractPacerDocument, AbstractPDF, AbstractDateTimeModel):
                         % (self.pk, other.pk)
                     )
 
+        solr_changes = self.get_solr_changes()
         super(RECAPDocument, self).save(*args, **kwargs)
+        self.reset_solr_changes()
         tasks = []
         if do_extraction and self.needs_extraction:
             # Context extraction not done and is requested.
             from cl.scrapers.tasks import extract_recap_pdf
 
             tasks.append(extract_recap_pdf.si(self.pk))
-        if index:
+        if index and solr_changes is None:
             from cl.search.tasks import add_items_to_solr
 
             tasks.append(
                 add_items_to_solr.si([self.pk], "search.RECAPDocument")
             )
+        elif index and solr_changes:
+            from cl.search.tasks import update_solr_fields
+
+            tasks.append(
+                update_solr_fields.si(
+                    {self.pk: solr_changes}, "search.RECAPDocument"
+                )
+            )
         if len(tasks) > 0:
             chain(*tasks)()
 
@@ -1237,80 +1359,27 @@ class RECAPDocument(AbstractPacerDocument, AbstractPDF, AbstractDateTimeModel):
 
     def get_docket_metadata(self):
         """The metadata for the item that comes from the Docket."""
+        from cl.lib.search_cache import get_docket_search_metadata
+
+        docket = self.docket_entry.docket
+        out = get_docket_search_metadata(docket)
+        out.update({"docket_id": docket.pk, "court_id": docket.court.pk})
+        return out
+
+    def get_nested_docket_metadata(self):
+        """The metadata for the item that comes from the Docket, when it's
+        indexed as a child of the docket in a nested RECAP core. Only the
+        fields that children keep are needed, so the docket's parties and
+        judges aren't looked up.
+        """
         docket = self.docket_entry.docket
-        # IDs
         out = {
             "docket_id": docket.pk,
-            "court_id": docket.court.pk,
-            "assigned_to_id": getattr(docket.assigned_to, "pk", None),
-            "referred_to_id": getattr(docket.referred_to, "pk", None),
+            "court_id": docket.court_id,
+            "court_exact": docket.court_id,
         }
-
-        # Docket
-        out.update(
-            {
-                "docketNumber": docket.docket_number,
-                "caseName": best_case_name(docket),
-                "suitNature": docket.nature_of_suit,
-                "cause": docket.cause,
-                "juryDemand": docket.jury_demand,
-                "jurisdictionType": docket.jurisdiction_type,
-            }
-        )
-        if docket.date_argued is not None:
-            out["dateArgued"] = midnight_pst(docket.date_argued)
         if docket.date_filed is not None:
             out["dateFiled"] = midnight_pst(docket.date_filed)
-        if docket.date_terminated is not None:
-            out["dateTerminated"] = midnight_pst(docket.date_terminated)
-        try:
-            out["docket_absolute_url"] = docket.get_absolute_url()
-        except NoReverseMatch:
-            raise InvalidDocumentError(
-                "Unable to save to index due to missing absolute_url: %s"
-                % self.pk
-            )
-
-        # Judges
-        if docket.assigned_to is not None:
-            out["assignedTo"] = docket.assigned_to.name_full
-        elif docket.assigned_to_str:
-            out["assignedTo"] = docket.assigned_to_str
-        if docket.referred_to is not None:
-            out["referredTo"] = docket.referred_to.name_full
-        elif docket.referred_to_str:
-            out["referredTo"] = docket.referred_to_str
-
-        # Court
-        out.update(
-            {
-                "court": docket.court.full_name,
-                "court_exact": docket.court_id,  # For faceting
-                "court_citation_string": docket.court.citation_string,
-            }
-        )
-
-        # Parties, Attorneys, Firms
-        out.update(
-            {
-                "party_id": set(),
-                "party": set(),
-                "attorney_id": set(),
-                "attorney": set(),
-                "firm_id": set(),
-                "firm": set(),
-            }
-        )
-        for p in docket.prefetched_parties:
-            out["party_id"].add(p.pk)
-            out["party"].add(p.name)
-            for a in p.attys_in_docket:
-                out["attorney_id"].add(a.pk)
-                out["attorney"].add(a.name)
-                for f in a.firms_in_docket:
-                    out["firm_id"].add(f.pk)
-                    out["firm"].add(f.name)
-
         return out
 
     def as_search_dict(self, docket_metadata=None):
@@ -1326,7 +1395,7 @@ class RECAPDocument(AbstractPacerDocument, AbstractPDF, AbstractDateTimeModel):
         every RECAPDocument on the docket. This can provide big performance
         boosts.
         """
-        out = docket_metadata or self.get_docket_metadata()
+        out = (docket_metadata or self.get_docket_metadata()).copy()
 
         # IDs
         out.update({"id": self.pk, "docket_entry_id": self.docket_entry.pk})
@@ -1367,6 +1436,16 @@ class RECAPDocument(AbstractPacerDocument, AbstractPDF, AbstractDateTimeModel):
 
         return normalize_search_dicts(out)
 
+    def as_nested_search_dict(self, docket_metadata=None):
+        """Create the child document that the item is indexed as in a nested
+        RECAP core.
+
+        :param docket_metadata: The result of get_nested_docket_metadata(),
+        if it's already known, as when adding many items from one docket.
+        """
+        metadata = docket_metadata or self.get_nested_docket_metadata()
+        return make_recap_child(self.as_search_dict(docket_metadata=metadata))
+
 
 class BankruptcyInformation(AbstractDateTimeModel):
     docket = models.OneToOneField(
@@ -1862,7 +1941,7 @@ class ClusterCitationQuerySet(models.query.QuerySet):
         return clone
 
 
-class OpinionCluster(AbstractDateTimeModel):
+class OpinionCluster(SolrFieldTracker, AbstractDateTimeModel):
     """A class representing a cluster of court opinions."""
 
     SCDB_DECISION_DIRECTIONS = (
@@ -2111,6 +2190,36 @@ class OpinionCluster(AbstractDateTimeModel):
 
     objects = ClusterCitationQuerySet.as_manager()
 
+    # The Solr fields of the cluster's opinions that come from each field
+    solr_fields = {
+        "case_name": lambda c: {"caseName": best_case_name(c)},
+        "case_name_short": lambda c: {
+            "caseName": best_case_name(c),
+            "caseNameShort": c.case_name_short,
+        },
+        "case_name_full": lambda c: {"caseName": best_case_name(c)},
+        "slug": lambda c: {"absolute_url": c.get_absolute_url()},
+        "judges": lambda c: {"judge": c.judges},
+        "attorneys": lambda c: {"attorney": c.attorneys},
+        "nature_of_suit": lambda c: {"suitNature": c.nature_of_suit},
+        "citation_count": lambda c: {"citeCount": c.citation_count},
+        "scdb_id": lambda c: {"scdb_id": c.scdb_id},
+        "source": lambda c: {"source": c.source},
+        "precedential_status": lambda c: {
+            "status": c.get_precedential_status_display(),
+            "status_exact": c.get_precedential_status_display(),
+        },
+        "date_filed": lambda c: {"dateFiled": solr_date(c.date_filed)},
+    }
+    # The cluster's fields that are only in the text field, which atomic
+    # updates don't touch, need full updates too.
+    solr_full_update_fields = (
+        "docket_id",
+        "procedural_history",
+        "posture",
+        "syllabus",
+    )
+
     @property
     def caption(self):
         """Make a proper caption
@@ -2169,20 +2278,13 @@ class OpinionCluster(AbstractDateTimeModel):
         authorities.
         """
         # All clusters that have sub_opinions cited by the sub_opinions of
-        # the current cluster, ordered by citation count, descending.
-        # Note that:
-        #  - sum()'ing an empty list with a nested one, flattens the nested
-        #    list.
-        #  - QuerySets are lazy by default, so we need to call list() on the
-        #    queryset object to evaluate it here and now.
+        # the current cluster, ordered by citation count, descending. The
+        # cited opinions are found in a subquery so this is a single query.
+        cited_opinions = Opinion.objects.filter(
+            citing_opinions__citing_opinion__cluster=self
+        ).values("pk")
         return OpinionCluster.objects.filter(
-            sub_opinions__in=sum(
-                [
-                    list(sub_opinion.opinions_cited.all().only("pk"))
-                    for sub_opinion in self.sub_opinions.all()
-                ],
-                [],
-            )
+            sub_opinions__in=cited_opinions
         ).order_by("-citation_count", "-date_filed")
 
     @property
@@ -2193,12 +2295,9 @@ class OpinionCluster(AbstractDateTimeModel):
     def has_private_authority(self):
         if not hasattr(self, "_has_private_authority"):
             # Calculate it, then cache it.
-            private = False
-            for authority in self.authorities:
-                if authority.blocked:
-                    private = True
-                    break
-            self._has_private_authority = private
+            self._has_private_authority = self.authorities.filter(
+                blocked=True
+            ).exists()
         return self._has_private_authority
 
     @property
@@ -2208,16 +2307,23 @@ class OpinionCluster(AbstractDateTimeModel):
         view template.
         The returned list is sorted by that citation count field.
         """
-        authorities_with_data = list(self.authorities)
-        for authority in authorities_with_data:
-            authority.citation_depth = get_citation_depth_between_clusters(
-                citing_cluster_pk=self.pk, cited_cluster_pk=authority.pk
+        if not hasattr(self, "_authorities_with_data"):
+            # Calculate it, then cache it. The depths for every authority are
+            # gathered in one query instead of one per authority.
+            depths = get_citation_depths_from_cluster(self.pk)
+            authorities_with_data = list(
+                self.authorities.select_related(
+                    "docket__court"
+                ).prefetch_related("citations", "sub_opinions")
             )
+            for authority in authorities_with_data:
+                authority.citation_depth = depths.get(authority.pk)
 
-        authorities_with_data.sort(
-            key=lambda x: x.citation_depth, reverse=True
-        )
-        return authorities_with_data
+            authorities_with_data.sort(
+                key=lambda x: x.citation_depth or 0, reverse=True
+            )
+            self._authorities_with_data = authorities_with_data
+        return self._authorities_with_data
 
     def top_visualizations(self):
         return self.visualizations.filter(
@@ -2235,13 +2341,21 @@ class OpinionCluster(AbstractDateTimeModel):
 
     def save(self, index=True, force_commit=False, *args, **kwargs):
         self.slug = slugify(trunc(best_case_name(self), 75))
+        solr_changes = self.get_solr_changes()
         super(OpinionCluster, self).save(*args, **kwargs)
-        if index:
+        self.reset_solr_changes()
+        if index and solr_changes is None:
             from cl.search.tasks import add_items_to_solr
 
             add_items_to_solr.delay(
                 [self.pk], "search.OpinionCluster", force_commit
             )
+        elif index and solr_changes:
+            from cl.search.tasks import update_solr_fields
+
+            update_solr_fields.delay(
+                {self.pk: solr_changes}, "search.OpinionCluster", force_commit
+            )
 
     def delete(self, *args, **kwargs):
         """
@@ -2332,7 +2446,8 @@ class OpinionCluster(AbstractDateTimeModel):
 
         # Opinion
         search_list = []
-        text_template = loader.get_template("indexes/opinion_text.txt")
+        # The cluster's part of the text is the same for all its opinions
+        cluster_text = make_cluster_text(self, self.citation_string)
         for opinion in self.sub_opinions.all():
             # Always make a copy to get a fresh version above metadata. Failure
             # to do this pushes metadata from previous iterations to objects
@@ -2347,12 +2462,9 @@ class OpinionCluster(AbstractDateTimeModel):
                     "type": opinion.type,
                     "download_url": opinion.download_url or None,
                     "local_path": str(opinion.local_path),
-                    "text": text_template.render(
-                        {
-                            "item": opinion,
-                            "citation_string": self.citation_string,
-                        }
-                    ).translate(null_map),
+                    "text": make_opinion_text(
+                        opinion, self.citation_string, cluster_text
+                    ),
                 }
             )
 
@@ -2760,11 +2872,8 @@ class Opinion(AbstractDateTimeModel):
         }
         out.update(court)
 
-        # Load the document text using a template for cleanup and concatenation
-        text_template = loader.get_template("indexes/opinion_text.txt")
-        out["text"] = text_template.render(
-            {"item": self, "citation_string": self.cluster.citation_string}
-        ).translate(null_map)
+        # Assemble the document text the way indexes/opinion_text.txt does
+        out["text"] = make_opinion_text(self, self.cluster.citation_string)
 
         return normalize_search_dicts(out)
 
@@ -2903,3 +3012,56 @@ class SEARCH_TYPES:
         (PEOPLE, "People"),
     )
     ALL_TYPES = [OPINION, RECAP, ORAL_ARGUMENT, PEOPLE]
+
+
+@receiver(post_save, sender=DocketEntry)
+def increment_docket_entry_count(sender, instance, created, **kwargs):
+    """Keep the cached entry count of the docket up to date."""
+    if created and instance.docket_id:
+        from cl.opinion_page.utils import adjust_docket_entry_count
+
+        adjust_docket_entry_count(instance.docket_id, 1)
+
+
+@receiver(post_delete, sender=DocketEntry)
+def decrement_docket_entry_count(sender, instance, **kwargs):
+    """Keep the cached entry count of the docket up to date."""
+    if instance.docket_id:
+        from cl.opinion_page.utils import adjust_docket_entry_count
+
+        adjust_docket_entry_count(instance.docket_id, -1)
+
+
+@receiver(post_save, sender=Court)
+@receiver(post_delete, sender=Court)
+def invalidate_court_registry_on_change(sender, **kwargs):
+    """Make processes reload their court registry when courts change."""
+    from cl.search.court_registry import invalidate_court_registry
+
+    invalidate_court_registry()
+
+
+@receiver(m2m_changed, sender=OpinionCluster.panel.through)
+@receiver(m2m_changed, sender=OpinionCluster.non_participating_judges.through)
+def mark_cluster_judges_changed(sender, instance, action, reverse, **kwargs):
+    """Make the next save of a cluster fully update its opinions in Solr
+    when its judges change.
+
+    Changes made from the judges' side of the relation aren't noticed.
+    """
+    if not reverse and action in ["post_add", "post_remove", "post_clear"]:
+        instance.mark_solr_stale()
+
+
+@receiver(post_save, sender=Citation)
+@receiver(post_delete, sender=Citation)
+def mark_cluster_citations_changed(sender, instance, **kwargs):
+    """Make the next save of a cluster fully update its opinions in Solr
+    when its citations change.
+
+    Only the cluster object the citation was made with is marked, so code
+    that makes citations from a cluster's id should index the cluster
+    itself.
+    """
+    if Citation.cluster.is_cached(instance):
+        instance.cluster.mark_solr_stale()
@@ -8,8 +8,23 @@ from django.utils.timezone import now
 from scorched.exc import SolrError
 
 from cl.celery_init import app
-from cl.lib.search_index_utils import InvalidDocumentError
-from cl.search.models import Docket, OpinionCluster, RECAPDocument
+from cl.lib.scorched_utils import ExtraSolrInterface
+from cl.lib.search_cache import bump_search_generation
+from cl.lib.search_index_utils import (
+    RECAP_CHILD_FIELDS,
+    RECAP_CHILD_FILTER,
+    RECAP_CHILD_RELATION,
+    RECAP_PARENT_FILTER,
+    InvalidDocumentError,
+    format_solr_dates,
+    make_atomic_update,
+    make_recap_child_update,
+    make_recap_parent_id,
+)
+from cl.search.models import Docket, Opinion, OpinionCluster, RECAPDocument
+
+# How many documents to fetch the ids of, and send to Solr, at once
+PARTIAL_UPDATE_BATCH_SIZE = 1000
 
 
 @app.task
@@ -21,9 +36,48 @@ def add_items_to_solr(item_pks, app_label, force_commit=False):
     :param force_commit: Whether to send a commit to Solr after your addition.
     This is generally not advised and is mostly used for testing.
     """
-    search_dicts = []
     model = apps.get_model(app_label)
+    if settings.SOLR_RECAP_NESTED and model in [Docket, RECAPDocument]:
+        try:
+            send_nested_recap_items(model, item_pks, force_commit)
+        except (socket.error, SolrError) as exc:
+            add_items_to_solr.retry(exc=exc, countdown=30)
+        return
+
     items = model.objects.filter(pk__in=item_pks).order_by()
+    if model == RECAPDocument:
+        # Group the documents by docket, to look up each docket once
+        search_dicts = make_recap_search_dicts(item_pks)
+    else:
+        search_dicts = make_search_dicts(model, items)
+
+    si = scorched.SolrInterface(settings.SOLR_URLS[app_label], mode="w")
+    try:
+        si.add(search_dicts)
+        if force_commit:
+            si.commit()
+        si.conn.http_connection.close()
+    except (socket.error, SolrError) as exc:
+        add_items_to_solr.retry(exc=exc, countdown=30)
+    else:
+        bump_search_generation(
+            settings.SOLR_URLS[app_label], committed=force_commit
+        )
+        # Mark dockets as updated if needed
+        if model == Docket:
+            items.update(date_modified=now(), date_last_index=now())
+        si.conn.http_connection.close()
+
+
+def make_search_dicts(model, items):
+    """Make the search dicts of items, skipping the ones that can't be
+    indexed.
+
+    :param model: The model of the items.
+    :param items: An iterable of the items.
+    :return: A list of search dicts.
+    """
+    search_dicts = []
     for item in items:
         try:
             if model in [OpinionCluster, Docket]:
@@ -37,19 +91,317 @@ def add_items_to_solr(item_pks, app_label, force_commit=False):
             print("ValueError trying to add: %s\n  %s" % (item, e))
         except InvalidDocumentError:
             print("Unable to parse: %s" % item)
+    return search_dicts
 
-    si = scorched.SolrInterface(settings.SOLR_URLS[app_label], mode="w")
+
+def get_recap_documents(rd_pks):
+    """Get RECAPDocuments for indexing, with their dockets loaded once.
+
+    The documents of a docket share one Docket object, with its court and
+    judges, so rendering their search dicts doesn't look them up again for
+    each document.
+
+    :param rd_pks: The pks of the RECAPDocuments.
+    :return: A dict of Docket pks to lists of their RECAPDocuments.
+    """
+    rds = (
+        RECAPDocument.objects.filter(pk__in=rd_pks)
+        .select_related("docket_entry")
+        .order_by()
+    )
+    rds_by_docket = {}
+    for rd in rds:
+        rds_by_docket.setdefault(rd.docket_entry.docket_id, []).append(rd)
+    dockets = Docket.objects.filter(pk__in=list(rds_by_docket)).select_related(
+        "court", "assigned_to", "referred_to"
+    )
+    for d in dockets:
+        for rd in rds_by_docket[d.pk]:
+            rd.docket_entry.docket = d
+    return rds_by_docket
+
+
+def make_recap_search_dicts(rd_pks):
+    """Make the search dicts of RECAPDocuments, getting the metadata of each
+    of their dockets once, from the cache if possible.
+
+    :param rd_pks: The pks of the RECAPDocuments.
+    :return: A list of search dicts, skipping items that can't be indexed.
+    """
+    search_dicts = []
+    for d_pk, rds in get_recap_documents(rd_pks).items():
+        try:
+            metadata = rds[0].get_docket_metadata()
+        except InvalidDocumentError:
+            print("Unable to parse docket: %s" % d_pk)
+            continue
+        for rd in rds:
+            try:
+                search_dicts.append(
+                    rd.as_search_dict(docket_metadata=metadata)
+                )
+            except AttributeError as e:
+                print("AttributeError trying to add: %s\n  %s" % (rd, e))
+            except ValueError as e:
+                print("ValueError trying to add: %s\n  %s" % (rd, e))
+            except InvalidDocumentError:
+                print("Unable to parse: %s" % rd)
+    return search_dicts
+
+
+def make_recap_blocks(dockets):
+    """Make the blocks of documents that dockets are indexed as in a nested
+    RECAP core, skipping the ones that can't be indexed.
+
+    :param dockets: An iterable of Dockets.
+    :return: A list of parent documents, each with its children.
+    """
+    blocks = []
+    for d in dockets:
+        try:
+            blocks.append(format_solr_dates(d.as_nested_search_dict()))
+        except AttributeError as e:
+            print("AttributeError trying to add: %s\n  %s" % (d, e))
+        except ValueError as e:
+            print("ValueError trying to add: %s\n  %s" % (d, e))
+        except InvalidDocumentError:
+            print("Unable to parse: %s" % d)
+    return blocks
+
+
+def get_indexed_recap_ids(si, rd_pks, d_pks):
+    """Find which RECAP documents and dockets are already in a nested core.
+
+    :param si: A readable ExtraSolrInterface for the core.
+    :param rd_pks: The pks of RECAPDocuments to look for.
+    :param d_pks: The pks of Dockets to look for.
+    :return: A tuple of the set of the RECAPDocument pks that have child
+    documents, and the set of the Docket pks that have parent documents.
+    """
+    if not rd_pks and not d_pks:
+        return set(), set()
+    params = {
+        "q": "(%s AND id:(%s)) OR (%s AND docket_id:(%s))"
+        % (
+            RECAP_CHILD_FILTER,
+            " OR ".join(str(pk) for pk in rd_pks) or "0",
+            RECAP_PARENT_FILTER,
+            " OR ".join(str(pk) for pk in d_pks) or "0",
+        ),
+        "fl": "id,doc_type,docket_id",
+        "rows": len(rd_pks) + len(d_pks),
+        "caller": "get_indexed_recap_ids",
+    }
+    rd_ids, d_ids = set(), set()
+    for doc in si.query().add_extra(**params).execute().result.docs:
+        if doc["doc_type"] == "docket":
+            d_ids.add(int(doc["docket_id"]))
+        else:
+            rd_ids.add(int(doc["id"]))
+    return rd_ids, d_ids
+
+
+def add_nested_recap_items(si, model, item_pks):
+    """Add or update Dockets or RECAPDocuments in a nested RECAP core.
+
+    Dockets are indexed as blocks, with their RECAP documents. RECAP
+    documents only touch their own child documents: ones that are already in
+    the core are updated in place, and new ones are added to their dockets'
+    blocks. Only if a docket isn't in the core yet is its whole block indexed.
+
+    :param si: A readable and writable ExtraSolrInterface for the core.
+    :param model: Docket or RECAPDocument.
+    :param item_pks: The pks of the items to add.
+    :return: The pks of the dockets whose blocks were indexed.
+    """
+    if model == Docket:
+        dockets = Docket.objects.filter(pk__in=item_pks).order_by()
+        si.add(make_recap_blocks(dockets))
+        return list(item_pks)
+
+    rds_by_docket = get_recap_documents(item_pks)
+    indexed_rds, indexed_dockets = get_indexed_recap_ids(
+        si,
+        [rd.pk for rds in rds_by_docket.values() for rd in rds],
+        list(rds_by_docket),
+    )
+
+    docs = []
+    new_blocks = []
+    for d_pk, d_rds in rds_by_docket.items():
+        if d_pk not in indexed_dockets:
+            new_blocks.append(d_pk)
+            continue
+        metadata = d_rds[0].get_nested_docket_metadata()
+        new_children = []
+        for rd in d_rds:
+            try:
+                child = rd.as_nested_search_dict(docket_metadata=metadata)
+            except InvalidDocumentError:
+                print("Unable to parse: %s" % rd)
+                continue
+            if rd.pk not in indexed_rds:
+                new_children.append(child)
+                continue
+            # Set every field, removing the ones the item no longer has
+            fields = {name: None for name in RECAP_CHILD_FIELDS}
+            fields.update(child)
+            del fields["id"]
+            docs.append(make_recap_child_update(rd.pk, d_pk, fields))
+        if new_children:
+            docs.append(
+                {
+                    "id": make_recap_parent_id(d_pk),
+                    RECAP_CHILD_RELATION: {"add": new_children},
+                }
+            )
+    if docs:
+        si.add(format_solr_dates(docs))
+    if new_blocks:
+        dockets = Docket.objects.filter(pk__in=new_blocks).order_by()
+        si.add(make_recap_blocks(dockets))
+    return new_blocks
+
+
+def send_nested_recap_items(model, item_pks, force_commit=False):
+    """Add or update Dockets or RECAPDocuments in the nested RECAP core, and
+    mark the dockets whose blocks were indexed.
+
+    :param model: Docket or RECAPDocument.
+    :param item_pks: The pks of the items to add.
+    :param force_commit: Whether to send a commit to Solr afterwards.
+    """
+    si = ExtraSolrInterface(settings.SOLR_RECAP_URL, mode="rw")
     try:
-        si.add(search_dicts)
+        d_pks = add_nested_recap_items(si, model, item_pks)
         if force_commit:
             si.commit()
+    finally:
         si.conn.http_connection.close()
+    bump_search_generation(settings.SOLR_RECAP_URL, committed=force_commit)
+    Docket.objects.filter(pk__in=d_pks).update(
+        date_modified=now(), date_last_index=now()
+    )
+
+
+def get_nested_recap_updates(model, item_pks, updates):
+    """Make the atomic updates that change some fields of Dockets or
+    RECAPDocuments in a nested RECAP core.
+
+    The fields of a docket are changed in its parent document, except for
+    the few that its RECAP documents keep too, which are changed in each of
+    them.
+
+    :param model: Docket or RECAPDocument.
+    :param item_pks: The pks of the items to update.
+    :param updates: A dict of item pks to dicts of the Solr fields that
+    changed and their new values.
+    :return: A list of atomic updates.
+    """
+    docs = []
+    if model == Docket:
+        child_updates = {}
+        for pk in item_pks:
+            parent_fields = {}
+            for name, value in updates[pk].items():
+                if name in RECAP_CHILD_FIELDS:
+                    child_updates.setdefault(pk, {})[name] = value
+                else:
+                    parent_fields[name] = value
+            if parent_fields:
+                docs.append(
+                    make_atomic_update(make_recap_parent_id(pk), parent_fields)
+                )
+        children = RECAPDocument.objects.filter(
+            docket_entry__docket_id__in=list(child_updates)
+        ).values_list(
+            "docket_entry__docket_id", "pk", "docket_entry__docket_id"
+        )
+    else:
+        child_updates = updates
+        children = RECAPDocument.objects.filter(pk__in=item_pks).values_list(
+            "pk", "pk", "docket_entry__docket_id"
+        )
+    for item_pk, rd_pk, d_pk in children:
+        docs.append(
+            make_recap_child_update(rd_pk, d_pk, child_updates[item_pk])
+        )
+    return format_solr_dates(docs)
+
+
+def get_solr_doc_ids(model, item_pks):
+    """Get the ids of the Solr documents that are made from some items.
+
+    Clusters are indexed as their opinions, and dockets as their RECAP
+    documents. Everything else is indexed as itself.
+
+    :param model: The model of the items.
+    :param item_pks: The pks of the items.
+    :return: A list of (item pk, Solr document id) tuples.
+    """
+    if model == OpinionCluster:
+        return Opinion.objects.filter(cluster_id__in=item_pks).values_list(
+            "cluster_id", "pk"
+        )
+    if model == Docket:
+        return RECAPDocument.objects.filter(
+            docket_entry__docket_id__in=item_pks
+        ).values_list("docket_entry__docket_id", "pk")
+    return [(pk, pk) for pk in item_pks]
+
+
+def send_solr_field_updates(si, updates, app_label):
+    """Send atomic updates that change some fields of items' documents.
+
+    :param si: A writable SolrInterface for the items' core.
+    :param updates: A dict of item pks to dicts of the Solr fields that
+    changed and their new values. See make_atomic_update for the values.
+    :param app_label: The type of the items.
+    :return: None
+    """
+    model = apps.get_model(app_label)
+    nested = settings.SOLR_RECAP_NESTED and model in [Docket, RECAPDocument]
+    item_pks = sorted(updates)
+    for i in range(0, len(item_pks), PARTIAL_UPDATE_BATCH_SIZE):
+        batch = item_pks[i : i + PARTIAL_UPDATE_BATCH_SIZE]
+        if nested:
+            docs = get_nested_recap_updates(model, batch, updates)
+        else:
+            docs = [
+                make_atomic_update(doc_id, updates[item_pk])
+                for item_pk, doc_id in get_solr_doc_ids(model, batch)
+            ]
+        if docs:
+            si.add(docs, chunk=PARTIAL_UPDATE_BATCH_SIZE)
+
+
+@app.task
+def update_solr_fields(updates, app_label, force_commit=False):
+    """Change only some fields of items in Solr.
+
+    Unlike add_items_to_solr, this doesn't rebuild the items' documents or
+    send their text again. Use it when you know which fields changed, e.g.,
+    from SolrFieldTracker.get_solr_changes().
+
+    :param updates: A dict of item pks to dicts of the Solr fields that
+    changed and their new values.
+    :param app_label: The type of the items.
+    :param force_commit: Whether to send a commit to Solr after the update.
+    """
+    if not updates:
+        return
+    si = scorched.SolrInterface(settings.SOLR_URLS[app_label], mode="w")
+    try:
+        send_solr_field_updates(si, updates, app_label)
+        if force_commit:
+            si.commit()
     except (socket.error, SolrError) as exc:
-        add_items_to_solr.retry(exc=exc, countdown=30)
+        update_solr_fields.retry(exc=exc, countdown=30)
     else:
-        # Mark dockets as updated if needed
-        if model == Docket:
-            items.update(date_modified=now(), date_last_index=now())
+        bump_search_generation(
+            settings.SOLR_URLS[app_label], committed=force_commit
+        )
+    finally:
         si.conn.http_connection.close()
 
 
@@ -71,10 +423,18 @@ def add_or_update_recap_docket(
     updated it in Solr. If that date is after a threshold, we just don't do the
     update unless we know the docket has something new.
 
+    When no documents were added, but we know which of the docket's fields
+    changed, only those fields are sent, as atomic updates. The documents are
+    fully updated the next time the docket goes stale without changes.
+
+    If the RECAP core is nested (see SOLR_RECAP_NESTED), the docket's fields
+    are only in its parent document, so those updates are a single write.
+
     :param data: A dictionary containing the a key for 'docket_pk' and
     'content_updated'. 'docket_pk' will be used to find the docket to modify.
     'content_updated' is a boolean indicating whether the docket must be
-    updated.
+    updated. It can also have a 'solr_changes' key with a dict of the Solr
+    fields of the docket that changed, from Docket.get_solr_changes().
     :param force_commit: Whether to send a commit to Solr (this is usually not
     needed).
     :param update_threshold: Items staler than this number of seconds will be
@@ -84,23 +444,47 @@ def add_or_update_recap_docket(
         return
 
     si = scorched.SolrInterface(settings.SOLR_RECAP_URL, mode="w")
+    update_not_required = not data.get("content_updated", False)
+    solr_changes = data.get("solr_changes")
+    if update_not_required and solr_changes:
+        try:
+            send_solr_field_updates(
+                si, {data["docket_pk"]: solr_changes}, "search.Docket"
+            )
+            if force_commit:
+                si.commit()
+        except (socket.error, SolrError) as exc:
+            add_or_update_recap_docket.retry(exc=exc, countdown=30)
+        else:
+            bump_search_generation(
+                settings.SOLR_RECAP_URL, committed=force_commit
+            )
+        finally:
+            si.conn.http_connection.close()
+        return
+
     some_time_ago = now() - timedelta(seconds=update_threshold)
     d = Docket.objects.get(pk=data["docket_pk"])
     too_fresh = d.date_last_index is not None and (
         d.date_last_index > some_time_ago
     )
-    update_not_required = not data.get("content_updated", False)
     if all([too_fresh, update_not_required]):
         return
     else:
         try:
-            si.add(d.as_search_list())
+            if settings.SOLR_RECAP_NESTED:
+                si.add(make_recap_blocks([d]))
+            else:
+                si.add(d.as_search_list())
             if force_commit:
                 si.commit()
             si.conn.http_connection.close()
         except SolrError as exc:
             add_or_update_recap_docket.retry(exc=exc, countdown=30)
         else:
+            bump_search_generation(
+                settings.SOLR_RECAP_URL, committed=force_commit
+            )
             d.date_last_index = now()
             d.save()
 
@@ -120,29 +504,79 @@ def add_docket_to_solr_by_rds(item_pks, force_commit=False):
     needed).
     :return: None
     """
-    si = scorched.SolrInterface(settings.SOLR_RECAP_URL, mode="w")
-    rds = RECAPDocument.objects.filter(pk__in=item_pks).order_by()
-    try:
-        metadata = rds[0].get_docket_metadata()
-    except IndexError:
-        metadata = None
+    if settings.SOLR_RECAP_NESTED:
+        # Child documents don't have most of the docket's metadata anyway
+        try:
+            send_nested_recap_items(RECAPDocument, item_pks, force_commit)
+        except (socket.error, SolrError) as exc:
+            add_docket_to_solr_by_rds.retry(exc=exc, countdown=30)
+        return
 
+    si = scorched.SolrInterface(settings.SOLR_RECAP_URL, mode="w")
     try:
-        si.add([item.as_search_dict(docket_metadata=metadata) for item in rds])
+        si.add(make_recap_search_dicts(item_pks))
         if force_commit:
             si.commit()
         si.conn.http_connection.close()
     except SolrError as exc:
         add_docket_to_solr_by_rds.retry(exc=exc, countdown=30)
+    else:
+        bump_search_generation(settings.SOLR_RECAP_URL, committed=force_commit)
+
+
+@app.task
+def add_recap_blocks_to_solr(docket_pks, solr_url, force_commit=False):
+    """Index dockets as blocks in a nested RECAP core.
+
+    Unlike add_items_to_solr, this takes the core to use, so that a nested
+    core can be built while the site still uses the old one, and it doesn't
+    mark the dockets as indexed.
+
+    :param docket_pks: The pks of the Dockets to index.
+    :param solr_url: The URL of the nested core.
+    :param force_commit: Whether to send a commit to Solr afterwards.
+    """
+    si = scorched.SolrInterface(solr_url, mode="w")
+    dockets = Docket.objects.filter(pk__in=docket_pks).order_by()
+    try:
+        si.add(make_recap_blocks(dockets))
+        if force_commit:
+            si.commit()
+    except (socket.error, SolrError) as exc:
+        add_recap_blocks_to_solr.retry(exc=exc, countdown=30)
+    else:
+        bump_search_generation(solr_url, committed=force_commit)
+    finally:
+        si.conn.http_connection.close()
 
 
 @app.task
 def delete_items(items, app_label, force_commit=False):
     si = scorched.SolrInterface(settings.SOLR_URLS[app_label], mode="w")
     try:
-        si.delete_by_ids(list(items))
+        if settings.SOLR_RECAP_NESTED and app_label in [
+            "search.Docket",
+            "search.RECAPDocument",
+        ]:
+            # Deleting by id only finds the roots of blocks. Dockets are
+            # deleted with their children.
+            if app_label == "search.Docket":
+                field = "_root_"
+                ids = [make_recap_parent_id(pk) for pk in items]
+            else:
+                field = "id"
+                ids = items
+            si.delete_by_query(
+                "%s:(%s)" % (field, " OR ".join('"%s"' % i for i in ids))
+            )
+        else:
+            si.delete_by_ids(list(items))
         if force_commit:
             si.commit()
         si.conn.http_connection.close()
     except SolrError as exc:
         delete_items.retry(exc=exc, countdown=30)
+    else:
+        bump_search_generation(
+            settings.SOLR_URLS[app_label], committed=force_commit
+        )
@@ -1,30 +1,65 @@
 import io
 import os
+import socket
 import time
 from datetime import date
+from unittest import mock
 
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.files.base import ContentFile
 from django.core.management import call_command
-from django.db import IntegrityError, transaction
+from django.db import IntegrityError, connection, transaction
 from django.http import HttpRequest
-from django.test import RequestFactory, TestCase, override_settings
+from django.template import loader
+from django.test import (
+    RequestFactory,
+    SimpleTestCase,
+    TestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.html import strip_tags
 from lxml import etree, html
+from rest_framework.exceptions import ParseError
 from rest_framework.status import HTTP_200_OK
 from selenium.common.exceptions import NoSuchElementException
 from selenium.webdriver.common.by import By
 from timeout_decorator import timeout_decorator
 
-from cl.lib.search_utils import cleanup_main_query
+from cl.lib.search_cache import (
+    get_docket_search_metadata,
+    invalidate_docket_search_metadata,
+)
+from cl.lib.search_index_utils import (
+    RECAP_CHILD_FILTER,
+    RECAP_CHILD_RELATION,
+    fast_strip_tags,
+    make_atomic_update,
+    make_opinion_text,
+    null_map,
+)
+from cl.lib.search_utils import (
+    build_main_query_from_query_string,
+    cleanup_main_query,
+    merge_form_with_courts,
+)
 from cl.lib.solr_core_admin import get_data_dir
 from cl.lib.test_helpers import (
     EmptySolrTestCase,
     IndexedSolrTestCase,
     SolrTestCase,
 )
+from cl.people_db.models import Person
+from cl.search.api_utils import (
+    add_sort_tiebreaker,
+    make_cursor_token,
+    parse_cursor_token,
+)
+from cl.search.court_registry import CheckedCourt, get_court_registry
 from cl.search.feeds import JurisdictionFeed
+from cl.search.forms import SearchForm
 from cl.search.management.commands.cl_calculate_pagerank import Command
 from cl.search.models import (
     DOCUMENT_STATUSES,
@@ -38,7 +73,11 @@ from cl.search.models import (
     RECAPDocument,
     sort_cites,
 )
-from cl.search.tasks import add_docket_to_solr_by_rds
+from cl.search.tasks import (
+    add_docket_to_solr_by_rds,
+    add_or_update_recap_docket,
+    make_recap_search_dicts,
+)
 from cl.search.views import do_search
 from cl.tests.base import SELENIUM_TIMEOUT, BaseSeleniumTest
 
@@ -270,6 +309,241 @@ class DocketValidationTest(TestCase):
                 )
 
 
+class CourtRegistryTest(TestCase):
+    fixtures = ["test_court.json"]
+
+    def test_form_fields_come_from_the_registry(self) -> None:
+        """Does the search form get a checkbox for every court in use, even
+        new ones?
+        """
+        self.assertIn("court_test", SearchForm().fields)
+        Court.objects.create(
+            pk="newcourt",
+            position=1000,
+            in_use=True,
+            jurisdiction=Court.FEDERAL_APPELLATE,
+            short_name="New Court",
+            full_name="The New Court",
+        )
+        self.assertIn("court_newcourt", SearchForm().fields)
+
+    def test_merging_checked_courts(self) -> None:
+        """Are the checked states of the courts merged into the tabs without
+        changing the registry's courts?
+        """
+        registry = get_court_registry()
+        courts = registry.get_courts()
+        form = SearchForm({"q": "foo", "court_test": "on"})
+        tabs, court_count_human, court_count = merge_form_with_courts(
+            courts, form
+        )
+        checked = {c.pk: c.checked for c in tabs["federal"]}
+        self.assertIsInstance(tabs["federal"][0], CheckedCourt)
+        self.assertEqual(checked, {"test": True, "ca1": False})
+        self.assertEqual(court_count, 1)
+        self.assertEqual(court_count_human, 1)
+        self.assertFalse(hasattr(registry.get_courts()[0], "checked"))
+        # The layout is only worked out once.
+        self.assertIs(
+            registry.get_tab_layout(courts), registry.get_tab_layout(courts)
+        )
+
+
+class SolrFieldTrackerTest(TestCase):
+    fixtures = ["test_court.json"]
+
+    def setUp(self) -> None:
+        docket = Docket.objects.create(
+            case_name="Lissner v. Saad",
+            court_id="test",
+            source=Docket.DEFAULT,
+            pacer_case_id="12345",
+            docket_number="1:21-cv-00001",
+        )
+        self.docket = Docket.objects.get(pk=docket.pk)
+
+    def test_new_objects_need_full_updates(self) -> None:
+        docket = Docket(case_name="Lissner v. Saad", court_id="test")
+        self.assertIsNone(docket.get_solr_changes())
+
+    def test_metadata_changes_are_partial(self) -> None:
+        """Are the Solr fields of changed metadata worked out, including
+        ones changed when saving?
+        """
+        self.assertEqual(self.docket.get_solr_changes(), {})
+        self.docket.case_name = "Lissner v. Lissner"
+        self.docket.ia_needs_upload = True
+        self.docket.save()
+        changes = self.docket.get_solr_changes()
+        self.assertEqual(changes["caseName"], "Lissner v. Lissner")
+        self.assertIn("lissner-v-lissner", changes["docket_absolute_url"])
+        self.assertNotIn("ia_needs_upload", changes)
+
+        self.docket.reset_solr_changes()
+        self.assertEqual(self.docket.get_solr_changes(), {})
+
+    def test_some_changes_need_full_updates(self) -> None:
+        self.docket.case_name = "Lissner v. Lissner"
+        self.docket.court_id = "ca1"
+        self.assertIsNone(self.docket.get_solr_changes())
+
+    def test_making_atomic_updates(self) -> None:
+        self.assertEqual(
+            make_atomic_update(
+                3, {"caseName": "Foo", "citeCount": {"inc": 1}, "x": None}
+            ),
+            {
+                "id": 3,
+                "caseName": {"set": "Foo"},
+                "citeCount": {"inc": 1},
+                "x": {"set": None},
+            },
+        )
+
+
+@mock.patch("cl.search.tasks.update_solr_fields")
+@mock.patch("cl.search.tasks.add_items_to_solr")
+class SolrSaveDispatchTest(TestCase):
+    """Does saving an object send Solr a full update, a partial one, or
+    nothing, depending on what changed?
+    """
+
+    fixtures = ["test_objects_search.json", "judge_judy.json"]
+
+    def setUp(self) -> None:
+        self.cluster = OpinionCluster.objects.get(pk=1)
+        entry = DocketEntry.objects.create(
+            docket=self.cluster.docket, entry_number=1, description="Foo"
+        )
+        rd = RECAPDocument.objects.create(
+            docket_entry=entry,
+            document_number="1",
+            document_type=RECAPDocument.PACER_DOCUMENT,
+        )
+        self.rd = RECAPDocument.objects.select_related("docket_entry").get(
+            pk=rd.pk
+        )
+
+    def test_unchanged_cluster_is_skipped(self, add, update) -> None:
+        self.cluster.save()
+        add.delay.assert_not_called()
+        update.delay.assert_not_called()
+
+    def test_changed_cluster_fields_are_partial(self, add, update) -> None:
+        self.cluster.judges = "Sheindlin"
+        self.cluster.save()
+        add.delay.assert_not_called()
+        update.delay.assert_called_once_with(
+            {self.cluster.pk: {"judge": "Sheindlin"}},
+            "search.OpinionCluster",
+            False,
+        )
+
+    def test_changed_cluster_text_is_a_full_update(self, add, update) -> None:
+        self.cluster.syllabus = "A new syllabus"
+        self.cluster.save()
+        add.delay.assert_called_once_with(
+            [self.cluster.pk], "search.OpinionCluster", False
+        )
+        update.delay.assert_not_called()
+
+    def test_changed_panel_is_a_full_update(self, add, update) -> None:
+        self.cluster.panel.add(Person.objects.get(pk=1))
+        self.cluster.save()
+        add.delay.assert_called_once()
+        update.delay.assert_not_called()
+
+        # Once it's been indexed, the cluster is clean again.
+        self.cluster.save()
+        add.delay.assert_called_once()
+
+    def test_new_citation_is_a_full_update(self, add, update) -> None:
+        Citation.objects.create(
+            cluster=self.cluster,
+            volume=1,
+            reporter="F.2d",
+            page="1",
+            type=Citation.FEDERAL,
+        )
+        self.cluster.save()
+        add.delay.assert_called_once()
+        update.delay.assert_not_called()
+
+    @mock.patch("cl.search.models.chain")
+    def test_rd_saves(self, chain, add, update) -> None:
+        """Are RECAPDocuments skipped, partially updated, or fully updated,
+        including when their docket entries change?
+        """
+        self.rd.save(index=True)
+        chain.assert_not_called()
+
+        self.rd.is_available = True
+        self.rd.save(index=True)
+        update.si.assert_called_once_with(
+            {self.rd.pk: {"is_available": True}}, "search.RECAPDocument"
+        )
+        add.si.assert_not_called()
+
+        self.rd.docket_entry.description = "Bar"
+        self.rd.save(index=True)
+        add.si.assert_called_once_with([self.rd.pk], "search.RECAPDocument")
+        self.assertEqual(chain.call_count, 2)
+
+
+@override_settings(SOLR_RECAP_NESTED=False)
+@mock.patch("cl.search.tasks.bump_search_generation")
+@mock.patch("cl.search.tasks.scorched.SolrInterface")
+class PartialRecapDocketUpdateTest(TestCase):
+    """Are changed docket fields sent to Solr as atomic updates of the
+    docket's documents?
+    """
+
+    fixtures = ["test_court.json"]
+
+    def setUp(self) -> None:
+        self.docket = Docket.objects.create(
+            case_name="Lissner v. Saad",
+            court_id="test",
+            source=Docket.RECAP,
+            pacer_case_id="12345",
+        )
+        entry = DocketEntry.objects.create(docket=self.docket, entry_number=1)
+        self.rd = RECAPDocument.objects.create(
+            docket_entry=entry,
+            document_number="1",
+            document_type=RECAPDocument.PACER_DOCUMENT,
+        )
+        self.data = {
+            "docket_pk": self.docket.pk,
+            "content_updated": False,
+            "solr_changes": {"caseName": "Lissner v. Lissner"},
+        }
+
+    def test_partial_update(self, solr_interface, bump) -> None:
+        si = solr_interface.return_value
+        add_or_update_recap_docket(self.data)
+        docs = si.add.call_args[0][0]
+        self.assertEqual(
+            docs,
+            [
+                make_atomic_update(
+                    self.rd.pk, {"caseName": "Lissner v. Lissner"}
+                )
+            ],
+        )
+        bump.assert_called_once()
+        si.conn.http_connection.close.assert_called_once()
+
+    def test_failed_partial_update_retries(self, solr_interface, bump) -> None:
+        si = solr_interface.return_value
+        si.add.side_effect = socket.error
+        with mock.patch.object(add_or_update_recap_docket, "retry") as retry:
+            add_or_update_recap_docket(self.data)
+        retry.assert_called_once()
+        bump.assert_not_called()
+        si.conn.http_connection.close.assert_called_once()
+
+
 class IndexingTest(EmptySolrTestCase):
     """Are things indexed properly?"""
 
@@ -324,6 +598,181 @@ class IndexingTest(EmptySolrTestCase):
         RECAPDocument.objects.all().delete()
 
 
+class DocketMetadataCacheTest(TestCase):
+    """Is the metadata of dockets looked up once for all their documents?"""
+
+    fixtures = ["test_court.json"]
+
+    def setUp(self) -> None:
+        self.docket = Docket.objects.create(
+            source=Docket.RECAP,
+            case_name="Lissner v. Saad",
+            docket_number="1:21-cv-00001",
+            pacer_case_id="asdf",
+            court_id="test",
+        )
+        de = DocketEntry.objects.create(docket=self.docket, entry_number=1)
+        self.rd_pks = [
+            RECAPDocument.objects.create(
+                docket_entry=de,
+                document_type=RECAPDocument.ATTACHMENT,
+                document_number="1",
+                attachment_number=i,
+                pacer_doc_id=str(i),
+            ).pk
+            for i in range(1, 4)
+        ]
+        invalidate_docket_search_metadata(self.docket.pk)
+
+    def test_metadata_is_cached_until_the_docket_changes(self) -> None:
+        d = Docket.objects.get(pk=self.docket.pk)
+        metadata = get_docket_search_metadata(d)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_docket_search_metadata(d), metadata)
+
+        d.case_name = "Lissner v. Lissner"
+        d.save()
+        self.assertEqual(
+            get_docket_search_metadata(d)["caseName"], "Lissner v. Lissner"
+        )
+
+    def test_queries_dont_grow_with_documents(self) -> None:
+        with CaptureQueriesContext(connection) as one:
+            search_dicts = make_recap_search_dicts(self.rd_pks[:1])
+        self.assertEqual(len(search_dicts), 1)
+
+        invalidate_docket_search_metadata(self.docket.pk)
+        with CaptureQueriesContext(connection) as many:
+            search_dicts = make_recap_search_dicts(self.rd_pks)
+        self.assertEqual(len(search_dicts), 3)
+        self.assertEqual(len(one), len(many))
+        self.assertEqual(
+            {d["caseName"] for d in search_dicts}, {"Lissner v. Saad"}
+        )
+
+
+class OpinionTextTest(TestCase):
+    """Is the indexed text of opinions the same as the template made it?"""
+
+    fixtures = ["test_objects_search.json", "judge_judy.json"]
+
+    def test_text_matches_template(self) -> None:
+        text_template = loader.get_template("indexes/opinion_text.txt")
+        bodies = [
+            ("html", '<p class="x">Smith &amp; Co. v. AT&T</p>\x01'),
+            ("html_lawbox", "<?xml version='1.0'?><p>A <b>bold</b> &#167 1"),
+            ("html_columbia", "<script>a < b</script><p>It's <i>odd</p>"),
+            ("plain_text", '1 < 2 & "3" > 0\x0b'),
+        ]
+        for opinion in Opinion.objects.all():
+            for field, body in bodies:
+                setattr(opinion, field, body)
+                citation_string = opinion.cluster.citation_string
+                expected = text_template.render(
+                    {"item": opinion, "citation_string": citation_string}
+                ).translate(null_map)
+                self.assertEqual(
+                    make_opinion_text(opinion, citation_string), expected
+                )
+
+    def test_fast_strip_tags(self) -> None:
+        for value in [
+            "No tags & no problem",
+            "<p>Simple</p> <a href='/x?a=1&b=2'>link</a>",
+            "<o:p>Word</o:p> &nbsp &#x41 &#65; &amp",
+            "<p>Entities that grow &a &b &c &d &e</p>",
+            "<!-- comment --><style>p { }</style>< p>x</p>",
+            '<a title="a>b">quoted</a> <a b=x"y>bare</a>',
+        ]:
+            self.assertEqual(fast_strip_tags(value), strip_tags(value))
+
+
+class NestedRecapIndexTest(TestCase):
+    """Are dockets indexed and queried as blocks in a nested RECAP core?"""
+
+    fixtures = ["test_court.json"]
+
+    def setUp(self) -> None:
+        self.docket = Docket.objects.create(
+            source=Docket.RECAP,
+            case_name="Lissner v. Saad",
+            docket_number="1:21-cv-00001",
+            pacer_case_id="asdf",
+            court_id="test",
+            date_filed=date(2021, 1, 4),
+        )
+        de = DocketEntry.objects.create(
+            docket=self.docket, entry_number=1, description="Complaint"
+        )
+        self.rd = RECAPDocument.objects.create(
+            docket_entry=de,
+            document_type=RECAPDocument.PACER_DOCUMENT,
+            document_number="1",
+            pacer_doc_id="1",
+        )
+
+    def test_nested_search_dict(self) -> None:
+        """Are the docket's fields only in its parent document?"""
+        block = self.docket.as_nested_search_dict()
+        self.assertEqual(block["id"], "docket-%s" % self.docket.pk)
+        self.assertEqual(block["doc_type"], "docket")
+        self.assertEqual(block["caseName"], "Lissner v. Saad")
+        self.assertEqual(block["docketNumber"], "1:21-cv-00001")
+
+        children = block[RECAP_CHILD_RELATION]
+        self.assertEqual(len(children), 1)
+        child = children[0]
+        self.assertEqual(child["id"], self.rd.pk)
+        self.assertEqual(child["doc_type"], "recap_document")
+        self.assertEqual(child["docket_id"], self.docket.pk)
+        self.assertEqual(child["court_exact"], "test")
+        self.assertIn("dateFiled", child)
+        self.assertNotIn("caseName", child)
+        self.assertNotIn("party", child)
+        # The docket's text is still searchable from the children
+        self.assertIn("Lissner v. Saad", child["text"])
+
+        self.assertEqual(self.rd.as_nested_search_dict(), child)
+
+    @override_settings(SOLR_RECAP_NESTED=True)
+    def test_nested_query(self) -> None:
+        """Do queries match RECAP documents through their dockets?"""
+        params = build_main_query_from_query_string(
+            "q=foo&type=r&case_name=Saad&description=complaint"
+        )
+        self.assertEqual(
+            params["q"], "{!bool should=$recap_q should=$docket_q}"
+        )
+        self.assertEqual(params["uq"], "foo")
+        self.assertIn(RECAP_CHILD_FILTER, params["fq"])
+        self.assertIn(
+            "{!child of=$parent_filter}caseName:(Saad)", params["fq"]
+        )
+        self.assertIn("description:(complaint)", params["fq"])
+        self.assertEqual(params["group.field"], "docket_id")
+
+
+class SearchCursorTest(SimpleTestCase):
+    def test_add_sort_tiebreaker(self):
+        """Do cursor sorts always end with the unique key?"""
+        self.assertEqual(
+            add_sort_tiebreaker("dateFiled desc"), "dateFiled desc,id asc"
+        )
+        self.assertEqual(add_sort_tiebreaker(""), "score desc,id asc")
+        self.assertEqual(add_sort_tiebreaker("id desc"), "id desc")
+
+    def test_cursor_tokens(self):
+        """Are cursor tokens tied to the query that made them?"""
+        query = {"q": "foo", "sort": "score desc,id asc"}
+        token = make_cursor_token("AoE/abc", query)
+        self.assertEqual(parse_cursor_token(token, query), "AoE/abc")
+        self.assertEqual(parse_cursor_token("*", query), "*")
+        with self.assertRaises(ParseError):
+            parse_cursor_token(token, {"q": "bar", "sort": query["sort"]})
+        with self.assertRaises(ParseError):
+            parse_cursor_token("not a cursor", query)
+
+
 class SearchTest(IndexedSolrTestCase):
     @staticmethod
     def get_article_count(r):
@@ -549,6 +998,31 @@ class SearchTest(IndexedSolrTestCase):
             msg="Did not get good status code from oral arguments API endpoint",
         )
 
+    def test_search_api_cursor(self):
+        """Can we page through the search API with cursors?"""
+        url = reverse("search-list", kwargs={"version": "v3"})
+        r = self.client.get(url, {"q": "*", "cursor": "*"})
+        self.assertEqual(r.status_code, HTTP_200_OK)
+        count = r.json()["count"]
+        ids = [result["id"] for result in r.json()["results"]]
+        while r.json()["next"]:
+            r = self.client.get(r.json()["next"])
+            ids.extend(result["id"] for result in r.json()["results"])
+        self.assertEqual(len(ids), count)
+        self.assertEqual(len(set(ids)), count)
+
+        # A cursor from one query can't be used with another.
+        cursor = make_cursor_token("AoE/abc", {"q": "something else"})
+        r = self.client.get(url, {"q": "honda", "cursor": cursor})
+        self.assertEqual(r.status_code, 400)
+
+    def test_search_api_export_needs_login(self):
+        """Is the NDJSON export closed to anonymous users?"""
+        r = self.client.get(
+            reverse("search-export", kwargs={"version": "v3"}), {"q": "*"}
+        )
+        self.assertIn(r.status_code, [401, 403])
+
     def test_homepage(self):
         """Is the homepage loaded when no GET parameters are provided?"""
         response = self.client.get(reverse("show_results"))
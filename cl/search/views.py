@@ -26,22 +26,29 @@ from cl.custom_filters.templatetags.text_filters import naturalduration
 from cl.lib.bot_detector import is_bot
 from cl.lib.ratelimiter import ratelimit_if_not_whitelisted
 from cl.lib.redis_utils import make_redis_interface
+from cl.lib.search_cache import (
+    get_or_compute_search_results,
+    make_search_fingerprint,
+)
 from cl.lib.search_utils import (
     add_depth_counts,
+    add_recap_docket_fields,
     build_main_query,
+    cleanup_main_query,
     get_mlt_query,
     get_query_citation,
     get_solr_interface,
+    get_solr_url,
     make_get_string,
     make_stats_variable,
     merge_form_with_courts,
     regroup_snippets,
 )
 from cl.search.constants import RELATED_PATTERN
+from cl.search.court_registry import get_court_registry
 from cl.search.forms import SearchForm, _clean_form
-from cl.search.models import SEARCH_TYPES, Court, Opinion, OpinionCluster
-from cl.stats.models import Stat
-from cl.stats.utils import tally_stat
+from cl.search.models import SEARCH_TYPES, Opinion, OpinionCluster
+from cl.stats.utils import sum_stats, tally_stat
 from cl.visualizations.models import SCOTUSMap
 
 logger = logging.getLogger(__name__)
@@ -58,8 +65,15 @@ def check_pagination_depth(page_number):
         raise PermissionDenied
 
 
-def paginate_cached_solr_results(get_params, cd, results, rows, cache_key):
-    # Run the query and set up pagination
+def paginate_cached_solr_results(
+    get_params, cd, results, rows, cache_key, facet=True
+):
+    """Run the query and set up pagination, using the cache if possible.
+
+    If a cache_key is provided, the results are saved under it for six hours.
+    Otherwise, they are saved in the search result cache under a fingerprint
+    of the query, and invalidated when the Solr core changes.
+    """
     if cache_key is not None:
         paged_results = cache.get(cache_key)
         if paged_results is not None:
@@ -74,21 +88,35 @@ def paginate_cached_solr_results(get_params, cd, results, rows, cache_key):
     if cd["type"] in [SEARCH_TYPES.RECAP, SEARCH_TYPES.DOCKETS]:
         rows = 10
 
-    paginator = Paginator(results, rows)
-    try:
-        paged_results = paginator.page(page)
-    except PageNotAnInteger:
-        paged_results = paginator.page(1)
-    except EmptyPage:
-        # Page is out of range (e.g. 9999), deliver last page.
-        paged_results = paginator.page(paginator.num_pages)
-
-    # Post processing of the results
-    regroup_snippets(paged_results)
+    def paginate():
+        paginator = Paginator(results, rows)
+        try:
+            paged_results = paginator.page(page)
+        except PageNotAnInteger:
+            paged_results = paginator.page(1)
+        except EmptyPage:
+            # Page is out of range (e.g. 9999), deliver last page.
+            paged_results = paginator.page(paginator.num_pages)
+
+        # Post processing of the results
+        if cd["type"] in [SEARCH_TYPES.RECAP, SEARCH_TYPES.DOCKETS]:
+            add_recap_docket_fields(
+                paged_results, cleanup_main_query(cd["q"] or "*")
+            )
+        regroup_snippets(paged_results)
+        return paged_results
 
     if cache_key is not None:
+        paged_results = paginate()
         six_hours = 60 * 60 * 6
         cache.set(cache_key, paged_results, six_hours)
+    else:
+        paged_results = get_or_compute_search_results(
+            make_search_fingerprint(cd, page, rows, facet),
+            get_solr_url(cd["type"]),
+            cd["type"],
+            paginate,
+        )
 
     return paged_results
 
@@ -108,8 +136,9 @@ def do_search(
     :param facet: Whether to complete faceting in the query
     :param cache_key: A cache key with which to save the results. Note that it
     does not do anything clever with the actual query, so if you use this, your
-    cache key should *already* have factored in the query. If None, no caching
-    is set or used. Results are saved for six hours.
+    cache key should *already* have factored in the query. Results are saved
+    for six hours. If None, the search result cache is used instead, which
+    keys the results on the query itself.
     :return A big dict of variables for use in the search results, homepage, or
     other location.
     """
@@ -117,7 +146,8 @@ def do_search(
     error = False
     paged_results = None
     cited_cluster = None
-    courts = Court.objects.filter(in_use=True)
+    court_registry = get_court_registry()
+    courts = court_registry.get_courts()
     related_cluster_pks = None
 
     # Add additional or overridden GET parameters
@@ -167,7 +197,7 @@ def do_search(
             si.conn.http_connection.close()
 
             paged_results = paginate_cached_solr_results(
-                get_params, cd, results, rows, cache_key
+                get_params, cd, results, rows, cache_key, facet
             )
             cited_cluster = add_depth_counts(
                 # Also returns cited cluster if found
@@ -198,14 +228,10 @@ def do_search(
             SEARCH_TYPES.PEOPLE,
         ]:
             # Exclude BAP courts from RECAP, Dockets, and People
-            panel_courts = Court.FEDERAL_BANKRUPTCY_PANEL
-            courts = courts.exclude(jurisdiction=panel_courts)
+            courts = court_registry.get_courts(exclude_bap=True)
         elif cd["type"] in [SEARCH_TYPES.RECAP, SEARCH_TYPES.DOCKETS]:
             # Only use courts with pacer_court_id and no end date in RECAP
-            courts = courts.filter(
-                pacer_court_id__isnull=False,
-                end_date__isnull=True,
-            )
+            courts = court_registry.get_courts(pacer_only=True)
     else:
         error = True
 
@@ -247,15 +273,13 @@ def get_homepage_stats():
         for x in range(0, 10)
     ]
     homepage_data = {
-        "alerts_in_last_ten": Stat.objects.filter(
-            name__contains="alerts.sent", date_logged__gte=ten_days_ago
-        ).aggregate(Sum("count"))["count__sum"],
-        "queries_in_last_ten": Stat.objects.filter(
-            name="search.results", date_logged__gte=ten_days_ago
-        ).aggregate(Sum("count"))["count__sum"],
-        "bulk_in_last_ten": Stat.objects.filter(
-            name__contains="bulk_data", date_logged__gte=ten_days_ago
-        ).aggregate(Sum("count"))["count__sum"],
+        "alerts_in_last_ten": sum_stats(
+            "alerts.sent", ten_days_ago, lookup="contains"
+        ),
+        "queries_in_last_ten": sum_stats("search.results", ten_days_ago),
+        "bulk_in_last_ten": sum_stats(
+            "bulk_data", ten_days_ago, lookup="contains"
+        ),
         "opinions_in_last_ten": Opinion.objects.filter(
             date_created__gte=ten_days_ago
         ).count(),
@@ -474,12 +498,13 @@ def advanced(request: HttpRequest) -> HttpResponse:
         render_dict["search_form"] = SearchForm({"type": obj_type})
         return render(request, "advanced.html", render_dict)
     else:
-        courts = Court.objects.filter(in_use=True)
+        court_registry = get_court_registry()
+        courts = court_registry.get_courts()
         if request.path == reverse("advanced_r"):
             obj_type = SEARCH_TYPES.RECAP
-            courts = courts.filter(
-                pacer_court_id__isnull=False, end_date__isnull=True
-            ).exclude(jurisdiction=Court.FEDERAL_BANKRUPTCY_PANEL)
+            courts = court_registry.get_courts(
+                exclude_bap=True, pacer_only=True
+            )
         elif request.path == reverse("advanced_oa"):
             obj_type = SEARCH_TYPES.ORAL_ARGUMENT
         elif request.path == reverse("advanced_p"):
@@ -137,6 +137,10 @@ SOLR_OPINION_URL = "%s/solr/collection1" % SOLR_HOST
 SOLR_AUDIO_URL = "%s/solr/audio" % SOLR_HOST
 SOLR_PEOPLE_URL = "%s/solr/person" % SOLR_HOST
 SOLR_RECAP_URL = "%s/solr/recap" % SOLR_RECAP_HOST
+# Whether the RECAP core is nested, with a parent document for each docket
+# and its RECAP documents as children. Build one with
+# cl_build_nested_recap_index before switching SOLR_RECAP_URL to it.
+SOLR_RECAP_NESTED = False
 SOLR_URLS = {
     "audio.Audio": SOLR_AUDIO_URL,
     "people_db.Person": SOLR_PEOPLE_URL,
@@ -292,6 +296,11 @@ XERO_APPLICATION_ID = "ca_1pvP3rYcArUkd3InUnImFI9llOiSIq6k"
 #######
 # API #
 #######
+# API usage stats are buffered in each process. Every API_METER_FLUSH_SIZE
+# requests they're handed to Celery to write to Redis, and a thread in each
+# process writes what's left every API_METER_FLUSH_INTERVAL seconds.
+API_METER_FLUSH_SIZE = 1 if DEVELOPMENT else 250
+API_METER_FLUSH_INTERVAL = 10
 REST_FRAMEWORK = {
     # Use Django's standard `django.contrib.auth` permissions,
     # or allow read-only access for unauthenticated users.
@@ -429,6 +438,12 @@ SCDB_LATEST_CASE = datetime.datetime(2019, 6, 27)
 # Security #
 ############
 RATELIMIT_VIEW = "cl.simple_pages.views.ratelimited"
+# How long to remember whether an IP belongs to an approved crawler, and what
+# to do with an unknown IP while it's being checked.
+CRAWLER_APPROVED_TTL = 60 * 60 * 24 * 7
+CRAWLER_REJECTED_TTL = 60 * 60 * 24
+CRAWLER_PROVISIONAL_VERDICT = False
+CRAWLER_VERIFY_TIMEOUT = 60 * 5
 if DEVELOPMENT:
     SESSION_COOKIE_SECURE = False
     CSRF_COOKIE_SECURE = False
@@ -574,6 +589,26 @@ RELATED_MLT_MINWL = 3
 RELATED_MLT_MAXWL = 0
 RELATED_FILTER_BY_STATUS = "Precedential"
 
+################
+# Search cache #
+################
+
+# Cached results are also invalidated whenever documents are sent to their
+# Solr core.
+SEARCH_CACHE_TIMEOUT = 60 * 10
+# How long Solr can take to show documents it was sent without a commit, from
+# its autoCommit and autoSoftCommit settings. Results cached this soon after
+# such a change expire when the window ends, since they may predate it.
+SEARCH_CACHE_COMMIT_WINDOW = 60
+# How long to wait for another process running the same search
+SEARCH_CACHE_LOCK_TIMEOUT = 10
+# Per-process LRU cache in front of Redis
+SEARCH_CACHE_LOCAL_SIZE = 256
+SEARCH_CACHE_LOCAL_TIMEOUT = 60
+# The docket fields copied onto RECAP documents when they're indexed. These
+# are dropped as soon as the docket or its parties change.
+DOCKET_METADATA_CACHE_TIMEOUT = 60 * 60 * 24
+
 #######
 # AWS #
 #######
@@ -625,3 +660,22 @@ BTE_URLS = {
         "timeout": 60 * 60 * 12,
     },
 }
+
+# Convert audio with a local copy of ffmpeg when BTE can't be reached.
+AUDIO_CONVERSION_LOCAL_FALLBACK = True
+
+
+####################
+# Internet Archive #
+####################
+# The S3-like endpoint that files are uploaded to.
+IA_S3_URL = "https://s3.us.archive.org"
+IA_UPLOAD_TIMEOUT = 60 * 5
+# How many items can be uploaded per second, across all workers, and how many
+# can be uploaded at once after a quiet spell.
+IA_UPLOAD_RATE = 1
+IA_UPLOAD_BURST = 10
+# How many items each upload task handles.
+IA_UPLOAD_BATCH_SIZE = 20
+# How many times an item is retried before its files are counted as failed.
+IA_UPLOAD_MAX_ATTEMPTS = 6
@@ -1,20 +1,36 @@
+import gzip
 import hashlib
+import json
+import os
+import uuid
+from bisect import bisect_right
 from calendar import timegm
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Any, Dict, Iterator, List, Optional
 
 from django.contrib.sitemaps import Sitemap
 from django.contrib.sitemaps.views import x_robots_tag
+from django.contrib.sites.models import Site
 from django.contrib.sites.shortcuts import get_current_site
 from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
 from django.core.paginator import EmptyPage, PageNotAnInteger
+from django.db.models import Model
 from django.http import Http404, HttpRequest, HttpResponse
+from django.template.loader import render_to_string
 from django.template.response import TemplateResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import force_bytes, iri_to_uri
 from django.utils.http import http_date
+from django.utils.timezone import now
 
 from cl.lib.ratelimiter import ratelimiter_all_2_per_m
 
+SHARD_DIR = "sitemaps"
+
 
 def make_cache_key(request: HttpRequest, section: str) -> str:
     """Make a cache key for a URL
@@ -34,6 +50,294 @@ def make_cache_key(request: HttpRequest, section: str) -> str:
     return "sitemap.%s.%s" % (section, url.hexdigest())
 
 
+def get_manifest_path(section: str) -> str:
+    return "%s/%s/manifest.json" % (SHARD_DIR, section)
+
+
+def load_shard_manifest(section: str) -> Optional[Dict[str, Any]]:
+    """Load the manifest of a section's prebuilt shards, if it has any.
+
+    Manifests are cached briefly so that serving a shard doesn't need an
+    extra trip to storage.
+
+    :param section: The section of the sitemap, e.g. "r".
+    :return: The manifest dict, or None if the section isn't prebuilt.
+    """
+    cache = caches["default"]
+    cache_key = "sitemap.manifest.%s" % section
+    manifest = cache.get(cache_key)
+    if manifest is not None:
+        # Sections without shards are cached as {}.
+        return manifest or None
+    path = get_manifest_path(section)
+    if default_storage.exists(path):
+        with default_storage.open(path, "rb") as f:
+            manifest = json.loads(f.read().decode())
+    cache.set(cache_key, manifest or {}, 60 * 10)
+    return manifest
+
+
+def save_file(path: str, content: bytes) -> None:
+    """Save a file to storage, replacing any file with the same name.
+
+    On the local file system, the file is saved under a temporary name and
+    then moved over the old one, so requests never find it missing or half
+    written. Other storages can't move files, so the old one is deleted
+    first.
+    """
+    if isinstance(default_storage, FileSystemStorage):
+        tmp_path = default_storage.save(
+            "%s.%s.tmp" % (path, uuid.uuid4().hex), ContentFile(content)
+        )
+        os.replace(default_storage.path(tmp_path), default_storage.path(path))
+        return
+    default_storage.delete(path)
+    default_storage.save(path, ContentFile(content))
+
+
+class SitemapShardBuilder(object):
+    """Build the pages of a large sitemap ahead of time.
+
+    Each page (shard) covers a range of primary keys. The ranges are set when
+    the shards are first built, and stay put after that, so a later run only
+    needs to rebuild the shards whose range has rows with a newer
+    date_modified. New rows land in the last shard, which is split once it
+    fills up. Shards are saved as gzipped XML in the default storage, along
+    with a JSON manifest listing them.
+
+    Deleted rows don't change date_modified, so they linger in their shard
+    until something else in its range changes or the shards are rebuilt with
+    build_all.
+    """
+
+    def __init__(
+        self,
+        section: str,
+        site: Sitemap,
+        batch_size: int = 10_000,
+        domain: Optional[str] = None,
+        protocol: str = "https",
+    ) -> None:
+        """
+        :param section: The section of the sitemap, as used in its URL.
+        :param site: The Sitemap to build. Its items() must be ordered by pk.
+        :param batch_size: How many rows to fetch from the DB at a time.
+        :param domain: The domain for URLs. Defaults to the current Site.
+        :param protocol: The protocol for URLs.
+        """
+        self.section = section
+        self.site = site
+        self.batch_size = batch_size
+        self.domain = domain or Site.objects.get_current().domain
+        self.protocol = protocol
+
+    def iter_items(
+        self,
+        start_pk: Optional[int] = None,
+        end_pk: Optional[int] = None,
+    ) -> Iterator[Model]:
+        """Walk the sitemap's items in pk order, in keyset-paginated batches,
+        from start_pk up to, but not including, end_pk.
+        """
+        qs = self.site.items().order_by("pk")
+        if end_pk is not None:
+            qs = qs.filter(pk__lt=end_pk)
+        last_pk = None
+        while True:
+            batch_qs = qs
+            if last_pk is not None:
+                batch_qs = batch_qs.filter(pk__gt=last_pk)
+            elif start_pk is not None:
+                batch_qs = batch_qs.filter(pk__gte=start_pk)
+            batch = list(batch_qs[: self.batch_size])
+            if not batch:
+                return
+            yield from batch
+            last_pk = batch[-1].pk
+
+    def make_url_info(self, item: Model) -> Dict[str, Any]:
+        """Make the same dict for an item that Sitemap.get_urls does."""
+        site = self.site
+        loc = "%s://%s%s" % (self.protocol, self.domain, site.location(item))
+        priority = site.priority
+        if callable(priority):
+            priority = priority(item)
+        changefreq = site.changefreq
+        if callable(changefreq):
+            changefreq = changefreq(item)
+        return {
+            "item": item,
+            "location": loc,
+            "lastmod": site.lastmod(item),
+            "changefreq": changefreq,
+            "priority": str(priority if priority is not None else ""),
+        }
+
+    def write_shard(self, start_pk: Optional[int], items: List[Model]) -> Dict:
+        """Render and save a shard.
+
+        :return: The shard's entry for the manifest, without its end_pk.
+        """
+        urls = [self.make_url_info(item) for item in items]
+        xml = render_to_string("sitemap.xml", {"urlset": urls})
+        # Each version of a shard gets a new name, so the one the manifest
+        # points to is never changed while it's being served.
+        path = default_storage.save(
+            "%s/%s/%s.%s.xml.gz"
+            % (SHARD_DIR, self.section, start_pk or 0, uuid.uuid4().hex),
+            ContentFile(gzip.compress(xml.encode(), compresslevel=6)),
+        )
+        lastmods = [u["lastmod"] for u in urls if u["lastmod"]]
+        lastmod = max(lastmods, default=None)
+        return {
+            "start_pk": start_pk,
+            "path": path,
+            "count": len(urls),
+            "lastmod": lastmod.isoformat() if lastmod else None,
+        }
+
+    def make_shards(
+        self,
+        start_pk: Optional[int],
+        end_pk: Optional[int],
+    ) -> List[Dict]:
+        """Build the shards for a pk range, splitting it as needed so no
+        shard has more than the sitemap's limit of URLs.
+        """
+        shards = []
+        shard_start, items = start_pk, []
+        for item in self.iter_items(start_pk, end_pk):
+            if len(items) == self.site.limit:
+                shards.append(self.write_shard(shard_start, items))
+                shard_start, items = item.pk, []
+            items.append(item)
+        shards.append(self.write_shard(shard_start, items))
+        return shards
+
+    def save_manifest(self, shards: List[Dict], started: datetime) -> Dict:
+        # Each shard ends where the next begins.
+        for shard, next_shard in zip(shards, shards[1:] + [None]):
+            shard["end_pk"] = next_shard["start_pk"] if next_shard else None
+        manifest = {"generated": started.isoformat(), "shards": shards}
+        old_manifest = load_shard_manifest(self.section)
+        # Serve the new manifest from the cache while its file is replaced.
+        caches["default"].set(
+            "sitemap.manifest.%s" % self.section, manifest, 60 * 10
+        )
+        save_file(
+            get_manifest_path(self.section), json.dumps(manifest).encode()
+        )
+        # Old versions of shards can go once nothing points to them.
+        if old_manifest is not None:
+            paths = {shard["path"] for shard in shards}
+            for shard in old_manifest["shards"]:
+                if shard["path"] not in paths:
+                    default_storage.delete(shard["path"])
+        return manifest
+
+    def build_all(self) -> Dict:
+        """Build every shard in a single pass over the table.
+
+        :return: The new manifest.
+        """
+        started = now()
+        return self.save_manifest(self.make_shards(None, None), started)
+
+    def update(self) -> Dict:
+        """Rebuild the shards with changes since the last run.
+
+        :return: The new manifest.
+        """
+        manifest = load_shard_manifest(self.section)
+        if manifest is None:
+            return self.build_all()
+        started = now()
+        shards = manifest["shards"]
+        changed_pks = (
+            self.site.items()
+            .filter(date_modified__gte=parse_datetime(manifest["generated"]))
+            .order_by()
+            .values_list("pk", flat=True)
+        )
+        # The first shard starts at None, so skip it when searching.
+        starts = [shard["start_pk"] for shard in shards[1:]]
+        dirty = {bisect_right(starts, pk) for pk in changed_pks.iterator()}
+
+        new_shards = []
+        for i, shard in enumerate(shards):
+            if i in dirty:
+                new_shards.extend(
+                    self.make_shards(shard["start_pk"], shard["end_pk"])
+                )
+            else:
+                new_shards.append(shard)
+        return self.save_manifest(new_shards, started)
+
+
+def serve_sitemap_shard(
+    request: HttpRequest,
+    manifest: Dict[str, Any],
+    content_type: str,
+) -> HttpResponse:
+    """Serve a prebuilt sitemap page from storage."""
+    try:
+        page = int(request.GET.get("p", 1))
+    except ValueError:
+        raise Http404("No page '%s'" % request.GET.get("p"))
+    if not 1 <= page <= len(manifest["shards"]):
+        raise Http404("Page %s empty" % page)
+    shard = manifest["shards"][page - 1]
+    with default_storage.open(shard["path"], "rb") as f:
+        content = f.read()
+    if "gzip" in request.META.get("HTTP_ACCEPT_ENCODING", ""):
+        response = HttpResponse(content, content_type=content_type)
+        response["Content-Encoding"] = "gzip"
+    else:
+        response = HttpResponse(
+            gzip.decompress(content), content_type=content_type
+        )
+    patch_vary_headers(response, ["Accept-Encoding"])
+    if shard["lastmod"]:
+        lastmod = parse_datetime(shard["lastmod"])
+        response["Last-Modified"] = http_date(timegm(lastmod.utctimetuple()))
+    return response
+
+
+@x_robots_tag
+def sitemap_index(
+    request: HttpRequest,
+    sitemaps: Dict[str, Sitemap],
+    template_name: str = "sitemap_index.xml",
+    content_type: str = "application/xml",
+    sitemap_url_name: str = "sitemaps",
+) -> HttpResponse:
+    """Copy the django sitemap index, but count the pages of prebuilt
+    sections from their manifests.
+    """
+    req_protocol = request.scheme
+    req_site = get_current_site(request)
+
+    sites = []
+    for section, site in sitemaps.items():
+        if callable(site):
+            site = site()
+        protocol = req_protocol if site.protocol is None else site.protocol
+        sitemap_url = reverse(sitemap_url_name, kwargs={"section": section})
+        absolute_url = "%s://%s%s" % (protocol, req_site.domain, sitemap_url)
+        sites.append(absolute_url)
+        manifest = load_shard_manifest(section)
+        if manifest is not None:
+            num_pages = len(manifest["shards"])
+        else:
+            num_pages = site.paginator.num_pages
+        for page in range(2, num_pages + 1):
+            sites.append("%s?p=%s" % (absolute_url, page))
+
+    return TemplateResponse(
+        request, template_name, {"sitemaps": sites}, content_type=content_type
+    )
+
+
 @ratelimiter_all_2_per_m
 @x_robots_tag
 def cached_sitemap(
@@ -44,7 +348,8 @@ def cached_sitemap(
     content_type: str = "application/xml",
 ) -> HttpResponse:
 
-    """Copy the django sitemap code, but cache URLs
+    """Copy the django sitemap code, but cache URLs, or serve prebuilt
+    shards for sections that have them.
 
     See Django documentation for parameter details.
     """
@@ -54,6 +359,9 @@ def cached_sitemap(
 
     if section not in sitemaps:
         raise Http404("No sitemap available for section: %r" % section)
+    manifest = load_shard_manifest(section)
+    if manifest is not None:
+        return serve_sitemap_shard(request, manifest, content_type)
     site = sitemaps[section]
     page = request.GET.get("p", 1)
 
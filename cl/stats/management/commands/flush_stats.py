@@ -0,0 +1,17 @@
+from cl.lib.command_utils import VerboseCommand, logger
+from cl.stats.utils import flush_stats
+
+
+class Command(VerboseCommand):
+    help = (
+        "Write the stats tallied in Redis to the database. Run this every "
+        "few minutes."
+    )
+
+    def handle(self, *args, **options):
+        super(Command, self).handle(*args, **options)
+        count = flush_stats()
+        if count is None:
+            logger.info("Another flush is running. Skipping.")
+        else:
+            logger.info("Flushed %s stats", count)
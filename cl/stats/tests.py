@@ -1,9 +1,17 @@
 from unittest import TestCase
 
 import pytest
+from django.utils.timezone import localdate
 
+from cl.lib.redis_utils import make_redis_interface
 from cl.stats.models import Stat
-from cl.stats.utils import get_milestone_range, tally_stat
+from cl.stats.utils import (
+    flush_stats,
+    get_milestone_range,
+    get_pending_stats,
+    sum_stats,
+    tally_stat,
+)
 
 
 class MilestoneTests(TestCase):
@@ -16,10 +24,18 @@ class MilestoneTests(TestCase):
 @pytest.mark.django_db
 class StatTests(TestCase):
     def setUp(self):
-        Stat.objects.all().delete()
+        self.clear_stats()
 
     def tearDown(self):
+        self.clear_stats()
+
+    @staticmethod
+    def clear_stats():
         Stat.objects.all().delete()
+        r = make_redis_interface("STATS")
+        keys = r.keys("stats:*")
+        if keys:
+            r.delete(*keys)
 
     def test_tally_a_stat(self):
         count = tally_stat("test")
@@ -36,3 +52,40 @@ class StatTests(TestCase):
         self.assertEqual(count, 2)
         count = tally_stat("test3", inc=2)
         self.assertEqual(count, 4)
+
+    def test_flush_stats(self):
+        """Are tallies written to the database in one go?"""
+        today = localdate()
+        tally_stat("test4")
+        tally_stat("test4")
+        tally_stat("test5", inc=3)
+        self.assertFalse(Stat.objects.exists())
+        self.assertEqual(get_pending_stats()[("test4", today)], 2)
+
+        self.assertEqual(flush_stats(), 2)
+        self.assertEqual(get_pending_stats(), {})
+        self.assertEqual(Stat.objects.get(name="test4").count, 2)
+        self.assertEqual(Stat.objects.get(name="test5").count, 3)
+
+        # Later tallies add to the saved counts.
+        self.assertEqual(tally_stat("test4"), 3)
+        flush_stats()
+        self.assertEqual(Stat.objects.get(name="test4").count, 3)
+
+    def test_count_includes_saved_stats(self):
+        """Do counts pick up where the database left off?"""
+        Stat.objects.create(name="test6", date_logged=localdate(), count=5)
+        self.assertEqual(tally_stat("test6"), 6)
+
+        # The saved count is only added once.
+        Stat.objects.filter(name="test6").update(count=100)
+        self.assertEqual(tally_stat("test6"), 7)
+
+    def test_sum_stats(self):
+        """Are flushed and pending tallies both summed?"""
+        today = localdate()
+        tally_stat("alerts.sent.dly", inc=2)
+        flush_stats()
+        tally_stat("alerts.sent.wly")
+        self.assertEqual(sum_stats("alerts.sent", today, "contains"), 3)
+        self.assertEqual(sum_stats("alerts.sent.wly", today), 1)
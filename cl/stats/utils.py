@@ -1,10 +1,23 @@
-from collections import OrderedDict
+from collections import OrderedDict, defaultdict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
 
-from django.db.models import F
+from django.db import connection, transaction
+from django.db.models import Sum
 from django.utils.timezone import now
 
+from cl.lib.redis_utils import make_redis_interface
 from cl.stats.models import Stat
 
+# Tallies waiting to be written to the database, keyed by "<date>|<name>"
+STATS_PENDING_KEY = "stats:pending"
+STATS_FLUSHING_KEY = "stats:pending:flushing"
+STATS_LOCK_KEY = "stats:flush-lock"
+STATS_LOCK_TIMEOUT = 60 * 10
+STATS_BATCH_SIZE = 1000
+# The running totals that tally_stat returns only need to outlive their day.
+STATS_TOTALS_TIMEOUT = 60 * 60 * 24 * 2
+
 MILESTONES = OrderedDict(
     (
         ("XXS", [1e0, 5e0]),  # 1 - 5
@@ -41,24 +54,147 @@ def get_milestone_range(start, end):
     return out
 
 
+def _normalize_date(date_logged) -> date:
+    """Convert a datetime to the date it'll be saved as, the same way the
+    date_logged field does.
+    """
+    if date_logged is None:
+        date_logged = now()
+    return Stat._meta.get_field("date_logged").to_python(date_logged)
+
+
+def _totals_key(day: date) -> str:
+    return "stats:totals:%s" % day.isoformat()
+
+
 def tally_stat(name, inc=1, date_logged=None):
-    """Tally an event's occurrence to the database.
+    """Tally an event's occurrence.
 
     Will assume the following overridable values:
        - the event happened today.
        - the event happened once.
+
+    Events are counted in Redis and written to the database in batches by
+    flush_stats, so this doesn't touch the database unless it's the first
+    time the stat is tallied on the day.
+
+    :return: The stat's count for the day, including this event.
     """
-    if date_logged is None:
-        date_logged = now()
-    stat, created = Stat.objects.get_or_create(
-        name=name, date_logged=date_logged, defaults={"count": inc}
+    day = _normalize_date(date_logged)
+    totals_key = _totals_key(day)
+    r = make_redis_interface("STATS")
+    if not r.hexists(totals_key, name):
+        # The first tally of the day in Redis. Start from whatever was already
+        # in the database, for stats that were flushed before the totals
+        # expired or were tallied before they were kept in Redis. Only the
+        # first process to get here sets it, and it's set before any of the
+        # day's tallies, so it can't include one that was already flushed.
+        saved = (
+            Stat.objects.filter(name=name, date_logged=day)
+            .values_list("count", flat=True)
+            .first()
+        )
+        r.hsetnx(totals_key, name, saved or 0)
+    pipe = r.pipeline()
+    pipe.hincrby(STATS_PENDING_KEY, "%s|%s" % (day.isoformat(), name), inc)
+    pipe.hincrby(totals_key, name, inc)
+    pipe.expire(totals_key, STATS_TOTALS_TIMEOUT)
+    _, total, _ = pipe.execute()
+    return total
+
+
+def get_pending_stats() -> Dict[Tuple[str, date], int]:
+    """Get the tallies that haven't been written to the database yet.
+
+    :return: A dict of (name, date) tuples to the amount to add to the
+    stat.
+    """
+    r = make_redis_interface("STATS")
+    pending = defaultdict(int)
+    for key in [STATS_FLUSHING_KEY, STATS_PENDING_KEY]:
+        for field, count in r.hgetall(key).items():
+            day, name = field.split("|", 1)
+            pending[(name, date.fromisoformat(day))] += int(count)
+    return dict(pending)
+
+
+def sum_stats(name: str, since, lookup: str = "exact") -> int:
+    """Sum a stat's counts since a date, including the tallies that haven't
+    been flushed to the database yet.
+
+    :param name: The name of the stat, or a part of it.
+    :param since: The earliest date to include.
+    :param lookup: How to match name against the stat names: "exact",
+    "contains" or "startswith".
+    :return: The total count.
+    """
+    since = _normalize_date(since)
+    matches = {
+        "exact": lambda n: n == name,
+        "contains": lambda n: name in n,
+        "startswith": lambda n: n.startswith(name),
+    }[lookup]
+    saved = Stat.objects.filter(
+        **{"name__%s" % lookup: name, "date_logged__gte": since}
+    ).aggregate(Sum("count"))["count__sum"]
+    pending = sum(
+        count
+        for (stat_name, day), count in get_pending_stats().items()
+        if day >= since and matches(stat_name)
     )
-    if created:
-        return stat.count
-    else:
-        count_cache = stat.count
-        stat.count = F("count") + inc
-        stat.save()
-        # stat doesn't have the new value when it's updated with a F object, so
-        # we fake the return value instead of looking it up again for the user.
-        return count_cache + inc
+    return (saved or 0) + pending
+
+
+def upsert_stats(tallies: List[Tuple[str, date, int]]) -> None:
+    """Add counts to many stats with one query, creating any that don't
+    exist yet.
+
+    :param tallies: A list of (name, date, amount to add) tuples.
+    """
+    if not tallies:
+        return
+    qn = connection.ops.quote_name
+    table = qn(Stat._meta.db_table)
+    query = (
+        "INSERT INTO {table} (name, date_logged, count) VALUES {values} "
+        "ON CONFLICT (date_logged, name) DO UPDATE "
+        "SET count = {table}.count + EXCLUDED.count".format(
+            table=table, values=", ".join(["(%s, %s, %s)"] * len(tallies))
+        )
+    )
+    params = [value for tally in tallies for value in tally]
+    with connection.cursor() as cursor:
+        cursor.execute(query, params)
+
+
+def flush_stats() -> Optional[int]:
+    """Write the pending tallies to the database.
+
+    The pending tallies are moved aside before they're written, so tallies
+    made during the flush are kept for the next one. If writing fails, the
+    moved tallies are retried on the next flush.
+
+    :return: The number of stats updated, or None if another flush is
+    already running.
+    """
+    r = make_redis_interface("STATS")
+    if not r.set(STATS_LOCK_KEY, 1, nx=True, ex=STATS_LOCK_TIMEOUT):
+        return None
+    try:
+        if not r.exists(STATS_FLUSHING_KEY):
+            if not r.exists(STATS_PENDING_KEY):
+                return 0
+            r.rename(STATS_PENDING_KEY, STATS_FLUSHING_KEY)
+        tallies = []
+        for field, count in r.hgetall(STATS_FLUSHING_KEY).items():
+            day, name = field.split("|", 1)
+            tallies.append((name, date.fromisoformat(day), int(count)))
+        # Sorted, so concurrent upserts lock rows in the same order.
+        tallies.sort()
+        with transaction.atomic():
+            for i in range(0, len(tallies), STATS_BATCH_SIZE):
+                upsert_stats(tallies[i : i + STATS_BATCH_SIZE])
+        r.delete(STATS_FLUSHING_KEY)
+        return len(tallies)
+    finally:
+        r.delete(STATS_LOCK_KEY)
@@ -0,0 +1,325 @@
+"""
+An in-memory graph of the citations between Supreme Court clusters.
+
+Building a SCOTUSMap used to walk the citation network one database query at a
+time. The SCOTUS network is small enough (tens of thousands of clusters and a
+few hundred thousand citations) to hold in memory as a pair of CSR adjacency
+arrays, which lets us find every path between two cases without touching the
+database at all.
+
+The graph is loaded once per process. When citations change, the citing
+clusters are logged to Redis, and each process patches its copy by reloading
+only the edges of those clusters the next time it's used.
+"""
+import threading
+from collections import deque
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import networkx
+import numpy as np
+
+from cl.lib.redis_utils import make_redis_interface
+from cl.search.models import OpinionCluster, OpinionsCited
+from cl.visualizations.exceptions import TooManyNodes
+
+CHANGES_KEY = "scotus-graph:changes"
+EPOCH_KEY = "scotus-graph:epoch"
+# If more clusters than this have changed, it's cheaper to reload everything.
+MAX_CHANGES = 50000
+
+
+def _make_csr(
+    src: np.ndarray,
+    dst: np.ndarray,
+    node_count: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Make CSR adjacency arrays from an edge list of node indexes.
+
+    :return: A tuple of (indptr, indices). The neighbors of node i are
+    indices[indptr[i]:indptr[i + 1]].
+    """
+    order = np.argsort(src, kind="stable")
+    indices = dst[order]
+    counts = np.bincount(src, minlength=node_count)
+    indptr = np.zeros(node_count + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return indptr, indices
+
+
+class SCOTUSCitationGraph(object):
+    """A directed graph of SCOTUS clusters, with edges from citing clusters
+    to the clusters they cite.
+    """
+
+    def __init__(self) -> None:
+        # Sorted cluster pks; a cluster's position here is its node index.
+        self.node_ids = np.zeros(0, dtype=np.int64)
+        # Per-node metadata, by node index
+        self.dates = np.zeros(0, dtype=np.int32)
+        self.citation_counts = np.zeros(0, dtype=np.int32)
+        # The edge list, as node indexes
+        self.src = np.zeros(0, dtype=np.int64)
+        self.dst = np.zeros(0, dtype=np.int64)
+        # CSR adjacency, in both directions
+        self.out_indptr = np.zeros(1, dtype=np.int64)
+        self.out_indices = np.zeros(0, dtype=np.int64)
+        self.in_indptr = np.zeros(1, dtype=np.int64)
+        self.in_indices = np.zeros(0, dtype=np.int64)
+        # How far through the Redis change log we've read
+        self.loaded = False
+        self.epoch = None
+        self.changes_read = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.node_ids)
+
+    @property
+    def edge_count(self) -> int:
+        return len(self.src)
+
+    def _lookup(self, pks: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Find the node indexes of cluster pks.
+
+        :return: A tuple of the indexes and a boolean mask of which pks were
+        found. Indexes where the mask is False are meaningless.
+        """
+        if not len(self.node_ids):
+            return np.zeros(len(pks), dtype=np.int64), np.zeros(
+                len(pks), dtype=bool
+            )
+        idx = np.searchsorted(self.node_ids, pks)
+        idx = np.minimum(idx, len(self.node_ids) - 1)
+        return idx, self.node_ids[idx] == pks
+
+    def _index(self, cluster_pks: Iterable[int]) -> np.ndarray:
+        """Convert cluster pks to node indexes, dropping unknown ones."""
+        idx, found = self._lookup(
+            np.asarray(list(cluster_pks), dtype=np.int64)
+        )
+        return idx[found]
+
+    def index_of(self, cluster_pk: int) -> Optional[int]:
+        idx = self._index([cluster_pk])
+        return int(idx[0]) if len(idx) else None
+
+    def _rebuild_adjacency(self) -> None:
+        n = len(self.node_ids)
+        self.out_indptr, self.out_indices = _make_csr(self.src, self.dst, n)
+        self.in_indptr, self.in_indices = _make_csr(self.dst, self.src, n)
+
+    @staticmethod
+    def _edge_query(citing_cluster_pks: Optional[List[int]] = None):
+        qs = OpinionsCited.objects.filter(
+            citing_opinion__cluster__docket__court_id="scotus",
+            cited_opinion__cluster__docket__court_id="scotus",
+        )
+        if citing_cluster_pks is not None:
+            qs = qs.filter(citing_opinion__cluster_id__in=citing_cluster_pks)
+        return (
+            qs.values_list(
+                "citing_opinion__cluster_id", "cited_opinion__cluster_id"
+            )
+            .order_by()
+            .distinct()
+        )
+
+    def _load_nodes(self) -> None:
+        clusters = (
+            OpinionCluster.objects.filter(docket__court_id="scotus")
+            .order_by("pk")
+            .values_list("pk", "date_filed", "citation_count")
+        )
+        pks, dates, counts = [], [], []
+        for pk, date_filed, citation_count in clusters.iterator():
+            pks.append(pk)
+            dates.append(date_filed.toordinal())
+            counts.append(citation_count)
+        self.node_ids = np.asarray(pks, dtype=np.int64)
+        self.dates = np.asarray(dates, dtype=np.int32)
+        self.citation_counts = np.asarray(counts, dtype=np.int32)
+
+    def _edges_to_indexes(
+        self, edges: Iterable[Tuple[int, int]]
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        pairs = np.asarray(list(edges), dtype=np.int64).reshape(-1, 2)
+        src, src_found = self._lookup(pairs[:, 0])
+        dst, dst_found = self._lookup(pairs[:, 1])
+        # Drop edges to clusters we don't know about (e.g., created since the
+        # nodes were loaded). They'll show up on the next full load.
+        ok = src_found & dst_found
+        return src[ok], dst[ok]
+
+    def load(self) -> None:
+        """Load the whole graph from the database."""
+        r = make_redis_interface("CACHE")
+        epoch = r.get(EPOCH_KEY)
+        changes_read = r.llen(CHANGES_KEY)
+        self._load_nodes()
+        self.src, self.dst = self._edges_to_indexes(
+            self._edge_query().iterator()
+        )
+        self._rebuild_adjacency()
+        self.loaded = True
+        self.epoch = epoch
+        self.changes_read = changes_read
+
+    def update_clusters(self, citing_cluster_pks: Iterable[int]) -> None:
+        """Reload the outgoing edges of some clusters.
+
+        :param citing_cluster_pks: The clusters whose citations changed.
+        """
+        citing_cluster_pks = list(set(citing_cluster_pks))
+        if not citing_cluster_pks:
+            return
+        changed = self._index(citing_cluster_pks)
+        keep = ~np.isin(self.src, changed)
+        src, dst = self._edges_to_indexes(self._edge_query(citing_cluster_pks))
+        self.src = np.concatenate([self.src[keep], src])
+        self.dst = np.concatenate([self.dst[keep], dst])
+        self._rebuild_adjacency()
+
+    def refresh(self) -> None:
+        """Bring the graph up to date with the change log in Redis."""
+        r = make_redis_interface("CACHE")
+        with self._lock:
+            epoch = r.get(EPOCH_KEY)
+            if not self.loaded or self.epoch != epoch:
+                self.load()
+                return
+            changes = r.lrange(CHANGES_KEY, self.changes_read, -1)
+            if not changes:
+                return
+            changed = {int(pk) for pk in changes}
+            if len(self._index(changed)) < len(changed):
+                # A new cluster. Rather than renumbering every node to fit it
+                # in, just reload.
+                self.load()
+                return
+            self.changes_read += len(changes)
+            self.update_clusters(changed)
+
+    def _bfs(
+        self,
+        start: int,
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        max_hops: int,
+        min_date: int,
+    ) -> Dict[int, int]:
+        """Find the hop distance to every node within max_hops of start,
+        skipping nodes filed before min_date.
+        """
+        distances = {start: 0}
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            hops = distances[node]
+            if hops == max_hops:
+                continue
+            for neighbor in indices[indptr[node] : indptr[node + 1]]:
+                neighbor = int(neighbor)
+                if neighbor in distances or self.dates[neighbor] < min_date:
+                    continue
+                distances[neighbor] = hops + 1
+                queue.append(neighbor)
+        return distances
+
+    def build_nx_digraph(
+        self,
+        cluster_start_pk: int,
+        cluster_end_pk: int,
+        start_date: date,
+        max_hops: int,
+        max_nodes: int = 70,
+    ) -> networkx.DiGraph:
+        """Make a graph of every citation path from the end cluster back to
+        the start cluster that's no more than max_hops long.
+
+        This searches from both ends at once: forward from the end along
+        citations and backward from the start along citing cases. A node is
+        on a short enough path if its distances from the two ends add up to
+        no more than max_hops.
+
+        :param cluster_start_pk: The earlier cluster, where paths end.
+        :param cluster_end_pk: The later cluster, where paths begin.
+        :param start_date: The date_filed of the start cluster. Paths only go
+        through clusters filed on or after it.
+        :param max_hops: The maximum degree of separation for the network.
+        :param max_nodes: The maximum number of nodes a network can contain.
+        :return: A networkx DiGraph, like SCOTUSMap.build_nx_digraph makes.
+        """
+        g = networkx.DiGraph()
+        start = self.index_of(cluster_start_pk)
+        end = self.index_of(cluster_end_pk)
+        if start is None or end is None:
+            return g
+
+        min_date = start_date.toordinal()
+        from_end = self._bfs(
+            end, self.out_indptr, self.out_indices, max_hops, min_date
+        )
+        if start not in from_end:
+            return g
+        to_start = self._bfs(
+            start, self.in_indptr, self.in_indices, max_hops, min_date
+        )
+
+        nodes = {
+            node
+            for node, hops in from_end.items()
+            if node in to_start and hops + to_start[node] <= max_hops
+        }
+        if len(nodes) > max_nodes:
+            raise TooManyNodes()
+
+        for node in nodes:
+            bounds = slice(self.out_indptr[node], self.out_indptr[node + 1])
+            for neighbor in self.out_indices[bounds]:
+                neighbor = int(neighbor)
+                if (
+                    neighbor in nodes
+                    and from_end[node] + 1 + to_start[neighbor] <= max_hops
+                ):
+                    g.add_edge(
+                        int(self.node_ids[node]), int(self.node_ids[neighbor])
+                    )
+        return g
+
+
+_graph = None
+_graph_lock = threading.Lock()
+
+
+def get_scotus_citation_graph() -> SCOTUSCitationGraph:
+    """Get this process's copy of the graph, loading or refreshing it as
+    needed.
+    """
+    global _graph
+    with _graph_lock:
+        if _graph is None:
+            _graph = SCOTUSCitationGraph()
+    _graph.refresh()
+    return _graph
+
+
+def log_citation_changes(citing_cluster_pks: Iterable[int]) -> None:
+    """Note that the citations made by some SCOTUS clusters have changed, so
+    that every process's graph picks up the change.
+
+    :param citing_cluster_pks: The pks of the SCOTUS clusters whose
+    OpinionsCited rows were added, changed or deleted.
+    """
+    citing_cluster_pks = list(citing_cluster_pks)
+    if not citing_cluster_pks:
+        return
+    r = make_redis_interface("CACHE")
+    length = r.rpush(CHANGES_KEY, *citing_cluster_pks)
+    if length > MAX_CHANGES:
+        # Too much has changed. Start a new epoch, which makes every process
+        # do a full reload.
+        pipe = r.pipeline()
+        pipe.delete(CHANGES_KEY)
+        pipe.incr(EPOCH_KEY)
+        pipe.execute()
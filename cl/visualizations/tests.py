@@ -17,10 +17,13 @@ from rest_framework.status import (
 )
 from rest_framework.test import APITestCase
 
+from cl.lib.view_utils import flush_view_counts, get_pending_view_counts
 from cl.search.models import OpinionCluster
 from cl.tests.utils import make_client
 from cl.users.models import UserProfile
 from cl.visualizations import views
+from cl.visualizations.citation_graph import SCOTUSCitationGraph
+from cl.visualizations.exceptions import TooManyNodes
 from cl.visualizations.forms import VizForm
 from cl.visualizations.models import JSONVersion, SCOTUSMap
 from cl.visualizations.network_utils import reverse_endpoints_if_needed
@@ -92,6 +95,45 @@ class TestVizModels(TestCase):
         g = viz.build_nx_digraph(**build_kwargs)
         self.assertTrue(len(g.edges()) > 0)
 
+    def test_in_memory_graph_matches_nx_digraph(self) -> None:
+        """Does the in-memory graph find the network the queries find?"""
+        viz = SCOTUSMap(
+            user=self.user,
+            cluster_start=self.start,
+            cluster_end=self.end,
+            title="Test SCOTUSMap",
+            notes="Test Notes",
+        )
+        g = viz.build_nx_digraph(
+            parent_authority=self.end,
+            visited_nodes={},
+            good_nodes={},
+            max_hops=3,
+        )
+
+        graph = SCOTUSCitationGraph()
+        graph.load()
+        in_memory_g = graph.build_nx_digraph(
+            cluster_start_pk=self.start.pk,
+            cluster_end_pk=self.end.pk,
+            start_date=self.start.date_filed,
+            max_hops=3,
+        )
+        # The recursive builder can skip some redundant routes, but every
+        # edge it finds is on a short enough path.
+        self.assertIn(self.start.pk, in_memory_g)
+        self.assertIn(self.end.pk, in_memory_g)
+        self.assertTrue(set(g.edges()) <= set(in_memory_g.edges()))
+
+        with self.assertRaises(TooManyNodes):
+            graph.build_nx_digraph(
+                cluster_start_pk=self.start.pk,
+                cluster_end_pk=self.end.pk,
+                start_date=self.start.date_filed,
+                max_hops=3,
+                max_nodes=1,
+            )
+
     def test_SCOTUSMap_deletes_cascade(self) -> None:
         """
         Make sure we delete JSONVersion instances when deleted SCOTUSMaps
@@ -205,6 +247,7 @@ class TestViews(TestCase):
             self.client.login(username="user", password="password")
         )
         response = self.client.get(viz.get_absolute_url())
+        flush_view_counts()
 
         viz.refresh_from_db(fields=["view_count", "date_modified"])
         self.assertEqual(response.status_code, 200)
@@ -216,6 +259,30 @@ class TestViews(TestCase):
             msg="date_modified changed when the page was loaded!",
         )
 
+    def test_view_counts_are_written_in_batches(self) -> None:
+        """Are views only written to the DB when they're flushed?"""
+        flush_view_counts()
+        viz = SCOTUSMap.objects.get(pk=1)
+        old_view_count = viz.view_count
+
+        self.assertTrue(
+            self.client.login(username="user", password="password")
+        )
+        self.client.get(viz.get_absolute_url())
+        self.client.get(viz.get_absolute_url())
+        self.assertEqual(
+            get_pending_view_counts("visualizations.scotusmap")[viz.pk], 2
+        )
+        viz.refresh_from_db(fields=["view_count"])
+        self.assertEqual(old_view_count, viz.view_count)
+
+        flush_view_counts()
+        viz.refresh_from_db(fields=["view_count"])
+        self.assertEqual(old_view_count + 2, viz.view_count)
+        self.assertNotIn(
+            viz.pk, get_pending_view_counts("visualizations.scotusmap")
+        )
+
 
 class TestVizAjaxCrud(TestCase):
     """
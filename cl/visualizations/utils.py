@@ -4,6 +4,7 @@ from django.conf import settings
 from django.contrib import messages
 
 from cl.stats.utils import tally_stat
+from cl.visualizations.citation_graph import get_scotus_citation_graph
 from cl.visualizations.exceptions import TooManyNodes
 from cl.visualizations.models import JSONVersion
 
@@ -14,20 +15,21 @@ def build_visualization(viz):
     :param viz: A Visualization object to work on
     :return: A tuple of (status<str>, viz)
     """
+    t1 = time.time()
+    graph = get_scotus_citation_graph()
     build_kwargs = {
-        "parent_authority": viz.cluster_end,
-        "visited_nodes": {},
-        "good_nodes": {},
+        "cluster_start_pk": viz.cluster_start_id,
+        "cluster_end_pk": viz.cluster_end_id,
+        "start_date": viz.cluster_start.date_filed,
         "max_hops": 3,
     }
-    t1 = time.time()
     try:
-        g = viz.build_nx_digraph(**build_kwargs)
+        g = graph.build_nx_digraph(**build_kwargs)
     except TooManyNodes:
         try:
             # Try with fewer hops.
             build_kwargs["max_hops"] = 2
-            g = viz.build_nx_digraph(**build_kwargs)
+            g = graph.build_nx_digraph(**build_kwargs)
         except TooManyNodes:
             # Still too many hops. Abort.
             tally_stat("visualization.too_many_nodes_failure")